@@ -59,7 +59,7 @@ class LoraUtil:
 			pkt.rssi = sx12.packetRssi()
 			pkt.snr = sx12.packetSnr()
 			try:
-				pkt.msgTxt = pay[4:].decode('utf-8', 'ignore')
+				pkt.msgTxt = bytes(pay[4:]).decode('utf-8', 'ignore')
 			except Exception as ex:
 				print("doReceiver error: ")
 				print(ex)
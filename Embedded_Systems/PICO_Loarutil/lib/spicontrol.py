@@ -30,6 +30,7 @@ class SpiControl:
 				 miso=Pin(PIN_ID_MISO, Pin.IN))
 		self.pinss = Pin(PIN_ID_LORA_SS, Pin.OUT)
 		self.pinrst = Pin(PIN_ID_LORA_RESET, Pin.OUT)
+		self._burstAddr = bytearray(1)	# address byte for burst transfers
 
 	# sx127x transfer is always write two bytes while reading the second byte
 	# a read doesn't write the second byte. a write returns the prior value.
@@ -42,6 +43,24 @@ class SpiControl:
 		self.pinss.value(1)
 		return response
 
+	# burst transfers move a whole buffer in one chip-select window. On the
+	# fifo register the sx127x advances its fifo pointer for every byte.
+	def burstRead(self, address, buf):
+		''' read len(buf) bytes starting at register address into buf '''
+		self._burstAddr[0] = address & 0x7f
+		self.pinss.value(0)
+		self.spi.write(self._burstAddr)
+		self.spi.readinto(buf)
+		self.pinss.value(1)
+
+	def burstWrite(self, address, buf):
+		''' write all of buf starting at register address '''
+		self._burstAddr[0] = address | 0x80
+		self.pinss.value(0)
+		self.spi.write(self._burstAddr)
+		self.spi.write(buf)
+		self.pinss.value(1)
+
 	# this doesn't belong here but it doesn't really belong anywhere, so put
 	# it with the other loraconfig-ed stuff
 	def getIrqPin(self):
@@ -13,6 +13,7 @@ Communications is handled by an SpiControl object wrapping SPI
 import gc
 import _thread
 from machine import Pin
+from time import ticks_us, ticks_diff
 
 PA_OUTPUT_RFO_PIN = 0
 PA_OUTPUT_PA_BOOST_PIN = 1
@@ -39,7 +40,7 @@ REG_IRQ_FLAGS_MASK = 0x11
 REG_IRQ_FLAGS = 0x12
 REG_RX_NB_BYTES = 0x13
 REG_PKT_RSSI_VALUE = 0x1a
-REG_PKT_SNR_VALUE = 0x1b
+REG_PKT_SNR_VALUE = 0x19
 REG_MODEM_CONFIG_1 = 0x1d
 REG_MODEM_CONFIG_2 = 0x1e
 REG_PREAMBLE_MSB = 0x20
@@ -89,6 +90,46 @@ DEFAULT_PARAMETERS = {'frequency': 915E6, 'tx_power_level': 2, 'signal_bandwidth
 
 REQUIRED_VERSION = 0x12
 
+# garbage collection policies
+GC_NEVER = 0		# never collect from packet operations
+GC_EVERY_N = 1		# collect every N packets
+GC_LOW_MEMORY = 2	# collect when gc.mem_free() drops below a threshold
+
+class GcPolicy:
+	''' Decides when a packet operation runs gc.collect(), instead of forcing a
+		full collection on every packet, and accounts for the time spent. '''
+	def __init__(self, mode=GC_LOW_MEMORY, every=16, threshold=16384):
+		self.mode = mode
+		self.every = every			# packets between collections for GC_EVERY_N
+		self.threshold = threshold	# free heap bytes for GC_LOW_MEMORY
+		self.packets = 0
+		self.collections = 0
+		self.collect_us = 0
+
+	def packet(self):
+		''' call once per packet, collects if due. Returns True if it collected '''
+		self.packets += 1
+		if self.mode == GC_EVERY_N:
+			due = self.packets % self.every == 0
+		elif self.mode == GC_LOW_MEMORY:
+			due = gc.mem_free() < self.threshold
+		else:
+			due = False
+		if due:
+			self.collect()
+		return due
+
+	def collect(self):
+		''' full collection, timed '''
+		start = ticks_us()
+		gc.collect()
+		self.collect_us += ticks_diff(ticks_us(), start)
+		self.collections += 1
+
+	def stats(self):
+		return {'packets': self.packets, 'collections': self.collections,
+				'collect_us': self.collect_us}
+
 class SX127x:
 	''' Standard SX127x library. Requires an spicontrol.SpiControl instance for spiControl '''
 	def __init__(self,
@@ -96,7 +137,8 @@ class SX127x:
 				 parameters={},
 				 onReceive=None,
 				 onTransmit=None,
-				 spiControl=None):
+				 spiControl=None,
+				 gcPolicy=None):
 
 		self.name = name
 		self.parameters = parameters
@@ -104,6 +146,7 @@ class SX127x:
 		self.spreading = 6	# default spreading factor
 		self._onReceive = onReceive	 # the onreceive function
 		self._onTransmit = onTransmit   # the ontransmit function
+		self.gcPolicy = gcPolicy if gcPolicy is not None else GcPolicy()
 		self.doAcquire = hasattr(_thread, 'allocate_lock') # micropython vs loboris
 		if self.doAcquire :
 			self._lock = _thread.allocate_lock()
@@ -111,6 +154,8 @@ class SX127x:
 			self._lock = True
 		self._spiControl = spiControl   # the spi wrapper - see spicontrol.py
 		self.irqPin = spiControl.getIrqPin() # a way to need loracontrol only in spicontrol
+		self._rxBuffer = bytearray(MAX_PKT_LENGTH + 1)	# reused for every received packet
+		self._rxView = memoryview(self._rxBuffer)
 		self.isLoboris = not callable(getattr(self.irqPin, "irq", None)) # micropython vs loboris
 
 	# if we passed in a param use it, else use default
@@ -184,7 +229,7 @@ class SX127x:
 		if (irqFlags & IRQ_TX_DONE_MASK) == 0:
 			return False
 		# clear IRQ's
-		self.collect_garbage()
+		self.gcPolicy.packet()
 		return True
 
 	def write(self, buffer):
@@ -192,9 +237,8 @@ class SX127x:
 		size = len(buffer)
 		# check size
 		size = min(size, (MAX_PKT_LENGTH - FifoTxBaseAddr - currentLength))
-		# write data
-		for i in range(size):
-			self.writeRegister(REG_FIFO, buffer[i])
+		# write data in one burst
+		self._spiControl.burstWrite(REG_FIFO, buffer if size == len(buffer) else memoryview(buffer)[:size])
 		# update length
 		self.writeRegister(REG_PAYLOAD_LENGTH, currentLength + size)
 		return size
@@ -231,7 +275,9 @@ class SX127x:
 		return self.readRegister(REG_PKT_RSSI_VALUE) - (164 if self._frequency < 868E6 else 157)
 
 	def packetSnr(self):
-		return self.readRegister(REG_PKT_SNR_VALUE) * 0.25
+		''' the snr register is two's complement in quarter dB steps '''
+		snr = self.readRegister(REG_PKT_SNR_VALUE)
+		return ((snr ^ 0x80) - 0x80) * 0.25
 
 	def standby(self):
 		self.writeRegister(REG_OP_MODE, MODE_LONG_RANGE_MODE | MODE_STDBY)
@@ -267,9 +313,9 @@ class SX127x:
 	def setFrequency(self, frequency):
 		self._frequency = frequency
 		frfs = (int)(frequency / 61.03515625)
-		self.writeRegister(REG_FRF_MSB, frfs >> 16)
-		self.writeRegister(REG_FRF_MID, frfs >> 8)
-		self.writeRegister(REG_FRF_LSB, frfs)
+		self.writeRegister(REG_FRF_MSB, (frfs >> 16) & 0xff)
+		self.writeRegister(REG_FRF_MID, (frfs >> 8) & 0xff)
+		self.writeRegister(REG_FRF_LSB, frfs & 0xff)
 
 	def setSpreadingFactor(self, sf):
 		sf = min(max(sf, 6), 12)
@@ -428,17 +474,18 @@ class SX127x:
 		return False
 
 	def read_payload(self):
+		''' burst read the packet into the receive buffer. Returns a memoryview
+			slice of it, only valid until the next packet - copy with bytes() to keep it '''
 		# set FIFO address to current RX address
 		# fifo_rx_current_addr = self.readRegister(REG_FIFO_RX_CURRENT_ADDR)
 		self.writeRegister(REG_FIFO_ADDR_PTR, self.readRegister(REG_FIFO_RX_CURRENT_ADDR))
 		# read packet length
 		packetLength = self.readRegister(REG_PAYLOAD_LENGTH) if self._implicitHeaderMode else \
 					   self.readRegister(REG_RX_NB_BYTES)
-		payload = bytearray()
-		for i in range(packetLength):
-			payload.append(self.readRegister(REG_FIFO))
-		self.collect_garbage()
-		return bytes(payload)
+		payload = self._rxView[:packetLength]
+		self._spiControl.burstRead(REG_FIFO, payload)
+		self.gcPolicy.packet()
+		return payload
 
 	def readRegister(self, address, byteorder='big', signed=False):
 		response = self._spiControl.transfer(address & 0x7f)
@@ -448,6 +495,7 @@ class SX127x:
 		self._spiControl.transfer(address | 0x80, value)
 
 	def collect_garbage(self):
-		gc.collect()
+		''' full collection now, regardless of the policy '''
+		self.gcPolicy.collect()
 		#print('[Memory - free: {}   allocated: {}]'.format(gc.mem_free(), gc.mem_alloc()))
 
@@ -1,6 +1,6 @@
 import gc
 from machine import Pin
-from time import sleep, sleep_ms
+from time import sleep, sleep_ms, ticks_ms, ticks_add, ticks_diff
 
 TX_BASE_ADDR = 0x00
 RX_BASE_ADDR = 0x00
@@ -22,8 +22,9 @@ REG_FIFO_RX_BASE_ADDR = 0x0f
 REG_FIFO_RX_CURRENT_ADDR = 0x10
 REG_IRQ_FLAGS = 0x12
 REG_RX_NB_BYTES = 0x13
+REG_MODEM_STAT = 0x18
 REG_PKT_RSSI_VALUE = 0x1a
-REG_PKT_SNR_VALUE = 0x1b
+REG_PKT_SNR_VALUE = 0x19
 REG_MODEM_CONFIG_1 = 0x1d
 REG_MODEM_CONFIG_2 = 0x1e
 REG_PREAMBLE_MSB = 0x20
@@ -45,16 +46,30 @@ MODE_RX_CONTINUOUS = 0x05
 IRQ_TX_DONE_MASK = 0x08
 IRQ_PAYLOAD_CRC_ERROR_MASK = 0x20
 
+# RegModemStat: signal detected, signal synchronized, header info valid
+MODEM_STAT_RECEIVING = 0x0B
+
 MAX_PKT_LENGTH = 255
 
+# FIFO burst access headers (address byte with the wnr bit)
+FIFO_READ = b'\x00'
+FIFO_WRITE = b'\x80'
+
 class LoRa:
 
     def __init__(self, spi, **kw):
         self.spi = spi
         self.cs = kw['cs']
         self.rx = kw['rx']
+        # received packets are burst read into this buffer, see _read_payload
+        self._rx_buf = bytearray(MAX_PKT_LENGTH + 1)
+        self._rx_view = memoryview(self._rx_buf)
+        # non-blocking transmit state, see send_nowait
+        self._tx_deadline = None
+        self.tx_ok = True
+        self.tx_timeouts = 0
         while self._read(REG_VERSION) != 0x12:
-            time.sleep_ms(100)
+            sleep_ms(100)
             #raise Exception('Invalid version or bad SPI connection')
         self.sleep()
         self.set_frequency(kw.get('frequency', 915.0))
@@ -94,8 +109,10 @@ class LoRa:
         p = MAX_PKT_LENGTH - TX_BASE_ADDR
         if n + m > p:
             raise ValueError('Max payload length is ' + str(p))
-        for i in range(m):
-            self._write(REG_FIFO, b[i])
+        self.cs.value(0)
+        self.spi.write(FIFO_WRITE)
+        self.spi.write(b)
+        self.cs.value(1)
         self._write(REG_PAYLOAD_LENGTH, n + m)
 
     def send(self, x):
@@ -111,6 +128,45 @@ class LoRa:
         print("Ending packet...")
         self.end_packet()
 
+    def send_nowait(self, x):
+        # starts the transmission and returns; poll tx_done() for its end,
+        # then recv() to listen again
+        if isinstance(x, str):
+            x = x.encode()
+        self.begin_packet()
+        self.write_packet(x)
+        # twice the time on air plus margin, as in Mayonnaise's driver
+        self._tx_deadline = ticks_add(ticks_ms(), 2 * self.time_on_air_ms(len(x)) + 100)
+        self._write(REG_OP_MODE, MODE_LORA | MODE_TX)
+
+    def tx_done(self):
+        # the radio drops back to standby by itself once TxDone is raised.
+        # A transmission past its deadline is aborted; tx_ok tells which
+        if self._read(REG_OP_MODE) & 0x07 == MODE_TX:
+            if self._tx_deadline is None or ticks_diff(ticks_ms(), self._tx_deadline) < 0:
+                return False
+            self.standby()
+            self.tx_timeouts += 1
+            self.tx_ok = False
+        else:
+            self.tx_ok = True
+        self._tx_deadline = None
+        self._write(REG_IRQ_FLAGS, IRQ_TX_DONE_MASK)
+        return True
+
+    def time_on_air_ms(self, n):
+        # SX127x datasheet formula for an n byte payload at the current settings
+        sf = self._sf
+        symbol_us = (1 << sf) * 1000000 // self._bandwidth
+        de = 1 if symbol_us > 16000 else 0
+        bits = 8 * n - 4 * sf + 28 + (16 if self._crc else 0) - (20 if self._implicit else 0)
+        symbols = 8 + max(-(-bits // (4 * (sf - 2 * de))) * (self._cr + 4), 0)
+        return ((self._preamble * 4 + 17) * symbol_us // 4 + symbols * symbol_us) // 1000 + 1
+
+    def receiving(self):
+        # a packet is being demodulated right now (preamble or header heard)
+        return self._read(REG_MODEM_STAT) & MODEM_STAT_RECEIVING != 0
+
     def _get_irq_flags(self):
         f = self._read(REG_IRQ_FLAGS)
         self._write(REG_IRQ_FLAGS, f)
@@ -123,7 +179,9 @@ class LoRa:
         return rssi - 164
 
     def get_snr(self):
-        return self._read(REG_PKT_SNR_VALUE) * 0.25
+        # two's complement, quarter dB steps
+        snr = self._read(REG_PKT_SNR_VALUE)
+        return ((snr ^ 0x80) - 0x80) * 0.25
 
     def standby(self):
         self._write(REG_OP_MODE, MODE_LORA | MODE_STDBY)
@@ -152,9 +210,10 @@ class LoRa:
             raise ValueError('Spreading factor must be between 6-12')
         self._write(REG_DETECTION_OPTIMIZE, 0xc5 if sf == 6 else 0xc3)
         self._write(REG_DETECTION_THRESHOLD, 0x0c if sf == 6 else 0x0a)
+        self._sf = sf
         reg2 = self._read(REG_MODEM_CONFIG_2)
         self._write(REG_MODEM_CONFIG_2, (reg2 & 0x0f) | ((sf << 4) & 0xf0))
-	self._write(REG_MODEM_CONFIG_3, 0x08 if (sf>10 and self._bandwidth<250000) else 0x00)
+        self._write(REG_MODEM_CONFIG_3, 0x08 if (sf>10 and self._bandwidth<250000) else 0x00)
 
     def set_bandwidth(self, bw):
         self._bandwidth = bw
@@ -170,14 +229,17 @@ class LoRa:
     def set_coding_rate(self, denom):
         denom = min(max(denom, 5), 8)
         cr = denom - 4
+        self._cr = cr
         reg1 = self._read(REG_MODEM_CONFIG_1)
         self._write(REG_MODEM_CONFIG_1, (reg1 & 0xf1) | (cr << 1))
 
     def set_preamble_length(self, n):
+        self._preamble = n
         self._write(REG_PREAMBLE_MSB, (n >> 8) & 0xff)
         self._write(REG_PREAMBLE_LSB, (n >> 0) & 0xff)
 
     def set_crc(self, crc=False):
+        self._crc = crc
         modem_config_2 = self._read(REG_MODEM_CONFIG_2)
         if crc:
             config = modem_config_2 | 0x04
@@ -217,16 +279,20 @@ class LoRa:
                 self._on_recv(self._read_payload())
 
     def _read_payload(self):
+        # returns a memoryview into the receive buffer, valid until the
+        # next packet arrives; copy it with bytes() to keep it
         self._write(REG_FIFO_ADDR_PTR, self._read(REG_FIFO_RX_CURRENT_ADDR))
         if self._implicit:
             n = self._read(REG_PAYLOAD_LENGTH)
         else:
             n = self._read(REG_RX_NB_BYTES)
-        payload = bytearray()
-        for i in range(n):
-            payload.append(self._read(REG_FIFO))
+        payload = self._rx_view[:n]
+        self.cs.value(0)
+        self.spi.write(FIFO_READ)
+        self.spi.readinto(payload)
+        self.cs.value(1)
         gc.collect()
-        return bytes(payload)
+        return payload
 
     def _transfer(self, addr, x=0x00):
         resp = bytearray(1)
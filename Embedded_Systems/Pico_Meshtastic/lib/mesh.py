@@ -0,0 +1,277 @@
+# Managed-flood mesh routing on top of the LoRa driver
+#
+# Every packet carries a hop limit and a per-source packet id:
+#
+#   B  0xC0 | hop limit   hops it may still be relayed (0-15)
+#   B  source             node that sent it first
+#   B  destination        0xFF: every node
+#   H  packet id          per source, little-endian, wraps
+#      payload...
+#
+# A node relays the first copy of each packet it hears, with the hop limit
+# one lower, after a random delay drawn from a contention window that
+# shrinks with the SNR the copy arrived at. Distant nodes (low SNR) extend
+# coverage most and relay first; a node that hears `redundancy` other nodes
+# relay the packet while its own copy is still waiting drops it. Copies it
+# has seen before are recognised with a fixed-size cache of (source,
+# packet id).
+# Nothing is sent while the radio is in the middle of receiving a packet.
+#
+#     router = MeshRouter(lora, node_id, on_receive=print)
+#     router.send(b"hello")
+#     while True:
+#         router.poll()
+
+import random
+from array import array
+from time import ticks_ms, ticks_add, ticks_diff
+
+MARKER = 0xC0
+MARKER_MASK = 0xF0
+HOP_MASK = 0x0F
+HEADER_SIZE = 5
+BROADCAST = 0xFF
+MAX_PACKET = 255
+# Outbox key of frames that are neither our packets nor relays, e.g. routing
+CONTROL = -1
+
+# SNR range the contention window is spread over, dB
+SNR_FAR = -20
+SNR_NEAR = 10
+
+
+class DuplicateCache:
+    """
+    The last `size` (source, packet id) keys seen, in a preallocated ring.
+    Lookups scan the ring, so memory stays fixed however many keys go
+    through it; the oldest key is forgotten once the ring is full.
+    """
+    def __init__(self, size=64):
+        self.size = size
+        self._ring = array('l', [-1] * size)
+        self._next = 0
+        self._count = 0
+
+    def __contains__(self, key):
+        return key in self._ring
+
+    def __len__(self):
+        return self._count
+
+    def add(self, key):
+        """
+        :return: False if the key was already in the cache.
+        """
+        ring = self._ring
+        if key in ring:
+            return False
+        ring[self._next] = key
+        self._next = (self._next + 1) % self.size
+        if self._count < self.size:
+            self._count += 1
+        return True
+
+
+class MeshRouter:
+    """
+    Sends, receives and relays packets through one LoRa radio. The radio's
+    receive interrupt only queues packets; poll() does the rest and must be
+    called often from the main loop.
+    """
+    def __init__(self, lora, node_id, hop_limit=3, slot_ms=50, min_window=2, max_window=16,
+                 redundancy=2, managed=True, cache_size=64, queue_size=8, on_receive=None, rng=None):
+        """
+        :param lora: LoRa driver from lib/lora.py.
+        :param node_id: This node's id, 0-254.
+        :param hop_limit: Relays a packet sent by this node may take.
+        :param slot_ms: Contention slot, about the airtime of a packet.
+        :param min_window: Slots a relay may wait at the lowest SNR.
+        :param max_window: Slots a relay may wait at the highest SNR.
+        :param redundancy: Relays by other nodes heard before a waiting
+                           relay is dropped.
+        :param managed: False relays every first copy after a uniform random
+                        delay and never drops a waiting relay: plain flooding,
+                        to compare against.
+        :param cache_size: (source, packet id) keys remembered.
+        :param queue_size: Received packets, and packets waiting to be sent,
+                           held at most.
+        :param on_receive: Called as on_receive(source, payload, rssi, snr)
+                           for packets for this node or everyone.
+        :param rng: Object with getrandbits(), e.g. a seeded random.Random.
+        """
+        self.lora = lora
+        self.node_id = node_id & 0xFF
+        self.hop_limit = min(hop_limit, HOP_MASK)
+        self.slot_ms = slot_ms
+        self.min_window = min_window
+        self.max_window = max_window
+        self.redundancy = redundancy
+        self.managed = managed
+        self.queue_size = queue_size
+        self.on_receive = on_receive
+        self.rng = rng or random
+        self.cache = DuplicateCache(cache_size)
+        self._packet_id = self.rng.getrandbits(16)
+        self._received = []      # (payload, rssi, snr) from the interrupt
+        self._outbox = []        # [due ms, key, frame, copies heard]; key None for our own,
+                                 # CONTROL for routing traffic
+        self._transmitting = False
+        # Counters
+        self.sent = 0
+        self.relayed = 0
+        self.delivered = 0
+        self.duplicates = 0
+        self.cancelled = 0       # relays dropped after hearing another node's
+        self.dropped = 0         # queue overflows
+        self.tx_failed = 0       # transmissions that timed out
+        self.tx_bytes = 0
+        lora.on_recv(self._on_packet)
+        lora.recv()
+
+    # ---------------------------
+    # Sending
+    # ---------------------------
+    def send(self, payload, destination=BROADCAST, hop_limit=None):
+        """
+        Queue a packet for every node, or one node, of the mesh.
+
+        :return: The packet id, or None if the queue is full.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode()
+        if len(payload) > MAX_PACKET - HEADER_SIZE:
+            raise ValueError('Max payload length is ' + str(MAX_PACKET - HEADER_SIZE))
+        if len(self._outbox) >= self.queue_size:
+            self.dropped += 1
+            return None
+        packet_id = self._new_id()
+        hops = self.hop_limit if hop_limit is None else min(hop_limit, HOP_MASK)
+        self._queue(bytes((MARKER | hops, self.node_id, destination, packet_id & 0xFF,
+                           packet_id >> 8)) + payload)
+        return packet_id
+
+    def _new_id(self):
+        packet_id = self._packet_id
+        self._packet_id = (packet_id + 1) & 0xFFFF
+        self.cache.add(self.node_id << 16 | packet_id)
+        return packet_id
+
+    def _queue(self, frame, delay_ms=0, key=None):
+        """
+        :param key: (source, packet id) key of a relay, None for our own
+                    packets, CONTROL for anything else.
+        :return: False if the outbox is full.
+        """
+        if len(self._outbox) >= self.queue_size:
+            self.dropped += 1
+            return False
+        self._outbox.append([ticks_add(ticks_ms(), delay_ms), key, frame, 0])
+        return True
+
+    def poll(self):
+        """
+        Handle the packets received since the last call, and start the next
+        transmission that is due once the radio is free.
+        """
+        while self._received:
+            self._handle(*self._received.pop(0))
+        if self._transmitting:
+            if not self.lora.tx_done():
+                return
+            self._transmitting = False
+            if not self.lora.tx_ok:
+                self.tx_failed += 1
+            self.lora.recv()
+        now = ticks_ms()
+        outbox = self._outbox
+        if not outbox or self.lora.receiving():
+            return
+        for i in range(len(outbox)):
+            due, key, frame, heard = outbox[i]
+            if ticks_diff(now, due) >= 0:
+                del outbox[i]
+                if key is None:
+                    self.sent += 1
+                elif key != CONTROL:
+                    self.relayed += 1
+                self.tx_bytes += len(frame)
+                self._transmitting = True
+                self.lora.send_nowait(frame)
+                return
+
+    def next_poll_ms(self):
+        """
+        :return: Milliseconds until poll() has something to do (0 if now, or
+                 while a packet is on air), or -1 if it is idle until a
+                 packet arrives or send() is called.
+        """
+        if self._received or self._transmitting:
+            return 0
+        now = ticks_ms()
+        wait = -1
+        for entry in self._outbox:
+            d = max(ticks_diff(entry[0], now), 0)
+            if wait < 0 or d < wait:
+                wait = d
+        return wait
+
+    # ---------------------------
+    # Receiving
+    # ---------------------------
+    def _on_packet(self, payload):
+        # Runs from the DIO0 interrupt: copy the packet out of the driver's
+        # buffer and leave the rest to poll()
+        if len(self._received) >= self.queue_size:
+            self.dropped += 1
+            return
+        self._received.append((bytes(payload), self.lora.get_rssi(), self.lora.get_snr()))
+
+    def _handle(self, packet, rssi, snr):
+        if len(packet) < HEADER_SIZE or packet[0] & MARKER_MASK != MARKER:
+            return
+        hops = packet[0] & HOP_MASK
+        source = packet[1]
+        destination = packet[2]
+        key = source << 16 | packet[3] | packet[4] << 8
+        if not self.cache.add(key):
+            self.duplicates += 1
+            if self.managed:
+                # Others relayed it: our copy would reach few nodes new
+                self._heard(key)
+            return
+        if destination == self.node_id or destination == BROADCAST:
+            self.delivered += 1
+            if self.on_receive:
+                self.on_receive(source, packet[HEADER_SIZE:], rssi, snr)
+        if destination != self.node_id and hops > 0:
+            self._relay(key, bytes((MARKER | (hops - 1),)) + packet[1:], snr)
+
+    def _relay(self, key, frame, snr):
+        window = self.max_window
+        if self.managed:
+            # Far (low SNR) nodes reach furthest: give them the short windows
+            near = min(max(snr - SNR_FAR, 0), SNR_NEAR - SNR_FAR)
+            window = self.min_window + (self.max_window - self.min_window) * near // (SNR_NEAR - SNR_FAR)
+        delay = self.rng.getrandbits(16) % (int(window) + 1) * self.slot_ms
+        self._queue(frame, delay, key)
+
+    def _heard(self, key):
+        outbox = self._outbox
+        for i in range(len(outbox)):
+            entry = outbox[i]
+            if entry[1] == key:
+                entry[3] += 1
+                if entry[3] >= self.redundancy:
+                    del outbox[i]
+                    self.cancelled += 1
+                return
+
+    def stats(self):
+        """
+        :return: Dict of packets sent, relayed, delivered here, duplicates
+                 heard, relays cancelled, queue overflows, transmissions
+                 that timed out and bytes sent.
+        """
+        return {"sent": self.sent, "relayed": self.relayed, "delivered": self.delivered,
+                "duplicates": self.duplicates, "cancelled": self.cancelled,
+                "dropped": self.dropped, "tx_failed": self.tx_failed, "tx_bytes": self.tx_bytes}
@@ -0,0 +1,426 @@
+# Distance-vector routing on top of the mesh router
+#
+# Flooding costs every node's airtime for every packet. Here each node
+# advertises the routes it knows to its neighbours, and unicast packets
+# follow the best route hop by hop; only a packet with no known route is
+# flooded as before. Broadcasts are still flooded.
+#
+#   ADVERT  0xE0, source, sequence, then per route: destination, its
+#           sequence, metric (255: unreachable). Never relayed.
+#   ROUTED  0xD0 | hop limit, source, destination, next hop,
+#           H packet id (little-endian), payload...
+#
+# Routes are DSDV: every node numbers its own adverts with even sequence
+# numbers, routes carry the sequence of the destination they lead to, and a
+# newer sequence always wins over a shorter route. The whole table goes out
+# every advert interval; routes found or lost in between go out sooner, on
+# their own, so news crosses the mesh in seconds without full adverts eating
+# the airtime. A route that is not refreshed within route_timeout_ms is
+# broken: advertised as unreachable with the next odd sequence, so nodes
+# routing through us drop it rather than loop, then forgotten. Metrics add
+# up a cost per hop that grows as the link's smoothed SNR and RSSI approach
+# the sensitivity limit.
+#
+#     router = DistanceVectorRouter(lora, node_id, on_receive=print)
+#     router.send(b"hello", destination=7)
+#     while True:
+#         router.poll()
+
+from array import array
+from time import ticks_ms, ticks_add, ticks_diff
+
+from mesh import MeshRouter, MARKER as MESH_MARKER, BROADCAST, MAX_PACKET, HOP_MASK, CONTROL
+
+ADVERT = 0xE0
+ROUTED = 0xD0
+MARKER_MASK = 0xF0
+ADVERT_HEADER = 3
+ENTRY_SIZE = 3
+ADVERT_ENTRIES = (MAX_PACKET - ADVERT_HEADER) // ENTRY_SIZE
+ROUTED_HEADER = 6
+
+NONE = 0xFF
+UNREACHABLE = 255
+HOP_COST = 10
+MAX_LINK_COST = 4 * HOP_COST
+# Links above these cost HOP_COST; every dB below adds to it
+SNR_GOOD = 5
+RSSI_WEAK = -110
+
+# Route states
+VALID = 0
+BROKEN = 1
+
+
+def seq_diff(a, b):
+    """
+    a - b for 8-bit sequence numbers, in -128..127.
+    """
+    return ((a - b + 128) & 0xFF) - 128
+
+
+class RoutingTable:
+    """
+    At most `size` routes in parallel arrays, with a 256-byte index from
+    node id to row so lookups are O(1). Link quality is kept per row but
+    only means something for neighbours (next hop == destination).
+    """
+    def __init__(self, size=32):
+        self.size = min(size, 255)
+        self.destination = bytearray(self.size)
+        self.next_hop = bytearray(self.size)
+        self.metric = bytearray(self.size)
+        self.seq = bytearray(self.size)
+        self.state = bytearray(self.size)
+        self.changed = bytearray(self.size)          # since the last advert
+        self.deadline = array('l', [0] * self.size)
+        self.snr = array('h', [0] * self.size)       # quarter dB, smoothed
+        self.rssi = array('h', [0] * self.size)      # dBm, smoothed
+        self._index = bytearray(b'\xff' * 256)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def find(self, destination):
+        """
+        :return: The row of a destination, or -1.
+        """
+        row = self._index[destination]
+        return -1 if row == NONE else row
+
+    def next_hop_for(self, destination):
+        """
+        :return: Next hop of a usable route to destination, or None.
+        """
+        row = self._index[destination]
+        if row == NONE or self.state[row] != VALID:
+            return None
+        return self.next_hop[row]
+
+    def add(self, destination, metric):
+        """
+        Make room for a new route, evicting a broken one or, failing that,
+        the longest one if it is longer than metric.
+
+        :return: The new row, or -1 if the table is full of better routes.
+        """
+        if self.count < self.size:
+            row = self.count
+            self.count += 1
+        else:
+            row = -1
+            worst = metric
+            for r in range(self.count):
+                if self.state[r] == BROKEN:
+                    row = r
+                    break
+                if self.metric[r] > worst:
+                    row = r
+                    worst = self.metric[r]
+            if row < 0:
+                return -1
+            self._index[self.destination[row]] = NONE
+        self.destination[row] = destination
+        self.state[row] = VALID
+        self.changed[row] = 0
+        self._index[destination] = row
+        return row
+
+    def remove(self, row):
+        # Move the last row into the hole so rows stay packed
+        self._index[self.destination[row]] = NONE
+        last = self.count - 1
+        if row != last:
+            for column in (self.destination, self.next_hop, self.metric, self.seq, self.state,
+                           self.changed, self.deadline, self.snr, self.rssi):
+                column[row] = column[last]
+            self._index[self.destination[row]] = row
+        self.count = last
+
+    def routes(self):
+        """
+        :return: List of (destination, next hop, metric, usable) for display.
+        """
+        return [(self.destination[r], self.next_hop[r], self.metric[r], self.state[r] == VALID)
+                for r in range(self.count)]
+
+
+class DistanceVectorRouter(MeshRouter):
+    """
+    MeshRouter that routes unicast packets along a distance-vector table
+    and floods only broadcasts and packets it has no route for.
+    """
+    def __init__(self, lora, node_id, table_size=32, advert_interval_ms=300000,
+                 route_timeout_ms=None, **kwargs):
+        """
+        :param table_size: Routes held at most.
+        :param advert_interval_ms: Mean time between adverts of the whole
+                                   table (jittered by +-25% so neighbours do
+                                   not collide). Routes found or lost go out
+                                   sooner, in an advert of their own a
+                                   quarter of this after the last.
+        :param route_timeout_ms: Silence after which a route breaks, and a
+                                 broken route is forgotten. Defaults to three
+                                 advert intervals.
+        Other keyword arguments go to MeshRouter.
+        """
+        super().__init__(lora, node_id, **kwargs)
+        self.table = RoutingTable(table_size)
+        self.advert_interval_ms = advert_interval_ms
+        self.route_timeout_ms = route_timeout_ms or 3 * advert_interval_ms
+        self.own_seq = 0
+        self._advert_sent = ticks_add(ticks_ms(), -advert_interval_ms)
+        self._full_at = ticks_add(ticks_ms(), self._jitter(advert_interval_ms // 4))
+        self._advert_at = self._full_at
+        # Counters
+        self.routed = 0          # unicast packets sent or forwarded along a route
+        self.fallbacks = 0       # unicast packets flooded for want of a route
+        self.adverts = 0
+        self.broken = 0
+
+    # ---------------------------
+    # Sending
+    # ---------------------------
+    def send(self, payload, destination=BROADCAST, hop_limit=None):
+        """
+        Queue a packet: along a route if there is one to destination,
+        flooded otherwise.
+
+        :return: The packet id, or None if the queue is full.
+        """
+        next_hop = self.table.next_hop_for(destination) if destination != BROADCAST else None
+        if next_hop is None:
+            packet_id = super().send(payload, destination, hop_limit)
+            if destination != BROADCAST and packet_id is not None:
+                self.fallbacks += 1
+            return packet_id
+        if isinstance(payload, str):
+            payload = payload.encode()
+        if len(payload) > MAX_PACKET - ROUTED_HEADER:
+            raise ValueError('Max payload length is ' + str(MAX_PACKET - ROUTED_HEADER))
+        if len(self._outbox) >= self.queue_size:
+            self.dropped += 1
+            return None
+        packet_id = self._new_id()
+        hops = HOP_MASK if hop_limit is None else min(hop_limit, HOP_MASK)
+        self.routed += 1
+        self._queue(bytes((ROUTED | hops, self.node_id, destination, next_hop,
+                           packet_id & 0xFF, packet_id >> 8)) + payload)
+        return packet_id
+
+    def poll(self):
+        now = ticks_ms()
+        if ticks_diff(now, self._advert_at) >= 0:
+            full = ticks_diff(now, self._full_at) >= 0
+            if full:
+                self._full_at = ticks_add(now, self._jitter(self.advert_interval_ms))
+            self._advert_sent = now
+            self._advert_at = self._full_at
+            self._expire(now)
+            self._advertise(full)
+        super().poll()
+
+    def next_poll_ms(self):
+        wait = super().next_poll_ms()
+        advert = max(ticks_diff(self._advert_at, ticks_ms()), 0)
+        return advert if wait < 0 or advert < wait else wait
+
+    def _changed(self, row):
+        # Tell the neighbours soon, rather than a hop per advert interval
+        self.table.changed[row] = 1
+        at = ticks_add(self._advert_sent, self._jitter(self.advert_interval_ms // 4))
+        if ticks_diff(at, self._advert_at) < 0:
+            self._advert_at = at
+
+    def _jitter(self, interval):
+        quarter = interval // 4
+        return interval - quarter + self.rng.getrandbits(16) % (2 * quarter + 1)
+
+    def _advertise(self, full):
+        # Every route, or only those changed since the last advert, in as
+        # many packets as it takes
+        table = self.table
+        changed = table.changed
+        rows = [row for row in range(table.count) if full or changed[row]]
+        for row in range(table.count):
+            changed[row] = 0
+        self.own_seq = (self.own_seq + 2) & 0xFF
+        start = 0
+        while True:
+            count = min(len(rows) - start, ADVERT_ENTRIES)
+            frame = bytearray(ADVERT_HEADER + ENTRY_SIZE * count)
+            frame[0] = ADVERT
+            frame[1] = self.node_id
+            frame[2] = self.own_seq
+            i = ADVERT_HEADER
+            for row in rows[start:start + count]:
+                frame[i] = table.destination[row]
+                frame[i + 1] = table.seq[row]
+                frame[i + 2] = table.metric[row]
+                i += ENTRY_SIZE
+            if not self._queue(bytes(frame), 0, CONTROL):
+                return
+            self.adverts += 1
+            start += count
+            if start >= len(rows):
+                return
+
+    def _expire(self, now):
+        table = self.table
+        row = 0
+        while row < table.count:
+            if ticks_diff(now, table.deadline[row]) < 0:
+                row += 1
+            elif table.state[row] == BROKEN:
+                table.remove(row)
+            else:
+                self._break(row, now)
+                row += 1
+
+    def _break(self, row, now):
+        table = self.table
+        neighbour = table.destination[row] if table.next_hop[row] == table.destination[row] else None
+        table.state[row] = BROKEN
+        table.metric[row] = UNREACHABLE
+        # Odd: newer than anything the destination advertised, older than
+        # its next advert
+        table.seq[row] = (table.seq[row] + 1) & 0xFF | 1
+        table.deadline[row] = ticks_add(now, self.route_timeout_ms)
+        self.broken += 1
+        self._changed(row)
+        if neighbour is not None:
+            # Lost a neighbour: so are the routes through it
+            for r in range(table.count):
+                if table.next_hop[r] == neighbour and table.state[r] == VALID:
+                    self._break(r, now)
+
+    # ---------------------------
+    # Receiving
+    # ---------------------------
+    def _handle(self, packet, rssi, snr):
+        if not packet:
+            return
+        marker = packet[0] & MARKER_MASK
+        if marker == ADVERT:
+            if len(packet) >= ADVERT_HEADER:
+                self._on_advert(packet, rssi, snr)
+        elif marker == ROUTED:
+            if len(packet) >= ROUTED_HEADER:
+                self._on_routed(packet, rssi, snr)
+        else:
+            super()._handle(packet, rssi, snr)
+
+    def link_cost(self, row):
+        """
+        :return: Metric of the hop to a neighbour from its smoothed SNR and
+                 RSSI: HOP_COST on a good link, up to MAX_LINK_COST near the
+                 sensitivity limit.
+        """
+        table = self.table
+        cost = HOP_COST + max(0, SNR_GOOD * 4 - table.snr[row]) // 2 + max(0, RSSI_WEAK - table.rssi[row])
+        return min(cost, MAX_LINK_COST)
+
+    def _on_advert(self, packet, rssi, snr):
+        neighbour = packet[1]
+        if neighbour == self.node_id:
+            return
+        table = self.table
+        now = ticks_ms()
+        row = table.find(neighbour)
+        fresh = row < 0 or table.next_hop[row] != neighbour
+        found = row < 0 or table.state[row] != VALID
+        if row < 0:
+            row = table.add(neighbour, HOP_COST)
+            if row < 0:
+                return
+        if found:
+            self._changed(row)
+        # Smooth the link quality; a new neighbour starts at this packet's
+        snr4 = int(snr * 4)
+        if fresh:
+            table.snr[row] = snr4
+            table.rssi[row] = rssi
+        else:
+            table.snr[row] = (3 * table.snr[row] + snr4) // 4
+            table.rssi[row] = (3 * table.rssi[row] + rssi) // 4
+        cost = self.link_cost(row)
+        table.next_hop[row] = neighbour
+        table.metric[row] = cost
+        table.seq[row] = packet[2]
+        table.state[row] = VALID
+        table.deadline[row] = ticks_add(now, self.route_timeout_ms)
+        for i in range(ADVERT_HEADER, len(packet) - ENTRY_SIZE + 1, ENTRY_SIZE):
+            destination = packet[i]
+            if destination != self.node_id and destination != neighbour:
+                self._update(destination, neighbour, packet[i + 1], packet[i + 2], cost, now)
+
+    def _update(self, destination, neighbour, seq, metric, cost, now):
+        table = self.table
+        if metric != UNREACHABLE:
+            metric = min(metric + cost, UNREACHABLE - 1)
+        row = table.find(destination)
+        if row < 0:
+            if metric == UNREACHABLE:
+                return
+            row = table.add(destination, metric)
+            if row < 0:
+                return
+            self._changed(row)
+        else:
+            d = seq_diff(seq, table.seq[row])
+            # Newer news wins; same news only if shorter, or if it comes
+            # from the neighbour we already route through
+            if d < 0 or (d == 0 and metric >= table.metric[row] and table.next_hop[row] != neighbour):
+                return
+        if (metric == UNREACHABLE) == (table.state[row] == VALID):
+            self._changed(row)
+        table.next_hop[row] = neighbour
+        table.metric[row] = metric
+        table.seq[row] = seq
+        if metric == UNREACHABLE:
+            if table.state[row] == VALID:
+                self.broken += 1
+            table.state[row] = BROKEN
+        else:
+            table.state[row] = VALID
+        table.deadline[row] = ticks_add(now, self.route_timeout_ms)
+
+    def _on_routed(self, packet, rssi, snr):
+        if packet[3] != self.node_id:
+            return  # for another hop
+        source = packet[1]
+        destination = packet[2]
+        packet_id = packet[4] | packet[5] << 8
+        if not self.cache.add(source << 16 | packet_id):
+            self.duplicates += 1
+            return
+        if destination == self.node_id:
+            self.delivered += 1
+            if self.on_receive:
+                self.on_receive(source, packet[ROUTED_HEADER:], rssi, snr)
+            return
+        hops = packet[0] & HOP_MASK
+        if hops == 0:
+            return
+        next_hop = self.table.next_hop_for(destination)
+        if next_hop is None:
+            # The route broke under the packet: flood the rest of the way
+            self.fallbacks += 1
+            frame = bytes((MESH_MARKER | (hops - 1), source, destination, packet[4], packet[5]))
+            self._queue(frame + packet[ROUTED_HEADER:], 0, source << 16 | packet_id)
+            return
+        self.routed += 1
+        self._queue(bytes((ROUTED | (hops - 1), source, destination, next_hop)) + packet[4:],
+                    0, source << 16 | packet_id)
+
+    def stats(self):
+        """
+        :return: MeshRouter.stats() plus packets routed, unicast packets
+                 flooded for want of a route, adverts sent, routes broken
+                 and routes held.
+        """
+        stats = super().stats()
+        stats.update({"routed": self.routed, "fallbacks": self.fallbacks, "adverts": self.adverts,
+                      "broken": self.broken, "routes": len(self.table)})
+        return stats
@@ -0,0 +1,58 @@
+# Mesh node: relays every packet it hears and broadcasts a hello every
+# 30 seconds. Flash the same script to each board; the node id comes from
+# the last byte of the Pico's unique id.
+#
+# Pin configuration as in lora_lib_test.py.
+
+from lora import LoRa
+from mesh import MeshRouter
+from machine import Pin, SPI, unique_id
+from time import ticks_ms, ticks_diff, sleep_ms
+
+# SPI pins
+SCK  = 10
+MOSI = 11
+MISO = 12
+# Chip select
+CS   = 13
+# Receive IRQ
+RX   = 9
+reset_pin = 14
+reset = Pin(reset_pin, Pin.OUT)
+reset.value(1)
+
+HELLO_INTERVAL_MS = 30000
+
+spi = SPI(
+    1,
+    baudrate=10000000,
+    sck=Pin(SCK, Pin.OUT, Pin.PULL_DOWN),
+    mosi=Pin(MOSI, Pin.OUT, Pin.PULL_UP),
+    miso=Pin(MISO, Pin.IN, Pin.PULL_UP),
+)
+spi.init()
+
+lora = LoRa(
+    spi,
+    cs=Pin(CS, Pin.OUT),
+    rx=Pin(RX, Pin.IN),
+)
+
+
+def received(source, payload, rssi, snr):
+    print(f"From {source}: {bytes(payload)} (RSSI: {rssi}, SNR: {snr})")
+
+
+node_id = unique_id()[-1] % 0xFF
+router = MeshRouter(lora, node_id, on_receive=received)
+print(f"Mesh node {node_id} up.")
+
+last_hello = ticks_ms() - HELLO_INTERVAL_MS
+count = 0
+while True:
+    if ticks_diff(ticks_ms(), last_hello) >= HELLO_INTERVAL_MS:
+        last_hello = ticks_ms()
+        router.send(f"hello {count} from {node_id}")
+        count += 1
+    router.poll()
+    sleep_ms(5)
@@ -1,6 +1,7 @@
 from machine import Pin, SPI
 from time import sleep
 from ulora.core import ULoRa  # Ensure the ULoRa class is implemented and imported correctly
+from Drivers.lora.telemetry import TelemetryEncoder, TYPE_PING  # shared with Mayonnaise, see ulora/core.py
 EX_LED = Pin(15, Pin.OUT)
 # ============================================================================ 
 # Sender Test Example
@@ -46,7 +47,9 @@ if __name__ == "__main__":
         print("ULoRa instance created successfully.")
         
         # ------------------------- Transmitting Test Message ----------------
-        Counter = 0
+        # Binary ping frames: node id = name_index, the frame sequence number
+        # replaces the counter (5 bytes on air instead of ~25 for the text)
+        telemetry = TelemetryEncoder(name_index)
         
         while True:
             # try:
@@ -59,16 +62,16 @@ if __name__ == "__main__":
             #     message = "None"  # Proceed to send message without waiting for input
 
 
-            test_message = f"Hello From {egg_name}: {Counter}!"
             print("\n----- Transmitting Message -----")
-            print(f"Message from {egg_name}: {test_message}")
+            seq = telemetry.seq
+            frame = telemetry.encode(TYPE_PING)
+            print(f"Ping from {egg_name} (node {name_index}, seq {seq}): {bytes(frame)}")
             
-            # Send the message via LoRa
-            lora.println(test_message)
+            # Send it via LoRa as a ping frame
+            lora.println(frame)
             
             print("Message transmission complete.")
             print("---------------------------------------------------------------------\n")
-            Counter += 1
             EX_LED.toggle()
              
 
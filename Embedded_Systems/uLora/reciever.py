@@ -1,6 +1,7 @@
 from machine import Pin, SPI
 from time import sleep
 from ulora.core import ULoRa  # Ensure the ULoRa class is implemented and imported correctly
+from Drivers.lora.telemetry import decode  # shared with Mayonnaise, see ulora/core.py
 
 EX_LED = Pin(15, Pin.OUT)
 
@@ -45,7 +46,11 @@ if __name__ == "__main__":
             if payload:
                 EX_LED.on()
                 # If a message is received, print it
-                print(f"Received payload: {payload}")
+                frame = decode(payload)
+                if frame is not None:
+                    print(f"Received frame: {frame}")
+                else:
+                    print(f"Received payload: {payload}")  # legacy text sender
                 print(f"RSSI (R) : {lora.packet_rssi()} dBm")
                 print(f"SNR (Singal To Noise): {lora.packet_snr()} dB")
 
@@ -0,0 +1,443 @@
+# Adaptive data rate for LoRaTransceiver links
+#
+# Every node keeps, per peer, the RSSI and SNR of the last `window` packets
+# it heard from that peer at the link's current settings. The node that
+# manages a link (manage(peer), e.g. the gateway) turns them into a link
+# margin, as a LoRaWAN network server does:
+#
+#   margin = SNR - REQUIRED_SNR[sf] - margin_db
+#
+# from the mean packet SNR, or from the mean RSSI over the noise floor where
+# the SNR reading saturates. The mean is steadier than LoRaWAN's best SNR of
+# the window, so the installation margin can be half its 10 dB. Each step_db
+# of margin buys one spreading factor less, then step_db less TX power; a
+# negative margin takes power, then the spreading factor, back up. Both ends
+# of a link use the same settings, so a change is negotiated over the air,
+# always at the link's current settings:
+#
+#   REQ    0x90, source, destination, seq, sf, power   "switch to these"
+#   ANS    0x91, source, destination, seq              "switching now"
+#   PING   0x92, source, destination, seq              "can you hear me?"
+#   PONG   0x93, source, destination, seq              answer to a PING
+#
+# The follower switches once its ANS is on air and PINGs at the new
+# settings; the manager switches when it hears the ANS. Each end keeps the
+# new settings once it hears the other at them, and goes back to the old
+# ones if that does not happen within confirm_ms, so a lost ANS or PING
+# only costs the attempt.
+#
+# A link that fails later falls back to the base settings the radio started
+# with, which both ends reach on their own: after ack_limit sends without
+# hearing the peer a node PINGs it, and after ack_delay more sends, or
+# timeout_ms of silence, it drops to base.
+#
+# A radio receives at one spreading factor, so a node with several links
+# talks to one peer at a time: before_send(peer) switches to its link.
+#
+#     adr = AdrController(radio, node_id)
+#     adr.manage(peer)                    # at one end of each link
+#     asyncio.create_task(adr.run())
+#     ... adr.handle(payload, rssi, snr) for each radio.poll(raw=True), and
+#         adr.observe(source, rssi, snr) for the application's packets
+#     adr.before_send(peer)
+#     await radio.send_async(message)
+
+import math
+from array import array
+
+from utime import ticks_ms, ticks_add, ticks_diff
+
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+MARKER = 0x90
+MARKER_MASK = 0xF0
+KIND_REQ = 0x00
+KIND_ANS = 0x01
+KIND_PING = 0x02
+KIND_PONG = 0x03
+
+REQ_LENGTH = 6
+SHORT_LENGTH = 4
+
+# SNR each spreading factor demodulates down to (SX1276 datasheet), dB
+REQUIRED_SNR = {6: -5.0, 7: -7.5, 8: -10.0, 9: -12.5, 10: -15.0, 11: -17.5, 12: -20.0}
+NOISE_FIGURE_DB = 6
+# Packet SNR readings flatten out above this; the RSSI says more
+SNR_CEILING = 10
+MIN_POWER = 2
+MAX_POWER = 17
+
+# Link states
+STABLE = 0
+SWITCHING = 1      # follower: ANS handed out, switch once it is on air
+CONFIRMING = 2     # new settings in use until the peer is heard at them
+
+
+def is_adr_frame(payload):
+    return len(payload) >= SHORT_LENGTH and payload[0] & MARKER_MASK == MARKER
+
+
+def noise_floor_dbm(bandwidth):
+    return -174 + 10 * math.log10(bandwidth) + NOISE_FIGURE_DB
+
+
+class _Link:
+    """Settings and signal history of the link to one peer."""
+    def __init__(self, peer, settings, window, now):
+        self.peer = peer
+        self.sf, self.power = settings
+        self.previous = settings   # settings to go back to if a change fails
+        self.managed = False
+        self.state = STABLE
+        self.deadline = now
+        self.snr = array('h', [0] * window)   # quarter dB
+        self.rssi = array('h', [0] * window)
+        self.samples = 0
+        self.heard_ms = now
+        self.unanswered = 0        # sends since the peer was last heard
+        self.ping_due = False
+        self.ping_at = now
+        self.proposal = None       # (sf, power) asked for, or being switched to
+        self.req_seq = 0
+        self.req_at = now
+        self.tries = 0
+        self.replies = []          # (kind, seq) owed to the peer
+
+
+class AdrController:
+    """
+    Per-link spreading factor and TX power control for a LoRaTransceiver,
+    negotiated with each peer over the air. handle() takes received ADR
+    frames, poll() hands out the ones to send.
+    """
+    def __init__(self, radio, node_id, window=20, margin_db=5, step_db=3, min_sf=7, max_sf=12,
+                 min_power=MIN_POWER, max_power=None, ack_limit=16, ack_delay=8, confirm_ms=10000,
+                 retry_ms=5000, max_tries=3, timeout_ms=None, clock=ticks_ms):
+        """
+        :param radio: LoRaTransceiver. Its "default" profile is the base
+                      the links start from and fall back to.
+        :param node_id: This node's id, 0-254.
+        :param window: Packets per peer the margin is computed over.
+        :param margin_db: Installation margin kept on top of the required SNR.
+        :param step_db: Margin per spreading factor or TX power step.
+        :param min_sf: Lowest spreading factor a link may use.
+        :param max_sf: Highest spreading factor a link may use.
+        :param min_power: Lowest TX power a link may use, dBm.
+        :param max_power: Highest TX power, dBm; the base power if None.
+        :param ack_limit: Sends without hearing the peer before it is PINGed.
+        :param ack_delay: Further sends before the link falls back to base.
+        :param confirm_ms: How long new settings have to prove themselves.
+        :param retry_ms: Wait for an ANS before a REQ is sent again.
+        :param max_tries: REQs sent per change before it is given up.
+        :param timeout_ms: Silence after which a link falls back to base,
+                           for ends that rarely send; None for never.
+        :param clock: Millisecond tick source.
+        """
+        self.radio = radio
+        self.node_id = node_id & 0xFF
+        parameters = radio.lora.profiles["default"].parameters
+        self.base = (parameters["spreading_factor"], parameters["tx_power_level"])
+        self.noise_floor = noise_floor_dbm(parameters["signal_bandwidth"])
+        self.window = window
+        self.margin_db = margin_db
+        self.step_db = step_db
+        self.min_sf = min_sf
+        self.max_sf = max_sf
+        self.min_power = min_power
+        self.max_power = self.base[1] if max_power is None else max_power
+        self.ack_limit = ack_limit
+        self.ack_delay = ack_delay
+        self.confirm_ms = confirm_ms
+        self.retry_ms = retry_ms
+        self.max_tries = max_tries
+        self.timeout_ms = timeout_ms
+        self.clock = clock
+        self.links = {}
+        self._current = None       # peer whose settings the radio should be on
+        self._applied = self.base
+        self._seq = 0
+        # Counters
+        self.changes = 0           # new settings confirmed
+        self.reverts = 0           # changes that were not confirmed in time
+        self.fallbacks = 0         # links dropped to base after losing the peer
+        self.requests = 0
+        self.pings = 0
+
+    def _link(self, peer):
+        link = self.links.get(peer)
+        if link is None:
+            link = self.links[peer] = _Link(peer, self.base, self.window, self.clock())
+        return link
+
+    def manage(self, peer):
+        """
+        Decide the settings of the link to peer here. The peer must not
+        manage it too.
+        """
+        self._link(peer).managed = True
+
+    def settings(self, peer):
+        """
+        :return: (spreading factor, TX power) of the link to peer.
+        """
+        link = self._link(peer)
+        return link.sf, link.power
+
+    def margin(self, peer):
+        """
+        :return: Link margin to peer in dB at its current settings, or None
+                 before anything has been heard from it.
+        """
+        link = self._link(peer)
+        n = min(link.samples, self.window)
+        if not n:
+            return None
+        snr = sum(link.snr[i] for i in range(n)) / (4 * n)
+        if snr >= SNR_CEILING:
+            snr = sum(link.rssi[i] for i in range(n)) / n - self.noise_floor
+        return snr - REQUIRED_SNR[link.sf] - self.margin_db
+
+    # ---------------------------
+    # Receiving
+    # ---------------------------
+    def observe(self, peer, rssi, snr, now=None):
+        """
+        Record a packet heard from peer, with its RSSI and SNR.
+        """
+        now = self.clock() if now is None else now
+        link = self._link(peer)
+        self._heard(link, now)
+        i = link.samples % self.window
+        link.snr[i] = int(snr * 4)
+        link.rssi[i] = int(rssi)
+        link.samples += 1
+        if link.managed and link.samples >= self.window and link.proposal is None \
+                and link.state == STABLE:
+            self._decide(link, now)
+
+    def handle(self, payload, rssi=None, snr=None, now=None):
+        """
+        Process a received packet.
+
+        :param rssi: Its RSSI, to be recorded as observe() does.
+        :param snr: Its SNR.
+        :return: True if it was an ADR frame, False if it is the caller's.
+        """
+        if not is_adr_frame(payload):
+            return False
+        if payload[2] != self.node_id:
+            return True
+        now = self.clock() if now is None else now
+        kind = payload[0] & 0x0F
+        source = payload[1]
+        seq = payload[3]
+        link = self._link(source)
+        if rssi is None:
+            self._heard(link, now)
+        else:
+            self.observe(source, rssi, snr, now)
+        if kind == KIND_REQ and len(payload) >= REQ_LENGTH and not link.managed:
+            settings = (min(max(payload[4], self.min_sf), self.max_sf),
+                        min(max(payload[5], self.min_power), MAX_POWER))
+            link.replies.append((KIND_ANS, seq))
+            if settings != (link.sf, link.power) and link.state == STABLE:
+                link.proposal = settings
+        elif kind == KIND_ANS and link.managed and link.proposal is not None and seq == link.req_seq:
+            self._switch(link, link.proposal, now)
+        elif kind == KIND_PING:
+            link.replies.append((KIND_PONG, seq))
+        return True
+
+    def _heard(self, link, now):
+        link.heard_ms = now
+        link.unanswered = 0
+        link.ping_due = False
+        if link.state == CONFIRMING:
+            link.state = STABLE
+            link.previous = (link.sf, link.power)
+            self.changes += 1
+
+    def _decide(self, link, now):
+        steps = int(self.margin(link.peer) // self.step_db)
+        sf, power = link.sf, link.power
+        while steps > 0 and sf > self.min_sf:
+            sf -= 1
+            steps -= 1
+        while steps > 0 and power > self.min_power:
+            power = max(power - self.step_db, self.min_power)
+            steps -= 1
+        while steps < 0 and power < self.max_power:
+            power = min(power + self.step_db, self.max_power)
+            steps += 1
+        while steps < 0 and sf < self.max_sf:
+            sf += 1
+            steps += 1
+        if (sf, power) != (link.sf, link.power):
+            link.proposal = (sf, power)
+            link.tries = 0
+            link.req_at = now
+
+    # ---------------------------
+    # Switching
+    # ---------------------------
+    def _switch(self, link, settings, now):
+        link.previous = (link.sf, link.power)
+        self._use(link, settings, now)
+        link.state = CONFIRMING
+        link.deadline = ticks_add(now, self.confirm_ms)
+
+    def _use(self, link, settings, now):
+        link.sf, link.power = settings
+        link.state = STABLE
+        link.proposal = None
+        link.samples = 0
+        link.heard_ms = now
+        link.unanswered = 0
+        link.ping_due = False
+        self._current = link.peer
+        if not self.radio.tx_busy():
+            self._apply(settings)
+
+    def _apply(self, settings):
+        if settings == self._applied:
+            return
+        if settings == self.base:
+            name = "default"
+        else:
+            name = "adr{}_{}".format(*settings)
+            if name not in self.radio.lora.profiles:
+                self.radio.lora.add_profile(name, {"spreading_factor": settings[0],
+                                                   "tx_power_level": settings[1]})
+        self.radio.use_profile(name)
+        self._applied = settings
+
+    def _check(self, link, now):
+        if link.state == CONFIRMING and ticks_diff(now, link.deadline) >= 0:
+            # The peer was never heard at the new settings
+            self._use(link, link.previous, now)
+            self.reverts += 1
+        elif link.state == STABLE and (link.sf, link.power) != self.base and (
+                link.unanswered >= self.ack_limit + self.ack_delay
+                or self.timeout_ms is not None and ticks_diff(now, link.heard_ms) >= self.timeout_ms):
+            self._use(link, self.base, now)
+            link.previous = self.base
+            self.fallbacks += 1
+
+    def before_send(self, peer, now=None):
+        """
+        Put the radio on the link to peer before sending it a packet, and
+        count the send towards the link's loss detection.
+
+        :return: False if the radio is still transmitting.
+        """
+        now = self.clock() if now is None else now
+        link = self._link(peer)
+        self._current = peer
+        if self.radio.tx_busy():
+            return False
+        self._check(link, now)
+        self._apply((link.sf, link.power))
+        link.unanswered += 1
+        if link.unanswered == self.ack_limit:
+            link.ping_due = True
+        return True
+
+    # ---------------------------
+    # Sending
+    # ---------------------------
+    def poll(self, now=None):
+        """
+        :return: The next ADR frame to transmit (bytes), or None if nothing
+                 is due or the radio is still transmitting. The radio is
+                 already on the frame's link settings.
+        """
+        if self.radio.tx_busy():
+            return None
+        now = self.clock() if now is None else now
+        for peer in self.links:
+            frame = self._poll_link(self.links[peer], now)
+            if frame is not None:
+                return frame
+        current = self.links.get(self._current)
+        if current is not None:
+            self._apply((current.sf, current.power))
+        return None
+
+    def _poll_link(self, link, now):
+        if link.state == SWITCHING:
+            # The ANS went out at the old settings: move and say so
+            self._switch(link, link.proposal, now)
+            link.ping_at = ticks_add(now, self.confirm_ms // 3)
+            return self._frame(link, KIND_PING)
+        self._check(link, now)
+        if link.replies:
+            kind, seq = link.replies.pop(0)
+            frame = self._frame(link, kind, seq)
+            if kind == KIND_ANS and link.proposal is not None and not link.managed:
+                link.state = SWITCHING
+            return frame
+        if link.state == CONFIRMING:
+            if not link.managed and ticks_diff(now, link.ping_at) >= 0:
+                link.ping_at = ticks_add(now, self.confirm_ms // 3)
+                return self._frame(link, KIND_PING)
+            return None
+        if link.proposal is not None and ticks_diff(now, link.req_at) >= 0:
+            if link.tries >= self.max_tries:
+                # The peer never answered: measure again before retrying
+                link.proposal = None
+                link.samples = 0
+                return None
+            link.tries += 1
+            link.req_at = ticks_add(now, self.retry_ms)
+            self.requests += 1
+            link.req_seq = self._next_seq()
+            return self._frame(link, KIND_REQ, link.req_seq, link.proposal)
+        if link.ping_due:
+            link.ping_due = False
+            return self._frame(link, KIND_PING)
+        return None
+
+    def _next_seq(self):
+        self._seq = (self._seq + 1) & 0xFF
+        return self._seq
+
+    def _frame(self, link, kind, seq=None, settings=None):
+        if kind == KIND_PING:
+            self.pings += 1
+            seq = self._next_seq()
+        self._current = link.peer
+        self._apply((link.sf, link.power))
+        frame = bytes((MARKER | kind, self.node_id, link.peer, seq))
+        if settings is not None:
+            frame += bytes(settings)
+        return frame
+
+    async def run(self, radio=None, period_ms=10):
+        """
+        Send whatever poll() hands out with radio.send_async(), e.g. a
+        CsmaTransmitter; the controller's own LoRaTransceiver if None.
+        Received packets still have to be passed to handle().
+        """
+        radio = radio or self.radio
+        while True:
+            frame = self.poll()
+            if frame is None:
+                await asyncio.sleep(period_ms / 1000)
+            else:
+                await radio.send_async(frame)
+
+    def stats(self):
+        """
+        :return: Dict of links, settings confirmed, changes reverted,
+                 fallbacks to base, REQs and PINGs sent, and the mean
+                 spreading factor and TX power over the links.
+        """
+        links = self.links.values()
+        n = len(links) or 1
+        return {"links": len(links), "changes": self.changes, "reverts": self.reverts,
+                "fallbacks": self.fallbacks, "requests": self.requests, "pings": self.pings,
+                "mean_sf": sum(link.sf for link in links) / n,
+                "mean_power": sum(link.power for link in links) / n}
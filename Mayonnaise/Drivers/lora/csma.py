@@ -0,0 +1,239 @@
+# Listen-before-talk for LoRaTransceiver: CSMA with channel activity detection
+#
+# Before each transmission the radio runs CAD. If the channel is busy the
+# send is retried after a random backoff of 1..2^k slots, where k counts the
+# busy detections for this message (capped at max_exponent), so contending
+# nodes spread out further the more crowded the channel is. After
+# max_attempts busy detections the message is dropped.
+#
+#     csma = CsmaTransmitter(LoRaTransceiver())
+#     csma.send(b"hello")                  # blocking
+#     await csma.send_async(b"hello")      # from an asyncio task
+#
+# A slot defaults to the airtime of the message being sent, roughly how long
+# the packet that made the channel busy still has to run.
+
+import random
+
+from utime import ticks_ms, ticks_add, ticks_diff, sleep_ms
+
+from Drivers.lora.lora import MAX_PKT_LENGTH
+
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+# States of a non-blocking send
+IDLE = 0
+CAD = 1
+BACKOFF = 2
+TX = 3
+CLEAR = 4      # CAD found the channel clear, TX starts on the next pending()
+
+
+class CsmaTransmitter:
+    """
+    Wraps LoRaTransceiver.send() with CAD and binary exponential backoff.
+    One message is in flight at a time.
+    """
+    def __init__(self, radio, slot_ms=None, max_exponent=6, max_attempts=8, rng=None):
+        """
+        :param radio: LoRaTransceiver to send with.
+        :param slot_ms: Backoff slot in ms. None uses the message's airtime.
+        :param max_exponent: Cap on k in the 1..2^k slot backoff.
+        :param max_attempts: Busy detections before a message is dropped.
+        :param rng: Object with getrandbits(), e.g. a seeded random.Random
+                    for simulation. Defaults to the random module.
+        """
+        self.radio = radio
+        self.lora = radio.lora
+        self.slot_ms = slot_ms
+        self.max_exponent = max_exponent
+        self.max_attempts = max_attempts
+        self.rng = rng or random
+        self._state = IDLE
+        self._message = None
+        self._callback = None
+        self._timeout = None
+        self._busy_count = 0
+        self._retry_at = 0
+        self._timeouts_seen = 0
+        # Counters
+        self.sent = 0
+        self.failed = 0      # TX timeouts, duty-cycle refusals and radio errors
+        self.dropped = 0     # gave up after max_attempts busy detections
+        self.busy = 0        # CAD runs that found the channel busy
+        self.cad_timeouts = 0  # CAD runs that never finished, backed off as busy
+        self.cads = 0
+        self.backoff_ms = 0
+
+    def backoff(self, busy_count, length):
+        """
+        :param busy_count: Busy detections so far for this message (>= 1).
+        :param length: Message length in bytes.
+        :return: Random backoff in ms.
+        """
+        slot = self.slot_ms
+        if slot is None:
+            slot = self.radio.airtime_us(length) // 1000 + 1
+        exponent = min(busy_count, self.max_exponent)
+        return (1 + self.rng.getrandbits(exponent)) * slot
+
+    # ---------------------------
+    # Blocking
+    # ---------------------------
+    def send(self, message, timeout=None):
+        """
+        Send once the channel is clear, sleeping through the backoffs.
+
+        :return: True if sent, False if dropped after max_attempts.
+        :raises DutyCycleError: If the duty-cycle limiter refuses it.
+        """
+        if isinstance(message, str):
+            message = message.encode()
+        for busy_count in range(1, self.max_attempts + 1):
+            self.cads += 1
+            if not self.lora.cad():
+                self.radio.send(message, timeout=timeout)
+                self.sent += 1
+                return True
+            self.busy += 1
+            if busy_count < self.max_attempts:
+                delay = self.backoff(busy_count, len(message))
+                self.backoff_ms += delay
+                sleep_ms(delay)
+        self.dropped += 1
+        return False
+
+    # ---------------------------
+    # Non-blocking
+    # ---------------------------
+    def send_nowait(self, message, callback=None, timeout=None):
+        """
+        Start a send and return immediately. CAD results and TxDone arrive
+        from the DIO0 interrupt; pending() starts the transmission once CAD
+        finds the channel clear, and retries once a backoff ends.
+
+        :param callback: Optional function called as callback(ok) once the
+                         message is sent (True), or dropped or failed (False).
+        :param timeout: Optional TX timeout in milliseconds.
+        :raises ValueError: If the message does not fit in one packet.
+        """
+        if self._state != IDLE:
+            raise RuntimeError("CSMA send already in progress")
+        if isinstance(message, str):
+            message = message.encode()
+        if len(message) > MAX_PKT_LENGTH:
+            raise ValueError("message of {} bytes does not fit in one packet".format(len(message)))
+        self._message = message
+        self._callback = callback
+        self._timeout = timeout
+        self._busy_count = 0
+        self._start_cad()
+
+    def pending(self):
+        """
+        Drive a non-blocking send: start the transmission after a clear
+        CAD, start a due retry and enforce the CAD and TX timeouts. Call it
+        often while CAD runs, as the channel may not stay clear for long.
+
+        :return: True while the message is neither sent nor given up.
+        """
+        state = self._state
+        if state == CLEAR:
+            self._start_tx()
+        elif state == BACKOFF:
+            if ticks_diff(ticks_ms(), self._retry_at) >= 0:
+                self._start_cad()
+        elif state == CAD:
+            self.lora.cad_pending()
+        elif state == TX:
+            self.radio.tx_busy()
+        return self._state != IDLE
+
+    def retry_in_ms(self):
+        """
+        :return: Milliseconds until the current backoff ends, 0 if not backing off.
+        """
+        if self._state != BACKOFF:
+            return 0
+        return max(ticks_diff(self._retry_at, ticks_ms()), 0)
+
+    async def send_async(self, message, timeout=None):
+        """
+        Awaitable send: waits for duty-cycle budget, then yields to other
+        tasks through CAD, backoffs and the transmission.
+
+        :return: True if the message was sent.
+        """
+        if isinstance(message, str):
+            message = message.encode()
+        await self.radio.wait_for_budget(message)
+        result = []
+        self.send_nowait(message, result.append, timeout)
+        while self.pending():
+            await asyncio.sleep(min(self.retry_in_ms(), 100) / 1000 or 0.005)
+        self.lora.gc_policy.packet()
+        return bool(result and result[0])
+
+    def _start_cad(self):
+        self._state = CAD
+        self.cads += 1
+        self._timeouts_seen = self.lora.cad_timeouts
+        self.lora.cad_nowait(self._on_cad)
+
+    def _on_cad(self, detected):
+        # Runs from the DIO0 interrupt handler (or cad_pending() on a
+        # timeout): only note the result, pending() starts the transmission
+        if not detected:
+            self._state = CLEAR
+            return
+        if self.lora.cad_timeouts != self._timeouts_seen:
+            self.cad_timeouts += 1
+        else:
+            self.busy += 1
+        self._busy_count += 1
+        if self._busy_count >= self.max_attempts:
+            self.dropped += 1
+            self._finish(None)
+            return
+        delay = self.backoff(self._busy_count, len(self._message))
+        self.backoff_ms += delay
+        self._retry_at = ticks_add(ticks_ms(), delay)
+        self._state = BACKOFF
+
+    def _start_tx(self):
+        self._state = TX
+        try:
+            self.radio.send(self._message, wait=False, callback=self._on_sent,
+                            timeout=self._timeout)
+        except Exception:
+            # Duty-cycle refusal or a radio error: never leave the MAC stuck in TX
+            self._finish(False)
+
+    def _on_sent(self, ok):
+        self._finish(ok)
+
+    def _finish(self, ok):
+        if ok:
+            self.sent += 1
+        elif ok is not None:
+            self.failed += 1
+        self._state = IDLE
+        self._message = None
+        callback = self._callback
+        self._callback = None
+        if callback:
+            callback(bool(ok))
+
+    def stats(self):
+        """
+        :return: Dict of messages sent, failed and dropped, CAD runs, busy
+                 detections, CAD timeouts, the fraction of CAD runs that
+                 found the channel busy and the total backoff time.
+        """
+        return {"sent": self.sent, "failed": self.failed, "dropped": self.dropped,
+                "cads": self.cads, "busy": self.busy, "cad_timeouts": self.cad_timeouts,
+                "busy_rate": self.busy / self.cads if self.cads else 0.0,
+                "backoff_ms": self.backoff_ms}
@@ -0,0 +1,476 @@
+# Fragmentation and reassembly for messages longer than one LoRa packet
+#
+# The SX127x FIFO holds at most 255 bytes, so logs, config blobs or batched
+# UWB histories are split into numbered fragments. Frames start with a
+# marker byte whose high nibble (0xB) neither telemetry nor the reliable
+# transport uses. Indexes are little-endian 16-bit, everything else a byte:
+#
+#   DATA    0xB0 | flags, source, destination, message id, index, data...
+#           flags: LAST (final fragment of the message), POLL (final
+#           fragment of a block: answer with a STATUS)
+#   STATUS  0xB4, source, destination, message id, next missing index,
+#           bitmap (bit i set: fragment next + 1 + i was received too)
+#   QUERY   0xB5, source, destination, message id   (resend the STATUS)
+#   ABORT   0xB6, source, destination, message id   (message refused or lost)
+#
+# The sender reads the message one block of fragments at a time, so it may
+# be a generator that is never materialised, and keeps only that block. The
+# block's last fragment asks for a STATUS, and only the fragments it reports
+# missing are sent again; once none are, the next block is read. The
+# receiver holds at most `block` out-of-order fragments per message and
+# hands data on in order: reassembled into one payload up to max_message
+# bytes, or chunk by chunk through on_chunk for messages of any length.
+# Sessions that hear nothing for timeout_ms are dropped.
+#
+#     fragmenter = Fragmenter(node_id, on_receive=print)
+#     fragmenter.send(peer, (line.encode() for line in history))
+#     asyncio.create_task(fragmenter.run(radio))
+#     ... fragmenter.handle(payload) for each radio.poll(raw=True)
+
+import random
+
+from utime import ticks_ms, ticks_add, ticks_diff
+
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+MARKER = 0xB0
+MARKER_MASK = 0xF0
+FLAG_LAST = 0x01
+FLAG_POLL = 0x02
+KIND_STATUS = 0x04
+KIND_QUERY = 0x05
+KIND_ABORT = 0x06
+
+SHORT_LENGTH = 4
+DATA_HEADER = 6
+STATUS_LENGTH = 8
+MAX_PACKET = 255
+MAX_FRAGMENT = MAX_PACKET - DATA_HEADER
+MAX_BLOCK = 16
+MAX_REPLIES = 4
+DONE_HISTORY = 4
+BROADCAST = 0xFF
+
+_EMPTY = memoryview(b"")
+
+
+class _Reader:
+    """Cuts bytes, or an iterable of bytes chunks, into fragments."""
+    def __init__(self, message):
+        if isinstance(message, str):
+            message = message.encode()
+        if isinstance(message, (bytes, bytearray, memoryview)):
+            message = (message,)
+        self._chunks = iter(message)
+        self._buffer = _EMPTY
+
+    def _fill(self):
+        # Pull chunks until one has data; False at the end of the message
+        while not len(self._buffer):
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                return False
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            self._buffer = memoryview(chunk)
+        return True
+
+    def read(self, size):
+        """
+        :return: The next size bytes, fewer at the end of the message.
+        """
+        if not self._fill():
+            return b""
+        buffer = self._buffer
+        if len(buffer) >= size:
+            self._buffer = buffer[size:]
+            return bytes(buffer[:size])
+        data = bytearray(buffer)
+        self._buffer = _EMPTY
+        while len(data) < size and self._fill():
+            part = self._buffer[:size - len(data)]
+            data.extend(part)
+            self._buffer = self._buffer[len(part):]
+        return bytes(data)
+
+    def at_end(self):
+        return not self._fill()
+
+
+class _Outgoing:
+    """The message being sent."""
+    def __init__(self, destination, message_id, reader):
+        self.destination = destination
+        self.id = message_id
+        self.reader = reader
+        self.start = 0           # index of the block's first fragment
+        self.fragments = []      # the block
+        self.unsent = []         # positions in the block still to send
+        self.last = False        # the block ends the message
+        self.resending = False
+        self.waiting = False     # POLL sent, STATUS due
+        self.deadline = 0
+        self.tries = 0
+
+
+class _Incoming:
+    """A message being reassembled."""
+    def __init__(self, now, stream):
+        self.next = 0            # index of the first fragment not yet handed on
+        self.fragments = {}      # out-of-order fragments, index -> data
+        self.end = None          # index of the LAST fragment, once heard
+        self.data = None if stream else bytearray()
+        self.heard_ms = now
+
+
+class Fragmenter:
+    """
+    Sends and receives messages of any length as fragments, as a protocol
+    state machine. Like ReliableTransport it never touches the radio:
+    poll() hands out frames and handle() takes them in.
+    """
+    def __init__(self, node_id, fragment_size=MAX_FRAGMENT, block=8, max_retries=4,
+                 reply_timeout_ms=2000, timeout_ms=30000, max_message=4096, max_sessions=2,
+                 queue_limit=4, on_receive=None, on_chunk=None, on_sent=None):
+        """
+        :param node_id: This node's id, 0-254.
+        :param fragment_size: Data bytes per fragment (at most MAX_FRAGMENT).
+        :param block: Fragments sent between STATUS reports, and out-of-order
+                      fragments a receiver holds per message (at most MAX_BLOCK).
+        :param max_retries: Unanswered QUERYs before a send fails.
+        :param reply_timeout_ms: Wait for a STATUS before the first QUERY,
+                                 doubled for each one after.
+        :param timeout_ms: Silence after which a receiver drops a message.
+        :param max_message: Largest message reassembled for on_receive.
+        :param max_sessions: Messages reassembled at once.
+        :param queue_limit: Messages that can wait to be sent.
+        :param on_receive: Called as on_receive(source, payload) per message.
+        :param on_chunk: Called as on_chunk(source, message_id, data, last) for
+                         each fragment in order instead: messages are then
+                         never held whole and max_message does not apply.
+        :param on_sent: Called as on_sent(destination, message_id, ok) when a
+                        send completes or fails.
+        """
+        self.node_id = node_id & 0xFF
+        self.fragment_size = max(1, min(fragment_size, MAX_FRAGMENT))
+        self.block = max(1, min(block, MAX_BLOCK))
+        self.max_retries = max_retries
+        self.reply_timeout_ms = reply_timeout_ms
+        self.timeout_ms = timeout_ms
+        self.max_message = max_message
+        self.max_sessions = max_sessions
+        self.queue_limit = queue_limit
+        self.on_receive = on_receive
+        self.on_chunk = on_chunk
+        self.on_sent = on_sent
+        self._queue = []
+        self._current = None
+        # A random first id, so a receiver that remembers our last messages
+        # from before a reboot does not take new ones for them
+        self._next_id = random.getrandbits(8)
+        self._sessions = {}      # (source, message id) -> _Incoming
+        self._done = []          # (source, message id, next) of finished messages
+        self._replies = []
+        # Counters
+        self.messages_sent = 0
+        self.messages_failed = 0
+        self.fragments_sent = 0
+        self.retransmits = 0
+        self.queries = 0
+        self.messages_received = 0
+        self.fragments_received = 0
+        self.duplicates = 0
+        self.aborts = 0          # messages this receiver refused or lost
+        self.timeouts = 0
+
+    # ---------------------------
+    # Sending
+    # ---------------------------
+    def send(self, destination, message):
+        """
+        Queue a message for sending. Messages go one at a time, in order.
+
+        :param message: bytes or str, or an iterable (e.g. a generator) of
+                        bytes chunks, read only as its fragments are sent.
+        :return: The message id, or None if the queue is full.
+        """
+        if destination == BROADCAST:
+            raise ValueError("fragmented messages need a single destination")
+        if len(self._queue) >= self.queue_limit:
+            return None
+        message_id = self._next_id
+        self._next_id = (message_id + 1) & 0xFF
+        self._queue.append(_Outgoing(destination, message_id, _Reader(message)))
+        return message_id
+
+    def pending(self):
+        """
+        :return: Messages queued or being sent.
+        """
+        return len(self._queue) + (self._current is not None)
+
+    def poll(self, now=None):
+        """
+        :return: The next frame to transmit (bytes), or None if nothing is due.
+                 Replies to other senders go first.
+        """
+        now = ticks_ms() if now is None else now
+        self._expire(now)
+        if self._replies:
+            return self._replies.pop(0)
+        out = self._current
+        if out is None:
+            if not self._queue:
+                return None
+            out = self._current = self._queue.pop(0)
+        if not out.fragments:
+            self._read_block(out)
+        if out.unsent:
+            position = out.unsent.pop(0)
+            flags = MARKER
+            if out.last and position == len(out.fragments) - 1:
+                flags |= FLAG_LAST
+            if not out.unsent:
+                flags |= FLAG_POLL
+                out.waiting = True
+                out.deadline = ticks_add(now, self.reply_timeout_ms)
+            if out.resending:
+                self.retransmits += 1
+            else:
+                self.fragments_sent += 1
+            index = out.start + position
+            return bytes((flags, self.node_id, out.destination, out.id,
+                          index & 0xFF, index >> 8)) + out.fragments[position]
+        if out.waiting and ticks_diff(now, out.deadline) >= 0:
+            if out.tries >= self.max_retries:
+                self._finish(False)
+                return None
+            # The STATUS (or the POLL fragment) was lost: ask again
+            out.tries += 1
+            out.deadline = ticks_add(now, self.reply_timeout_ms << out.tries)
+            self.queries += 1
+            return self._short(KIND_QUERY, out.destination, out.id)
+        return None
+
+    def next_poll_ms(self, now=None):
+        """
+        :return: Milliseconds until poll() may have something to send
+                 (0 if now), or -1 if it is idle until send() or handle().
+        """
+        now = ticks_ms() if now is None else now
+        out = self._current
+        if self._replies or (out is None and self._queue):
+            return 0
+        if out is None:
+            return -1
+        if out.unsent or not out.fragments:
+            return 0
+        return max(ticks_diff(out.deadline, now), 0) if out.waiting else -1
+
+    def _read_block(self, out):
+        reader = out.reader
+        fragments = out.fragments
+        while len(fragments) < self.block:
+            fragments.append(reader.read(self.fragment_size))
+            if reader.at_end():
+                out.last = True
+                break
+        out.unsent = list(range(len(fragments)))
+        out.resending = False
+
+    def _on_status(self, out, next_index, bitmap):
+        out.waiting = False
+        out.tries = 0
+        missing = []
+        for position in range(len(out.fragments)):
+            d = out.start + position - next_index
+            if d == 0 or (d > 0 and not bitmap >> (d - 1) & 1):
+                missing.append(position)
+        if missing:
+            out.unsent = missing
+            out.resending = True
+        elif out.last:
+            self._finish(True)
+        else:
+            out.start += len(out.fragments)
+            out.fragments = []
+
+    def _finish(self, ok):
+        out = self._current
+        self._current = None
+        if ok:
+            self.messages_sent += 1
+        else:
+            self.messages_failed += 1
+        if self.on_sent:
+            self.on_sent(out.destination, out.id, ok)
+
+    # ---------------------------
+    # Receiving
+    # ---------------------------
+    def handle(self, payload, now=None):
+        """
+        Process a received packet.
+
+        :return: True if it was a fragmentation frame (for this node or not),
+                 False if it is something else.
+        """
+        if len(payload) < SHORT_LENGTH or payload[0] & MARKER_MASK != MARKER:
+            return False
+        if payload[2] != self.node_id:
+            return True
+        now = ticks_ms() if now is None else now
+        kind = payload[0] & 0x0F
+        source = payload[1]
+        message_id = payload[3]
+        out = self._current
+        mine = out is not None and out.destination == source and out.id == message_id
+        if kind < KIND_STATUS:
+            if len(payload) >= DATA_HEADER:
+                self._on_data(source, message_id, payload, now)
+        elif kind == KIND_STATUS:
+            if mine and out.waiting and len(payload) >= STATUS_LENGTH:
+                self._on_status(out, payload[4] | payload[5] << 8, payload[6] | payload[7] << 8)
+        elif kind == KIND_QUERY:
+            self._report(source, message_id, now)
+        elif kind == KIND_ABORT:
+            if mine:
+                self._finish(False)
+        return True
+
+    def _on_data(self, source, message_id, payload, now):
+        flags = payload[0]
+        index = payload[4] | payload[5] << 8
+        key = (source, message_id)
+        session = self._sessions.get(key)
+        if session is None:
+            if self._finished(source, message_id) is not None:
+                self.duplicates += 1
+                if flags & FLAG_POLL:
+                    self._report(source, message_id, now)
+                return
+            # A message starts with its first block; anything later belongs
+            # to a message whose start was dropped
+            if index >= MAX_BLOCK or len(self._sessions) >= self.max_sessions:
+                self._abort(source, message_id)
+                return
+            session = self._sessions[key] = _Incoming(now, self.on_chunk is not None)
+        session.heard_ms = now
+        self.fragments_received += 1
+        if index < session.next or index in session.fragments:
+            self.duplicates += 1
+        elif index < session.next + self.block:
+            session.fragments[index] = payload[DATA_HEADER:]
+            if flags & FLAG_LAST:
+                session.end = index
+            if not self._deliver(source, message_id, session):
+                return
+        if flags & FLAG_POLL:
+            self._report(source, message_id, now)
+
+    def _deliver(self, source, message_id, session):
+        """
+        Hand on the fragments that are now in order.
+
+        :return: False if the message had to be aborted.
+        """
+        fragments = session.fragments
+        while session.next in fragments:
+            index = session.next
+            data = fragments.pop(index)
+            session.next = index + 1
+            last = index == session.end
+            if session.data is None:
+                self.on_chunk(source, message_id, data, last)
+            elif len(session.data) + len(data) > self.max_message:
+                self._abort(source, message_id)
+                return False
+            else:
+                session.data.extend(data)
+            if last:
+                del self._sessions[(source, message_id)]
+                self._done.append((source, message_id, session.next))
+                if len(self._done) > DONE_HISTORY:
+                    self._done.pop(0)
+                self.messages_received += 1
+                if session.data is not None and self.on_receive:
+                    self.on_receive(source, bytes(session.data))
+                break
+        return True
+
+    def _finished(self, source, message_id):
+        for done_source, done_id, next_index in self._done:
+            if done_source == source and done_id == message_id:
+                return next_index
+        return None
+
+    def _report(self, source, message_id, now):
+        session = self._sessions.get((source, message_id))
+        if session is None:
+            next_index = self._finished(source, message_id)
+            if next_index is None:
+                self._abort(source, message_id)
+                return
+            bitmap = 0
+        else:
+            session.heard_ms = now
+            next_index = session.next
+            bitmap = 0
+            for index in session.fragments:
+                d = index - next_index - 1
+                if 0 <= d < MAX_BLOCK:
+                    bitmap |= 1 << d
+        self._reply(bytes((MARKER | KIND_STATUS, self.node_id, source, message_id,
+                           next_index & 0xFF, next_index >> 8, bitmap & 0xFF, bitmap >> 8)))
+
+    def _abort(self, source, message_id):
+        self._sessions.pop((source, message_id), None)
+        self.aborts += 1
+        self._reply(self._short(KIND_ABORT, source, message_id))
+
+    def _reply(self, frame):
+        # Bounded: a flood of requests costs old replies, not memory
+        if len(self._replies) >= MAX_REPLIES:
+            self._replies.pop(0)
+        self._replies.append(frame)
+
+    def _short(self, kind, node, message_id):
+        return bytes((MARKER | kind, self.node_id, node, message_id))
+
+    def _expire(self, now):
+        sessions = self._sessions
+        for key in [k for k in sessions if ticks_diff(now, sessions[k].heard_ms) > self.timeout_ms]:
+            del sessions[key]
+            self.timeouts += 1
+
+    # ---------------------------
+    # Driving a radio
+    # ---------------------------
+    async def run(self, radio, period_ms=10):
+        """
+        Send whatever poll() hands out with radio.send_async(), e.g. a
+        LoRaTransceiver or CsmaTransmitter. Received packets still have to
+        be passed to handle().
+        """
+        while True:
+            frame = self.poll()
+            if frame is None:
+                await asyncio.sleep(period_ms / 1000)
+            else:
+                await radio.send_async(frame)
+
+    def stats(self):
+        """
+        :return: Dict of messages sent, failed and received, fragments sent,
+                 retransmitted and received, QUERYs sent, duplicate
+                 fragments, and messages aborted or timed out as receiver.
+        """
+        return {"messages_sent": self.messages_sent, "messages_failed": self.messages_failed,
+                "messages_received": self.messages_received,
+                "fragments_sent": self.fragments_sent, "retransmits": self.retransmits,
+                "fragments_received": self.fragments_received, "queries": self.queries,
+                "duplicates": self.duplicates, "aborts": self.aborts, "timeouts": self.timeouts}
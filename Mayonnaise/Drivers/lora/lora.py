@@ -4,13 +4,22 @@ This library provides functionalities for configuring and communicating with the
 It supports functions for setting frequency, TX power, bandwidth, spreading factor, etc.,
 as well as packet transmission and reception.
 
+This is the one copy of the driver shared by every node firmware: the
+ulora/core.py files in the other projects import it from here (the Pymakr
+projects fall back to a copy Host/vendor_drivers.py writes before upload).
+
+The hardware backend is pluggable: any object with write(), readinto() and
+write_readinto() can be passed as the SPI bus, and pins can be given as pin
+numbers or as ready-made Pin-like objects with value() and irq(). On CPython
+the Host/ stand-ins and fake SX127x provide a mock backend.
+
 https://github.com/armanghobadi/ulora/
 
 """
 
 import gc
 from machine import SPI, Pin
-from utime import ticks_ms, sleep_ms  # ticks_ms and sleep_ms imported from utime
+from utime import ticks_ms, ticks_us, ticks_add, ticks_diff, sleep_ms  # tick helpers imported from utime
 from micropython import const
 
 # EX_LED removed — GPIO15 is used for UWB reset
@@ -59,6 +68,7 @@ MODE_STDBY              = const(0x01)
 MODE_TX                 = const(0x03)
 MODE_RX_CONTINUOUS      = const(0x05)
 MODE_RX_SINGLE          = const(0x06)
+MODE_CAD                = const(0x07)
 
 PA_OUTPUT_RFO_PIN       = const(0)
 PA_OUTPUT_PA_BOOST_PIN  = const(0x01)
@@ -67,11 +77,20 @@ PA_BOOST                = const(0x80)
 # ============================================================================
 # IRQ Masks
 # ============================================================================
+IRQ_CAD_DETECTED_MASK   = const(0x01)
+IRQ_CAD_DONE_MASK       = const(0x04)
 IRQ_TX_DONE_MASK        = const(0x08)
 IRQ_PAYLOAD_CRC_ERROR_MASK = const(0x20)
 IRQ_RX_DONE_MASK        = const(0x40)
 IRQ_RX_TIME_OUT_MASK    = const(0x80)
 
+# ============================================================================
+# DIO0 Mapping (REG_DIO_MAPPING_1 bits 7-6)
+# ============================================================================
+DIO0_RX_DONE            = const(0x00)
+DIO0_TX_DONE            = const(0x40)
+DIO0_CAD_DONE           = const(0x80)
+
 # ============================================================================
 # IQ Inversion Constants
 # ============================================================================
@@ -83,6 +102,7 @@ RFLR_INVERTIQ_TX_OFF    = const(0x01)
 RFLR_INVERTIQ_TX_ON     = const(0x00)
 RFLR_INVERTIQ2_ON       = const(0x19)
 RFLR_INVERTIQ2_OFF      = const(0x1D)
+RFLR_INVERTIQ_RESET     = const(0x27)  # REG_INVERTIQ power-on value
 
 # ============================================================================
 # Other Definitions
@@ -91,6 +111,36 @@ MAX_PKT_LENGTH = const(255)
 FifoTxBaseAddr = const(0x00)
 FifoRxBaseAddr = const(0x00)
 
+# FIFO burst access headers (address byte with the wnr bit)
+FIFO_READ_CMD = b"\x00"
+FIFO_WRITE_CMD = b"\x80"
+
+# Configuration registers mirrored in RAM (see ULoRa.resync). The chip never
+# changes these on its own, so the shadow stays valid between writes.
+SHADOW_REGISTERS = (
+    REG_FRF_MSB, REG_FRF_MID, REG_FRF_LSB, REG_PA_CONFIG, REG_LNA,
+    REG_MODEM_CONFIG_1, REG_MODEM_CONFIG_2, REG_PREAMBLE_MSB, REG_PREAMBLE_LSB,
+    REG_PAYLOAD_LENGTH, REG_MODEM_CONFIG_3, REG_DETECTION_OPTIMIZE,
+    REG_INVERTIQ, REG_DETECTION_THRESHOLD, REG_SYNC_WORD, REG_INVERTIQ2,
+)
+
+# Bandwidth settings selected by REG_MODEM_CONFIG_1 bits 7-4
+BANDWIDTHS = (7800, 10400, 15600, 20800, 31250, 41700, 62500, 125000, 250000, 500000)
+
+# Registers covered by a ModemProfile, as runs of consecutive addresses
+# that can each be written in a single SPI burst
+PROFILE_BLOCKS = (
+    (REG_FRF_MSB, 4),          # FRF MSB/MID/LSB, PA config
+    (REG_MODEM_CONFIG_1, 2),   # modem config 1 and 2
+    (REG_PREAMBLE_MSB, 2),
+    (REG_MODEM_CONFIG_3, 1),
+    (REG_DETECTION_OPTIMIZE, 1),
+    (REG_INVERTIQ, 1),
+    (REG_DETECTION_THRESHOLD, 1),
+    (REG_SYNC_WORD, 1),
+    (REG_INVERTIQ2, 1),
+)
+
 # ============================================================================
 # Default LoRa Parameters
 # ============================================================================
@@ -106,8 +156,302 @@ DEFAULT_PARAMETERS = {
     "sync_word": 0x12,
     "enable_CRC": True,
     "invert_IQ": False,
+    "pa_output_pin": PA_OUTPUT_PA_BOOST_PIN,
 }
-print(DEFAULT_PARAMETERS)
+
+def bandwidth_index(sbw):
+    """
+    Map a bandwidth in Hz to its REG_MODEM_CONFIG_1 setting.
+    
+    :param sbw: Bandwidth in Hz, or a setting index below 10.
+    :return: Index into BANDWIDTHS (the smallest bandwidth >= sbw).
+    """
+    if sbw < 10:
+        return int(sbw)
+    for i, bw in enumerate(BANDWIDTHS):
+        if sbw <= bw:
+            return i
+    return 7  # Default to 125 kHz
+
+def pa_config(level, output_pin):
+    """
+    REG_PA_CONFIG value for a power level on the given PA output.
+    
+    :param level: Power level in dBm, clamped to 0-14 on RFO, 2-17 on PA_BOOST.
+    :param output_pin: PA_OUTPUT_RFO_PIN or PA_OUTPUT_PA_BOOST_PIN.
+    """
+    if output_pin == PA_OUTPUT_RFO_PIN:
+        return 0x70 | min(max(level, 0), 14)
+    return PA_BOOST | (min(max(level, 2), 17) - 2)
+
+def make_pin(pin, mode):
+    """
+    Return pin unchanged if it is already Pin-like, else create a machine.Pin.
+    """
+    return pin if hasattr(pin, "value") else Pin(pin, mode)
+
+# ============================================================================
+# Garbage Collection Policy
+# ============================================================================
+GC_NEVER                = const(0)  # never collect from packet operations
+GC_EVERY_N              = const(1)  # collect every N packets
+GC_LOW_MEMORY           = const(2)  # collect when gc.mem_free() drops below a threshold
+
+class GcPolicy:
+    """
+    Decides when a packet operation runs gc.collect(), instead of forcing a
+    full collection on every packet, and accounts for the time spent.
+    """
+    def __init__(self, mode=GC_LOW_MEMORY, every=16, threshold=16384):
+        """
+        :param mode: GC_NEVER, GC_EVERY_N or GC_LOW_MEMORY.
+        :param every: Packets between collections for GC_EVERY_N.
+        :param threshold: Free heap bytes below which GC_LOW_MEMORY collects.
+        """
+        self.mode = mode
+        self.every = every
+        self.threshold = threshold
+        self.packets = 0
+        self.collections = 0
+        self.collect_us = 0
+
+    def packet(self):
+        """
+        Called once per packet sent or received; collects if the policy says so.
+
+        :return: True if a collection was run.
+        """
+        self.packets += 1
+        if self.mode == GC_EVERY_N:
+            due = self.packets % self.every == 0
+        elif self.mode == GC_LOW_MEMORY:
+            due = gc.mem_free() < self.threshold
+        else:
+            due = False
+        if due:
+            self.collect()
+        return due
+
+    def collect(self):
+        """
+        Run a full collection and add its duration to the counters.
+        """
+        start = ticks_us()
+        gc.collect()
+        self.collect_us += ticks_diff(ticks_us(), start)
+        self.collections += 1
+
+    def stats(self):
+        """
+        :return: Dict of packets seen, collections run and total collect time.
+        """
+        return {"packets": self.packets, "collections": self.collections,
+                "collect_us": self.collect_us}
+
+# ============================================================================
+# Duty Cycle
+# ============================================================================
+class DutyCycleError(RuntimeError):
+    """
+    Raised when a transmission would exceed the duty-cycle budget.
+    wait_ms is how long until it would fit (-1 if it never can).
+    """
+    def __init__(self, wait_ms):
+        super().__init__("Duty cycle budget exhausted (wait {} ms)".format(wait_ms))
+        self.wait_ms = wait_ms
+
+class DutyCycleLimiter:
+    """
+    Token bucket on transmit airtime. The bucket holds up to burst_ms of
+    airtime and refills at the duty-cycle rate, so over any window_ms the
+    node is on air for at most duty * window_ms, e.g. 36 s per hour for a
+    1% band. Budget is kept in whole microseconds of airtime.
+    """
+    def __init__(self, duty=0.01, window_ms=3600000, burst_ms=None, wait=False):
+        """
+        :param duty: Allowed fraction of time on air, e.g. 0.01 for 1%.
+        :param window_ms: Window the band limit is defined over.
+        :param burst_ms: (Optional) Bucket size in ms of airtime. Defaults to
+                         the whole window's allowance, duty * window_ms.
+        :param wait: True to make blocking sends sleep until the budget
+                     allows them, False to reject them with DutyCycleError.
+        """
+        self.rate_ppm = max(int(duty * 1000000), 1)  # ns of airtime earned per ms
+        if burst_ms is None:
+            burst_ms = duty * window_ms
+        self.capacity_us = int(burst_ms * 1000)
+        self.wait = wait
+        self.tokens_us = self.capacity_us
+        self._remainder = 0  # refill below 1 us carried to the next refill
+        self._updated = ticks_ms()
+        self.used_us = 0
+        self.rejected = 0
+
+    def _refill(self, now):
+        elapsed = ticks_diff(now, self._updated)
+        if elapsed <= 0:
+            return
+        self._updated = now
+        if self.tokens_us >= self.capacity_us:
+            return
+        # Cap the elapsed time at a full refill so the product stays small
+        elapsed = min(elapsed, self.capacity_us * 1000 // self.rate_ppm + 1)
+        refill, self._remainder = divmod(elapsed * self.rate_ppm + self._remainder, 1000)
+        self.tokens_us = min(self.tokens_us + refill, self.capacity_us)
+
+    def remaining_us(self, now=None):
+        """
+        :return: Microseconds of airtime that could be sent right now.
+        """
+        self._refill(ticks_ms() if now is None else now)
+        return self.tokens_us
+
+    def wait_ms(self, airtime_us, now=None):
+        """
+        :param airtime_us: Airtime of the packet to send (see ULoRa.time_on_air_us).
+        :return: Milliseconds until it can be sent, 0 if it can be now, or -1
+                 if it is longer than the bucket and can never be sent.
+        """
+        if airtime_us > self.capacity_us:
+            return -1
+        missing = airtime_us - self.remaining_us(now)
+        if missing <= 0:
+            return 0
+        return (missing * 1000 - self._remainder + self.rate_ppm - 1) // self.rate_ppm
+
+    def consume(self, airtime_us, now=None):
+        """
+        Take airtime from the bucket if there is enough.
+
+        :return: True if the packet may be sent.
+        """
+        if self.wait_ms(airtime_us, now):
+            self.rejected += 1
+            return False
+        self.tokens_us -= airtime_us
+        self.used_us += airtime_us
+        return True
+
+    def stats(self):
+        """
+        :return: Dict of remaining budget, airtime used and sends rejected.
+        """
+        return {"remaining_us": self.remaining_us(), "used_us": self.used_us,
+                "rejected": self.rejected}
+
+# ============================================================================
+# Modem Profiles
+# ============================================================================
+class ModemProfile:
+    """
+    A complete set of modem settings compiled to its register image once,
+    so ULoRa.apply_profile() can switch to it by writing only the registers
+    that differ from the current shadow.
+    """
+    def __init__(self, parameters, name=None):
+        """
+        :param parameters: LoRa parameters; missing keys take DEFAULT_PARAMETERS.
+        :param name: (Optional) Name the profile is registered under.
+        """
+        p = DEFAULT_PARAMETERS.copy()
+        p.update(parameters)
+        bw_index = bandwidth_index(p["signal_bandwidth"])
+        p["signal_bandwidth"] = BANDWIDTHS[bw_index]
+        p["spreading_factor"] = sf = min(max(p["spreading_factor"], 6), 12)
+        p["coding_rate"] = cr = min(max(p["coding_rate"], 5), 8)
+        self.name = name
+        self.parameters = p
+        
+        image = bytearray(128)
+        frf = ((p["frequency"] + p["frequency_offset"]) << 19) // 32000000
+        image[REG_FRF_MSB] = (frf >> 16) & 0xFF
+        image[REG_FRF_MID] = (frf >> 8) & 0xFF
+        image[REG_FRF_LSB] = frf & 0xFF
+        image[REG_PA_CONFIG] = pa_config(p["tx_power_level"], p["pa_output_pin"])
+        image[REG_MODEM_CONFIG_1] = (bw_index << 4) | ((cr - 4) << 1) | (0x01 if p["implicitHeader"] else 0)
+        image[REG_MODEM_CONFIG_2] = ((sf << 4) & 0xF0) | (0x04 if p["enable_CRC"] else 0)
+        image[REG_PREAMBLE_MSB] = (p["preamble_length"] >> 8) & 0xFF
+        image[REG_PREAMBLE_LSB] = p["preamble_length"] & 0xFF
+        # Auto AGC, plus LowDataRateOptimize when a symbol lasts over 16 ms
+        symbol_ms = (1 << sf) * 1000 / p["signal_bandwidth"]
+        image[REG_MODEM_CONFIG_3] = 0x04 | (0x08 if symbol_ms > 16 else 0)
+        image[REG_DETECTION_OPTIMIZE] = 0xC5 if sf == 6 else 0xC3
+        image[REG_DETECTION_THRESHOLD] = 0x0C if sf == 6 else 0x0A
+        image[REG_SYNC_WORD] = p["sync_word"]
+        invert_iq = RFLR_INVERTIQ_RESET & RFLR_INVERTIQ_TX_MASK & RFLR_INVERTIQ_RX_MASK
+        if p["invert_IQ"]:
+            image[REG_INVERTIQ] = invert_iq | RFLR_INVERTIQ_RX_ON | RFLR_INVERTIQ_TX_ON
+            image[REG_INVERTIQ2] = RFLR_INVERTIQ2_ON
+        else:
+            image[REG_INVERTIQ] = invert_iq | RFLR_INVERTIQ_RX_OFF | RFLR_INVERTIQ_TX_OFF
+            image[REG_INVERTIQ2] = RFLR_INVERTIQ2_OFF
+        self.image = image
+
+# ============================================================================
+# Receive Ring Buffer
+# ============================================================================
+class PacketRing:
+    """
+    Fixed-size ring buffer of received packets, filled from the DIO0 interrupt.
+    Every slot is preallocated and the SNR is kept as an int in quarter dB,
+    so filling a slot never allocates; get() converts it to dB. (A receive
+    callback still gets a copy of the payload, see ULoRa.receive_irq().)
+    When the ring is full the newest packet is dropped and counted, and no
+    callback is made for it.
+    """
+    def __init__(self, slots=8):
+        """
+        :param slots: Number of packets that can be buffered.
+        """
+        self.slots = [bytearray(MAX_PKT_LENGTH) for _ in range(slots)]
+        self.lengths = [0] * slots
+        self.rssi = [0] * slots
+        self.snr = [0] * slots  # quarter dB
+        self.head = 0  # next slot to fill
+        self.tail = 0  # next slot to read
+        self.count = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.count
+
+    def next_slot(self):
+        """
+        Get the buffer for the next packet to be written.
+
+        :return: bytearray slot, or None if the ring is full.
+        """
+        if self.count == len(self.slots):
+            self.dropped += 1
+            return None
+        return self.slots[self.head]
+
+    def commit(self, length, rssi, snr):
+        """
+        Mark the slot returned by next_slot() as filled.
+
+        :param snr: SNR in quarter dB, see ULoRa.packet_snr_raw().
+        """
+        self.lengths[self.head] = length
+        self.rssi[self.head] = rssi
+        self.snr[self.head] = snr
+        self.head = (self.head + 1) % len(self.slots)
+        self.count += 1
+
+    def get(self):
+        """
+        Pop the oldest packet.
+
+        :return: (payload bytes, rssi, snr in dB) tuple, or None if empty.
+        """
+        if self.count == 0:
+            return None
+        i = self.tail
+        packet = (bytes(self.slots[i][:self.lengths[i]]), self.rssi[i], self.snr[i] * 0.25)
+        self.tail = (i + 1) % len(self.slots)
+        self.count -= 1
+        return packet
+
 # ============================================================================
 # ULoRa Class Definition
 # ============================================================================
@@ -115,33 +459,82 @@ class ULoRa:
     """
     ULoRa class to interface with the SX127x LoRa module.
     """
-    def __init__(self, spi, pins, parameters=None):
+    def __init__(self, spi, pins, parameters=None, gc_policy=None, profiles=None,
+                 duty_cycle=None):
         """
         Initialize the LoRa module.
         
         :param spi: Initialized SPI object.
         :param pins: Dictionary with pin mappings, e.g.,
-                     {"ss": <pin>, "reset": <pin>, "dio0": <pin>}.
+                     {"ss": <pin>, "reset": <pin>, "dio0": <pin>}, where each
+                     <pin> is a pin number or a Pin-like object.
+                     "dio0" is only needed for interrupt-driven receive.
         :param parameters: (Optional) Dictionary with LoRa configuration parameters.
+        :param gc_policy: (Optional) GcPolicy deciding when packet operations
+                          collect garbage. Defaults to collecting on low memory.
+        :param profiles: (Optional) Dictionary of name -> parameter overrides,
+                         compiled with add_profile() for apply_profile().
+        :param duty_cycle: (Optional) DutyCycleLimiter every transmission is
+                           charged against. None transmits without a limit.
         """
         self.spi = spi
         self.pins = pins
+        self.gc_policy = gc_policy if gc_policy is not None else GcPolicy()
+        self.duty_cycle = duty_cycle
+        self.airtime_us = 0  # total time on air of every packet sent
         self.parameters = DEFAULT_PARAMETERS.copy()
         if parameters:
             self.parameters.update(parameters)
         
         # Setup slave select (CS) pin
-        self.pin_ss = Pin(self.pins["ss"], Pin.OUT)
+        self.pin_ss = make_pin(self.pins["ss"], Pin.OUT)
+        
+        # Preallocated SPI buffers: register access never allocates
+        self._reg_tx = bytearray(2)  # address byte, value byte
+        self._reg_rx = bytearray(2)  # status byte, register value
+        self._burst = bytearray(MAX_PKT_LENGTH + 1)
+        self._burst_view = memoryview(self._burst)
+        
+        # Write-through shadow of the configuration registers, so settings
+        # are changed with a single write instead of read-modify-write
+        self.shadow = bytearray(128)
+        self._shadowed = bytearray(128)  # 1 for addresses kept in the shadow
+        for address in SHADOW_REGISTERS:
+            self._shadowed[address] = 1
+        self.verify_shadow = False  # debug: check every shadow read against the chip
+        
+        self.lock = False
+        self.implicit_header_mode = None
         
         # Setup reset pin if provided and perform a hardware reset
         if "reset" in self.pins:
-            self.pin_reset = Pin(self.pins["reset"], Pin.OUT)
+            self.pin_reset = make_pin(self.pins["reset"], Pin.OUT)
             self.reset_module()
         else:
             self.pin_reset = None
+            self.resync()
         
-        self.lock = False
-        self.implicit_header_mode = None
+        # DIO0 is raised by the module on RxDone / TxDone
+        self.pin_dio0 = make_pin(self.pins["dio0"], Pin.IN) if "dio0" in self.pins else None
+        
+        # Interrupt-driven receive state (see receive_irq)
+        self.rx_ring = None
+        self._on_receive = None
+        self._irq_rx_active = False
+        self.crc_errors = 0
+        
+        # Non-blocking transmit state (see send_nowait)
+        self._on_transmit = None
+        self._tx_pending = False
+        self._tx_deadline = 0
+        
+        # Channel activity detection state (see cad_nowait)
+        self._on_cad = None
+        self._cad_pending = False
+        self._cad_deadline = 0
+        self.cad_runs = 0
+        self.cad_detections = 0
+        self.cad_timeouts = 0
         
         # Check LoRa module version
         version = None
@@ -159,28 +552,16 @@ class ULoRa:
         # Put module in sleep mode for configuration
         self.sleep()
         
-        # Configure LoRa parameters
-        self.set_frequency(self.parameters["frequency"])
-        self.set_signal_bandwidth(self.parameters["signal_bandwidth"])
-        
-        # Enable LNA boost and auto AGC
-        self.write_register(REG_LNA, self.read_register(REG_LNA) | 0x03)
-        self.write_register(REG_MODEM_CONFIG_3, 0x04)
-        
-        self.set_tx_power(self.parameters["tx_power_level"])
-        self.set_implicit_header(self.parameters["implicitHeader"])
-        self.set_spreading_factor(self.parameters["spreading_factor"])
-        self.set_coding_rate(self.parameters["coding_rate"])
-        self.set_preamble_length(self.parameters["preamble_length"])
-        self.set_sync_word(self.parameters["sync_word"])
-        self.enable_crc(self.parameters["enable_CRC"])
-        self.invert_iq(self.parameters["invert_IQ"])
-        
-        # Enable LowDataRateOptimize if symbol duration > 16ms
-        bw = self.parameters["signal_bandwidth"]
-        sf = self.parameters["spreading_factor"]
-        if (1000 / bw / (2 ** sf)) > 16:
-            self.write_register(REG_MODEM_CONFIG_3, self.read_register(REG_MODEM_CONFIG_3) | 0x08)
+        # Configure LoRa parameters: the constructor parameters become the
+        # "default" profile, written as a handful of bursts
+        self.profiles = {"default": ModemProfile(self.parameters, "default")}
+        if profiles:
+            for name, overrides in profiles.items():
+                self.add_profile(name, overrides)
+        self.apply_profile("default")
+        
+        # Enable LNA boost
+        self.write_register(REG_LNA, self.read_shadow(REG_LNA) | 0x03)
         
         # Set FIFO base addresses
         self.write_register(REG_FIFO_TX_BASE_ADDR, FifoTxBaseAddr)
@@ -191,6 +572,7 @@ class ULoRa:
     def reset_module(self):
         """
         Perform a hardware reset of the LoRa module using the reset pin.
+        The register shadow is reloaded afterwards.
         """
         if self.pin_reset is None:
             return
@@ -199,6 +581,7 @@ class ULoRa:
         sleep_ms(100)
         self.pin_reset.value(1)
         sleep_ms(100)
+        self.resync()
     
     # ---------------------------
     # Packet Transmission Methods
@@ -209,6 +592,10 @@ class ULoRa:
         
         :param implicit_header: (Optional) Boolean to override current header mode.
         """
+        if self.tx_pending():
+            raise RuntimeError("Previous packet is still transmitting")
+        if self.cad_pending():
+            raise RuntimeError("Channel activity detection in progress")
         self.standby()
         if implicit_header is not None:
             self.set_implicit_header(implicit_header)
@@ -223,46 +610,204 @@ class ULoRa:
         :param buffer: Data bytes (or bytearray) to be sent.
         :return: Number of bytes written.
         """
-        current_length = self.read_register(REG_PAYLOAD_LENGTH)
+        current_length = self.read_shadow(REG_PAYLOAD_LENGTH)
         size = len(buffer)
         # Ensure packet does not exceed maximum allowed length
         size = min(size, MAX_PKT_LENGTH - FifoTxBaseAddr - current_length)
         # FIX: burst write entire buffer in one SPI transaction
         self.pin_ss.value(0)
-        self.spi.write(bytes([REG_FIFO | 0x80]))  # FIFO register, write mode
-        self.spi.write(bytes(buffer[:size]))
+        self.spi.write(FIFO_WRITE_CMD)  # FIFO register, write mode
+        self.spi.write(buffer if size == len(buffer) else memoryview(buffer)[:size])
         self.pin_ss.value(1)
         # Update payload length
         self.write_register(REG_PAYLOAD_LENGTH, current_length + size)
         return size
     
-    def end_packet(self):
+    def end_packet(self, timeout=None):
         """
         Transmit the packet and wait until transmission is complete.
+        
+        :param timeout: (Optional) Timeout in milliseconds. Defaults to twice
+                        the worst-case airtime for the current settings.
+        :raises DutyCycleError: If the duty-cycle budget does not allow it.
+        :raises RuntimeError: If TX_DONE is not raised before the timeout.
         """
+        self._charge_airtime(True)
+        deadline = ticks_add(ticks_ms(), timeout or self.tx_timeout_ms())
         # Set module to TX mode
         self.write_register(REG_OP_MODE, MODE_LONG_RANGE_MODE | MODE_TX)
         # Wait until TX_DONE flag is set
         while (self.read_register(REG_IRQ_FLAGS) & IRQ_TX_DONE_MASK) == 0:
-            pass
+            if ticks_diff(deadline, ticks_ms()) <= 0:
+                self._abort_tx()
+                if self._irq_rx_active:
+                    self._arm_receive_irq()
+                raise RuntimeError("TX timeout: TX_DONE not raised")
+            sleep_ms(1)
         # Clear TX_DONE flag
         self.write_register(REG_IRQ_FLAGS, IRQ_TX_DONE_MASK)
+        # Go back to listening if interrupt-driven receive was active
+        if self._irq_rx_active:
+            self._arm_receive_irq()
+    
+    def end_packet_nowait(self, callback=None, timeout=None):
+        """
+        Start transmitting the packet and return immediately. DIO0 is mapped
+        to TxDone so completion is reported from the interrupt handler.
+        
+        :param callback: (Optional) function called as callback(ok) when the
+                         transmission completes (True) or times out (False).
+        :param timeout: (Optional) Timeout in milliseconds, see end_packet().
+                        Only enforced while tx_pending() is being called.
+        :raises DutyCycleError: If the duty-cycle budget does not allow it now.
+        """
+        if self.pin_dio0 is None:
+            raise RuntimeError("end_packet_nowait needs a 'dio0' entry in pins")
+        self._charge_airtime(False)
+        self._on_transmit = callback
+        self._tx_pending = True
+        self._tx_deadline = ticks_add(ticks_ms(), timeout or self.tx_timeout_ms())
+        self.write_register(REG_DIO_MAPPING_1, DIO0_TX_DONE)
+        self.pin_dio0.irq(handler=self._handle_dio0, trigger=Pin.IRQ_RISING)
+        self.write_register(REG_OP_MODE, MODE_LONG_RANGE_MODE | MODE_TX)
     
-    def println(self, message, implicit_header=None, repeat=1):
+    def send_nowait(self, message, callback=None, timeout=None, implicit_header=None):
+        """
+        Non-blocking version of println(): load the FIFO, start the
+        transmission and return without waiting for TX_DONE.
+        
+        :param message: str or bytes to transmit.
+        :param callback: (Optional) function called as callback(ok) on completion.
+        :param timeout: (Optional) Timeout in milliseconds.
+        :param implicit_header: (Optional) Boolean to override header mode.
+        """
+        if isinstance(message, str):
+            message = message.encode()
+        self.begin_packet(implicit_header)
+        self.write(message)
+        self.end_packet_nowait(callback, timeout)
+    
+    def tx_pending(self):
+        """
+        Check whether a send_nowait() transmission is still in flight.
+        A transmission past its timeout is aborted and reported as failed.
+        
+        :return: True while transmitting.
+        """
+        if self._tx_pending and ticks_diff(ticks_ms(), self._tx_deadline) >= 0:
+            self._abort_tx()
+            self._finish_tx(False)
+        return self._tx_pending
+    
+    def tx_timeout_ms(self, length=MAX_PKT_LENGTH):
+        """
+        Upper bound on how long a transmission may take: twice the airtime
+        of a packet of the given length at the current settings, plus margin.
+        
+        :param length: Payload length in bytes.
+        :return: Timeout in milliseconds.
+        """
+        return 2 * self.time_on_air_us(length) // 1000 + 100
+    
+    def time_on_air_us(self, length, implicit_header=None):
+        """
+        Exact time on air of a packet, from the SX127x datasheet formula and
+        the modem settings currently in the registers (spreading factor,
+        bandwidth, coding rate, preamble, header mode, CRC and
+        LowDataRateOptimize). Read from the shadow, so no SPI traffic.
+        
+        :param length: Payload length in bytes.
+        :param implicit_header: (Optional) Boolean to override header mode.
+        :return: Airtime in microseconds (rounded down).
+        """
+        shadow = self.shadow
+        config_1 = shadow[REG_MODEM_CONFIG_1]
+        config_2 = shadow[REG_MODEM_CONFIG_2]
+        sf = config_2 >> 4
+        bandwidth = BANDWIDTHS[min(config_1 >> 4, len(BANDWIDTHS) - 1)]
+        cr = (config_1 >> 1) & 0x07  # 1..4 for 4/5..4/8
+        if implicit_header is None:
+            implicit_header = config_1 & 0x01
+        preamble = (shadow[REG_PREAMBLE_MSB] << 8) | shadow[REG_PREAMBLE_LSB]
+        # Payload symbols: 8 + max(ceil((8PL - 4SF + 28 + 16CRC - 20IH) / (4(SF - 2DE))) (CR + 4), 0)
+        bits = 8 * length - 4 * sf + 28
+        if config_2 & 0x04:
+            bits += 16
+        if implicit_header:
+            bits -= 20
+        per_block = 4 * (sf - 2 if shadow[REG_MODEM_CONFIG_3] & 0x08 else sf)
+        blocks = -(-bits // per_block) if bits > 0 else 0
+        # Whole packet in quarter symbols: preamble + 4.25 sync + payload
+        quarters = 4 * (preamble + 8 + blocks * (cr + 4)) + 17
+        return (quarters << sf) * 250000 // bandwidth
+    
+    def symbol_us(self):
+        """
+        :return: Duration of one LoRa symbol at the current settings, in us.
+        """
+        config_1 = self.shadow[REG_MODEM_CONFIG_1]
+        bandwidth = BANDWIDTHS[min(config_1 >> 4, len(BANDWIDTHS) - 1)]
+        return (1000000 << (self.shadow[REG_MODEM_CONFIG_2] >> 4)) // bandwidth
+    
+    def _charge_airtime(self, blocking):
+        """
+        Charge the packet in the FIFO against the duty-cycle budget before
+        it is sent. A blocking send sleeps until it fits if the limiter is
+        set to wait; otherwise the packet is refused and the module goes
+        back to what it was doing.
+        
+        :raises DutyCycleError: If the packet does not fit the budget.
+        """
+        airtime = self.time_on_air_us(self.read_shadow(REG_PAYLOAD_LENGTH))
+        limiter = self.duty_cycle
+        if limiter is not None:
+            if blocking and limiter.wait:
+                wait = limiter.wait_ms(airtime)
+                if wait > 0:
+                    sleep_ms(wait)
+            if not limiter.consume(airtime):
+                if self._irq_rx_active:
+                    self._arm_receive_irq()
+                raise DutyCycleError(limiter.wait_ms(airtime))
+        self.airtime_us += airtime
+    
+    def _abort_tx(self):
+        """
+        Give up on a transmission: return to standby and clear TX_DONE.
+        """
+        self.standby()
+        self.write_register(REG_IRQ_FLAGS, IRQ_TX_DONE_MASK)
+    
+    def _finish_tx(self, ok):
+        """
+        Complete a non-blocking transmission and notify the callback.
+        """
+        self._tx_pending = False
+        if self._irq_rx_active:
+            self._arm_receive_irq()
+        elif self.pin_dio0 is not None:
+            self.pin_dio0.irq(handler=None)
+        callback = self._on_transmit
+        self._on_transmit = None
+        if callback:
+            callback(ok)
+    
+    def println(self, message, implicit_header=None, repeat=1, timeout=None):
         """
         Transmit a text message.
         
         :param message: String message to transmit.
         :param implicit_header: (Optional) Boolean to override header mode.
         :param repeat: Number of times to send the message.
+        :param timeout: (Optional) TX timeout in milliseconds, see end_packet().
         """
         if isinstance(message, str):
             message = message.encode()
         self.begin_packet(implicit_header)
         self.write(message)
         for _ in range(repeat):
-            self.end_packet()
-        self.collect_garbage()
+            self.end_packet(timeout)
+        self.gc_policy.packet()
     
     # ---------------------------
     # Packet Reception Methods
@@ -275,7 +820,7 @@ class ULoRa:
         """
         self.set_implicit_header(size > 0)
         if size > 0:
-            self.write_register(REG_PAYLOAD_LENGTH, size & 0xFF)
+            self.update_register(REG_PAYLOAD_LENGTH, size & 0xFF)
         self.write_register(REG_OP_MODE, MODE_LONG_RANGE_MODE | MODE_RX_CONTINUOUS)
     
     def listen(self, timeout=1000):
@@ -290,7 +835,7 @@ class ULoRa:
         while True:
             if self.received_packet():
                 return self.read_payload()
-            if ticks_ms() - start > timeout:
+            if ticks_diff(ticks_ms(), start) > timeout:
                 return None
     
     def received_packet(self, size=0):
@@ -303,9 +848,10 @@ class ULoRa:
         # FIX 1: use & not == so other IRQ bits (CRC ok etc) dont block detection
         # FIX 2: dont switch to single RX — stay in continuous RX mode
         irq_flags = self.read_register(REG_IRQ_FLAGS)  # read but dont clear yet
+        # Header mode and length come from the shadow: no SPI unless they change
         self.set_implicit_header(size > 0)
         if size > 0:
-            self.write_register(REG_PAYLOAD_LENGTH, size & 0xFF)
+            self.update_register(REG_PAYLOAD_LENGTH, size & 0xFF)
         if irq_flags & IRQ_RX_DONE_MASK:
             # Check for CRC error
             if irq_flags & IRQ_PAYLOAD_CRC_ERROR_MASK:
@@ -315,30 +861,236 @@ class ULoRa:
             return True
         return False
     
-    def read_payload(self):
+    def _prepare_fifo_read(self):
         """
-        Read the received payload from the FIFO using burst SPI read.
+        Point the FIFO at the last received packet.
         
-        :return: Payload data as bytes.
+        :return: Length of the received payload.
         """
         # Set FIFO pointer to the current RX address
         self.write_register(REG_FIFO_ADDR_PTR, self.read_register(REG_FIFO_RX_CURRENT_ADDR))
         # Determine payload length based on header mode
         if self.implicit_header_mode:
-            packet_length = self.read_register(REG_PAYLOAD_LENGTH)
-        else:
-            packet_length = self.read_register(REG_RX_NB_BYTES)
+            return self.read_shadow(REG_PAYLOAD_LENGTH)
+        return self.read_register(REG_RX_NB_BYTES)
+    
+    def read_payload(self):
+        """
+        Read the received payload from the FIFO using burst SPI read.
+        
+        :return: Payload data as bytes.
+        """
+        packet_length = self._prepare_fifo_read()
         if packet_length == 0:
             return b""
         # FIX 3: burst read entire payload in one SPI transaction
         # byte-by-byte reads are too slow and corrupt the data
         self.pin_ss.value(0)
-        self.spi.write(bytes([REG_FIFO & 0x7F]))  # FIFO register, read mode
+        self.spi.write(FIFO_READ_CMD)  # FIFO register, read mode
         payload = self.spi.read(packet_length)
         self.pin_ss.value(1)
-        self.collect_garbage()
+        self.gc_policy.packet()
         return bytes(payload)
     
+    def read_payload_into(self, buffer):
+        """
+        Burst read the received payload into a caller-supplied buffer.
+        Does not allocate a new payload object, so it is safe to use from the
+        DIO0 interrupt handler.
+        
+        :param buffer: bytearray to fill (payloads longer than it are truncated).
+        :return: Number of bytes read.
+        """
+        packet_length = min(self._prepare_fifo_read(), len(buffer))
+        if packet_length:
+            self.pin_ss.value(0)
+            self.spi.write(FIFO_READ_CMD)  # FIFO register, read mode
+            self.spi.readinto(memoryview(buffer)[:packet_length])
+            self.pin_ss.value(1)
+        return packet_length
+    
+    # ---------------------------
+    # Channel Activity Detection
+    # ---------------------------
+    def cad(self, timeout=None):
+        """
+        Listen for LoRa activity on the channel with CAD, e.g. before
+        transmitting. CAD takes about two symbols, after which the module
+        returns to standby (or continuous RX if receive_irq() is active).
+        
+        :param timeout: (Optional) Timeout in milliseconds, see cad_timeout_ms().
+        :return: True if a LoRa signal was detected.
+        :raises RuntimeError: If CadDone is not raised before the timeout.
+        """
+        if self.cad_pending():
+            raise RuntimeError("Channel activity detection in progress")
+        self._start_cad()
+        deadline = ticks_add(ticks_ms(), timeout or self.cad_timeout_ms())
+        while True:
+            irq_flags = self.read_register(REG_IRQ_FLAGS)
+            if irq_flags & IRQ_CAD_DONE_MASK:
+                break
+            if ticks_diff(deadline, ticks_ms()) <= 0:
+                self.standby()
+                self.cad_timeouts += 1
+                if self._irq_rx_active:
+                    self._arm_receive_irq()
+                raise RuntimeError("CAD timeout: CAD_DONE not raised")
+            sleep_ms(1)
+        self.write_register(REG_IRQ_FLAGS, IRQ_CAD_DONE_MASK | IRQ_CAD_DETECTED_MASK)
+        detected = bool(irq_flags & IRQ_CAD_DETECTED_MASK)
+        if detected:
+            self.cad_detections += 1
+        if self._irq_rx_active:
+            self._arm_receive_irq()
+        return detected
+    
+    def cad_nowait(self, callback, timeout=None):
+        """
+        Start CAD and return immediately. DIO0 is mapped to CadDone so the
+        result is reported from the interrupt handler.
+        
+        :param callback: function called as callback(detected) when CAD
+                         completes. A CAD that times out is reported as
+                         detected, so a caller never transmits on a guess,
+                         but counted in cad_timeouts, not cad_detections.
+        :param timeout: (Optional) Timeout in milliseconds, see cad().
+                        Only enforced while cad_pending() is being called.
+        """
+        if self.pin_dio0 is None:
+            raise RuntimeError("cad_nowait needs a 'dio0' entry in pins")
+        self._on_cad = callback
+        self._cad_pending = True
+        self._cad_deadline = ticks_add(ticks_ms(), timeout or self.cad_timeout_ms())
+        self.pin_dio0.irq(handler=self._handle_dio0, trigger=Pin.IRQ_RISING)
+        self._start_cad(DIO0_CAD_DONE)
+    
+    def cad_pending(self):
+        """
+        Check whether a cad_nowait() detection is still running.
+        A detection past its timeout is aborted and reported as detected.
+        
+        :return: True while detecting.
+        """
+        if self._cad_pending and ticks_diff(ticks_ms(), self._cad_deadline) >= 0:
+            self.standby()
+            self._finish_cad(True, timed_out=True)
+        return self._cad_pending
+    
+    def cad_timeout_ms(self):
+        """
+        Upper bound on how long CAD may take: four symbols plus margin.
+        """
+        return 4 * self.symbol_us() // 1000 + 10
+    
+    def _start_cad(self, dio0_mapping=None):
+        """
+        Clear the CAD flags and enter CAD mode from standby.
+        """
+        if self.tx_pending():
+            raise RuntimeError("Cannot run CAD while transmitting")
+        self.standby()
+        self.write_register(REG_IRQ_FLAGS, IRQ_CAD_DONE_MASK | IRQ_CAD_DETECTED_MASK)
+        if dio0_mapping is not None:
+            self.write_register(REG_DIO_MAPPING_1, dio0_mapping)
+        self.cad_runs += 1
+        self.write_register(REG_OP_MODE, MODE_LONG_RANGE_MODE | MODE_CAD)
+    
+    def _finish_cad(self, detected, timed_out=False):
+        """
+        Complete a non-blocking detection and notify the callback.
+        """
+        self._cad_pending = False
+        if timed_out:
+            self.cad_timeouts += 1
+        elif detected:
+            self.cad_detections += 1
+        if self._irq_rx_active:
+            self._arm_receive_irq()
+        elif self.pin_dio0 is not None:
+            self.pin_dio0.irq(handler=None)
+        callback = self._on_cad
+        self._on_cad = None
+        if callback:
+            callback(detected)
+    
+    # ---------------------------
+    # Interrupt-Driven Reception
+    # ---------------------------
+    def receive_irq(self, callback=None, ring=None):
+        """
+        Start continuous receive with DIO0 raised on RxDone, instead of
+        polling REG_IRQ_FLAGS over SPI. Each packet is stored in a ring
+        buffer and/or handed to a callback from the interrupt handler.
+        Storing into the ring does not allocate; the callback's payload is
+        a new copy, so leave it out where allocation in the handler matters.
+        
+        :param callback: (Optional) function called as callback(payload),
+                         except for packets a full ring drops.
+        :param ring: (Optional) PacketRing to store packets in. A new one is
+                     created if neither callback nor ring is given.
+        :return: The PacketRing in use (None if callback only).
+        """
+        if self.pin_dio0 is None:
+            raise RuntimeError("receive_irq needs a 'dio0' entry in pins")
+        if ring is None and callback is None:
+            ring = PacketRing()
+        self.rx_ring = ring
+        self._on_receive = callback
+        self._irq_rx_active = True
+        self.pin_dio0.irq(handler=self._handle_dio0, trigger=Pin.IRQ_RISING)
+        self._arm_receive_irq()
+        return ring
+    
+    def stop_receive_irq(self):
+        """
+        Detach the DIO0 handler and put the module in standby.
+        """
+        self._irq_rx_active = False
+        if self.pin_dio0 is not None:
+            self.pin_dio0.irq(handler=None)
+        self.standby()
+    
+    def _arm_receive_irq(self):
+        """
+        Map DIO0 to RxDone and enter continuous RX mode.
+        """
+        self.write_register(REG_DIO_MAPPING_1, DIO0_RX_DONE)
+        self.receive()
+    
+    def _handle_dio0(self, pin):
+        """
+        DIO0 interrupt handler: complete a pending transmission on TxDone
+        or detection on CadDone, or read the packet that raised RxDone.
+        """
+        irq_flags = self.get_irq_flags()
+        if irq_flags & IRQ_TX_DONE_MASK and self._tx_pending:
+            self._finish_tx(True)
+            return
+        if irq_flags & IRQ_CAD_DONE_MASK and self._cad_pending:
+            self._finish_cad(bool(irq_flags & IRQ_CAD_DETECTED_MASK))
+            return
+        if not irq_flags & IRQ_RX_DONE_MASK:
+            return
+        if irq_flags & IRQ_PAYLOAD_CRC_ERROR_MASK:
+            self.crc_errors += 1
+            return
+        ring = self.rx_ring
+        if ring is not None:
+            slot = ring.next_slot()
+            if slot is None:
+                # Ring full: next_slot() counted the drop. Leave the packet in
+                # the FIFO for the next one to overwrite; reading it here
+                # would allocate inside the interrupt.
+                return
+            length = self.read_payload_into(slot)
+            ring.commit(length, self.packet_rssi(), self.packet_snr_raw())
+            if self._on_receive:
+                self._on_receive(slot[:length])
+            return
+        if self._on_receive:
+            self._on_receive(self.read_payload())
+    
     def get_irq_flags(self):
         """
         Retrieve and clear the IRQ flags.
@@ -349,13 +1101,17 @@ class ULoRa:
         self.write_register(REG_IRQ_FLAGS, irq_flags)
         return irq_flags
     
-    def packet_rssi(self, high_frequency=True):
+    def packet_rssi(self, high_frequency=None):
         """
         Get the RSSI value of the last received packet.
         
-        :param high_frequency: Boolean flag; if True, uses high frequency offset.
+        :param high_frequency: Boolean flag; if True, uses the high frequency
+                               (RFO_HF, 779 MHz and up) offset. Defaults to
+                               the port matching the configured frequency.
         :return: Adjusted RSSI value.
         """
+        if high_frequency is None:
+            high_frequency = self.parameters["frequency"] >= 779000000
         rssi = self.read_register(REG_PKT_RSSI_VALUE)
         return rssi - (157 if high_frequency else 164)
     
@@ -363,9 +1119,18 @@ class ULoRa:
         """
         Get the SNR (Signal-to-Noise Ratio) of the last packet.
         
-        :return: SNR value.
+        :return: SNR value in dB.
         """
-        return self.read_register(REG_PKT_SNR_VALUE) * 0.25
+        return self.packet_snr_raw() * 0.25
+    
+    def packet_snr_raw(self):
+        """
+        SNR of the last packet as an int in quarter dB, e.g. for the
+        interrupt handler, where a float would be allocated.
+        """
+        # Two's complement, in quarter dB steps
+        snr = self.read_register(REG_PKT_SNR_VALUE)
+        return (snr ^ 0x80) - 0x80
     
     # ---------------------------
     # Module Mode Methods
@@ -385,20 +1150,19 @@ class ULoRa:
     # ---------------------------
     # Configuration Methods
     # ---------------------------
-    def set_tx_power(self, level, output_pin=PA_OUTPUT_PA_BOOST_PIN):
+    def set_tx_power(self, level, output_pin=None):
         """
         Set the transmission power level.
         
         :param level: Power level.
         :param output_pin: PA output type (PA_OUTPUT_RFO_PIN or PA_OUTPUT_PA_BOOST_PIN).
+                           None keeps the current one, see "pa_output_pin".
         """
+        if output_pin is None:
+            output_pin = self.parameters["pa_output_pin"]
         self.parameters["tx_power_level"] = level
-        if output_pin == PA_OUTPUT_RFO_PIN:
-            level = min(max(level, 0), 14)
-            self.write_register(REG_PA_CONFIG, 0x70 | level)
-        else:
-            level = min(max(level, 2), 17)
-            self.write_register(REG_PA_CONFIG, PA_BOOST | (level - 2))
+        self.parameters["pa_output_pin"] = output_pin
+        self.write_register(REG_PA_CONFIG, pa_config(level, output_pin))
     
     def set_frequency(self, frequency):
         """
@@ -409,9 +1173,11 @@ class ULoRa:
         self.parameters["frequency"] = frequency
         frequency += self.parameters["frequency_offset"]
         frf = (frequency << 19) // 32000000
-        self.write_register(REG_FRF_MSB, (frf >> 16) & 0xFF)
-        self.write_register(REG_FRF_MID, (frf >> 8) & 0xFF)
-        self.write_register(REG_FRF_LSB, frf & 0xFF)
+        self.write_registers((
+            (REG_FRF_MSB, (frf >> 16) & 0xFF),
+            (REG_FRF_MID, (frf >> 8) & 0xFF),
+            (REG_FRF_LSB, frf & 0xFF),
+        ))
     
     def set_spreading_factor(self, sf):
         """
@@ -420,13 +1186,14 @@ class ULoRa:
         :param sf: Spreading factor.
         """
         sf = min(max(sf, 6), 12)
+        self.parameters["spreading_factor"] = sf
         if sf == 6:
             self.write_register(REG_DETECTION_OPTIMIZE, 0xC5)
             self.write_register(REG_DETECTION_THRESHOLD, 0x0C)
         else:
             self.write_register(REG_DETECTION_OPTIMIZE, 0xC3)
             self.write_register(REG_DETECTION_THRESHOLD, 0x0A)
-        current = self.read_register(REG_MODEM_CONFIG_2) & 0x0F
+        current = self.read_shadow(REG_MODEM_CONFIG_2) & 0x0F
         self.write_register(REG_MODEM_CONFIG_2, current | ((sf << 4) & 0xF0))
     
     def set_signal_bandwidth(self, sbw):
@@ -435,17 +1202,9 @@ class ULoRa:
         
         :param sbw: Bandwidth in Hz.
         """
-        # Predefined bandwidth bins
-        bins = (7800, 10400, 15600, 20800, 31250, 41700, 62500, 125000, 250000)
-        bw_index = 7  # Default to 125 kHz
-        if sbw < 10:
-            bw_index = int(sbw)
-        else:
-            for i, bw in enumerate(bins):
-                if sbw <= bw:
-                    bw_index = i
-                    break
-        current = self.read_register(REG_MODEM_CONFIG_1) & 0x0F
+        bw_index = bandwidth_index(sbw)
+        self.parameters["signal_bandwidth"] = BANDWIDTHS[bw_index]
+        current = self.read_shadow(REG_MODEM_CONFIG_1) & 0x0F
         self.write_register(REG_MODEM_CONFIG_1, current | (bw_index << 4))
     
     def set_coding_rate(self, denominator):
@@ -455,8 +1214,9 @@ class ULoRa:
         :param denominator: Denominator (between 5 and 8).
         """
         denominator = min(max(denominator, 5), 8)
+        self.parameters["coding_rate"] = denominator
         cr = denominator - 4
-        current = self.read_register(REG_MODEM_CONFIG_1) & 0xF1
+        current = self.read_shadow(REG_MODEM_CONFIG_1) & 0xF1
         self.write_register(REG_MODEM_CONFIG_1, current | (cr << 1))
     
     def set_preamble_length(self, length):
@@ -465,8 +1225,11 @@ class ULoRa:
         
         :param length: Preamble length.
         """
-        self.write_register(REG_PREAMBLE_MSB, (length >> 8) & 0xFF)
-        self.write_register(REG_PREAMBLE_LSB, length & 0xFF)
+        self.parameters["preamble_length"] = length
+        self.write_registers((
+            (REG_PREAMBLE_MSB, (length >> 8) & 0xFF),
+            (REG_PREAMBLE_LSB, length & 0xFF),
+        ))
     
     def enable_crc(self, enable_crc):
         """
@@ -474,7 +1237,7 @@ class ULoRa:
         
         :param enable_crc: Boolean flag.
         """
-        modem_config_2 = self.read_register(REG_MODEM_CONFIG_2)
+        modem_config_2 = self.read_shadow(REG_MODEM_CONFIG_2)
         if enable_crc:
             config = modem_config_2 | 0x04
         else:
@@ -488,7 +1251,7 @@ class ULoRa:
         :param invert: Boolean flag.
         """
         self.parameters["invert_IQ"] = invert
-        current = self.read_register(REG_INVERTIQ)
+        current = self.read_shadow(REG_INVERTIQ)
         if invert:
             new_val = (current & RFLR_INVERTIQ_TX_MASK & RFLR_INVERTIQ_RX_MASK) | RFLR_INVERTIQ_RX_ON | RFLR_INVERTIQ_TX_ON
             self.write_register(REG_INVERTIQ, new_val)
@@ -514,13 +1277,77 @@ class ULoRa:
         """
         if self.implicit_header_mode != implicit:
             self.implicit_header_mode = implicit
-            modem_config_1 = self.read_register(REG_MODEM_CONFIG_1)
+            modem_config_1 = self.read_shadow(REG_MODEM_CONFIG_1)
             if implicit:
                 config = modem_config_1 | 0x01
             else:
                 config = modem_config_1 & 0xFE
             self.write_register(REG_MODEM_CONFIG_1, config)
     
+    # ---------------------------
+    # Modem Profiles
+    # ---------------------------
+    def add_profile(self, name, overrides):
+        """
+        Compile and register a named profile.
+        
+        :param name: Profile name for apply_profile().
+        :param overrides: Parameters that differ from the "default" profile.
+        :return: The compiled ModemProfile.
+        """
+        parameters = self.profiles["default"].parameters.copy()
+        parameters.update(overrides)
+        profile = ModemProfile(parameters, name)
+        self.profiles[name] = profile
+        return profile
+    
+    def apply_profile(self, profile):
+        """
+        Switch to a modem profile with the fewest SPI transactions: registers
+        that already match the shadow are skipped, and the changed registers
+        of each PROFILE_BLOCKS run go out as one burst. Call with the module
+        in sleep or standby; interrupt-driven receive is paused and re-armed.
+        
+        :param profile: ModemProfile or the name of a registered one.
+        :return: Number of SPI bursts written (0 if nothing changed).
+        :raises RuntimeError: If a send_nowait() transmission or cad_nowait()
+                              detection is in flight.
+        """
+        if self.tx_pending():
+            raise RuntimeError("Cannot change profile while transmitting")
+        if self.cad_pending():
+            raise RuntimeError("Cannot change profile during channel activity detection")
+        if isinstance(profile, str):
+            profile = self.profiles[profile]
+        image = profile.image
+        shadow = self.shadow
+        burst = self._burst
+        receiving = self._irq_rx_active
+        bursts = 0
+        for start, count in PROFILE_BLOCKS:
+            first = -1
+            for address in range(start, start + count):
+                if image[address] != shadow[address]:
+                    if first < 0:
+                        first = address
+                    last = address
+            if first < 0:
+                continue
+            if receiving and bursts == 0:
+                self.standby()
+            burst[0] = first | 0x80
+            length = 1
+            for address in range(first, last + 1):
+                burst[length] = shadow[address] = image[address]
+                length += 1
+            self._write_burst(length)
+            bursts += 1
+        self.parameters.update(profile.parameters)
+        self.implicit_header_mode = bool(profile.parameters["implicitHeader"])
+        if receiving and bursts:
+            self._arm_receive_irq()
+        return bursts
+    
     # ---------------------------
     # Low-Level SPI Methods
     # ---------------------------
@@ -531,34 +1358,127 @@ class ULoRa:
         :param address: Register address.
         :return: Value read.
         """
-        response = self.transfer(address & 0x7F)
-        return int.from_bytes(response, 'big')
+        return self.transfer(address & 0x7F)
     
     def write_register(self, address, value):
         """
-        Write a byte to the specified register.
+        Write a byte to the specified register, updating the shadow copy
+        if the register is shadowed.
         
         :param address: Register address.
         :param value: Value to write.
         """
         self.transfer(address | 0x80, value)
+        if self._shadowed[address]:
+            self.shadow[address] = value
+    
+    def update_register(self, address, value):
+        """
+        Write a shadowed register only if its value would change.
+        
+        :param address: Shadowed register address.
+        :param value: Value to write.
+        :return: True if an SPI write was made.
+        """
+        if self.read_shadow(address) == value:
+            return False
+        self.write_register(address, value)
+        return True
+    
+    def write_registers(self, pairs):
+        """
+        Write a sequence of registers. Runs of consecutive addresses are
+        sent as one SPI burst (the SX127x auto-increments the address)
+        from the preallocated burst buffer.
+        
+        :param pairs: Iterable of (address, value) tuples, written in order.
+        """
+        burst = self._burst
+        length = 0
+        next_address = -1
+        for address, value in pairs:
+            if length and address != next_address:
+                self._write_burst(length)
+                length = 0
+            if length == 0:
+                burst[0] = address | 0x80
+                length = 1
+            burst[length] = value
+            length += 1
+            if self._shadowed[address]:
+                self.shadow[address] = value
+            # The FIFO register does not auto-increment
+            next_address = address + 1 if address != REG_FIFO else -1
+        if length:
+            self._write_burst(length)
+    
+    def _write_burst(self, length):
+        """
+        Send the first length bytes of the burst buffer in one transaction.
+        """
+        self.pin_ss.value(0)
+        self.spi.write(self._burst_view[:length])
+        self.pin_ss.value(1)
     
     def transfer(self, address, value=0x00):
         """
-        Perform an SPI transfer.
+        Perform a single-register SPI transfer: address and value go out in
+        one write_readinto using preallocated buffers.
         
-        :param address: Register address.
+        :param address: Register address (bit 7 set for a write).
         :param value: Byte to write.
-        :return: Response as a bytearray.
+        :return: Register value clocked out during the value byte.
         """
-        response = bytearray(1)
+        tx = self._reg_tx
+        tx[0] = address
+        tx[1] = value
         self.pin_ss.value(0)
-        # Write the register address
-        self.spi.write(bytes([address]))
-        # Write the value and simultaneously read the response
-        self.spi.write_readinto(bytes([value]), response)
+        self.spi.write_readinto(tx, self._reg_rx)
         self.pin_ss.value(1)
-        return response
+        return self._reg_rx[1]
+    
+    # ---------------------------
+    # Register Shadow
+    # ---------------------------
+    def read_shadow(self, address):
+        """
+        Read a shadowed register from RAM instead of over SPI.
+        With verify_shadow set, the chip is read as well and any difference
+        raises, which catches writes that bypassed the driver.
+        
+        :param address: Shadowed register address.
+        :return: Last value written to (or resynced from) the register.
+        :raises RuntimeError: In verify mode, if the shadow is stale.
+        """
+        value = self.shadow[address]
+        if self.verify_shadow:
+            actual = self.read_register(address)
+            if actual != value:
+                raise RuntimeError("Shadow mismatch at 0x{:02X}: shadow 0x{:02X}, chip 0x{:02X}".format(
+                    address, value, actual))
+        return value
+    
+    def resync(self):
+        """
+        Reload the shadow from the chip, e.g. after a reset or after the
+        registers were written by other code.
+        """
+        for address in SHADOW_REGISTERS:
+            self.shadow[address] = self.read_register(address)
+        self.implicit_header_mode = bool(self.shadow[REG_MODEM_CONFIG_1] & 0x01)
+    
+    def check_shadow(self):
+        """
+        Compare every shadowed register with the chip.
+        
+        :return: List of (address, shadow value, chip value) for mismatches.
+        """
+        mismatches = []
+        for address in SHADOW_REGISTERS:
+            actual = self.read_register(address)
+            if actual != self.shadow[address]:
+                mismatches.append((address, self.shadow[address], actual))
+        return mismatches
     
     def dump_registers(self):
         """
@@ -573,6 +1493,6 @@ class ULoRa:
     
     def collect_garbage(self):
         """
-        Run garbage collection.
+        Run a full garbage collection now, regardless of the policy.
         """
-        gc.collect()
+        self.gc_policy.collect()
@@ -0,0 +1,425 @@
+# Reliable delivery over LoRaTransceiver: sequence numbers, ACK/NACK and a
+# sliding window
+#
+# Frames start with a marker byte whose high nibble (0xA) no telemetry frame
+# uses, so both can share the link. All fields are one byte:
+#
+#   DATA       0xA0 | flags, source, destination, seq[, session], payload...
+#              flags: MORE (another frame follows straight away), SYN (frame
+#              of a new session, carrying the session's first seq)
+#   ACK/NACK   0xA1 / 0xA2, source, destination, next expected seq, SACK bitmap
+#              (bit i set: seq next + 1 + i was received too)
+#
+# A sender keeps up to `window` frames in flight per peer and sends them
+# back to back, flagging all but the last with MORE. The receiver delivers
+# frames in order, drops duplicates, and answers each burst with one
+# cumulative ACK; if frames are missing it sends a NACK instead and the
+# sender retransmits just those at once. Frames nobody acknowledges are
+# retransmitted after an RTO adapted from the measured round-trip time
+# (RFC 6298, with Karn's rule and exponential backoff).
+#
+# The protocol is driven by poll(), which returns the next frame to send,
+# and handle(), which takes every received packet:
+#
+#     transport = ReliableTransport(node_id, on_receive=print)
+#     transport.send(peer, b"hello")
+#     asyncio.create_task(transport.run(radio))  # or CsmaTransmitter
+#     ... transport.handle(payload) for each radio.poll(raw=True)
+
+import random
+
+from utime import ticks_ms, ticks_add, ticks_diff
+
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+MARKER = 0xA0
+MARKER_MASK = 0xF0
+KIND_DATA = 0x00
+KIND_ACK = 0x01
+KIND_NACK = 0x02
+FLAG_MORE = 0x04
+FLAG_SYN = 0x08
+
+DATA_HEADER = 4
+SYN_HEADER = 5
+ACK_LENGTH = 5
+SACK_BITS = 8
+BROADCAST = 0xFF
+
+
+def seq_diff(a, b):
+    """
+    a - b for 8-bit sequence numbers, in -128..127.
+    """
+    return ((a - b + 128) & 0xFF) - 128
+
+
+def is_transport_frame(payload):
+    return len(payload) >= DATA_HEADER and payload[0] & MARKER_MASK == MARKER
+
+
+class _InFlight:
+    """A sent frame waiting for its acknowledgement."""
+    def __init__(self, payload, now):
+        self.payload = payload
+        self.first_ms = now
+        self.sent_ms = now
+        self.tries = 1
+
+
+class _Peer:
+    """Sender and receiver state for one remote node."""
+    def __init__(self, seq, rto_ms):
+        # Sending
+        self.next_seq = seq
+        self.session = seq
+        self.synced = False      # an ACK has been seen for this session
+        self.queue = []
+        self.inflight = {}       # seq -> _InFlight
+        self.resend = []         # seqs to retransmit now
+        self.srtt = 0
+        self.rttvar = 0
+        self.rto = rto_ms
+        # Receiving
+        self.rx_session = None
+        self.expected = None
+        self.buffer = {}         # out-of-order frames, seq -> payload
+        self.ack_due = False
+        self.ack_at = 0
+        self.ack_nack = False
+
+
+class ReliableTransport:
+    """
+    Reliable, in-order delivery of payloads to other nodes, as a protocol
+    state machine. It never touches the radio: poll() hands out frames and
+    handle() takes them in.
+    """
+    def __init__(self, node_id, window=4, max_retries=5, rto_ms=2000, min_rto_ms=200,
+                 max_rto_ms=30000, ack_delay_ms=300, queue_limit=16, on_receive=None,
+                 rng=None):
+        """
+        :param node_id: This node's id, 0-254.
+        :param window: Frames in flight per peer (at most SACK_BITS + 1).
+        :param max_retries: Retransmissions before a frame is given up and
+                            the peer's session restarted.
+        :param rto_ms: Retransmission timeout before the first RTT sample.
+        :param min_rto_ms: Lower bound on the adaptive timeout.
+        :param max_rto_ms: Upper bound, also for the backoff.
+        :param ack_delay_ms: How long a receiver waits for the rest of a
+                             burst (frames flagged MORE) before answering.
+        :param queue_limit: Payloads that can wait per peer.
+        :param on_receive: Called as on_receive(source, payload) in order.
+        :param rng: Object with getrandbits() for the initial sequence numbers.
+        """
+        self.node_id = node_id & 0xFF
+        self.window = min(window, SACK_BITS + 1)
+        self.max_retries = max_retries
+        self.initial_rto_ms = rto_ms
+        self.min_rto_ms = min_rto_ms
+        self.max_rto_ms = max_rto_ms
+        self.ack_delay_ms = ack_delay_ms
+        self.queue_limit = queue_limit
+        self.on_receive = on_receive
+        self.rng = rng or random
+        self.peers = {}
+        # Counters
+        self.sent = 0            # data frames transmitted, first tries
+        self.retransmits = 0
+        self.acked = 0
+        self.failed = 0
+        self.delivered = 0
+        self.duplicates = 0
+        self.acks_sent = 0
+        self.nacks_sent = 0
+        self.latency_total_ms = 0
+        self.latency_max_ms = 0
+
+    def _peer(self, node):
+        peer = self.peers.get(node)
+        if peer is None:
+            peer = self.peers[node] = _Peer(self.rng.getrandbits(8), self.initial_rto_ms)
+        return peer
+
+    # ---------------------------
+    # Sending
+    # ---------------------------
+    def send(self, destination, payload):
+        """
+        Queue a payload for reliable delivery.
+
+        :return: False if the peer's queue is full.
+        """
+        if destination == BROADCAST:
+            raise ValueError("reliable delivery needs a single destination")
+        peer = self._peer(destination)
+        if len(peer.queue) >= self.queue_limit:
+            return False
+        peer.queue.append(bytes(payload))
+        return True
+
+    def pending(self, destination=None):
+        """
+        :return: Payloads queued or unacknowledged, for one peer or all.
+        """
+        peers = self.peers.values() if destination is None else (self._peer(destination),)
+        return sum(len(p.queue) + len(p.inflight) for p in peers)
+
+    def poll(self, now=None):
+        """
+        :return: The next frame to transmit (bytes), or None if nothing is due.
+                 Acknowledgements go first, then retransmissions, then new data.
+        """
+        now = ticks_ms() if now is None else now
+        peers = self.peers
+        for node in peers:
+            peer = peers[node]
+            if peer.ack_due and ticks_diff(now, peer.ack_at) >= 0:
+                return self._ack_frame(node, peer)
+        for node in peers:
+            peer = peers[node]
+            self._check_timeouts(node, peer, now)
+            if peer.resend:
+                seq = peer.resend.pop(0)
+                frame = peer.inflight[seq]
+                frame.sent_ms = now
+                frame.tries += 1
+                self.retransmits += 1
+                return self._data_frame(node, peer, seq, frame.payload, bool(peer.resend))
+        for node in peers:
+            peer = peers[node]
+            if peer.queue and len(peer.inflight) < self.window:
+                seq = peer.next_seq
+                peer.next_seq = (seq + 1) & 0xFF
+                payload = peer.queue.pop(0)
+                peer.inflight[seq] = _InFlight(payload, now)
+                self.sent += 1
+                more = bool(peer.queue) and len(peer.inflight) < self.window
+                return self._data_frame(node, peer, seq, payload, more)
+        return None
+
+    def next_poll_ms(self, now=None):
+        """
+        :return: Milliseconds until poll() may have something to send
+                 (0 if now), or -1 if it is idle until send() or handle().
+        """
+        now = ticks_ms() if now is None else now
+        wait = -1
+        for peer in self.peers.values():
+            if peer.resend or (peer.queue and len(peer.inflight) < self.window):
+                return 0
+            due = []
+            if peer.ack_due:
+                due.append(ticks_diff(peer.ack_at, now))
+            for frame in peer.inflight.values():
+                due.append(ticks_diff(ticks_add(frame.sent_ms, peer.rto), now))
+            for d in due:
+                d = max(d, 0)
+                if wait < 0 or d < wait:
+                    wait = d
+        return wait
+
+    def _data_frame(self, node, peer, seq, payload, more):
+        flags = MARKER | KIND_DATA | (FLAG_MORE if more else 0)
+        if not peer.synced:
+            return bytes((flags | FLAG_SYN, self.node_id, node, seq, peer.session)) + payload
+        return bytes((flags, self.node_id, node, seq)) + payload
+
+    def _check_timeouts(self, node, peer, now):
+        expired = False
+        for seq in peer.inflight:
+            frame = peer.inflight[seq]
+            if ticks_diff(now, frame.sent_ms) >= peer.rto and seq not in peer.resend:
+                if frame.tries > self.max_retries:
+                    self._restart_session(peer)
+                    return
+                expired = True
+        if expired:
+            # No ACK covered the oldest frame, so none came for the frames
+            # after it either: resend them all as one burst, and back off as
+            # the link or the peer is slower than we thought
+            self._resend_all(peer)
+            peer.rto = min(peer.rto * 2, self.max_rto_ms)
+
+    def _restart_session(self, peer):
+        """
+        Give up on everything in flight and start a new session, so the
+        receiver skips the frames it will never get.
+        """
+        self.failed += len(peer.inflight)
+        peer.inflight = {}
+        peer.resend = []
+        peer.session = peer.next_seq
+        peer.synced = False
+        peer.rto = self.initial_rto_ms
+
+    def _on_ack(self, peer, expected, bitmap, nack, now):
+        peer.synced = True
+        sample = None
+        sample_sent = None
+        progress = False
+        for seq in list(peer.inflight):
+            d = seq_diff(seq, expected)
+            if d < 0 or (0 < d <= SACK_BITS and bitmap >> (d - 1) & 1):
+                frame = peer.inflight.pop(seq)
+                progress = True
+                if seq in peer.resend:
+                    peer.resend.remove(seq)
+                latency = ticks_diff(now, frame.first_ms)
+                self.acked += 1
+                self.latency_total_ms += latency
+                self.latency_max_ms = max(self.latency_max_ms, latency)
+                # Karn's rule: only frames sent once give an RTT sample. The
+                # oldest one waited for the whole burst, as the timer must
+                if frame.tries == 1 and (sample_sent is None or ticks_diff(frame.sent_ms, sample_sent) < 0):
+                    sample = ticks_diff(now, frame.sent_ms)
+                    sample_sent = frame.sent_ms
+        if sample is not None:
+            self._update_rto(peer, sample)
+        elif progress and peer.srtt:
+            # Only retransmitted frames were acknowledged: no sample, but the
+            # link works again, so drop the backoff
+            peer.rto = self._rto(peer)
+        if nack:
+            # Everything still unacknowledged was missed: retransmit it now
+            self._resend_all(peer)
+
+    def _resend_all(self, peer):
+        for seq in peer.inflight:
+            if seq not in peer.resend:
+                peer.resend.append(seq)
+        peer.resend.sort(key=lambda s: seq_diff(s, peer.session))
+
+    def _update_rto(self, peer, rtt):
+        if peer.srtt == 0:
+            peer.srtt = rtt
+            peer.rttvar = rtt // 2
+        else:
+            peer.rttvar = (3 * peer.rttvar + abs(peer.srtt - rtt)) // 4
+            peer.srtt = (7 * peer.srtt + rtt) // 8
+        peer.rto = self._rto(peer)
+
+    def _rto(self, peer):
+        # min_rto_ms also floors the variance term (RFC 6298's clock
+        # granularity): on a steady link rttvar decays to nothing, and an
+        # ACK that is one CAD backoff late would trigger a resend
+        return min(peer.srtt + max(4 * peer.rttvar, self.min_rto_ms), self.max_rto_ms)
+
+    # ---------------------------
+    # Receiving
+    # ---------------------------
+    def handle(self, payload, now=None):
+        """
+        Process a received packet.
+
+        :return: True if it was a transport frame (for this node or not),
+                 False if it is something else, e.g. telemetry.
+        """
+        if not is_transport_frame(payload):
+            return False
+        kind = payload[0] & 0x03
+        source = payload[1]
+        if payload[2] != self.node_id:
+            return True
+        now = ticks_ms() if now is None else now
+        peer = self._peer(source)
+        if kind == KIND_DATA:
+            self._on_data(source, peer, payload, now)
+        elif len(payload) >= ACK_LENGTH:
+            self._on_ack(peer, payload[3], payload[4], kind == KIND_NACK, now)
+        return True
+
+    def _on_data(self, source, peer, payload, now):
+        flags = payload[0]
+        seq = payload[3]
+        start = DATA_HEADER
+        if flags & FLAG_SYN:
+            if len(payload) < SYN_HEADER:
+                return
+            start = SYN_HEADER
+            if payload[4] != peer.rx_session:
+                # The sender (re)started: begin at its session's first frame
+                peer.rx_session = payload[4]
+                peer.expected = payload[4]
+                peer.buffer = {}
+        if peer.expected is None:
+            peer.expected = seq
+        d = seq_diff(seq, peer.expected)
+        if d < 0 or seq in peer.buffer:
+            # Our ACK was lost: answer again, after the rest of the burst
+            self.duplicates += 1
+            self._ack_later(peer, now, self.ack_delay_ms if flags & FLAG_MORE else 0, False)
+            return
+        if d > SACK_BITS:
+            return  # beyond what an ACK can describe
+        peer.buffer[seq] = payload[start:]
+        while peer.expected in peer.buffer:
+            data = peer.buffer.pop(peer.expected)
+            peer.expected = (peer.expected + 1) & 0xFF
+            self.delivered += 1
+            if self.on_receive:
+                self.on_receive(source, data)
+        if flags & FLAG_MORE:
+            # Answer once the burst is over, or if its rest never comes
+            self._ack_later(peer, now, self.ack_delay_ms, True)
+        else:
+            self._ack_later(peer, now, 0, bool(peer.buffer))
+
+    def _ack_later(self, peer, now, delay_ms, nack):
+        at = ticks_add(now, delay_ms)
+        if not peer.ack_due or ticks_diff(at, peer.ack_at) < 0 or delay_ms:
+            peer.ack_at = at
+        peer.ack_due = True
+        peer.ack_nack = nack
+
+    def _ack_frame(self, node, peer):
+        peer.ack_due = False
+        bitmap = 0
+        for seq in peer.buffer:
+            d = seq_diff(seq, peer.expected) - 1
+            if 0 <= d < SACK_BITS:
+                bitmap |= 1 << d
+        nack = peer.ack_nack or bool(peer.buffer)
+        if nack:
+            self.nacks_sent += 1
+        else:
+            self.acks_sent += 1
+        return bytes((MARKER | (KIND_NACK if nack else KIND_ACK), self.node_id, node,
+                      peer.expected, bitmap))
+
+    # ---------------------------
+    # Driving a radio
+    # ---------------------------
+    async def run(self, radio, period_ms=10):
+        """
+        Send whatever poll() hands out with radio.send_async(), e.g. a
+        LoRaTransceiver or CsmaTransmitter. Received packets still have to
+        be passed to handle().
+        """
+        while True:
+            frame = self.poll()
+            if frame is None:
+                await asyncio.sleep(period_ms / 1000)
+            else:
+                await radio.send_async(frame)
+
+    def rto_ms(self, destination):
+        """
+        :return: Current retransmission timeout towards a peer, in ms.
+        """
+        return self._peer(destination).rto
+
+    def stats(self):
+        """
+        :return: Dict of frames sent and retransmitted, payloads acknowledged,
+                 failed, delivered and duplicated, ACKs and NACKs sent, and
+                 the mean and worst delivery latency (first send to ACK).
+        """
+        return {"sent": self.sent, "retransmits": self.retransmits, "acked": self.acked,
+                "failed": self.failed, "delivered": self.delivered,
+                "duplicates": self.duplicates, "acks": self.acks_sent, "nacks": self.nacks_sent,
+                "latency_ms": self.latency_total_ms // self.acked if self.acked else 0,
+                "latency_max_ms": self.latency_max_ms}
@@ -0,0 +1,157 @@
+# Binary framing for packets a receiver board forwards to a host over serial
+#
+# Each received LoRa packet goes out as one frame, little-endian:
+#
+#   2s  sync        0xA5 0x5A
+#   H   length      of the body
+#   body
+#     I   timestamp   ticks_ms on the board when the packet was read (wraps)
+#     h   rssi        dBm
+#     h   snr         quarter dB
+#         payload...
+#   H   crc         CRC-16/CCITT-FALSE of length and body
+#
+# The sync word and CRC let the host skip anything else on the same stream,
+# e.g. print() output on the USB console, and resynchronise after lost or
+# corrupted bytes.
+#
+#     writer = FrameWriter(sys.stdout.buffer)
+#     writer.write(payload, rssi, snr)
+#
+#     decoder = FrameDecoder()
+#     for timestamp, rssi, snr, payload in decoder.feed(data): ...
+
+import struct
+
+from utime import ticks_ms
+
+SYNC = b"\xa5\x5a"
+HEAD_SIZE = 4
+BODY_HEADER = 8
+CRC_SIZE = 2
+MAX_PAYLOAD = 255
+MAX_BODY = BODY_HEADER + MAX_PAYLOAD
+MAX_FRAME = HEAD_SIZE + MAX_BODY + CRC_SIZE
+
+
+def _table():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = (crc << 1 ^ 0x1021 if crc & 0x8000 else crc << 1) & 0xFFFF
+        table.append(crc)
+    return table
+
+
+_TABLE = _table()
+
+
+def _crc16(data, crc=0xFFFF):
+    table = _TABLE
+    for byte in data:
+        crc = (crc << 8 & 0xFF00) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+try:
+    from binascii import crc_hqx
+
+    def crc16(data):
+        return crc_hqx(data, 0xFFFF)
+except ImportError:
+    crc16 = _crc16
+
+
+class FrameWriter:
+    """
+    Writes frames to a stream (sys.stdout.buffer, a UART) from a single
+    preallocated buffer.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.buf = bytearray(MAX_FRAME)
+        self._view = memoryview(self.buf)
+        self.buf[0:2] = SYNC
+        self.frames = 0
+
+    def encode(self, payload, rssi, snr, timestamp_ms=None):
+        """
+        :return: The frame, as a memoryview valid until the next encode().
+        """
+        length = len(payload)
+        if length > MAX_PAYLOAD:
+            raise ValueError("payload of {} bytes is too long".format(length))
+        if timestamp_ms is None:
+            timestamp_ms = ticks_ms()
+        buf = self.buf
+        end = HEAD_SIZE + BODY_HEADER + length
+        struct.pack_into("<HIhh", buf, 2, BODY_HEADER + length, timestamp_ms & 0xFFFFFFFF,
+                         int(rssi), int(snr * 4))
+        buf[HEAD_SIZE + BODY_HEADER:end] = payload
+        struct.pack_into("<H", buf, end, crc16(self._view[2:end]))
+        return self._view[:end + CRC_SIZE]
+
+    def write(self, payload, rssi, snr, timestamp_ms=None):
+        """
+        Encode one packet and write it out.
+        """
+        self.stream.write(self.encode(payload, rssi, snr, timestamp_ms))
+        self.frames += 1
+
+
+class FrameDecoder:
+    """
+    Incremental frame parser: feed() takes whatever the stream delivered and
+    returns the frames completed by it. Bytes that are not part of a valid
+    frame are skipped and counted.
+    """
+    def __init__(self):
+        self.buf = bytearray()
+        self.frames = 0
+        self.crc_errors = 0
+        self.skipped = 0     # bytes discarded outside frames
+
+    def feed(self, data):
+        """
+        :return: List of (timestamp ms, rssi dBm, snr dB, payload bytes).
+        """
+        buf = self.buf
+        buf += data
+        size = len(buf)
+        frames = []
+        pos = 0
+        while True:
+            start = buf.find(SYNC, pos)
+            if start < 0:
+                # Keep a trailing half of the sync word for the next feed
+                keep = size - 1 if size > pos and buf[size - 1] == SYNC[0] else size
+                self.skipped += keep - pos
+                pos = keep
+                break
+            self.skipped += start - pos
+            pos = start
+            if start + HEAD_SIZE > size:
+                break
+            length = buf[start + 2] | buf[start + 3] << 8
+            if length < BODY_HEADER or length > MAX_BODY:
+                self.skipped += 1
+                pos = start + 1
+                continue
+            end = start + HEAD_SIZE + length
+            if end + CRC_SIZE > size:
+                break
+            if crc16(buf[start + 2:end]) != buf[end] | buf[end + 1] << 8:
+                self.crc_errors += 1
+                self.skipped += 1
+                pos = start + 1
+                continue
+            timestamp, rssi, snr = struct.unpack_from("<Ihh", buf, start + HEAD_SIZE)
+            frames.append((timestamp, rssi, snr / 4, bytes(buf[start + HEAD_SIZE + BODY_HEADER:end])))
+            pos = end + CRC_SIZE
+        del buf[:pos]
+        self.frames += len(frames)
+        return frames
+
+    def stats(self):
+        return {"frames": self.frames, "crc_errors": self.crc_errors, "skipped": self.skipped}
@@ -0,0 +1,499 @@
+# TDMA for LoRaTransceiver: beacon time sync and one TX slot per egg
+#
+# A gateway broadcasts a beacon every frame. The end of the beacon (TxDone
+# at the gateway, RxDone at every egg, the same instant to within the
+# propagation delay) starts the frame; the frame is then cut into slots and
+# egg `id` from config.json transmits only in slot id. Ids must be unique
+# and below the number of slots: an egg whose id has no slot refuses to send
+# rather than share another egg's. The beacon itself goes out in the tail of
+# the frame, after the last slot.
+#
+#   B  0x80
+#   B  sequence
+#   I  gateway ticks_us at TxDone of the previous beacon (little-endian)
+#   H  frame length, ms
+#   H  slot length, ms
+#   B  guard time, ms
+#
+# Each beacon thus pairs the previous beacon's RxDone on the egg's clock
+# with its TxDone on the gateway's, which ClockSync turns into the offset
+# and drift between the two. With the drift known, an egg keeps its slot
+# through a few missed beacons, and the slots late in a frame land where
+# the gateway expects them.
+#
+#     tdma = TdmaScheduler(radio, config["id"])
+#     radio.start_listening(callback=tdma.on_packet)
+#     ...
+#     tdma.handle(payload)                  # every packet polled from radio
+#     await tdma.send_async(b"hello")       # waits for this egg's slot
+#
+# and on the gateway:
+#
+#     beacon = TdmaBeacon(radio, frame_ms=10000)
+#     radio.start_listening(callback=beacon.on_packet)
+#     await beacon.run()
+
+import struct
+
+from utime import ticks_us, ticks_add, ticks_diff
+
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+BEACON = 0x80
+BEACON_FORMAT = "<BBIHHB"
+BEACON_LENGTH = struct.calcsize(BEACON_FORMAT)
+
+# States of a non-blocking send
+IDLE = 0
+WAIT = 1
+TX = 2
+
+
+def slot_ms_for(radio, payload_length, guard_ms):
+    """
+    :return: Slot length fitting a packet of payload_length bytes between
+             two guard times, with a third guard time of leeway for the
+             main loop to start it late.
+    """
+    return -(-(radio.airtime_us(payload_length) + 3 * guard_ms * 1000) // 1000)
+
+
+def beacon_tail_us(radio, guard_us):
+    """
+    :return: Length of the frame tail kept free for the next beacon.
+    """
+    return radio.airtime_us(BEACON_LENGTH) + guard_us
+
+
+class ClockSync:
+    """
+    Maps a local ticks_us clock onto a reference clock from pairs of
+    timestamps of the same instant. Keeps the latest pair as the offset and
+    a smoothed drift in parts per billion (positive: the local clock runs
+    fast).
+    """
+    def __init__(self, smoothing=4):
+        """
+        :param smoothing: Weight 1/smoothing of each new drift sample.
+        """
+        self.smoothing = smoothing
+        self.local_us = None
+        self.reference_us = None
+        self.drift_ppb = 0
+        self.samples = 0
+        # Prediction error over one interval, once the drift is estimated
+        self.error_us = 0
+        self.max_error_us = 0
+        self._error_sum = 0
+        self._errors = 0
+
+    @property
+    def synced(self):
+        return self.local_us is not None
+
+    def update(self, local_us, reference_us):
+        """
+        Add a pair of timestamps of the same instant.
+        """
+        if self.local_us is not None:
+            reference = ticks_diff(reference_us, self.reference_us)
+            local = ticks_diff(local_us, self.local_us)
+            if reference > 0:
+                if self.samples:
+                    # How far off the model was, before learning from it
+                    error = local - self.scale(reference)
+                    self.error_us = error
+                    self.max_error_us = max(self.max_error_us, abs(error))
+                    self._error_sum += abs(error)
+                    self._errors += 1
+                drift = (local - reference) * 1000000000 // reference
+                if self.samples:
+                    drift = self.drift_ppb + (drift - self.drift_ppb) // self.smoothing
+                self.drift_ppb = drift
+                self.samples += 1
+        self.local_us = local_us
+        self.reference_us = reference_us
+
+    def scale(self, reference_us):
+        """
+        :return: A reference clock interval in local microseconds.
+        """
+        return reference_us + reference_us * self.drift_ppb // 1000000000
+
+    def to_local(self, reference_us):
+        """
+        :return: The local ticks_us at a reference clock time.
+        """
+        return ticks_add(self.local_us, self.scale(ticks_diff(reference_us, self.reference_us)))
+
+    def to_reference(self, local_us):
+        """
+        :return: The reference clock time at a local ticks_us.
+        """
+        local = ticks_diff(local_us, self.local_us)
+        return ticks_add(self.reference_us, local - local * self.drift_ppb // 1000000000)
+
+    def mean_error_us(self):
+        return self._error_sum // self._errors if self._errors else 0
+
+
+class TdmaBeacon:
+    """
+    Gateway side: sends a beacon every frame and counts which slots the
+    packets it hears arrive in.
+    """
+    def __init__(self, radio, frame_ms=10000, slot_ms=None, guard_ms=5, payload_length=32,
+                 clock=ticks_us):
+        """
+        :param radio: LoRaTransceiver to send with.
+        :param frame_ms: Time between beacons.
+        :param slot_ms: Slot length. None fits a packet of payload_length
+                        bytes, see slot_ms_for().
+        :param guard_ms: Margin either side of a packet in its slot, for
+                         sync error and interrupt latency.
+        :param payload_length: Longest packet the default slot must fit.
+        :param clock: Microsecond tick source, for simulation.
+        """
+        self.radio = radio
+        self.clock = clock
+        guard_us = guard_ms * 1000
+        if slot_ms is None:
+            slot_ms = slot_ms_for(radio, payload_length, guard_ms)
+        self.frame_ms = frame_ms
+        self.slot_ms = slot_ms
+        self.guard_ms = guard_ms
+        self.slots = (frame_ms * 1000 - beacon_tail_us(radio, guard_us)) // (slot_ms * 1000)
+        if self.slots < 1:
+            raise ValueError("frame of {} ms has no room for a {} ms slot".format(frame_ms, slot_ms))
+        self.seq = 0
+        self._sending = False
+        self._done_us = 0            # TxDone of the last beacon: start of this frame
+        self._next_us = clock()
+        self._used = bytearray(self.slots)
+        # Counters
+        self.beacons = 0
+        self.failed = 0
+        self.frames = 0              # frames closed, for utilisation
+        self.received = 0
+        self.in_slot = 0             # packets that fell inside a slot
+        self.slots_used = 0          # (frame, slot) pairs that carried a packet
+
+    def pending(self):
+        """
+        Send the beacon once it is due.
+
+        :return: Milliseconds until the next beacon is due.
+        """
+        if not self._sending and ticks_diff(self.clock(), self._next_us) >= 0:
+            payload = struct.pack(BEACON_FORMAT, BEACON, self.seq, self._done_us & 0xFFFFFFFF,
+                                  self.frame_ms, self.slot_ms, self.guard_ms)
+            self._sending = True
+            try:
+                self.radio.send(payload, wait=False, callback=self._on_sent)
+            except Exception:
+                self._on_sent(False)
+        return max(ticks_diff(self._next_us, self.clock()), 0) // 1000
+
+    async def run(self):
+        """
+        Beacon task for the gateway's asyncio loop.
+        """
+        while True:
+            await asyncio.sleep(max(self.pending(), 1) / 1000)
+
+    def _on_sent(self, ok):
+        # Runs from the DIO0 interrupt: stamp first
+        now = self.clock()
+        self._sending = False
+        if not ok:
+            self.failed += 1
+            self._next_us = ticks_add(now, self.frame_ms * 100)
+            return
+        self.beacons += 1
+        if self.beacons > 1:
+            self._close_frame()
+        self.seq = (self.seq + 1) & 0xFF
+        self._done_us = now
+        # Start the next beacon so that it ends one frame from now
+        self._next_us = ticks_add(now, self.frame_ms * 1000 - self.radio.airtime_us(BEACON_LENGTH))
+
+    def _close_frame(self):
+        used = self._used
+        self.frames += 1
+        for i in range(self.slots):
+            if used[i]:
+                self.slots_used += 1
+                used[i] = 0
+
+    def slot_at(self, local_us):
+        """
+        :return: Slot a time falls in, or -1 outside the slots (before the
+                 first beacon, or in the beacon's tail).
+        """
+        if not self.beacons:
+            return -1
+        offset = ticks_diff(local_us, self._done_us)
+        slot = offset // (self.slot_ms * 1000)
+        return slot if 0 <= slot < self.slots else -1
+
+    def on_packet(self, payload):
+        """
+        Receive callback for radio.start_listening(): counts the slot a
+        packet ended in.
+        """
+        slot = self.slot_at(self.clock())
+        self.received += 1
+        if slot >= 0:
+            self.in_slot += 1
+            self._used[slot] = 1
+
+    def stats(self):
+        """
+        :return: Dict of beacons sent and failed, the slot layout, packets
+                 received, the fraction of them that fell inside a slot and
+                 the fraction of slots carrying a packet (utilisation).
+        """
+        return {"beacons": self.beacons, "failed": self.failed, "slots": self.slots,
+                "slot_ms": self.slot_ms, "received": self.received,
+                "in_slot": self.in_slot / self.received if self.received else 0.0,
+                "utilisation": self.slots_used / (self.frames * self.slots) if self.frames else 0.0}
+
+
+class TdmaScheduler:
+    """
+    Egg side: follows the gateway's beacons and sends each message in this
+    egg's slot. One message is in flight at a time, as with
+    CsmaTransmitter, whose non-blocking interface this mirrors.
+    """
+    def __init__(self, radio, node_id, max_missed=3, clock=ticks_us):
+        """
+        :param radio: LoRaTransceiver to send with.
+        :param node_id: This egg's id, which is also its slot; an id at or
+                        above the frame's slot count gets no slot.
+        :param max_missed: Beacons that may be missed in a row before the
+                           egg stops sending until it hears one again.
+        :param clock: Microsecond tick source, for simulation.
+        """
+        self.radio = radio
+        self.node_id = node_id
+        self.max_missed = max_missed
+        self.clock = clock
+        self.sync = ClockSync()
+        self.frame_us = 0
+        self.slot_us = 0
+        self.guard_us = 0
+        self.slots = 0
+        self.slot = -1
+        self._frame_start = None     # local RxDone of the last beacon
+        self._seq = None
+        self._stamp_us = 0           # RxDone of the beacon being handled
+        self._stamp_seq = -1
+        self._state = IDLE
+        self._message = None
+        self._callback = None
+        self._timeout = None
+        self._queued_us = 0
+        # Counters
+        self.beacons = 0
+        self.missed = 0
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0             # messages too long for a slot
+        self.refused = 0             # messages refused: node id has no slot
+        self.wait_us = 0             # time messages waited for their slot
+
+    @property
+    def synced(self):
+        """
+        True while the last beacon is recent enough to send on.
+        """
+        if self._frame_start is None:
+            return False
+        age = ticks_diff(self.clock(), self._frame_start)
+        return age < (self.max_missed + 1) * self.sync.scale(self.frame_us)
+
+    # ---------------------------
+    # Beacons
+    # ---------------------------
+    def on_packet(self, payload):
+        """
+        Receive callback for radio.start_listening(): timestamps beacons as
+        close to RxDone as the interrupt allows.
+        """
+        if len(payload) == BEACON_LENGTH and payload[0] == BEACON:
+            self._stamp_us = self.clock()
+            self._stamp_seq = payload[1]
+
+    def handle(self, payload):
+        """
+        Feed a packet polled from the radio.
+
+        :return: True if it was a beacon (and so not for the application).
+        """
+        if len(payload) != BEACON_LENGTH or payload[0] != BEACON:
+            return False
+        _, seq, done_us, frame_ms, slot_ms, guard_ms = struct.unpack(BEACON_FORMAT, payload)
+        if seq != self._stamp_seq:
+            return True  # no timestamp for it
+        self._stamp_seq = -1
+        stamp = self._stamp_us
+        if self._seq is not None:
+            gap = (seq - self._seq) & 0xFF
+            if gap == 1:
+                # done_us is the previous beacon's TxDone, which we stamped
+                self.sync.update(self._frame_start, done_us)
+            else:
+                self.missed += gap - 1
+        self.beacons += 1
+        self._seq = seq
+        self._frame_start = stamp
+        self.frame_us = frame_ms * 1000
+        self.slot_us = slot_ms * 1000
+        self.guard_us = guard_ms * 1000
+        self.slots = (self.frame_us - beacon_tail_us(self.radio, self.guard_us)) // self.slot_us
+        # Wrapping the id would put this egg in another egg's slot
+        self.slot = self.node_id if 0 <= self.node_id < self.slots else -1
+        return True
+
+    def network_time_us(self, local_us=None):
+        """
+        :return: The gateway's ticks_us now (or at local_us), or None before
+                 two consecutive beacons have been heard.
+        """
+        if not self.sync.synced:
+            return None
+        return self.sync.to_reference(self.clock() if local_us is None else local_us)
+
+    def next_slot_us(self, length, now=None):
+        """
+        :param length: Payload length in bytes.
+        :return: Local ticks_us at which a packet of this length can next
+                 start in this egg's slot, or None if not synced or it does
+                 not fit a slot.
+        """
+        if not self.synced or self.slot < 0:
+            return None
+        window = self.slot_us - 2 * self.guard_us - self.radio.airtime_us(length)
+        if window < 0:
+            return None
+        now = self.clock() if now is None else now
+        sync = self.sync
+        frame = sync.scale(self.frame_us)
+        start = ticks_add(self._frame_start, sync.scale(self.slot * self.slot_us + self.guard_us))
+        late = ticks_diff(now, start) - sync.scale(window)
+        if late > 0:
+            start = ticks_add(start, (late // frame + 1) * frame)
+        return start
+
+    # ---------------------------
+    # Non-blocking
+    # ---------------------------
+    def send_nowait(self, message, callback=None, timeout=None):
+        """
+        Queue a message for this egg's next slot and return immediately;
+        pending() sends it once the slot starts.
+
+        :param callback: Optional function called as callback(ok) once the
+                         message is sent (True), or failed, dropped as too
+                         long for a slot or refused as this egg has no slot
+                         (False).
+        :param timeout: Optional TX timeout in milliseconds.
+        """
+        if self._state != IDLE:
+            raise RuntimeError("TDMA send already in progress")
+        if isinstance(message, str):
+            message = message.encode()
+        self._message = message
+        self._callback = callback
+        self._timeout = timeout
+        self._queued_us = self.clock()
+        self._state = WAIT
+        self.pending()
+
+    def pending(self):
+        """
+        Drive a non-blocking send: start it once this egg's slot begins.
+
+        :return: True while the message is neither sent nor given up.
+        """
+        if self._state == WAIT:
+            now = self.clock()
+            if self.synced and self.slot_us and \
+                    self.radio.airtime_us(self._message) > self.slot_us - 2 * self.guard_us:
+                self.dropped += 1
+                self._finish(None)
+                return False
+            if self.synced and self.slot < 0:
+                self.refused += 1
+                self._finish(None)
+                return False
+            start = self.next_slot_us(len(self._message), now)
+            if start is not None and ticks_diff(now, start) >= 0:
+                self._state = TX
+                self.wait_us += ticks_diff(now, self._queued_us)
+                try:
+                    self.radio.send(self._message, wait=False, callback=self._finish,
+                                    timeout=self._timeout)
+                except Exception:
+                    self._finish(False)
+        elif self._state == TX:
+            self.radio.tx_busy()
+        return self._state != IDLE
+
+    def retry_in_ms(self):
+        """
+        :return: Milliseconds until this egg's slot starts while a message
+                 waits for it (100 while out of sync), 0 otherwise.
+        """
+        if self._state != WAIT:
+            return 0
+        start = self.next_slot_us(len(self._message))
+        if start is None:
+            return 100
+        return -(-max(ticks_diff(start, self.clock()), 0) // 1000)
+
+    async def send_async(self, message, timeout=None):
+        """
+        Awaitable send: waits for duty-cycle budget and this egg's slot,
+        yielding to other tasks, then sends.
+
+        :return: True if the message was sent.
+        """
+        if isinstance(message, str):
+            message = message.encode()
+        await self.radio.wait_for_budget(message)
+        result = []
+        self.send_nowait(message, result.append, timeout)
+        while self.pending():
+            await asyncio.sleep(min(self.retry_in_ms(), 100) / 1000 or 0.001)
+        self.radio.lora.gc_policy.packet()
+        return bool(result and result[0])
+
+    def _finish(self, ok):
+        if ok:
+            self.sent += 1
+        elif ok is not None:
+            self.failed += 1
+        self._state = IDLE
+        self._message = None
+        callback = self._callback
+        self._callback = None
+        if callback:
+            callback(bool(ok))
+
+    def stats(self):
+        """
+        :return: Dict of this egg's slot, beacons heard and missed, the
+                 estimated drift (ppm) and sync error over a frame (mean and
+                 worst, us), messages sent, failed, dropped and refused
+                 for want of a slot, and the mean wait for a slot in ms.
+        """
+        sync = self.sync
+        return {"slot": self.slot, "beacons": self.beacons, "missed": self.missed,
+                "drift_ppm": sync.drift_ppb / 1000, "sync_error_us": sync.mean_error_us(),
+                "max_sync_error_us": sync.max_error_us, "sent": self.sent,
+                "failed": self.failed, "dropped": self.dropped, "refused": self.refused,
+                "wait_ms": self.wait_us // 1000 // self.sent if self.sent else 0}
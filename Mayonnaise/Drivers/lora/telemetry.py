@@ -0,0 +1,190 @@
+# Compact binary telemetry frames for the egg LoRa link
+#
+# Every frame starts with a 5 byte header, followed by the optional sections
+# named in its flags, in flag order. All fields are little-endian.
+#
+#   header     B  version << 4 | type
+#              B  node id
+#              H  sequence number (wraps)
+#              B  flags
+#   RANGES     B  mask of base stations present, then H per present station:
+#                 range in mm (0xFFFF = beyond 65.534 m)
+#   POSITION   h h  x, y in cm
+#   POSITION_Z h    z in cm
+#   LINK       b  RSSI of the last packet heard, dBm
+#              b  its SNR in quarter dB
+#   BATTERY    H  millivolts
+#
+# A TEXT frame carries UTF-8 text after the header (and any sections).
+# A receiver ignores frames with a version it does not know.
+
+import struct
+
+VERSION = 1
+
+TYPE_PING = 1
+TYPE_TELEMETRY = 2
+TYPE_TEXT = 3
+TYPE_NAMES = {TYPE_PING: "P", TYPE_TELEMETRY: "T", TYPE_TEXT: "X"}
+
+FLAG_RANGES = 0x01
+FLAG_POSITION = 0x02
+FLAG_POSITION_Z = 0x04
+FLAG_LINK = 0x08
+FLAG_BATTERY = 0x10
+
+HEADER_FORMAT = '<BBHB'
+HEADER_SIZE = 5
+MAX_STATIONS = 8
+RANGE_BEYOND = 0xFFFF
+
+
+def _clamp(value, low, high):
+    return low if value < low else high if value > high else value
+
+
+class TelemetryEncoder:
+    """
+    Builds frames for one node into a single preallocated buffer. encode()
+    returns a memoryview of that buffer, valid until the next encode();
+    copy it with bytes() to queue it.
+    """
+    def __init__(self, node_id, size=64):
+        self.node_id = node_id & 0xFF
+        self.seq = 0
+        self.buf = bytearray(size)
+        self._view = memoryview(self.buf)
+
+    def encode(self, type=TYPE_TELEMETRY, ranges=None, range_scale=1, position=None,
+               rssi=None, snr=None, battery_mv=None, text=None):
+        """
+        :param ranges: Range per base station, 0 or None if not visible.
+        :param range_scale: Multiplier from ranges to mm, e.g. 1000 for metres.
+        :param position: (x, y) or (x, y, z) in metres.
+        :param rssi: RSSI in dBm of the last packet heard (needs snr too).
+        :param snr: Its SNR in dB.
+        :param battery_mv: Battery voltage in millivolts.
+        :param text: str or bytes appended after the sections.
+        :return: memoryview of the encoded frame.
+        """
+        buf = self.buf
+        flags = 0
+        n = HEADER_SIZE
+        if ranges is not None:
+            flags |= FLAG_RANGES
+            mask_at = n
+            n += 1
+            mask = 0
+            for i in range(min(len(ranges), MAX_STATIONS)):
+                r = ranges[i]
+                if r:
+                    mask |= 1 << i
+                    struct.pack_into('<H', buf, n, _clamp(int(r * range_scale + 0.5), 1, RANGE_BEYOND))
+                    n += 2
+            buf[mask_at] = mask
+        if position is not None:
+            flags |= FLAG_POSITION
+            struct.pack_into('<hh', buf, n, _clamp(int(round(position[0] * 100)), -32768, 32767),
+                             _clamp(int(round(position[1] * 100)), -32768, 32767))
+            n += 4
+            if len(position) > 2:
+                flags |= FLAG_POSITION_Z
+                struct.pack_into('<h', buf, n, _clamp(int(round(position[2] * 100)), -32768, 32767))
+                n += 2
+        if rssi is not None and snr is not None:
+            flags |= FLAG_LINK
+            struct.pack_into('<bb', buf, n, _clamp(int(rssi), -128, 127),
+                             _clamp(int(round(snr * 4)), -128, 127))
+            n += 2
+        if battery_mv is not None:
+            flags |= FLAG_BATTERY
+            struct.pack_into('<H', buf, n, _clamp(int(battery_mv), 0, 0xFFFF))
+            n += 2
+        if text is not None:
+            if isinstance(text, str):
+                text = text.encode()
+            if n + len(text) > len(buf):
+                raise ValueError("telemetry frame too long")
+            buf[n:n + len(text)] = text
+            n += len(text)
+        struct.pack_into(HEADER_FORMAT, buf, 0, VERSION << 4 | type, self.node_id, self.seq, flags)
+        self.seq = (self.seq + 1) & 0xFFFF
+        return self._view[:n]
+
+
+class Telemetry:
+    """A decoded frame. Fields of sections the frame did not carry are None."""
+    def __init__(self, type, node, seq):
+        self.type = type
+        self.node = node
+        self.seq = seq
+        self.ranges = None      # list of MAX_STATIONS ranges in mm, None if not visible
+        self.position = None    # tuple in metres
+        self.rssi = None
+        self.snr = None
+        self.battery_mv = None
+        self.text = None
+
+    def describe(self):
+        """Short summary for small displays, e.g. 'T3#42'."""
+        return "{}{}#{}".format(TYPE_NAMES.get(self.type, "?"), self.node, self.seq)
+
+    def as_dict(self):
+        return {"type": self.type, "node": self.node, "seq": self.seq, "ranges": self.ranges,
+                "position": self.position, "rssi": self.rssi, "snr": self.snr,
+                "battery_mv": self.battery_mv, "text": self.text}
+
+    def __repr__(self):
+        return "Telemetry({})".format(self.as_dict())
+
+
+def decode(payload):
+    """
+    Decode a frame. Returns a Telemetry, or None if payload is not a frame
+    of a known version (e.g. a legacy text packet) or is truncated.
+    """
+    if len(payload) < HEADER_SIZE:
+        return None
+    version_type, node, seq, flags = struct.unpack_from(HEADER_FORMAT, payload, 0)
+    if version_type >> 4 != VERSION or not version_type & 0x0F:
+        return None
+    frame = Telemetry(version_type & 0x0F, node, seq)
+    n = HEADER_SIZE
+    try:
+        if flags & FLAG_RANGES:
+            mask = payload[n]
+            n += 1
+            ranges = [None] * MAX_STATIONS
+            for i in range(MAX_STATIONS):
+                if mask & (1 << i):
+                    ranges[i] = struct.unpack_from('<H', payload, n)[0]
+                    n += 2
+            frame.ranges = ranges
+        if flags & FLAG_POSITION:
+            x, y = struct.unpack_from('<hh', payload, n)
+            n += 4
+            if flags & FLAG_POSITION_Z:
+                z = struct.unpack_from('<h', payload, n)[0]
+                n += 2
+                frame.position = (x / 100, y / 100, z / 100)
+            else:
+                frame.position = (x / 100, y / 100)
+        if flags & FLAG_LINK:
+            rssi, snr = struct.unpack_from('<bb', payload, n)
+            n += 2
+            frame.rssi = rssi
+            frame.snr = snr / 4
+        if flags & FLAG_BATTERY:
+            frame.battery_mv = struct.unpack_from('<H', payload, n)[0]
+            n += 2
+    except Exception:
+        # Truncated section: IndexError, or struct's error for a short buffer
+        return None
+    if n > len(payload):
+        return None
+    if frame.type == TYPE_TEXT:
+        try:
+            frame.text = bytes(payload[n:]).decode()
+        except UnicodeError:
+            frame.text = None
+    return frame
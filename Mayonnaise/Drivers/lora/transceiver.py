@@ -1,6 +1,16 @@
 from machine import Pin, SPI
-from Drivers.lora.lora import ULoRa
+from Drivers.lora.lora import ULoRa, PacketRing, MAX_PKT_LENGTH
 
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+# Named modem profiles, as overrides of the constructor parameters
+DEFAULT_PROFILES = {
+    "long_range": {"spreading_factor": 12, "signal_bandwidth": 125e3, "coding_rate": 8},
+    "fast": {"spreading_factor": 7, "signal_bandwidth": 250e3, "coding_rate": 5},
+}
 
 class LoRaTransceiver:
     """
@@ -8,12 +18,21 @@ class LoRaTransceiver:
     The device switches between TX and RX modes as needed.
     """
 
-    def __init__(self, spi=None, pins=None, parameters=None):
+    def __init__(self, spi=None, pins=None, parameters=None, gc_policy=None,
+                 profiles=DEFAULT_PROFILES, duty_cycle=None, verbose=True):
         """
         :param spi: Initialized SPI object. If None, a default SPI bus is created.
         :param pins: Dict with pin mappings: {"ss": <n>, "reset": <n>, "dio0": <n>}.
                      If None, defaults are used.
         :param parameters: Optional dict of LoRa configuration parameters.
+        :param gc_policy: Optional GcPolicy for packet operations (see lora.py).
+        :param profiles: Named modem profiles for use_profile(), as a dict of
+                         name -> parameter overrides.
+        :param duty_cycle: Optional DutyCycleLimiter (see lora.py). send()
+                           then raises DutyCycleError when over budget, while
+                           send_async() waits until the budget allows.
+        :param verbose: Print every packet sent and received. Turn it off
+                        when stdout carries binary frames (serial_frame.py).
         """
         if spi is None:
             spi = SPI(1, baudrate=5000000, polarity=0, phase=0,
@@ -26,18 +45,111 @@ class LoRaTransceiver:
                 "dio0": 5,
             }
 
-        self.lora = ULoRa(spi, pins, parameters)
+        self.lora = ULoRa(spi, pins, parameters, gc_policy, profiles, duty_cycle)
+        self.rx_ring = None
+        self.verbose = verbose
 
-    def send(self, message):
+    def send(self, message, wait=True, callback=None, timeout=None):
         """
         Transmit a message string or bytes.
 
         :param message: str or bytes to send.
+        :param wait: If False, return as soon as the transmission has started
+                     and report completion through callback instead.
+        :param callback: Optional function called as callback(ok) when a
+                         non-blocking send completes or times out.
+        :param timeout: Optional TX timeout in milliseconds.
+        :raises ValueError: If the message does not fit in one packet; send
+                            it through Fragmenter instead.
         """
         if isinstance(message, str):
             message = message.encode()
-        self.lora.println(message)
-        print("Sent: {}".format(message))
+        if len(message) > MAX_PKT_LENGTH:
+            raise ValueError("message of {} bytes does not fit in one packet".format(len(message)))
+        if wait:
+            self.lora.println(message, timeout=timeout)
+            if self.verbose:
+                print("Sent: {}".format(message))
+        else:
+            self.lora.send_nowait(message, callback, timeout)
+            if self.verbose:
+                print("Sending: {}".format(message))
+
+    def use_profile(self, name):
+        """
+        Switch modem settings, writing only the registers that change.
+        Both ends of a link must use the same profile.
+
+        :param name: "default" or a key of the profiles given at construction.
+        :return: Number of SPI bursts it took.
+        """
+        return self.lora.apply_profile(name)
+
+    def tx_busy(self):
+        """
+        :return: True while a non-blocking send is still on air.
+        """
+        return self.lora.tx_pending()
+
+    def airtime_us(self, length):
+        """
+        :param length: Payload length in bytes, or the payload itself.
+        :return: Its time on air in microseconds at the current settings.
+        """
+        if not isinstance(length, int):
+            length = len(length)
+        return self.lora.time_on_air_us(length)
+
+    def budget_us(self):
+        """
+        :return: Airtime in microseconds that could be sent right now under
+                 the duty-cycle limit, or None if there is no limit.
+        """
+        limiter = self.lora.duty_cycle
+        return None if limiter is None else limiter.remaining_us()
+
+    def send_delay_ms(self, length):
+        """
+        How long a packet would have to wait for duty-cycle budget, so a
+        scheduler can plan or drop it instead of queueing blindly.
+
+        :param length: Payload length in bytes, or the payload itself.
+        :return: Milliseconds until it can be sent (0 if now), or -1 if it
+                 is too long to ever fit the budget.
+        """
+        limiter = self.lora.duty_cycle
+        return 0 if limiter is None else limiter.wait_ms(self.airtime_us(length))
+
+    async def wait_for_budget(self, message):
+        """
+        Yield to other tasks until the duty-cycle budget allows message.
+        Returns at once if there is no limit, or if message can never fit
+        (the send itself then raises DutyCycleError).
+        """
+        delay = self.send_delay_ms(message)
+        while delay > 0:
+            await asyncio.sleep(delay / 1000)
+            delay = self.send_delay_ms(message)
+
+    async def send_async(self, message, timeout=None):
+        """
+        Awaitable send: yields to other tasks while it waits for duty-cycle
+        budget, then until TX_DONE or the timeout.
+
+        :param message: str or bytes to send.
+        :param timeout: Optional TX timeout in milliseconds.
+        :return: True if the packet was sent, False on timeout.
+        :raises DutyCycleError: If the message can never fit the budget.
+        """
+        if isinstance(message, str):
+            message = message.encode()
+        await self.wait_for_budget(message)
+        result = []
+        self.send(message, wait=False, callback=result.append, timeout=timeout)
+        while self.lora.tx_pending():
+            await asyncio.sleep(0.005)
+        self.lora.gc_policy.packet()
+        return bool(result and result[0])
 
     def receive(self, timeout=5000):
         """
@@ -50,13 +162,62 @@ class LoRaTransceiver:
         if payload:
             rssi = self.lora.packet_rssi()
             snr = self.lora.packet_snr()
-            print("Received: {} | RSSI: {} dBm | SNR: {} dB".format(payload, rssi, snr))
+            if self.verbose:
+                print("Received: {} | RSSI: {} dBm | SNR: {} dB".format(payload, rssi, snr))
             try:
                 return payload.decode()
             except Exception:
                 return payload
         return None
 
+    def start_listening(self, callback=None, slots=8):
+        """
+        Switch to interrupt-driven receive. Packets arriving on DIO0 are
+        buffered in the background; fetch them with poll().
+
+        :param callback: Optional function called as callback(payload) from the
+                         interrupt handler for every packet the buffer has
+                         room for.
+        :param slots: Number of packets the receive buffer can hold; 0 for no
+                      buffer, handing every packet to the callback (whose
+                      copy allocates in the handler) and none to poll().
+        """
+        self.rx_ring = self.lora.receive_irq(callback=callback,
+                                             ring=PacketRing(slots) if slots else None)
+
+    def stop_listening(self):
+        """
+        Stop interrupt-driven receive.
+        """
+        self.lora.stop_receive_irq()
+        self.rx_ring = None
+
+    def poll(self, raw=False):
+        """
+        Non-blocking fetch of the oldest packet received since start_listening().
+
+        :param raw: Return the payload as bytes, e.g. for binary telemetry frames.
+        :return: (payload, rssi, snr) tuple, payload decoded to str where
+                 possible unless raw, or None if nothing is waiting.
+        """
+        if self.rx_ring is None:
+            return None
+        packet = self.rx_ring.get()
+        if packet is None:
+            return None
+        payload, rssi, snr = packet
+        # Interrupt-driven packets are accounted here, outside the handler
+        self.lora.gc_policy.packet()
+        if self.verbose:
+            print("Received: {} | RSSI: {} dBm | SNR: {} dB".format(payload, rssi, snr))
+        if raw:
+            return payload, rssi, snr
+        try:
+            payload = payload.decode()
+        except Exception:
+            pass
+        return payload, rssi, snr
+
     def send_and_wait(self, message, timeout=5000):
         """
         Send a message then immediately listen for a reply.
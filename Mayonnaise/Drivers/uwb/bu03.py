@@ -6,33 +6,382 @@
 # last updated: 23/02/26
 
 import struct
-
+from array import array
 
 from machine import UART, Pin
 import time
 
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+# Distance frame: header, then one little-endian uint32 range in mm per base
+# station (0 = not visible)
+FRAME_HEADER = b'\xaa%\x01'
+FRAME_FORMAT = '<8I'
+BASE_STATIONS = 8
+FRAME_LENGTH = len(FRAME_HEADER) + 4 * BASE_STATIONS  # 35 bytes
+
+
+class FrameParser:
+    """
+    Incremental parser for the BU03 distance stream.
+
+    UART bytes go into a preallocated ring buffer (straight from the UART
+    with fill(), or from recorded data with feed()). next_frame() skips
+    anything before a frame header, so partial, concatenated and mid-stream
+    data all resynchronise, and returns each complete frame in turn. The
+    ranges are unpacked into one reused array, so decoding allocates nothing
+    beyond struct's result tuple.
+
+    Every fill()/feed() is stamped with ticks_us, and each frame takes the
+    stamp of the write that delivered its last byte, so a frame read long
+    after it arrived still carries its arrival time. The writer (fill/feed)
+    only moves the tail and the reader (next_frame) only moves the head, so
+    one of each may run from a UART interrupt and the main loop at once.
+    """
+    def __init__(self, size=256, chunks=32):
+        """
+        :param size: Byte ring size, a power of two >= one frame.
+        :param chunks: Separate arrival stamps kept for unparsed data (>= 2);
+                       further writes share the newest stamp.
+        """
+        if size & (size - 1) or size < FRAME_LENGTH:
+            raise ValueError("size must be a power of two >= {}".format(FRAME_LENGTH))
+        self.buf = bytearray(size)
+        self._view = memoryview(self.buf)
+        self._size = size
+        # Head and tail run modulo twice the size so full and empty differ
+        self._head = 0      # parser side: next unparsed byte
+        self._tail = 0      # writer side: next free byte
+        # A frame that wraps around the end of the ring is copied here to decode
+        self._scratch = bytearray(FRAME_LENGTH)
+        # Arrival stamp per write: byte count and ticks_us
+        self._chunks = chunks
+        self._chunk_len = [0] * chunks
+        self._chunk_us = [0] * chunks
+        self._chunk_head = 0
+        self._chunk_tail = 0
+        self._chunk_used = 0    # bytes of the head chunk already parsed
+        self.ranges = array('I', [0] * BASE_STATIONS)  # last frame, in mm
+        self.timestamp_us = 0   # ticks_us when the last frame arrived
+        self.frames = 0
+        self.skipped = 0    # bytes discarded while looking for a header
+        self.overflows = 0  # writes refused or cut short because the ring was full
+
+    def pending(self):
+        return (self._tail - self._head) % (2 * self._size)
+
+    def free(self):
+        return self._size - self.pending()
+
+    def reset(self):
+        self._head = self._tail
+        self._chunk_head = self._chunk_tail
+        self._chunk_used = 0
+
+    # ---------------------------
+    # Writer side
+    # ---------------------------
+    def feed(self, data, now_us=None):
+        """
+        Copy bytes into the ring. Returns how many fitted; call next_frame()
+        to make room for the rest.
+
+        :param now_us: Arrival time to stamp them with (default: now).
+        """
+        n = min(len(data), self.free())
+        if n < len(data):
+            self.overflows += 1
+        if not n:
+            return 0
+        size = self._size
+        tail = self._tail % size
+        first = min(n, size - tail)
+        self.buf[tail:tail + first] = data[:first]
+        if n > first:
+            self.buf[:n - first] = data[first:n]
+        self._wrote(n, time.ticks_us() if now_us is None else now_us)
+        return n
+
+    def fill(self, uart):
+        """
+        Read as much as fits straight from uart into the ring. Returns the
+        number of bytes read.
+        """
+        total = 0
+        size = self._size
+        while uart.any():
+            free = self.free()
+            if not free:
+                self.overflows += 1
+                break
+            tail = self._tail % size
+            n = uart.readinto(self._view[tail:tail + min(free, size - tail)])
+            if not n:
+                break
+            self._wrote(n, time.ticks_us())
+            total += n
+        return total
+
+    def _wrote(self, n, now_us):
+        chunks = self._chunks
+        if (self._chunk_tail - self._chunk_head) % (2 * chunks) >= chunks:
+            # Out of stamps: extend the newest write, which the parser is not
+            # reading while two or more are queued
+            i = (self._chunk_tail - 1) % chunks
+            self._chunk_len[i] += n
+        else:
+            i = self._chunk_tail % chunks
+            self._chunk_len[i] = n
+            self._chunk_tail = (self._chunk_tail + 1) % (2 * chunks)
+        self._chunk_us[i] = now_us
+        self._tail = (self._tail + n) % (2 * self._size)
+
+    # ---------------------------
+    # Reader side
+    # ---------------------------
+    def _at(self, offset):
+        return self.buf[(self._head + offset) % self._size]
+
+    def _skip(self, n):
+        self._head = (self._head + n) % (2 * self._size)
+        # Retire the stamps of the bytes consumed, keeping the last one
+        chunks = self._chunks
+        while n:
+            i = self._chunk_head % chunks
+            left = self._chunk_len[i] - self._chunk_used
+            self.timestamp_us = self._chunk_us[i]
+            if n < left:
+                self._chunk_used += n
+                return
+            n -= left
+            self._chunk_used = 0
+            self._chunk_head = (self._chunk_head + 1) % (2 * chunks)
+
+    def next_frame(self):
+        """
+        Decode the next complete frame into self.ranges and its arrival time
+        into self.timestamp_us.
+
+        :return: self.ranges, or None until a whole frame has arrived.
+        """
+        h0, h1, h2 = FRAME_HEADER
+        count = self.pending()
+        while count >= 3:
+            if self._at(0) == h0 and self._at(1) == h1 and self._at(2) == h2:
+                break
+            self._skip(1)
+            self.skipped += 1
+            count -= 1
+        if count < FRAME_LENGTH:
+            return None
+
+        offset = (self._head + 3) % self._size
+        if offset + FRAME_LENGTH - 3 <= self._size:
+            values = struct.unpack_from(FRAME_FORMAT, self.buf, offset)
+        else:
+            scratch = self._scratch
+            for i in range(FRAME_LENGTH - 3):
+                scratch[i] = self._at(3 + i)
+            values = struct.unpack_from(FRAME_FORMAT, scratch, 0)
+        ranges = self.ranges
+        for i in range(BASE_STATIONS):
+            ranges[i] = values[i]
+        self._skip(FRAME_LENGTH)
+        self.frames += 1
+        return ranges
+
+
+def ranges_to_distances(ranges):
+    """Convert a frame's ranges in mm to metres, None for base stations not visible."""
+    return [r / 1000.0 if r else None for r in ranges]
+
+
+### AT Commands
+
+AT_TIMEOUT_MS = 1000
+SAVE_TIMEOUT_MS = 2000   # AT+SAVE writes flash
+
+# GETCFG field names, e.g. "getcfg ID:0, Role:1, CH:1, Rate:1"
+CONFIG_KEYS = {'id': 'id', 'role': 'role', 'ch': 'channel', 'channel': 'channel', 'rate': 'rate'}
+
+
+class BU03Config:
+    """Module configuration as reported by AT+GETCFG."""
+    def __init__(self, id, role, channel, rate):
+        self.id = id
+        self.role = role
+        self.channel = channel
+        self.rate = rate
+
+    @classmethod
+    def parse(cls, line):
+        """
+        Parse a GETCFG reply line. Accepts labelled fields (ID:0, Role:1,
+        CH:1, Rate:1) or four bare numbers after the getcfg tag. Returns a
+        BU03Config or None.
+        """
+        text = line.lower()
+        if 'getcfg' not in text and 'role' not in text:
+            return None
+        for sep in ':,=':
+            text = text.replace(sep, ' ')
+        values = {}
+        numbers = []
+        key = None
+        for token in text.split():
+            if token.isdigit():
+                numbers.append(int(token))
+                if key is not None:
+                    values[key] = int(token)
+                    key = None
+            else:
+                key = CONFIG_KEYS.get(token)
+        if len(values) == 4:
+            return cls(values['id'], values['role'], values['channel'], values['rate'])
+        if not values and len(numbers) >= 4:
+            return cls(*numbers[:4])
+        return None
+
+    def matches(self, id, role, channel, rate):
+        return (self.id, self.role, self.channel, self.rate) == (id, role, channel, rate)
+
+    def __repr__(self):
+        return "BU03Config(id={}, role={}, channel={}, rate={})".format(
+            self.id, self.role, self.channel, self.rate)
+
+
+class ATResponse:
+    """Reply to one AT command: status is 'OK', 'ERROR' or 'TIMEOUT'."""
+    def __init__(self, command):
+        self.command = command
+        self.status = None
+        self.lines = []
+
+    @property
+    def ok(self):
+        return self.status == 'OK'
+
+    def __repr__(self):
+        return "{} -> {} {}".format(self.command, self.status, self.lines)
+
+
+class ATEngine:
+    """
+    Sends one AT command at a time and matches the reply line by line as it
+    arrives: OK or ERROR end the command, as does any line accepted by the
+    command's until(line) test (for replies with no trailing OK), and a
+    per-command deadline turns silence into TIMEOUT.
+
+    start() and poll() never block, for cooperative schedulers; command()
+    waits, but only as long as the module takes to answer.
+    """
+    def __init__(self, uart, line_size=128):
+        self.uart = uart
+        self._line = bytearray()
+        self.line_size = line_size
+        self.response = None
+        self._until = None
+        self._deadline = 0
+
+    def start(self, command, timeout_ms=AT_TIMEOUT_MS, until=None):
+        # Anything still buffered belongs to an earlier command
+        while self.uart.any():
+            self.uart.read()
+        self._line[:] = b''
+        self.response = ATResponse(command)
+        self._until = until
+        self._deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+        self.uart.write(command + '\r\n')
+
+    def poll(self):
+        """
+        Process whatever has arrived. Returns the ATResponse once complete,
+        otherwise None.
+        """
+        response = self.response
+        if response is None or response.status is not None:
+            return response
+        if self.uart.any():
+            data = self.uart.read()
+            for i in range(len(data)):
+                b = data[i]
+                if b == 0x0A:  # '\n'
+                    if self._end_line():
+                        return response
+                elif b != 0x0D and len(self._line) < self.line_size:
+                    self._line.append(b)
+        if time.ticks_diff(self._deadline, time.ticks_ms()) <= 0:
+            response.status = 'TIMEOUT'
+            return response
+        return None
+
+    def _end_line(self):
+        try:
+            line = self._line.decode().strip()
+        except UnicodeError:
+            line = ''
+        self._line[:] = b''
+        if not line:
+            return False
+        response = self.response
+        if line == 'OK':
+            response.status = 'OK'
+        elif line.startswith('ERROR'):
+            response.status = 'ERROR'
+            response.lines.append(line)
+        else:
+            response.lines.append(line)
+            if self._until is not None and self._until(line):
+                response.status = 'OK'
+        return response.status is not None
+
+    def command(self, command, timeout_ms=AT_TIMEOUT_MS, until=None):
+        self.start(command, timeout_ms, until)
+        while True:
+            response = self.poll()
+            if response is not None:
+                return response
+            time.sleep_ms(1)
+
+
 class BU03:
     def __init__(self, uart_id=1, tx=17, rx=18,
                  config_uart_id=2, config_tx=2, config_rx=1,
-                 reset_pin=15):
-        self.uart = UART(uart_id, baudrate=115200, tx=tx, rx=rx)
+                 reset_pin=15, rxbuf=2048, ring_size=4096, ring_chunks=128):
+        """
+        rxbuf sizes the UART driver's own receive buffer; ring_size and
+        ring_chunks size the frame parser's ring, which holds about two
+        seconds of frames at the default sizes.
+        """
+        self.uart = UART(uart_id, baudrate=115200, tx=tx, rx=rx, rxbuf=rxbuf)
         self.config_uart = UART(config_uart_id, baudrate=115200, tx=config_tx, rx=config_rx)
         self.reset_pin = Pin(reset_pin, Pin.OUT)
         self.reset_pin.value(1)
+        self.parser = FrameParser(ring_size, ring_chunks)
+        self.irq_active = False
+        self.at = ATEngine(self.uart)
+        self.config = None   # last BU03Config read from the module
 
     def reconfigure(self, id, role, channel=1, rate=1):
         """
         Configure the UWB module over the config UART pins, then reset and
-        switch back to the data UART pins ready for distance reads.
+        switch back to the data UART pins ready for distance reads. The reset
+        is skipped when the module already had this configuration.
+        Returns True if the module was reconfigured.
         """
         data_uart = self.uart
         self.uart = self.config_uart
         try:
-            self.configure(id, role, channel, rate)
+            changed = self.configure(id, role, channel, rate)
         finally:
             self.uart = data_uart
 
-        self.reset()
+        if changed:
+            self.reset()
+        return changed
 
     def reset(self,sleep = 500):
         self.reset_pin.value(0)
@@ -40,68 +389,136 @@ class BU03:
         self.reset_pin.value(1)
         time.sleep_ms(sleep *2)  # wait for module to boot on data UART
 
-    def send_at(self, cmd):
-        self.uart.write(cmd + '\r\n')
-        time.sleep(0.5)
-        if self.uart.any():
-            msg = self.uart.read()
-            print(msg)
+    def send_at(self, cmd, timeout_ms=AT_TIMEOUT_MS, until=None):
+        """Send an AT command and wait for its reply. Returns the ATResponse."""
+        if self.at.uart is not self.uart:
+            self.at = ATEngine(self.uart)
+        response = self.at.command(cmd, timeout_ms, until)
+        print(response)
+        return response
+
+    def get_config(self):
+        """Read the module configuration with AT+GETCFG. Returns a BU03Config or None."""
+        response = self.send_at('AT+GETCFG', until=BU03Config.parse)
+        for line in response.lines:
+            config = BU03Config.parse(line)
+            if config is not None:
+                self.config = config
+                return config
+        return None
 
     def configure(self, id, role, channel=1, rate=1):  # ID, Role (0 = tag, 1 = base station), Channel, Rate
+        """
+        Write and save the configuration unless GETCFG shows the module
+        already has it. Returns True if it was written.
+        """
         # uart.write('AT') can be used to test if AT commands are sending successfully, refer to docs for more info
         # send_at('AT+RESTORE') # factory reset
-        self.send_at(f'AT+SETCFG={id},{role},{channel},{rate}')
-        self.send_at('AT+SAVE')
-        self.send_at('AT+GETCFG')
+        current = self.get_config()
+        if current is not None and current.matches(id, role, channel, rate):
+            return False
+        for cmd, timeout_ms in ((f'AT+SETCFG={id},{role},{channel},{rate}', AT_TIMEOUT_MS),
+                                ('AT+SAVE', SAVE_TIMEOUT_MS)):
+            response = self.send_at(cmd, timeout_ms)
+            if not response.ok:
+                raise RuntimeError("BU03 {} failed: {}".format(cmd, response.status))
+        current = self.get_config()
+        if current is None or not current.matches(id, role, channel, rate):
+            raise RuntimeError("BU03 configuration not applied, module reports {}".format(current))
+        return True
 
     def verify_config(self, expected_id, expected_role):
-        self.send_at('AT+GETCFG')
+        config = self.get_config()
+        return config is not None and config.id == expected_id and config.role == expected_role
+
+    ### Receive Path
+
+    def start_irq(self):
+        """
+        Drain the data UART into the frame ring from its receive interrupt,
+        so frames are stamped as they arrive however long the main loop is
+        busy. Returns False if this port's UART has no receive IRQ; use
+        drain_task() instead.
+        """
+        uart = self.uart
+        trigger = getattr(UART, 'IRQ_RXIDLE', None) or getattr(UART, 'IRQ_RX', None)
+        if trigger is None or not hasattr(uart, 'irq'):
+            return False
+        # The handler is the only writer to the ring from now on
+        self._irq_cb = self._on_uart_irq
+        uart.irq(handler=self._irq_cb, trigger=trigger)
+        self.irq_active = True
+        return True
+
+    def stop_irq(self):
+        if self.irq_active:
+            self.uart.irq(handler=None)
+            self.irq_active = False
+
+    def _on_uart_irq(self, uart):
+        self.parser.fill(uart)
+
+    async def drain_task(self, period_ms=5):
+        """
+        Background task for ports without a UART receive IRQ: moves bytes
+        into the frame ring every period_ms, so they are stamped within a
+        task period of arrival while other tasks await.
+        """
+        while True:
+            self.parser.fill(self.uart)
+            await asyncio.sleep(period_ms / 1000)
+
+    def poll(self, callback=None):
+        """
+        Decode every complete frame received so far, in order, calling
+        callback(ranges_mm) for each one; parser.timestamp_us holds its
+        arrival time. The ranges array is reused, so copy it to keep it.
+        Returns the number of frames decoded.
+        """
+        parser = self.parser
+        uart = self.uart
+        frames = 0
+        while True:
+            if not self.irq_active:
+                parser.fill(uart)
+            if parser.next_frame() is None:
+                if self.irq_active or not uart.any():
+                    return frames
+                continue
+            frames += 1
+            if callback is not None:
+                callback(parser.ranges)
 
     def read_distance(self, timeout_ms=200):
-        """Wait up to timeout_ms for data, then decode. Returns distances list or None."""
+        """Wait up to timeout_ms for a frame. Returns distances list or None."""
         deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
-        while time.ticks_diff(deadline, time.ticks_ms()) > 0:
-            if self.uart.any():
-                time.sleep_ms(20)  # let the full frame arrive
-                message = self.uart.read()
-                distances = self.decode_uwb_distances(message)
-                if distances is not None:
-                    return distances
-        return None
+        while True:
+            if self.poll():
+                return ranges_to_distances(self.parser.ranges)
+            if time.ticks_diff(deadline, time.ticks_ms()) <= 0:
+                return None
+            time.sleep_ms(1)
+
+    def poll_distance(self):
+        """
+        Non-blocking read for cooperative schedulers. Decodes everything
+        buffered and returns the newest frame's distances, or None.
+        """
+        if not self.poll():
+            return None
+        return ranges_to_distances(self.parser.ranges)
 
     ### UWB Distance Decoding Functions
 
     def decode_uwb_distances(self, data):
         """
-        Decode UWB distance data from binary message
+        Decode the first complete distance frame found in a binary message
         Returns list of distances in meters for each base station
         """
-        if len(data) < 35:  # Minimum expected length
+        start = data.find(FRAME_HEADER)
+        if start < 0 or len(data) - start < FRAME_LENGTH:
             return None
-
-        # Check for header pattern
-        if data[0:3] != b'\xaa%\x01':
-            return None
-
-        # Extract distance data (skip header, process 4-byte chunks)
-        distances = []
-
-        # Starting from byte 3, read 4-byte chunks for each base station
-        for i in range(8):  # 8 base stations (0-7)
-            byte_offset = 3 + (i * 4)  # Each distance is 4 bytes
-            if byte_offset + 3 < len(data):
-                # Read as little-endian 32-bit integer
-                distance_raw = struct.unpack('<I', data[byte_offset:byte_offset+4])[0]
-                # Convert to meters
-                if distance_raw > 0:
-                    distance_meters = distance_raw / 1000.0
-                    distances.append(distance_meters)
-                else:
-                    distances.append(None)  # No signal/not visible
-            else:
-                distances.append(None)  # Base station not in data
-
-        return distances
+        return ranges_to_distances(struct.unpack_from(FRAME_FORMAT, data, start + len(FRAME_HEADER)))
 
     def print_distances(self, distances):
         """Print distances in a readable format"""
@@ -0,0 +1,273 @@
+# Tag position from BU03 base-station ranges (multilateration)
+#
+# Anchor coordinates come from the "anchors" list in config.json, one entry
+# per base-station id (0-7), in metres: [x, y] for a 2D fix or [x, y, z] for
+# 3D. Use null for base stations that are not installed.
+#
+# The solver works on preallocated float arrays sized for eight anchors, so a
+# fix allocates nothing beyond the floats MicroPython boxes anyway.
+
+from array import array
+import math
+
+MAX_ANCHORS = 8
+
+
+def load_anchors(config):
+    """
+    Anchor list from a config dict, or None if it has no usable anchors.
+    Every anchor must have the same number of coordinates (2 or 3).
+    """
+    anchors = config.get("anchors") if config else None
+    if not anchors:
+        return None
+    dims = None
+    for anchor in anchors:
+        if anchor is None:
+            continue
+        if dims is None:
+            dims = len(anchor)
+        if len(anchor) != dims or dims not in (2, 3):
+            raise ValueError("anchors must all be [x, y] or all be [x, y, z]")
+    if dims is None:
+        return None
+    return anchors[:MAX_ANCHORS]
+
+
+def _solve_linear(m, k):
+    """
+    Solve the k x (k + 1) augmented system in m (row-major, in place) by
+    Gaussian elimination with partial pivoting. The solution is left in the
+    last column. Returns False if the system is singular.
+    """
+    w = k + 1
+    scale = 0.0
+    for i in range(k):
+        scale = max(scale, abs(m[i * w + i]))
+    if scale == 0.0:
+        return False
+    for col in range(k):
+        pivot = col
+        best = abs(m[col * w + col])
+        for r in range(col + 1, k):
+            v = abs(m[r * w + col])
+            if v > best:
+                best = v
+                pivot = r
+        if best <= scale * 1e-6:
+            return False
+        if pivot != col:
+            for c in range(col, w):
+                m[col * w + c], m[pivot * w + c] = m[pivot * w + c], m[col * w + c]
+        p = m[col * w + col]
+        for r in range(col + 1, k):
+            f = m[r * w + col] / p
+            if f:
+                for c in range(col, w):
+                    m[r * w + c] -= f * m[col * w + c]
+    for r in range(k - 1, -1, -1):
+        s = m[r * w + k]
+        for c in range(r + 1, k):
+            s -= m[r * w + c] * m[c * w + k]
+        m[r * w + k] = s / m[r * w + r]
+    return True
+
+
+class Multilateration:
+    """
+    Position solver: a linearised least-squares fix as the starting point,
+    refined by Gauss-Newton on the true range residuals.
+
+    The linear step solves -2 a.p + |p|^2 = r^2 - |a|^2 for (p, |p|^2) with
+    anchors taken relative to their centroid, so it needs one anchor more
+    than the number of dimensions. Gauss-Newton then needs only as many
+    anchors as dimensions, starting from the last fix when the linear step
+    cannot run.
+
+        solver = Multilateration(load_anchors(config))
+        if solver.solve(uwb.parser.ranges, scale=0.001):
+            x, y = solver.position[0], solver.position[1]
+    """
+    def __init__(self, anchors, iterations=5, tolerance=0.001, max_residual=None):
+        """
+        :param anchors: List of [x, y] or [x, y, z] (metres) indexed by base
+                        station id, None for missing base stations.
+        :param iterations: Gauss-Newton iteration limit.
+        :param tolerance: Stop iterating once a step is shorter than this (m).
+        :param max_residual: Reject fixes whose RMS range residual (m) is
+                             above this. None accepts every fix.
+        """
+        self.dims = None
+        for anchor in anchors:
+            if anchor is not None:
+                self.dims = len(anchor)
+                break
+        if self.dims not in (2, 3):
+            raise ValueError("need 2D or 3D anchor coordinates")
+        d = self.dims
+        self.anchors = array('f', [0.0] * (MAX_ANCHORS * d))
+        self.installed = bytearray(MAX_ANCHORS)
+        for i, anchor in enumerate(anchors[:MAX_ANCHORS]):
+            if anchor is not None:
+                self.installed[i] = 1
+                for j in range(d):
+                    self.anchors[i * d + j] = anchor[j]
+        self.iterations = iterations
+        self.tolerance = tolerance
+        self.max_residual = max_residual
+
+        self.position = array('f', [0.0] * d)
+        self.has_fix = False
+        self.residual = 0.0   # RMS range residual of the last fix (m)
+        self.used = 0         # anchors in the last fix
+
+        # Scratch: selected anchor indices and ranges, centroid, and the
+        # augmented normal-equation matrix (up to 4 x 5 for the 3D linear step)
+        self._index = bytearray(MAX_ANCHORS)
+        self._range = array('f', [0.0] * MAX_ANCHORS)
+        self._centre = array('f', [0.0] * d)
+        self._m = array('f', [0.0] * 20)
+        self._p = array('f', [0.0] * d)
+
+    def solve(self, ranges, scale=1.0):
+        """
+        Fix the tag position from one frame of ranges.
+
+        :param ranges: Range per base station id; None or 0 if not visible.
+        :param scale: Multiplier to metres, e.g. 0.001 for the BU03 parser's
+                      millimetre ranges.
+        :return: True with self.position updated, or False if there are too
+                 few anchors, the geometry is degenerate or the fix is
+                 rejected by max_residual.
+        """
+        d = self.dims
+        n = 0
+        for i in range(min(len(ranges), MAX_ANCHORS)):
+            r = ranges[i]
+            if r and self.installed[i]:
+                self._index[n] = i
+                self._range[n] = r * scale
+                n += 1
+        if n < d:
+            return False
+
+        p = self._p
+        if n > d and self._linear(n):
+            pass
+        elif self.has_fix:
+            for j in range(d):
+                p[j] = self.position[j]
+        else:
+            return False
+
+        if not self._gauss_newton(n):
+            return False
+        residual = self._rms(n)
+        if self.max_residual is not None and residual > self.max_residual:
+            return False
+        for j in range(d):
+            self.position[j] = p[j]
+        self.residual = residual
+        self.used = n
+        self.has_fix = True
+        return True
+
+    # ---------------------------
+    # Steps
+    # ---------------------------
+    def _linear(self, n):
+        """
+        Linearised least-squares estimate into self._p.
+        """
+        d = self.dims
+        a = self.anchors
+        c = self._centre
+        for j in range(d):
+            s = 0.0
+            for k in range(n):
+                s += a[self._index[k] * d + j]
+            c[j] = s / n
+
+        # Normal equations for rows [-2 (a - c), 1] . [p - c, |p - c|^2] = r^2 - |a - c|^2
+        k = d + 1
+        w = k + 1
+        m = self._m
+        for i in range(k * w):
+            m[i] = 0.0
+        row = self._p  # reuse as scratch for -2 (a - c)
+        for s in range(n):
+            base = self._index[s] * d
+            rhs = self._range[s] * self._range[s]
+            for j in range(d):
+                v = a[base + j] - c[j]
+                row[j] = -2.0 * v
+                rhs -= v * v
+            for r in range(k):
+                vr = row[r] if r < d else 1.0
+                for q in range(r, k):
+                    m[r * w + q] += vr * (row[q] if q < d else 1.0)
+                m[r * w + k] += vr * rhs
+        for r in range(k):
+            for q in range(r):
+                m[r * w + q] = m[q * w + r]
+        if not _solve_linear(m, k):
+            return False
+        for j in range(d):
+            self._p[j] = m[j * w + k] + c[j]
+        return True
+
+    def _gauss_newton(self, n):
+        """
+        Refine self._p against the range residuals |p - a| - r.
+        """
+        d = self.dims
+        a = self.anchors
+        p = self._p
+        m = self._m
+        w = d + 1
+        for _ in range(self.iterations):
+            for i in range(d * w):
+                m[i] = 0.0
+            for s in range(n):
+                base = self._index[s] * d
+                dist = 0.0
+                for j in range(d):
+                    v = p[j] - a[base + j]
+                    dist += v * v
+                dist = math.sqrt(dist)
+                if dist < 1e-6:
+                    continue
+                f = dist - self._range[s]
+                for r in range(d):
+                    jr = (p[r] - a[base + r]) / dist
+                    for q in range(r, d):
+                        m[r * w + q] += jr * (p[q] - a[base + q]) / dist
+                    m[r * w + d] -= jr * f
+            for r in range(d):
+                for q in range(r):
+                    m[r * w + q] = m[q * w + r]
+            if not _solve_linear(m, d):
+                return False
+            step = 0.0
+            for j in range(d):
+                delta = m[j * w + d]
+                p[j] += delta
+                step += delta * delta
+            if step < self.tolerance * self.tolerance:
+                break
+        return True
+
+    def _rms(self, n):
+        d = self.dims
+        a = self.anchors
+        p = self._p
+        total = 0.0
+        for s in range(n):
+            base = self._index[s] * d
+            dist = 0.0
+            for j in range(d):
+                v = p[j] - a[base + j]
+                dist += v * v
+            f = math.sqrt(dist) - self._range[s]
+            total += f * f
+        return math.sqrt(total / n)
@@ -0,0 +1,249 @@
+# Streaming filters for BU03 ranges and tag positions
+#
+# RangeFilter smooths each base station's range with an alpha-beta filter and
+# PositionTracker runs a constant-velocity Kalman filter on the multilateration
+# fix. Both gate outliers against their prediction, coast through dropouts and
+# keep their state in fixed arrays, so each update is O(1) in time and memory
+# and allocates nothing per sample.
+#
+#     ranges = RangeFilter()
+#     tracker = PositionTracker()
+#     uwb.poll(lambda mm: ranges.update(mm, time.ticks_ms(), scale=0.001))
+#     if solver.solve(ranges.ranges):
+#         tracker.update(solver.position, time.ticks_ms())
+#     if tracker.report_due(time.ticks_ms()):
+#         send(tracker.position)
+#         tracker.mark_reported(time.ticks_ms())
+
+from array import array
+import math
+import time
+
+from Drivers.uwb.position import MAX_ANCHORS
+
+# 99% chi-square quantile for the innovation, by degrees of freedom (dims)
+CHI2_99 = {2: 9.21, 3: 11.34}
+
+
+class RangeFilter:
+    """
+    Alpha-beta filter per base station. A range further than gate_m from the
+    prediction is dropped as a spike; after max_misses spikes in a row the
+    track is restarted from the new range, since the tag really moved. A base
+    station with no accepted range for timeout_ms is marked not visible.
+    """
+    def __init__(self, alpha=0.5, beta=0.1, gate_m=0.5, max_misses=3, timeout_ms=1000):
+        """
+        :param alpha: Range gain, 0..1 (higher follows faster, smooths less).
+        :param beta: Rate gain, 0..1.
+        :param gate_m: Largest accepted innovation in metres.
+        :param max_misses: Consecutive rejections before the track restarts.
+        :param timeout_ms: Time without an accepted range before a base
+                           station is reported as not visible.
+        """
+        self.alpha = alpha
+        self.beta = beta
+        self.gate_m = gate_m
+        self.max_misses = max_misses
+        self.timeout_ms = timeout_ms
+        # Filtered range per base station (m), 0 when not visible: drop-in
+        # input for Multilateration.solve()
+        self.ranges = array('f', [0.0] * MAX_ANCHORS)
+        self.rates = array('f', [0.0] * MAX_ANCHORS)    # m/s
+        self._updated = array('i', [0] * MAX_ANCHORS)   # ticks_ms of last accepted range
+        self._misses = bytearray(MAX_ANCHORS)
+        self.rejected = 0
+
+    def reset(self):
+        for i in range(MAX_ANCHORS):
+            self.ranges[i] = 0.0
+            self.rates[i] = 0.0
+            self._misses[i] = 0
+
+    def update(self, ranges, now_ms, scale=1.0):
+        """
+        Feed one frame of raw ranges (None or 0 where not visible).
+
+        :param scale: Multiplier to metres, e.g. 0.001 for the BU03 parser's
+                      millimetre ranges.
+        :return: Number of base stations currently visible.
+        """
+        visible = 0
+        for i in range(min(len(ranges), MAX_ANCHORS)):
+            z = ranges[i]
+            tracked = self.ranges[i] > 0.0
+            dt = time.ticks_diff(now_ms, self._updated[i]) / 1000 if tracked else 0.0
+            if tracked and dt * 1000 > self.timeout_ms:
+                self.ranges[i] = 0.0
+                tracked = False
+            if z:
+                z *= scale
+                if not tracked:
+                    self._start(i, z, now_ms)
+                else:
+                    predicted = self.ranges[i] + self.rates[i] * dt
+                    innovation = z - predicted
+                    if abs(innovation) > self.gate_m:
+                        self.rejected += 1
+                        self._misses[i] += 1
+                        if self._misses[i] >= self.max_misses:
+                            self._start(i, z, now_ms)
+                    else:
+                        self.ranges[i] = predicted + self.alpha * innovation
+                        if dt > 0:
+                            self.rates[i] += self.beta * innovation / dt
+                        self._updated[i] = now_ms
+                        self._misses[i] = 0
+            if self.ranges[i] > 0.0:
+                visible += 1
+        return visible
+
+    def _start(self, i, z, now_ms):
+        self.ranges[i] = z
+        self.rates[i] = 0.0
+        self._updated[i] = now_ms
+        self._misses[i] = 0
+
+
+class PositionTracker:
+    """
+    Constant-velocity Kalman filter on 2D or 3D positions, one independent
+    [position, velocity] filter per axis. A fix whose normalised innovation
+    (squared Mahalanobis distance) exceeds gate is rejected; after max_misses
+    rejections in a row the filter restarts at the new fix.
+    """
+    def __init__(self, dims=2, accel_noise=0.5, fix_noise=0.05, gate=None, max_misses=5):
+        """
+        :param dims: 2 or 3.
+        :param accel_noise: Process noise as acceleration standard deviation (m/s^2).
+        :param fix_noise: Position fix standard deviation (m).
+        :param gate: Chi-square threshold on the innovation. None uses the
+                     99% quantile for dims: 9.21 in 2D, 11.34 in 3D.
+        :param max_misses: Consecutive rejections before the filter restarts.
+        """
+        self.dims = dims
+        self.q = accel_noise * accel_noise
+        self.r = fix_noise * fix_noise
+        self.gate = CHI2_99[dims] if gate is None else gate
+        self.max_misses = max_misses
+        self.position = array('f', [0.0] * dims)
+        self.velocity = array('f', [0.0] * dims)
+        # Per-axis covariance [pp, pv, vv]
+        self._cov = array('f', [0.0] * (3 * dims))
+        self._reported = array('f', [0.0] * dims)
+        self._time = 0
+        self._report_time = 0
+        self._misses = 0
+        self.has_track = False
+        self.has_report = False
+        self.rejected = 0
+
+    def reset(self):
+        self.has_track = False
+        self.has_report = False
+        self._misses = 0
+
+    def predict(self, now_ms):
+        """
+        Advance the state to now_ms without a measurement.
+        """
+        if not self.has_track:
+            return
+        dt = time.ticks_diff(now_ms, self._time) / 1000
+        if dt <= 0:
+            return
+        q = self.q
+        dt2 = dt * dt
+        cov = self._cov
+        for axis in range(self.dims):
+            self.position[axis] += self.velocity[axis] * dt
+            k = 3 * axis
+            pp, pv, vv = cov[k], cov[k + 1], cov[k + 2]
+            # P = F P F' + Q for F = [[1, dt], [0, 1]], white acceleration noise
+            cov[k] = pp + 2 * dt * pv + dt2 * vv + q * dt2 * dt2 / 4
+            cov[k + 1] = pv + dt * vv + q * dt2 * dt / 2
+            cov[k + 2] = vv + q * dt2
+        self._time = now_ms
+
+    def update(self, fix, now_ms):
+        """
+        Fold in one position fix taken at now_ms.
+
+        :return: True if the fix was accepted.
+        """
+        if not self.has_track:
+            self._start(fix, now_ms)
+            return True
+        self.predict(now_ms)
+        cov = self._cov
+        r = self.r
+        d2 = 0.0
+        for axis in range(self.dims):
+            innovation = fix[axis] - self.position[axis]
+            d2 += innovation * innovation / (cov[3 * axis] + r)
+        if d2 > self.gate:
+            self.rejected += 1
+            self._misses += 1
+            if self._misses >= self.max_misses:
+                self._start(fix, now_ms)
+                return True
+            return False
+        self._misses = 0
+        for axis in range(self.dims):
+            k = 3 * axis
+            pp, pv, vv = cov[k], cov[k + 1], cov[k + 2]
+            s = pp + r
+            kp = pp / s
+            kv = pv / s
+            innovation = fix[axis] - self.position[axis]
+            self.position[axis] += kp * innovation
+            self.velocity[axis] += kv * innovation
+            cov[k] = (1 - kp) * pp
+            cov[k + 1] = (1 - kp) * pv
+            cov[k + 2] = vv - kv * pv
+        return True
+
+    def _start(self, fix, now_ms):
+        for axis in range(self.dims):
+            self.position[axis] = fix[axis]
+            self.velocity[axis] = 0.0
+            k = 3 * axis
+            self._cov[k] = self.r
+            self._cov[k + 1] = 0.0
+            self._cov[k + 2] = 1.0
+        self._time = now_ms
+        self._misses = 0
+        self.has_track = True
+
+    # ---------------------------
+    # Reporting
+    # ---------------------------
+    def report_due(self, now_ms, min_move_m=0.1, max_interval_ms=10000):
+        """
+        True if the tracked position has moved min_move_m since the last
+        report, or max_interval_ms has passed since it, so updates only go
+        out when they carry news.
+        """
+        if not self.has_track:
+            return False
+        if not self.has_report:
+            return True
+        if time.ticks_diff(now_ms, self._report_time) >= max_interval_ms:
+            return True
+        d2 = 0.0
+        for axis in range(self.dims):
+            v = self.position[axis] - self._reported[axis]
+            d2 += v * v
+        return d2 >= min_move_m * min_move_m
+
+    def mark_reported(self, now_ms):
+        for axis in range(self.dims):
+            self._reported[axis] = self.position[axis]
+        self._report_time = now_ms
+        self.has_report = True
+
+    def speed(self):
+        s = 0.0
+        for axis in range(self.dims):
+            s += self.velocity[axis] * self.velocity[axis]
+        return math.sqrt(s)
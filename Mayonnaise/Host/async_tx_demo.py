@@ -0,0 +1,53 @@
+"""
+Exercise the non-blocking LoRa transmit path on a Linux host against the
+fake SX127x: callback completion, the hard TX timeout on a wedged radio,
+and the awaitable send under asyncio.
+
+    python3 Host/async_tx_demo.py
+"""
+import asyncio
+
+import hostenv
+
+from fake_sx127x import FakeSX127x
+from Drivers.lora.transceiver import LoRaTransceiver
+
+
+def main():
+    radio = FakeSX127x(spi_id=1, ss=10, dio0=5, auto_tx_done=False)
+    transceiver = LoRaTransceiver()
+
+    # Completion reported from the TxDone interrupt
+    transceiver.send("Ping 0", wait=False,
+                     callback=lambda ok: print("TX complete callback: ok={}".format(ok)))
+    print("send returned, busy={}".format(transceiver.tx_busy()))
+    radio.complete_tx()
+    print("after TxDone, busy={}".format(transceiver.tx_busy()))
+
+    # A radio that never raises TxDone is abandoned after the timeout
+    transceiver.send("Ping 1", wait=False, timeout=50,
+                     callback=lambda ok: print("TX complete callback: ok={}".format(ok)))
+    while transceiver.tx_busy():
+        pass
+    try:
+        transceiver.send("Ping 2", timeout=50)
+    except RuntimeError as e:
+        print("Blocking send:", e)
+
+    # Awaitable send lets other tasks run while the packet is on air
+    async def finish_later():
+        await asyncio.sleep(0.05)
+        radio.complete_tx()
+
+    async def run():
+        task = asyncio.create_task(finish_later())
+        ok = await transceiver.send_async("Ping 3")
+        await task
+        print("send_async ->", ok)
+
+    asyncio.run(run())
+    print("Sent over the air:", radio.sent)
+
+
+if __name__ == "__main__":
+    main()
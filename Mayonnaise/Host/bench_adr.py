@@ -0,0 +1,229 @@
+"""
+Adaptive data rate benchmark: AdrController against fixed SF9 links on the
+simulated RF channel.
+
+Scatters N point-to-point links over a square: a gateway, and an egg within
+--radius of it that sends a small packet every --interval seconds on its own
+timer. All links share one frequency, so links on the same spreading factor
+collide. Links see log-normal shadowing and per-packet fading. Half way
+through, --move of the eggs walk off to up to twice their distance, so links
+that had stepped down have to step back up or fall back. Runs each link
+count in two modes:
+
+    fixed   every link stays on the base settings, SF9 at 14 dBm
+    adr     the gateway manages its link with AdrController
+
+and reports:
+
+    PDR      packets the gateway received / packets generated
+    late     PDR over the second half, after the eggs moved
+    air/pkt  egg airtime per packet generated, ADR frames included, in ms
+    saved    airtime saved against fixed
+    ctrl     share of all airtime spent on ADR frames
+    SF       mean spreading factor of the links at the end
+    dBm      mean TX power of the links at the end
+    fallb.   links that fell back to base, changes reverted
+    coll.    collisions at receivers, per packet generated
+    speed    virtual seconds simulated per wall-clock second
+
+    python3 Host/bench_adr.py [links ...] [--seconds 7200] [--interval 30]
+                              [--radius 3000] [--area 12000] [--move 0.2]
+                              [--fading 2] [--seed 1]
+"""
+import argparse
+import math
+import random
+import time
+
+import hostenv
+
+from bench_channel import HEADER, PAYLOAD_LENGTH
+from rf_sim import Simulation
+from Drivers.lora.adr import AdrController
+
+BASE = {"frequency": 868100000, "spreading_factor": 9, "tx_power_level": 14}
+MODES = ("fixed", "adr")
+
+
+class Node:
+    """
+    One end of a link: its RX task, plus a FIFO of application packets sent
+    one at a time behind any ADR frames that are due.
+    """
+    def __init__(self, sim, node, node_id, peer, adr, log):
+        self.sim = sim
+        self.node = node
+        self.radio = radio = node.driver
+        self.node_id = node_id
+        self.peer = peer
+        self.adr = adr
+        self.log = log
+        self.queue = []
+        self.sending = False
+        radio.start_listening(callback=self.on_packet)
+        if adr is not None:
+            # The firmware's main loop, for the ADR timers
+            sim.every(1000, self.kick, start_ms=sim.now_ms + random.Random(node_id).uniform(0, 1000))
+
+    def on_packet(self, payload):
+        # Runs from the DIO0 handler: read the ring outside it
+        self.sim.at(self.sim.now_ms, self.drain)
+
+    def drain(self):
+        packet = self.radio.poll(raw=True)
+        while packet:
+            payload, rssi, snr = packet
+            if self.adr is None or not self.adr.handle(payload, rssi, snr):
+                self.received(payload, rssi, snr)
+            packet = self.radio.poll(raw=True)
+        self.kick()
+
+    def received(self, payload, rssi, snr):
+        if len(payload) != PAYLOAD_LENGTH:
+            return
+        key = HEADER.unpack_from(payload)
+        if key[0] != self.peer:
+            return
+        if self.adr is not None:
+            self.adr.observe(self.peer, rssi, snr)
+        generated = self.log["generated"].get(key)
+        if generated is not None and key not in self.log["delivered"]:
+            self.log["delivered"][key] = self.sim.now_ms
+
+    def kick(self):
+        if self.sending:
+            return
+        frame = None if self.adr is None else self.adr.poll()
+        if frame is not None:
+            self.send(frame, "ctrl")
+        elif self.queue and (self.adr is None or self.adr.before_send(self.peer)):
+            self.send(self.queue.pop(0), "data")
+
+    def send(self, payload, kind):
+        self.sending = True
+        self.log["airtime"][kind] += self.radio.airtime_us(payload)
+        self.radio.send(payload, wait=False, callback=self.sent)
+
+    def sent(self, ok):
+        # Runs from the DIO0 handler: start the next packet outside it
+        self.sending = False
+        self.sim.at(self.sim.now_ms, self.kick)
+
+
+class Egg(Node):
+    """
+    The sending end: a fixed timer on the egg's own phase.
+    """
+    def __init__(self, sim, node, node_id, peer, adr, interval_ms, rng, log):
+        super().__init__(sim, node, node_id, peer, adr, log)
+        self.interval_ms = interval_ms
+        self.seq = 0
+        sim.at(rng.uniform(0, interval_ms), self.generate)
+
+    def generate(self):
+        if self.sim.now_ms >= self.log["stop_ms"]:
+            return
+        self.seq += 1
+        payload = HEADER.pack(self.node_id, self.seq)
+        self.queue.append(payload + bytes(PAYLOAD_LENGTH - len(payload)))
+        self.log["generated"][(self.node_id, self.seq)] = self.sim.now_ms
+        self.kick()
+        self.sim.at(self.sim.now_ms + self.interval_ms, self.generate)
+
+
+def run(links, mode, seconds, interval_s, radius, area, move, fading_db, seed, baseline):
+    rng = random.Random(seed)
+    log = {"generated": {}, "delivered": {}, "airtime": {"data": 0, "ctrl": 0},
+           "stop_ms": seconds * 1000}
+    interval_ms = interval_s * 1000
+    with Simulation(seed=seed, shadowing_db=4.0, fading_db=fading_db) as sim:
+        gateways = []
+        eggs = []
+        for i in range(links):
+            gateway_id, egg_id = 2 * i, 2 * i + 1
+            x, y = rng.uniform(0, area), rng.uniform(0, area)
+            r = radius * math.sqrt(rng.random())
+            angle = rng.uniform(0, 2 * math.pi)
+            gateway = sim.add_transceiver("gateway{}".format(i), (x, y), BASE)
+            egg = sim.add_transceiver("egg{}".format(i), (x + r * math.cos(angle), y + r * math.sin(angle)),
+                                      BASE)
+            gateway_adr = egg_adr = None
+            if mode == "adr":
+                clock = lambda: int(sim.now_ms)
+                # The gateway only sends ADR frames: it falls back on silence
+                gateway_adr = AdrController(gateway.driver, gateway_id, clock=clock,
+                                            timeout_ms=int(interval_ms * 24))
+                gateway_adr.manage(egg_id)
+                egg_adr = AdrController(egg.driver, egg_id, clock=clock)
+            gateways.append(Node(sim, gateway, gateway_id, egg_id, gateway_adr, log))
+            eggs.append(Egg(sim, egg, egg_id, gateway_id, egg_adr, interval_ms, rng, log))
+
+        def walk():
+            # Half way: some eggs move off along the same bearing
+            for egg in rng.sample(eggs, int(len(eggs) * move)):
+                gateway = gateways[egg.node_id // 2].node.radio
+                radio = egg.node.radio
+                (gx, gy), (ex, ey) = gateway.position, radio.position
+                factor = rng.uniform(1.3, 2.0)
+                radio.position = (gx + (ex - gx) * factor, gy + (ey - gy) * factor)
+        sim.at(seconds * 500, walk)
+
+        start = time.perf_counter()
+        # Stop generating at the end, then let the queues drain
+        sim.run(seconds * 1000 + 10000)
+        wall = time.perf_counter() - start
+
+        generated = log["generated"]
+        delivered = log["delivered"]
+        late = [key for key, at in generated.items() if at >= seconds * 500]
+        airtime = log["airtime"]
+        packets = len(generated) or 1
+        air = (airtime["data"] + airtime["ctrl"]) / 1000 / packets
+        saved = "-"
+        if baseline.get(links):
+            saved = "{:.1%}".format(1 - air / baseline[links])
+        else:
+            baseline[links] = air
+        sf = power = "-"
+        fallbacks = "-"
+        if mode == "adr":
+            stats = [node.adr.stats() for node in gateways]
+            sf = "{:.2f}".format(sum(s["mean_sf"] for s in stats) / links)
+            power = "{:.1f}".format(sum(s["mean_power"] for s in stats) / links)
+            fallbacks = "{}/{}".format(sum(s["fallbacks"] for s in stats),
+                                       sum(s["reverts"] for s in stats))
+        print("{:>6} {:>6} {:>6.1%} {:>6.1%} {:>8.1f} {:>6} {:>5.1%} {:>5} {:>5} {:>7} {:>6.3f} {:>7.0f}".format(
+            links, mode, len(delivered) / packets, sum(key in delivered for key in late) / (len(late) or 1),
+            air, saved, airtime["ctrl"] / ((airtime["data"] + airtime["ctrl"]) or 1), sf, power, fallbacks,
+            sim.channel.stats["collisions"] / packets, (seconds + 10) / wall))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("links", nargs="*", type=int, default=[25, 50, 100])
+    parser.add_argument("--seconds", type=float, default=7200)
+    parser.add_argument("--interval", type=float, default=30, help="seconds between packets per egg")
+    parser.add_argument("--radius", type=float, default=3000, help="metres from egg to gateway")
+    parser.add_argument("--area", type=float, default=12000, help="side of the square, metres")
+    parser.add_argument("--move", type=float, default=0.2, help="fraction of eggs that move away")
+    parser.add_argument("--fading", type=float, default=2.0, help="per-packet fading, dB")
+    parser.add_argument("--mode", nargs="*", default=list(MODES))
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print("SF9 {} dBm base, {} byte packets, one every {} s per egg, {} s simulated, {} m radius, "
+          "{} m square, {:.0%} move, {} dB fading".format(
+              BASE["tx_power_level"], PAYLOAD_LENGTH, args.interval, args.seconds, args.radius,
+              args.area, args.move, args.fading))
+    print("{:>6} {:>6} {:>6} {:>6} {:>8} {:>6} {:>5} {:>5} {:>5} {:>7} {:>6} {:>7}".format(
+        "links", "mode", "PDR", "late", "air/pkt", "saved", "ctrl", "SF", "dBm", "fallb.", "coll.",
+        "speed"))
+    baseline = {}
+    for links in args.links:
+        for mode in args.mode:
+            run(links, mode, args.seconds, args.interval, args.radius, args.area, args.move,
+                args.fading, args.seed, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Multi-node LoRa channel benchmark on the simulated RF channel.
+
+Places N ULoRa eggs at random in a square field, each broadcasting a small
+packet at random (Poisson) intervals with send_nowait() while listening
+with receive_irq(), and reports per run:
+
+    offered   channel load: total airtime offered per second of simulation
+    PDR       packets delivered / (packets sent x receivers in range)
+    latency   mean send() call to receiver callback, in ms
+    coll.     collisions seen at receivers (corrupted packets)
+    busy      sends skipped because the node was still transmitting
+    speed     virtual seconds simulated per wall-clock second
+
+    python3 Host/bench_channel.py [nodes ...] [--seconds 300] [--interval 10]
+                                  [--sf 7] [--field 2000] [--seed 1]
+"""
+import argparse
+import random
+import struct
+import time
+
+import hostenv
+
+from rf_channel import DEMOD_FLOOR_DB, time_on_air_us
+from rf_sim import Simulation
+
+HEADER = struct.Struct("<HI")  # source node, sequence number
+PAYLOAD_LENGTH = 20
+
+
+class Traffic:
+    """
+    Poisson traffic for one node, recording send times by (source, seq).
+    """
+    def __init__(self, sim, node, index, interval_ms, rng, log):
+        self.sim = sim
+        self.node = node
+        self.index = index
+        self.interval_ms = interval_ms
+        self.rng = rng
+        self.log = log
+        self.seq = 0
+        self.busy = 0
+        node.driver.receive_irq(callback=self.received)
+        self.schedule()
+
+    def schedule(self):
+        self.sim.at(self.sim.now_ms + self.rng.expovariate(1 / self.interval_ms), self.send)
+
+    def send(self):
+        lora = self.node.driver
+        if lora.tx_pending():
+            self.busy += 1
+        else:
+            self.seq += 1
+            payload = HEADER.pack(self.index, self.seq)
+            payload += bytes(PAYLOAD_LENGTH - len(payload))
+            self.log["sent"][(self.index, self.seq)] = self.sim.now_ms
+            lora.send_nowait(payload)
+        self.schedule()
+
+    def received(self, payload):
+        if len(payload) != PAYLOAD_LENGTH:
+            return
+        key = HEADER.unpack_from(payload)
+        sent_at = self.log["sent"].get(key)
+        if sent_at is not None:
+            self.log["latency"].append(self.sim.now_ms - sent_at)
+
+
+def in_range_pairs(sim):
+    """
+    Number of ordered (sender, receiver) pairs whose link SNR clears the
+    demodulation floor, i.e. the receptions a perfect MAC would get.
+    """
+    channel = sim.channel
+    pairs = 0
+    for tx in sim.nodes:
+        power = tx.radio.tx_power_dbm()
+        for rx in sim.nodes:
+            if rx is tx:
+                continue
+            modem = rx.radio.modem_config()
+            snr = power - channel.path_loss_db(tx.radio, rx.radio) - channel.noise_floor_dbm(modem.bandwidth)
+            if snr >= DEMOD_FLOOR_DB[modem.sf]:
+                pairs += 1
+    return pairs
+
+
+def run(nodes, seconds, interval_s, sf, field, seed):
+    rng = random.Random(seed)
+    log = {"sent": {}, "latency": []}
+    parameters = {"frequency": 868100000, "spreading_factor": sf, "tx_power_level": 14}
+    with Simulation(seed=seed, shadowing_db=4.0) as sim:
+        traffic = []
+        for i in range(nodes):
+            position = (rng.uniform(0, field), rng.uniform(0, field))
+            node = sim.add_ulora("egg{}".format(i), position, parameters)
+            traffic.append(Traffic(sim, node, i, interval_s * 1000, rng, log))
+        pairs = in_range_pairs(sim)
+
+        start = time.perf_counter()
+        sim.run(seconds * 1000)
+        wall = time.perf_counter() - start
+
+        sent = len(log["sent"])
+        modem = sim.nodes[0].radio.modem_config()
+        airtime_s = time_on_air_us(modem.sf, modem.bandwidth, modem.coding_rate, modem.preamble,
+                                   PAYLOAD_LENGTH, modem.implicit_header, modem.crc, modem.ldro) / 1e6
+        expected = sent * pairs / nodes if nodes else 0
+        delivered = len(log["latency"])
+        latency = sum(log["latency"]) / delivered if delivered else 0
+        print("{:>6} {:>7} {:>8.3f} {:>7.1%} {:>9.1f} {:>7} {:>6} {:>7.1f}".format(
+            nodes, sent, sent * airtime_s / seconds, delivered / expected if expected else 0,
+            latency, sim.channel.stats["collisions"], sum(t.busy for t in traffic), seconds / wall))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("nodes", nargs="*", type=int, default=[10, 50, 100, 200])
+    parser.add_argument("--seconds", type=float, default=300)
+    parser.add_argument("--interval", type=float, default=10, help="mean seconds between sends per node")
+    parser.add_argument("--sf", type=int, default=7)
+    parser.add_argument("--field", type=float, default=2000, help="side of the square field in metres")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print("SF{}, {} byte packets, one every {} s per node, {} s simulated, {} m field".format(
+        args.sf, PAYLOAD_LENGTH, args.interval, args.seconds, args.field))
+    print("{:>6} {:>7} {:>8} {:>7} {:>9} {:>7} {:>6} {:>7}".format(
+        "nodes", "sent", "offered", "PDR", "latency", "coll.", "busy", "speed"))
+    for nodes in args.nodes:
+        run(nodes, args.seconds, args.interval, args.sf, args.field, args.seed)
+
+
+if __name__ == "__main__":
+    main()
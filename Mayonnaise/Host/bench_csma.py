@@ -0,0 +1,177 @@
+"""
+Listen-before-talk benchmark: CSMA with CAD against plain ALOHA sends.
+
+Places N LoRaTransceiver eggs at random within --radius of a gateway, each
+generating a small packet at random (Poisson) intervals into a queue and
+sending them one at a time, either straight away (ALOHA) or through
+CsmaTransmitter. Nodes near opposite edges cannot hear each other, so CAD
+cannot prevent every collision (hidden terminals). Reports per node count
+and MAC:
+
+    offered   G: airtime of the packets generated per second of simulation
+    PDR       packets the gateway received / packets generated
+    coll.     collision rate: transmissions that overlapped another one
+    goodput   payload bits per second delivered to the gateway
+    S         throughput: airtime of the delivered packets per second
+    latency   mean time from generation to delivery, in ms
+    drop      packets CSMA gave up on after max_attempts busy channels
+    busy      fraction of CAD runs that found the channel busy
+    speed     virtual seconds simulated per wall-clock second
+
+    python3 Host/bench_csma.py [nodes ...] [--seconds 300] [--interval 10]
+                               [--sf 7] [--radius 1500] [--seed 1]
+"""
+import argparse
+import math
+import random
+import time
+
+import hostenv
+
+from bench_channel import HEADER, PAYLOAD_LENGTH
+from rf_sim import Simulation
+from Drivers.lora.csma import CsmaTransmitter
+
+
+class Egg:
+    """
+    One node's traffic: a Poisson source feeding a FIFO that is sent one
+    packet at a time with the chosen MAC.
+    """
+    def __init__(self, sim, node, index, interval_ms, csma, rng, log):
+        self.sim = sim
+        self.radio = node.driver
+        self.index = index
+        self.interval_ms = interval_ms
+        self.rng = rng
+        self.log = log
+        # Backoffs draw from their own generator so both MACs see the same traffic
+        self.csma = CsmaTransmitter(self.radio, rng=random.Random(~index)) if csma else None
+        self.queue = []
+        self.sending = False
+        self.seq = 0
+        self.generate_later()
+
+    def generate_later(self):
+        self.sim.at(self.sim.now_ms + self.rng.expovariate(1 / self.interval_ms), self.generate)
+
+    def generate(self):
+        self.seq += 1
+        payload = HEADER.pack(self.index, self.seq)
+        self.queue.append(payload + bytes(PAYLOAD_LENGTH - len(payload)))
+        self.log["generated"][(self.index, self.seq)] = self.sim.now_ms
+        if not self.sending:
+            self.send_next()
+        self.generate_later()
+
+    def send_next(self):
+        if not self.queue:
+            self.sending = False
+            return
+        self.sending = True
+        payload = self.queue.pop(0)
+        if self.csma is None:
+            self.radio.send(payload, wait=False, callback=self.sent)
+        else:
+            self.csma.send_nowait(payload, self.sent)
+            self.pump()
+
+    def pump(self):
+        # Firmware calls pending() from its main loop; here it runs when due
+        if self.csma.pending():
+            self.sim.at(self.sim.now_ms + (self.csma.retry_in_ms() or 1), self.pump)
+
+    def sent(self, ok):
+        # Runs from the DIO0 handler: start the next packet outside it
+        self.sim.at(self.sim.now_ms, self.send_next)
+
+
+def collision_rate(intervals):
+    """
+    Fraction of transmissions that overlapped at least one other.
+    """
+    intervals.sort()
+    collided = [False] * len(intervals)
+    latest_end = -1
+    latest = -1
+    for i, (start, end) in enumerate(intervals):
+        if start < latest_end:
+            collided[i] = True
+            collided[latest] = True
+        if end > latest_end:
+            latest_end = end
+            latest = i
+    return sum(collided) / len(intervals) if intervals else 0.0
+
+
+def run(nodes, csma, seconds, interval_s, sf, radius, seed):
+    rng = random.Random(seed)
+    log = {"generated": {}, "latency": []}
+    parameters = {"frequency": 868100000, "spreading_factor": sf, "tx_power_level": 14}
+    with Simulation(seed=seed, shadowing_db=4.0) as sim:
+        gateway = sim.add_ulora("gateway", (0, 0), parameters)
+
+        def received(payload):
+            if len(payload) != PAYLOAD_LENGTH:
+                return
+            generated = log["generated"].get(HEADER.unpack_from(payload))
+            if generated is not None:
+                log["latency"].append(sim.now_ms - generated)
+        gateway.driver.receive_irq(callback=received)
+
+        eggs = []
+        for i in range(nodes):
+            r = radius * math.sqrt(rng.random())
+            angle = rng.uniform(0, 2 * math.pi)
+            node = sim.add_transceiver("egg{}".format(i), (r * math.cos(angle), r * math.sin(angle)),
+                                       parameters)
+            eggs.append(Egg(sim, node, i, interval_s * 1000, csma, rng, log))
+
+        intervals = []
+        transmit = sim.channel.transmit
+
+        def logged(radio, payload):
+            tx = transmit(radio, payload)
+            intervals.append((tx.start_us, tx.end_us))
+            return tx
+        sim.channel.transmit = logged
+
+        start = time.perf_counter()
+        sim.run(seconds * 1000)
+        wall = time.perf_counter() - start
+
+        airtime_s = gateway.driver.time_on_air_us(PAYLOAD_LENGTH) / 1e6
+        generated = len(log["generated"])
+        delivered = len(log["latency"])
+        latency = sum(log["latency"]) / delivered if delivered else 0
+        stats = [egg.csma.stats() for egg in eggs if egg.csma]
+        cads = sum(s["cads"] for s in stats)
+        busy = sum(s["busy"] for s in stats) / cads if cads else 0.0
+        print("{:>6} {:>6} {:>8.3f} {:>7.1%} {:>6.1%} {:>8.0f} {:>6.3f} {:>8.0f} {:>5} {:>6.1%} {:>7.1f}".format(
+            nodes, "CSMA" if csma else "ALOHA", generated * airtime_s / seconds,
+            delivered / generated if generated else 0, collision_rate(intervals),
+            delivered * PAYLOAD_LENGTH * 8 / seconds, delivered * airtime_s / seconds,
+            latency, sum(s["dropped"] for s in stats), busy, seconds / wall))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("nodes", nargs="*", type=int, default=[10, 25, 50, 100, 200])
+    parser.add_argument("--seconds", type=float, default=300)
+    parser.add_argument("--interval", type=float, default=10, help="mean seconds between packets per node")
+    parser.add_argument("--sf", type=int, default=7)
+    parser.add_argument("--radius", type=float, default=1500, help="metres from the gateway")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print("SF{}, {} byte packets, one every {} s per node, {} s simulated, {} m radius".format(
+        args.sf, PAYLOAD_LENGTH, args.interval, args.seconds, args.radius))
+    print("{:>6} {:>6} {:>8} {:>7} {:>6} {:>8} {:>6} {:>8} {:>5} {:>6} {:>7}".format(
+        "nodes", "MAC", "offered", "PDR", "coll.", "goodput", "S", "latency", "drop", "busy", "speed"))
+    for nodes in args.nodes:
+        for csma in (False, True):
+            run(nodes, csma, args.seconds, args.interval, args.sf, args.radius, args.seed)
+
+
+if __name__ == "__main__":
+    main()
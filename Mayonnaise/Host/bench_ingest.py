@@ -0,0 +1,164 @@
+"""
+Gateway ingest benchmark: Host/gateway_ingest.py fed through a
+pseudo-terminal pair, with a thread standing in for the receiver board.
+
+The board thread writes --frames telemetry packets from --nodes eggs as
+serial frames into the master end of the pty, at --rate frames per second
+(0: as fast as the pty takes them). Console text is mixed in every
+--noise-every frames, and one frame in --corrupt-every has a byte flipped.
+The daemon reads the slave end, as it would a /dev/ttyACM port. Runs once
+per --workers count, and reports:
+
+    stored   frames written to SQLite (and the columnar file)
+    rate     frames stored per second, from the first write to the last
+    lost     good frames that were not stored (should be 0)
+    crc      frames rejected by their CRC (should match the corrupted ones)
+    batch    mean frames per SQLite transaction
+    write    share of the run spent in SQLite and columnar writes
+    latency  longest time from a frame's arrival to its commit, in ms
+
+    python3 Host/bench_ingest.py [--frames 50000] [--rate 0] [--nodes 50]
+                                 [--workers 0 2 4] [--batch 512]
+                                 [--noise-every 100] [--corrupt-every 1000]
+                                 [--columnar] [--seed 1]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import hostenv
+
+from gateway_ingest import Ingest, SqliteSink, ColumnarSink, open_serial, read_columnar
+from Drivers.lora.serial_frame import FrameWriter
+from Drivers.lora.telemetry import TelemetryEncoder
+
+NOISE = b"Received: b'T3#42' | RSSI: -72 dBm | SNR: 7.5 dB\r\n"
+
+
+class Buffer:
+    """Stream that collects what FrameWriter writes."""
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+
+def board_stream(frames, nodes, noise_every, corrupt_every, rng):
+    """
+    :return: (bytes the board sends, good frames in it, corrupted frames).
+    """
+    stream = Buffer()
+    writer = FrameWriter(stream)
+    encoders = [TelemetryEncoder(node) for node in range(nodes)]
+    corrupted = 0
+    for i in range(frames):
+        encoder = encoders[rng.randrange(nodes)]
+        payload = encoder.encode(ranges=[rng.randrange(20000) for _ in range(4)], position=(1.5, 2.5),
+                                 battery_mv=3700)
+        start = len(stream.data)
+        writer.write(payload, -rng.randrange(40, 120), rng.randrange(-80, 40) / 4, i * 10)
+        if corrupt_every and i % corrupt_every == corrupt_every - 1:
+            # Flip a bit past the sync word, so the frame is seen and rejected
+            stream.data[rng.randrange(start + 4, len(stream.data))] ^= 0x10
+            corrupted += 1
+        if noise_every and i % noise_every == 0:
+            stream.data += NOISE
+    return bytes(stream.data), frames - corrupted, corrupted
+
+
+def feed(master, data, frames, rate):
+    # The board: write whole chunks, paced to rate frames per second
+    chunk = 4096
+    per_chunk_s = chunk / (len(data) / frames) / rate if rate else 0
+    start = time.time()
+    for i, pos in enumerate(range(0, len(data), chunk)):
+        view = memoryview(data)[pos:pos + chunk]
+        while view:
+            view = view[os.write(master, view):]
+        if rate:
+            delay = start + (i + 1) * per_chunk_s - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+
+def run(args, workers, data, good, corrupted):
+    with tempfile.TemporaryDirectory() as directory:
+        master, slave = os.openpty()
+        fd = open_serial(os.ttyname(slave))
+        sinks = [SqliteSink(os.path.join(directory, "packets.db"))]
+        if args.columnar:
+            sinks.append(ColumnarSink(os.path.join(directory, "packets.col")))
+        ingest = Ingest(fd, sinks, workers=workers, batch=args.batch, flush_ms=args.flush_ms)
+        board = threading.Thread(target=feed, args=(master, data, args.frames, args.rate), daemon=True)
+
+        def watch():
+            # Stop once everything is in, or nothing has arrived for a while
+            last, idle = -1, 0
+            while idle < 20:
+                time.sleep(0.1)
+                stats = ingest.stats()
+                done = stats["frames"] + stats["crc_errors"]
+                if stats["stored"] >= good and done >= good + corrupted:
+                    break
+                idle = idle + 1 if done == last else 0
+                last = done
+            ingest.stop()
+        start = time.perf_counter()
+        board.start()
+        threading.Thread(target=watch, daemon=True).start()
+        ingest.run()
+        elapsed = time.perf_counter() - start
+        board.join()
+        os.close(fd)
+        os.close(slave)
+        os.close(master)
+
+        stats = ingest.stats()
+        db = sqlite3.connect(os.path.join(directory, "packets.db"))
+        rows, decoded = db.execute("SELECT COUNT(*), COUNT(node) FROM packets").fetchone()
+        db.close()
+        if args.columnar:
+            columnar = sum(len(block["payload"]) for block in read_columnar(os.path.join(directory, "packets.col")))
+            if columnar != rows:
+                print("columnar file has {} rows, database {}".format(columnar, rows))
+        if decoded != rows:
+            print("{} of {} rows did not decode".format(rows - decoded, rows))
+        print("{:>7} {:>7} {:>8.0f} {:>5} {:>5} {:>6.0f} {:>6.1%} {:>8.0f}".format(
+            workers, rows, rows / elapsed, good - rows, stats["crc_errors"],
+            stats["stored"] / (stats["batches"] or 1), stats["write_s"] / elapsed,
+            stats["latency_max_s"] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--frames", type=int, default=50000)
+    parser.add_argument("--rate", type=float, default=0, help="frames per second, 0 for flat out")
+    parser.add_argument("--nodes", type=int, default=50)
+    parser.add_argument("--workers", nargs="*", type=int, default=[0, 2, 4])
+    parser.add_argument("--batch", type=int, default=512)
+    parser.add_argument("--flush-ms", type=int, default=200)
+    parser.add_argument("--noise-every", type=int, default=100)
+    parser.add_argument("--corrupt-every", type=int, default=1000)
+    parser.add_argument("--columnar", action="store_true", help="also write the columnar file")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    data, good, corrupted = board_stream(args.frames, args.nodes, args.noise_every, args.corrupt_every,
+                                         random.Random(args.seed))
+    print("{} frames ({} corrupted) in {} bytes from {} nodes, {}, batches of {}{}".format(
+        args.frames, corrupted, len(data), args.nodes,
+        "{:.0f} frames/s".format(args.rate) if args.rate else "flat out", args.batch,
+        ", columnar" if args.columnar else ""))
+    print("{:>7} {:>7} {:>8} {:>5} {:>5} {:>6} {:>6} {:>8}".format(
+        "workers", "stored", "rate", "lost", "crc", "batch", "write", "latency"))
+    for workers in args.workers:
+        run(args, workers, data, good, corrupted)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Mesh flooding benchmark: Pico_Meshtastic's MeshRouter on the simulated RF
+channel.
+
+Scatters N nodes running the Pico_Meshtastic LoRa driver over a square
+--area metres wide, at a transmit power that reaches only a fraction of it,
+so packets need several hops. Every node broadcasts a small packet at
+random (Poisson) intervals. Runs each node count with three routers:
+
+    direct    hop limit 0: no relaying, one-hop reach only
+    flood     every node relays every first copy after a uniform random delay
+    managed   SNR-weighted delay (far nodes relay first), relays dropped on
+              hearing --redundancy other nodes' (counter-based flooding)
+
+and reports:
+
+    conn.     mean fraction of the other nodes a packet could reach at all,
+              through any chain of links (the bound on reach)
+    reach     mean fraction of the other nodes each packet was delivered to
+    full      fraction of packets that reached every node
+    tx/pkt    transmissions per packet generated (1 + relays)
+    air/pkt   airtime spent per packet generated, in ms
+    util      airtime of all transmissions / simulated time
+    coll.     collisions at receivers, per packet generated
+    speed     virtual seconds simulated per wall-clock second
+
+    python3 Host/bench_mesh.py [nodes ...] [--seconds 1200] [--interval 600]
+                               [--area 8000] [--hop-limit 7] [--redundancy 2]
+                               [--mode direct flood managed] [--seed 1]
+"""
+import argparse
+import random
+import time
+import types
+
+import hostenv
+
+from rf_channel import DEMOD_FLOOR_DB
+from rf_sim import Simulation, meshtastic_module
+
+mesh = meshtastic_module("mesh")
+# The driver runs gc.collect() for every packet it reads, cheap on the Pico
+# but a full CPython collection here: skip it
+meshtastic_module("lora").gc = types.SimpleNamespace(collect=lambda: None)
+
+PAYLOAD_LENGTH = 16
+POLL_MS = 5
+RADIO = {"frequency": 915.0, "bandwidth": 125000, "spreading_factor": 7, "preamble_length": 8,
+         "crc": True, "tx_power": 2}
+
+
+class SimRouter(mesh.MeshRouter):
+    """
+    MeshRouter whose main loop sleeps until next_poll_ms(), so hundreds of
+    idle nodes cost no events: a received packet wakes it.
+    """
+    def __init__(self, sim, *args, **kwargs):
+        self.sim = sim
+        self.wake_at = None      # when the loop runs next, None while idle
+        self._loops = 0          # scheduled loops; only the latest runs
+        super().__init__(*args, **kwargs)
+
+    def _on_packet(self, payload):
+        super()._on_packet(payload)
+        self.wake()
+
+    def wake(self):
+        if self.wake_at is None or self.wake_at > self.sim.now_ms:
+            self._schedule(self.sim.now_ms)
+
+    def _schedule(self, ms):
+        self._loops += 1
+        self.wake_at = ms
+        self.sim.at(ms, self.loop, self._loops)
+
+    def loop(self, n):
+        if n != self._loops:
+            return  # superseded by an earlier wake()
+        self.poll()
+        wait = self.next_poll_ms()
+        if wait < 0:
+            self.wake_at = None
+        else:
+            self._schedule(self.sim.now_ms + max(wait, POLL_MS))
+
+
+def connected(sim, nodes):
+    """
+    :return: For each node, how many others it can reach through links
+             that close on their own (no interference).
+    """
+    return [len(seen) - 1 for seen in reachable(sim, nodes)]
+
+
+def reachable(sim, nodes):
+    """
+    :return: For each node, the set of node indices (itself included) it
+             can reach through links that close on their own.
+    """
+    radios = [node.radio for node in nodes]
+    modem = radios[0].modem_config()
+    floor = sim.channel.noise_floor_dbm(modem.bandwidth) + DEMOD_FLOOR_DB[modem.sf]
+    links = [[j for j, b in enumerate(radios)
+              if b is not a and a.tx_power_dbm() - sim.channel.path_loss_db(a, b) >= floor]
+             for a in radios]
+    reach = []
+    for i in range(len(radios)):
+        seen = {i}
+        frontier = [i]
+        while frontier:
+            frontier = [j for k in frontier for j in links[k] if j not in seen]
+            seen.update(frontier)
+        reach.append(seen)
+    return reach
+
+
+def run(nodes, mode, seconds, interval_s, area, hop_limit, redundancy, seed):
+    rng = random.Random(seed)
+    reached = {}
+    with Simulation(seed=seed) as sim:
+        routers = []
+        sim_nodes = []
+        for i in range(nodes):
+            node = sim.add_meshtastic("node{}".format(i), (rng.uniform(0, area), rng.uniform(0, area)),
+                                      **RADIO)
+            sim_nodes.append(node)
+
+            def received(source, payload, rssi, snr, i=i):
+                reached.setdefault(bytes(payload[:4]), set()).add(i)
+            routers.append(SimRouter(sim, node.driver, i, hop_limit=0 if mode == "direct" else hop_limit,
+                                     managed=mode == "managed", redundancy=redundancy, on_receive=received,
+                                     rng=random.Random(seed * 1000 + i)))
+
+        generated = []
+        reachable = connected(sim, sim_nodes)
+
+        def generate(i):
+            router = routers[i]
+            tag = len(generated).to_bytes(4, "little")
+            if router.send(tag + bytes(PAYLOAD_LENGTH - 4)) is not None:
+                generated.append((tag, reachable[i]))
+                router.wake()
+            sim.at(sim.now_ms + rng.expovariate(1 / (interval_s * 1000)), generate, i)
+        for i in range(nodes):
+            sim.at(rng.uniform(0, interval_s * 1000), generate, i)
+
+        airtime = [0]
+        transmit = sim.channel.transmit
+
+        def logged(radio, payload):
+            tx = transmit(radio, payload)
+            airtime[0] += tx.end_us - tx.start_us
+            return tx
+        sim.channel.transmit = logged
+
+        start = time.perf_counter()
+        # Stop generating at the end, then let the last floods finish
+        sim.run(seconds * 1000)
+        for router in routers:
+            router.send = lambda *args, **kwargs: None
+        sim.run(10000)
+        wall = time.perf_counter() - start
+
+        counts = [len(reached.get(tag, ())) for tag, bound in generated]
+        packets = len(generated) or 1
+        transmissions = sim.channel.stats["transmissions"]
+        print("{:>6} {:>8} {:>6.1%} {:>7.1%} {:>6.1%} {:>7.1f} {:>8.0f} {:>6.1%} {:>6.2f} {:>7.1f}".format(
+            nodes, mode, sum(bound for tag, bound in generated) / packets / (nodes - 1),
+            sum(counts) / packets / (nodes - 1), sum(c == nodes - 1 for c in counts) / packets,
+            transmissions / packets, airtime[0] / 1000 / packets, airtime[0] / 1e6 / (seconds + 10),
+            sim.channel.stats["collisions"] / packets, (seconds + 10) / wall))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("nodes", nargs="*", type=int, default=[50, 100, 150])
+    parser.add_argument("--seconds", type=float, default=1200)
+    parser.add_argument("--interval", type=float, default=600, help="mean seconds between packets per node")
+    parser.add_argument("--area", type=float, default=8000, help="side of the square, metres")
+    parser.add_argument("--hop-limit", type=int, default=7)
+    parser.add_argument("--redundancy", type=int, default=2)
+    parser.add_argument("--mode", nargs="*", default=["direct", "flood", "managed"])
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print("SF7 125 kHz, {} dBm, {} byte packets, one every {} s per node, {} s, {} m square".format(
+        RADIO["tx_power"], PAYLOAD_LENGTH + mesh.HEADER_SIZE, args.interval, args.seconds, args.area))
+    print("{:>6} {:>8} {:>6} {:>7} {:>6} {:>7} {:>8} {:>6} {:>6} {:>7}".format(
+        "nodes", "router", "conn.", "reach", "full", "tx/pkt", "air/pkt", "util", "coll.", "speed"))
+    for nodes in args.nodes:
+        for mode in args.mode:
+            run(nodes, mode, args.seconds, args.interval, args.area, args.hop_limit, args.redundancy, args.seed)
+
+
+if __name__ == "__main__":
+    main()
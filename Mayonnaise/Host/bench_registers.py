@@ -0,0 +1,135 @@
+"""
+Allocation-counting benchmark for ULoRa register access on CPython.
+
+Counts every bytes / bytearray / memoryview object constructed by the
+driver code while reading registers, polling IRQ flags and writing
+configuration, comparing the preallocated-buffer transfer() with the
+original allocate-per-call version, and switching between two modem
+profiles with the individual setters versus apply_profile(). The fake SX127x stands in for the SPI
+bus, so SPI transaction counts are reported as well. Slicing an existing
+memoryview (one small object per burst on MicroPython) is not counted.
+
+    python3 Host/bench_registers.py [iterations]
+"""
+import sys
+import time
+import types
+
+import hostenv
+
+from fake_sx127x import FakeSX127x
+from Drivers.lora import lora as lora_module
+from Drivers.lora.lora import ULoRa, REG_IRQ_FLAGS, REG_FRF_MSB, REG_FRF_MID, REG_FRF_LSB
+
+COUNTED = ("bytes", "bytearray", "memoryview")
+
+
+class AllocationCounter:
+    """
+    Replace the buffer constructors in the given modules with counting
+    wrappers while the context is active.
+    """
+    def __init__(self, *modules):
+        self.modules = modules
+        self.count = 0
+
+    def __enter__(self):
+        builtins = __builtins__ if isinstance(__builtins__, dict) else vars(__builtins__)
+        for module in self.modules:
+            for name in COUNTED:
+                setattr(module, name, self._wrap(builtins[name]))
+        return self
+
+    def __exit__(self, *exc):
+        for module in self.modules:
+            for name in COUNTED:
+                delattr(module, name)
+
+    def _wrap(self, constructor):
+        def counted(*args):
+            self.count += 1
+            return constructor(*args)
+        return counted
+
+
+def legacy_transfer(self, address, value=0x00):
+    """The original transfer(): three buffer objects per register access."""
+    response = bytearray(1)
+    self.pin_ss.value(0)
+    self.spi.write(bytes([address]))
+    self.spi.write_readinto(bytes([value]), response)
+    self.pin_ss.value(1)
+    return int.from_bytes(response, 'big')
+
+
+def legacy_set_frequency(self, frequency):
+    """The original set_frequency(): one transaction per register."""
+    frf = (frequency << 19) // 32000000
+    self.write_register(REG_FRF_MSB, (frf >> 16) & 0xFF)
+    self.write_register(REG_FRF_MID, (frf >> 8) & 0xFF)
+    self.write_register(REG_FRF_LSB, frf & 0xFF)
+
+
+def measure(name, lora, radio, func, iterations):
+    transactions = radio.spi_transactions
+    with AllocationCounter(lora_module, sys.modules[__name__]) as counter:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = time.perf_counter() - start
+    transactions = radio.spi_transactions - transactions
+    print("{:<32} {:>8.2f} allocs/op {:>6.2f} SPI txn/op {:>8.2f} us/op".format(
+        name, counter.count / iterations, transactions / iterations,
+        elapsed / iterations * 1e6))
+
+
+PROFILES = {
+    "long_range": {"spreading_factor": 12, "signal_bandwidth": 125e3, "coding_rate": 8},
+    "fast": {"spreading_factor": 7, "signal_bandwidth": 250e3, "coding_rate": 5},
+}
+
+
+def setter_switch(lora, parameters):
+    """Change profile the way callers did before apply_profile()."""
+    lora.set_frequency(parameters["frequency"])
+    lora.set_signal_bandwidth(parameters["signal_bandwidth"])
+    lora.set_spreading_factor(parameters["spreading_factor"])
+    lora.set_coding_rate(parameters["coding_rate"])
+    lora.set_preamble_length(parameters["preamble_length"])
+    lora.set_tx_power(parameters["tx_power_level"])
+
+
+def main(iterations):
+    radio = FakeSX127x(spi_id=1, ss=10, dio0=5)
+    lora = ULoRa(lora_module.SPI(1), {"ss": 10, "reset": 4, "dio0": 5}, profiles=PROFILES)
+    print("\n{} iterations per case".format(iterations))
+
+    def poll():
+        lora.read_register(REG_IRQ_FLAGS)
+
+    def config():
+        lora.set_frequency(868000000)
+
+    names = ["long_range", "fast"]
+
+    def switch_setters():
+        names.reverse()
+        setter_switch(lora, lora.profiles[names[0]].parameters)
+
+    def switch_profile():
+        names.reverse()
+        lora.apply_profile(names[0])
+
+    measure("profile switch (setters)", lora, radio, switch_setters, iterations)
+    measure("profile switch (apply_profile)", lora, radio, switch_profile, iterations)
+    measure("read_register (preallocated)", lora, radio, poll, iterations)
+    measure("set_frequency (batched)", lora, radio, config, iterations)
+
+    lora.transfer = types.MethodType(legacy_transfer, lora)
+    lora.set_frequency = types.MethodType(legacy_set_frequency, lora)
+    measure("read_register (original)", lora, radio, poll, iterations)
+    measure("set_frequency (original)", lora, radio, config, iterations)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,147 @@
+"""
+Mesh routing benchmark: Pico_Meshtastic's DistanceVectorRouter against the
+managed flood, for unicast traffic on the simulated RF channel.
+
+Scatters N nodes over a square as bench_mesh.py does. After --warm-up
+seconds in which the routers only exchange adverts, every node sends small
+packets at random (Poisson) intervals, each to a random node it could reach
+through some chain of links. Runs each node count with two routers:
+
+    flood     MeshRouter: the managed flood, unicast packets go everywhere
+    routed    DistanceVectorRouter: along the next-hop table, flooded only
+              when there is no route
+
+and reports, over the measured period only:
+
+    pdr       fraction of packets delivered to their destination
+    tx/pkt    transmissions per packet generated, adverts included
+    air/pkt   airtime spent per packet generated, adverts included, in ms
+    adv.      share of that airtime spent on adverts
+    fallb.    fraction of packets (sends and forwards) flooded for want of
+              a route
+    routes    mean routes held per node at the end
+    coll.     collisions at receivers, per packet generated
+    speed     virtual seconds simulated per wall-clock second
+
+    python3 Host/bench_routing.py [nodes ...] [--seconds 1200] [--interval 300]
+                                  [--warm-up 600] [--advert-interval 300]
+                                  [--area 8000] [--mode flood routed] [--seed 1]
+"""
+import argparse
+import random
+import time
+
+import hostenv
+
+from rf_sim import Simulation, meshtastic_module
+from bench_mesh import SimRouter, RADIO, reachable
+
+routing = meshtastic_module("routing")
+
+PAYLOAD_LENGTH = 16
+HOP_LIMIT = 7
+
+
+class SimDistanceVectorRouter(SimRouter, routing.DistanceVectorRouter):
+    """
+    DistanceVectorRouter with SimRouter's event-driven main loop.
+    """
+
+
+def run(nodes, mode, seconds, interval_s, warm_up_s, advert_interval_s, area, seed):
+    rng = random.Random(seed)
+    delivered = set()
+    with Simulation(seed=seed) as sim:
+        routers = []
+        sim_nodes = []
+        for i in range(nodes):
+            node = sim.add_meshtastic("node{}".format(i), (rng.uniform(0, area), rng.uniform(0, area)),
+                                      **RADIO)
+            sim_nodes.append(node)
+
+            def received(source, payload, rssi, snr, i=i):
+                delivered.add((bytes(payload[:4]), i))
+            options = {"hop_limit": HOP_LIMIT, "on_receive": received, "rng": random.Random(seed * 1000 + i)}
+            if mode == "routed":
+                router = SimDistanceVectorRouter(sim, node.driver, i, table_size=nodes,
+                                                 advert_interval_ms=int(advert_interval_s * 1000), **options)
+            else:
+                router = SimRouter(sim, node.driver, i, **options)
+            routers.append(router)
+            router.wake()
+
+        generated = []
+        reach = reachable(sim, sim_nodes)
+
+        def generate(i):
+            others = sorted(reach[i] - {i})
+            if others:
+                destination = rng.choice(others)
+                tag = len(generated).to_bytes(4, "little")
+                if routers[i].send(tag + bytes(PAYLOAD_LENGTH - 4), destination) is not None:
+                    generated.append((tag, destination))
+                    routers[i].wake()
+            sim.at(sim.now_ms + rng.expovariate(1 / (interval_s * 1000)), generate, i)
+        for i in range(nodes):
+            sim.at(warm_up_s * 1000 + rng.uniform(0, interval_s * 1000), generate, i)
+
+        airtime = {"data": 0, "advert": 0}
+        transmit = sim.channel.transmit
+
+        def logged(radio, payload):
+            tx = transmit(radio, payload)
+            if sim.now_ms >= warm_up_s * 1000:
+                kind = "advert" if payload[0] & 0xF0 == routing.ADVERT else "data"
+                airtime[kind] += tx.end_us - tx.start_us
+            return tx
+        sim.channel.transmit = logged
+
+        start = time.perf_counter()
+        sim.run(warm_up_s * 1000)
+        transmissions = sim.channel.stats["transmissions"]
+        collisions = sim.channel.stats["collisions"]
+        sim.run(seconds * 1000)
+        # Stop generating, then let the last packets arrive
+        for router in routers:
+            router.send = lambda *args, **kwargs: None
+        sim.run(10000)
+        wall = time.perf_counter() - start
+
+        packets = len(generated) or 1
+        total_air = airtime["data"] + airtime["advert"]
+        fallbacks = sum(getattr(r, "fallbacks", 0) for r in routers)
+        forwarded = fallbacks + sum(getattr(r, "routed", 0) for r in routers)
+        print("{:>6} {:>7} {:>6.1%} {:>7.1f} {:>8.0f} {:>5.0%} {:>6.1%} {:>6.1f} {:>6.2f} {:>7.1f}".format(
+            nodes, mode, sum((tag, d) in delivered for tag, d in generated) / packets,
+            (sim.channel.stats["transmissions"] - transmissions) / packets, total_air / 1000 / packets,
+            airtime["advert"] / (total_air or 1), fallbacks / (forwarded or 1) if mode == "routed" else 1,
+            sum(len(getattr(r, "table", ())) for r in routers) / nodes,
+            (sim.channel.stats["collisions"] - collisions) / packets, (warm_up_s + seconds + 10) / wall))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("nodes", nargs="*", type=int, default=[50, 100, 150])
+    parser.add_argument("--seconds", type=float, default=1200)
+    parser.add_argument("--interval", type=float, default=300, help="mean seconds between packets per node")
+    parser.add_argument("--warm-up", type=float, default=600, help="seconds of adverts before traffic starts")
+    parser.add_argument("--advert-interval", type=float, default=300)
+    parser.add_argument("--area", type=float, default=8000, help="side of the square, metres")
+    parser.add_argument("--mode", nargs="*", default=["flood", "routed"])
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print("SF7 125 kHz, {} dBm, {} byte payloads, one every {} s per node, adverts every {} s, "
+          "{} s after {} s warm-up, {} m square".format(
+              RADIO["tx_power"], PAYLOAD_LENGTH, args.interval, args.advert_interval, args.seconds,
+              args.warm_up, args.area))
+    print("{:>6} {:>7} {:>6} {:>7} {:>8} {:>5} {:>6} {:>6} {:>6} {:>7}".format(
+        "nodes", "router", "pdr", "tx/pkt", "air/pkt", "adv.", "fallb.", "routes", "coll.", "speed"))
+    for nodes in args.nodes:
+        for mode in args.mode:
+            run(nodes, mode, args.seconds, args.interval, args.warm_up, args.advert_interval, args.area,
+                args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+TDMA benchmark: beacon-synchronised slots against eggs sending on their own
+timers, with and without listen-before-talk.
+
+Places N LoRaTransceiver eggs at random within --radius of a gateway. Each
+sends a small packet every --interval seconds on its own timer, as the
+example scripts do, from a random phase and on a crystal that is up to
+--ppm fast or slow. Timestamps taken in interrupt handlers land up to
+--jitter-us late. Runs each node count with three MACs:
+
+    ALOHA   send when the timer fires
+    CSMA    CsmaTransmitter: CAD and backoff
+    TDMA    TdmaScheduler: wait for the egg's slot in the gateway's frame,
+            sized to give every egg one
+
+and reports:
+
+    frame   TDMA frame length in ms (slot ms x slots + beacon)
+    PDR     packets the gateway received / packets generated
+    coll.   transmissions that overlapped another one, beacons included
+    latency mean time from generation to delivery, in ms
+    sync    mean / worst egg clock error over one frame, in us
+    drift   mean error of the eggs' drift estimates, in ppm
+    util.   fraction of slots that carried a packet
+    speed   virtual seconds simulated per wall-clock second
+
+    python3 Host/bench_tdma.py [nodes ...] [--seconds 300] [--interval 20]
+                               [--sf 7] [--radius 1500] [--ppm 30]
+                               [--jitter-us 50] [--seed 1]
+"""
+import argparse
+import math
+import random
+import time
+
+import hostenv
+import utime
+
+from bench_channel import HEADER, PAYLOAD_LENGTH
+from bench_csma import collision_rate
+from rf_sim import Simulation
+from Drivers.lora.csma import CsmaTransmitter
+from Drivers.lora.tdma import TdmaBeacon, TdmaScheduler, slot_ms_for, beacon_tail_us
+
+GUARD_MS = 5
+MACS = ("ALOHA", "CSMA", "TDMA")
+
+
+class Egg:
+    """
+    One node: a fixed timer on a skewed crystal feeding a FIFO that is sent
+    one packet at a time with the chosen MAC.
+    """
+    def __init__(self, sim, node, index, interval_ms, mac, rng, log):
+        self.sim = sim
+        self.radio = node.driver
+        self.index = index
+        self.log = log
+        self.ppm = rng.uniform(-log["ppm"], log["ppm"])
+        offset = rng.getrandbits(30)
+        jitter = random.Random(~index)
+        # Crystal error, an arbitrary boot time and interrupt latency
+        self.clock = lambda: (int(sim.clock.now_us * (1 + self.ppm / 1e6)) + offset +
+                              jitter.randrange(log["jitter_us"] + 1)) % utime.TICKS_PERIOD
+        self.interval_ms = interval_ms * (1 + self.ppm / 1e6)
+        self.mac = None
+        if mac == "CSMA":
+            self.mac = CsmaTransmitter(self.radio, rng=random.Random(~index))
+        elif mac == "TDMA":
+            self.mac = TdmaScheduler(self.radio, index, clock=self.clock)
+            self.radio.start_listening(callback=self.mac.on_packet)
+            sim.every(20, self.drain)
+        self.queue = []
+        self.sending = False
+        self.seq = 0
+        sim.at(rng.uniform(0, interval_ms), self.generate)
+
+    def generate(self):
+        if self.sim.now_ms >= self.log["stop_ms"]:
+            return
+        self.seq += 1
+        payload = HEADER.pack(self.index, self.seq)
+        self.queue.append(payload + bytes(PAYLOAD_LENGTH - len(payload)))
+        self.log["generated"][(self.index, self.seq)] = self.sim.now_ms
+        if not self.sending:
+            self.send_next()
+        self.sim.at(self.sim.now_ms + self.interval_ms, self.generate)
+
+    def drain(self):
+        # The egg's RX task: beacons go to the scheduler
+        packet = self.radio.poll(raw=True)
+        while packet:
+            self.mac.handle(packet[0])
+            packet = self.radio.poll(raw=True)
+
+    def send_next(self):
+        if not self.queue:
+            self.sending = False
+            return
+        self.sending = True
+        payload = self.queue.pop(0)
+        if self.mac is None:
+            self.radio.send(payload, wait=False, callback=self.sent)
+        else:
+            self.mac.send_nowait(payload, self.sent)
+            self.pump()
+
+    def pump(self):
+        # Firmware calls pending() from its main loop; here it runs when due
+        if self.mac.pending():
+            self.sim.at(self.sim.now_ms + (self.mac.retry_in_ms() or 1), self.pump)
+
+    def sent(self, ok):
+        # Runs from the DIO0 handler: start the next packet outside it
+        self.sim.at(self.sim.now_ms, self.send_next)
+
+
+def frame_ms(radio, nodes):
+    """
+    :return: (frame, slot) lengths in ms giving each of nodes eggs a slot.
+    """
+    slot_ms = slot_ms_for(radio, PAYLOAD_LENGTH, GUARD_MS)
+    frame = nodes * slot_ms + -(-beacon_tail_us(radio, GUARD_MS * 1000) // 1000)
+    return -(-frame // 100) * 100, slot_ms
+
+
+def run(nodes, mac, seconds, interval_s, sf, radius, ppm, jitter_us, seed):
+    rng = random.Random(seed)
+    log = {"generated": {}, "latency": [], "ppm": ppm, "jitter_us": jitter_us, "stop_ms": seconds * 1000}
+    parameters = {"frequency": 868100000, "spreading_factor": sf, "tx_power_level": 14}
+    with Simulation(seed=seed, shadowing_db=4.0) as sim:
+        gateway = sim.add_transceiver("gateway", (0, 0), parameters)
+        beacon = None
+        frame = slot = 0
+        if mac == "TDMA":
+            frame, slot = frame_ms(gateway.driver, nodes)
+            beacon = TdmaBeacon(gateway.driver, frame_ms=frame, slot_ms=slot, guard_ms=GUARD_MS,
+                                clock=lambda: sim.clock.now_us)
+
+            def pump_beacon():
+                sim.at(sim.now_ms + max(beacon.pending(), 1), pump_beacon)
+            sim.at(0, pump_beacon)
+
+        def received(payload):
+            if beacon is not None:
+                beacon.on_packet(payload)
+            if len(payload) != PAYLOAD_LENGTH:
+                return
+            generated = log["generated"].get(HEADER.unpack_from(payload))
+            if generated is not None:
+                log["latency"].append(sim.now_ms - generated)
+        gateway.driver.start_listening(callback=received, slots=0)
+
+        eggs = []
+        for i in range(nodes):
+            r = radius * math.sqrt(rng.random())
+            angle = rng.uniform(0, 2 * math.pi)
+            node = sim.add_transceiver("egg{}".format(i), (r * math.cos(angle), r * math.sin(angle)),
+                                       parameters)
+            eggs.append(Egg(sim, node, i, interval_s * 1000, mac, rng, log))
+
+        intervals = []
+        transmit = sim.channel.transmit
+
+        def logged(radio, payload):
+            tx = transmit(radio, payload)
+            intervals.append((tx.start_us, tx.end_us))
+            return tx
+        sim.channel.transmit = logged
+
+        start = time.perf_counter()
+        # Stop generating at the end, then give queued packets a frame to go
+        sim.run(seconds * 1000 + frame + 1000)
+        wall = time.perf_counter() - start
+
+        generated = len(log["generated"])
+        delivered = len(log["latency"])
+        latency = sum(log["latency"]) / delivered if delivered else 0
+        sync = drift = "-"
+        utilisation = "-"
+        if mac == "TDMA":
+            stats = [egg.mac.stats() for egg in eggs]
+            sync = "{:.0f}/{}".format(sum(s["sync_error_us"] for s in stats) / nodes,
+                                       max(s["max_sync_error_us"] for s in stats))
+            drift = "{:.2f}".format(sum(abs(s["drift_ppm"] - egg.ppm) for s, egg in zip(stats, eggs)) / nodes)
+            utilisation = "{:.1%}".format(beacon.stats()["utilisation"])
+        print("{:>6} {:>6} {:>6} {:>7.1%} {:>6.1%} {:>8.0f} {:>9} {:>6} {:>6} {:>7.1f}".format(
+            nodes, mac, frame or "-", delivered / generated if generated else 0, collision_rate(intervals),
+            latency, sync, drift, utilisation, (seconds * 1000 + frame + 1000) / 1000 / wall))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("nodes", nargs="*", type=int, default=[10, 25, 50, 100, 200])
+    parser.add_argument("--seconds", type=float, default=300)
+    parser.add_argument("--interval", type=float, default=20, help="seconds between packets per node")
+    parser.add_argument("--sf", type=int, default=7)
+    parser.add_argument("--radius", type=float, default=1500, help="metres from the gateway")
+    parser.add_argument("--ppm", type=float, default=30, help="worst crystal error")
+    parser.add_argument("--jitter-us", type=int, default=50, help="worst interrupt latency")
+    parser.add_argument("--mac", nargs="*", default=list(MACS))
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print("SF{}, {} byte packets, one every {} s per node, {} s simulated, {} m radius, "
+          "+-{} ppm, {} us jitter".format(args.sf, PAYLOAD_LENGTH, args.interval, args.seconds,
+                                          args.radius, args.ppm, args.jitter_us))
+    print("{:>6} {:>6} {:>6} {:>7} {:>6} {:>8} {:>9} {:>6} {:>6} {:>7}".format(
+        "nodes", "MAC", "frame", "PDR", "coll.", "latency", "sync", "drift", "util.", "speed"))
+    for nodes in args.nodes:
+        for mac in args.mac:
+            run(nodes, mac, args.seconds, args.interval, args.sf, args.radius, args.ppm, args.jitter_us,
+                args.seed)
+
+
+if __name__ == "__main__":
+    main()
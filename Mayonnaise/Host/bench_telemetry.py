@@ -0,0 +1,96 @@
+"""
+Airtime of the binary telemetry frames against the text payloads they
+replace, at the modem settings the eggs use.
+
+For each kind of message it prints the payload size and time on air of the
+text form (as main.py and uLora/main.py used to send it) and of the binary
+frame, and the airtime saved. Then it times encode() and decode() on the
+host and counts the buffers encode() allocates.
+
+    python3 Host/bench_telemetry.py [--sf 7 9 12] [--bandwidth 125000]
+"""
+import argparse
+import time
+
+import hostenv
+
+from bench_registers import AllocationCounter
+from rf_channel import time_on_air_us
+from Drivers.lora import telemetry
+from Drivers.lora.telemetry import TelemetryEncoder, TYPE_PING, TYPE_TELEMETRY, decode
+
+RANGES = [1.512, 2.304, 1.815, 2.750, 0, 0, 0, 0]
+POSITION = (2.30, 1.70)
+RSSI, SNR, BATTERY_MV = -72, 7.25, 3912
+
+
+def messages(encoder):
+    """
+    (name, text payload, binary payload) for each kind of message.
+    """
+    full_text = "T3 #42 r={} p={:.2f},{:.2f} rssi={} snr={} bat={}".format(
+        ",".join(str(int(r * 1000)) for r in RANGES if r), POSITION[0], POSITION[1],
+        RSSI, SNR, BATTERY_MV)
+    return [
+        ("ping", "Ping 42", encoder.encode(TYPE_PING)),
+        ("uLora hello", "Hello From Eggbert: 42!", encoder.encode(TYPE_PING)),
+        ("position", "Pos 2.30,1.70", encoder.encode(TYPE_TELEMETRY, position=POSITION)),
+        ("ping + link", "Ping 42 rssi=-72 snr=7.25", encoder.encode(TYPE_PING, rssi=RSSI, snr=SNR)),
+        ("full telemetry", full_text,
+         encoder.encode(TYPE_TELEMETRY, ranges=RANGES, range_scale=1000, position=POSITION,
+                        rssi=RSSI, snr=SNR, battery_mv=BATTERY_MV)),
+    ]
+
+
+def airtime_ms(length, sf, bandwidth):
+    # Egg defaults: CR 4/5, 8 symbol preamble, explicit header, CRC on
+    ldro = (1 << sf) * 1000 / bandwidth > 16
+    return time_on_air_us(sf, bandwidth, 1, 8, length, False, True, ldro) / 1000
+
+
+def airtime_table(sfs, bandwidth):
+    encoder = TelemetryEncoder(3)
+    # Each frame is a view of the shared encode buffer, but its length is fixed
+    rows = [(name, len(text), len(frame)) for name, text, frame in messages(encoder)]
+    for sf in sfs:
+        print("\nSF{} / {:g} kHz".format(sf, bandwidth / 1000))
+        print("{:>16} {:>6} {:>6} {:>10} {:>10} {:>7}".format(
+            "message", "text B", "bin B", "text ms", "bin ms", "saved"))
+        for name, text_len, bin_len in rows:
+            text_ms = airtime_ms(text_len, sf, bandwidth)
+            bin_ms = airtime_ms(bin_len, sf, bandwidth)
+            print("{:>16} {:>6} {:>6} {:>10.1f} {:>10.1f} {:>6.0%}".format(
+                name, text_len, bin_len, text_ms, bin_ms, 1 - bin_ms / text_ms))
+
+
+def codec_speed(iterations=20000):
+    encoder = TelemetryEncoder(3)
+    args = dict(ranges=RANGES, range_scale=1000, position=POSITION, rssi=RSSI, snr=SNR,
+                battery_mv=BATTERY_MV)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        encoder.encode(TYPE_TELEMETRY, **args)
+    encode_us = (time.perf_counter() - start) / iterations * 1e6
+    frame = bytes(encoder.encode(TYPE_TELEMETRY, **args))
+    start = time.perf_counter()
+    for _ in range(iterations):
+        decode(frame)
+    decode_us = (time.perf_counter() - start) / iterations * 1e6
+    with AllocationCounter(telemetry) as counter:
+        for _ in range(100):
+            encoder.encode(TYPE_TELEMETRY, **args)
+    print("\nencode {:.1f} us, decode {:.1f} us per full frame on this host; "
+          "{} buffers allocated per encode".format(encode_us, decode_us, counter.count / 100))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sf", type=int, nargs="+", default=[7, 9, 12])
+    parser.add_argument("--bandwidth", type=float, default=125000)
+    args = parser.parse_args()
+    airtime_table(args.sf, args.bandwidth)
+    codec_speed()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1714 @@
+"""
+Conformance checks for the shared ULoRa driver against the fake SX127x
+register model. Every check builds a fresh radio and driver, exercises one
+behaviour and inspects the registers, FIFO and DIO0 traffic it produced.
+The BU03 checks replay recorded UART byte streams through its frame parser.
+
+    python3 Host/conformance.py          # exits non-zero on any failure
+"""
+import contextlib
+import importlib
+import io
+import math
+import os
+import random
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import hostenv
+import utime
+
+from machine import Pin, UART
+from fake_sx127x import FakeSX127x
+from bench_registers import AllocationCounter
+from Drivers.lora import lora as lora_module
+from Drivers.lora.lora import ULoRa, PacketRing, ModemProfile, DutyCycleLimiter, DutyCycleError, \
+    PA_OUTPUT_RFO_PIN
+from rf_channel import VirtualClock, time_on_air_us
+from rf_sim import Simulation, quiet, meshtastic_module
+from Drivers.lora import telemetry
+from Drivers.lora.csma import CsmaTransmitter
+from Drivers.lora.tdma import ClockSync, TdmaBeacon, TdmaScheduler
+from Drivers.lora.adr import AdrController, KIND_ANS, noise_floor_dbm
+from Drivers.lora.transceiver import LoRaTransceiver
+from Drivers.lora.reliable import ReliableTransport
+from Drivers.lora.fragment import Fragmenter, FLAG_POLL
+from Drivers.lora import serial_frame
+from Drivers.lora.serial_frame import FrameWriter, FrameDecoder
+from Drivers.uwb.bu03 import BU03, BU03Config, FrameParser, FRAME_LENGTH
+from fake_bu03 import FakeBU03
+from Drivers.uwb.position import Multilateration, load_anchors
+from Drivers.uwb.tracking import RangeFilter, PositionTracker
+from gateway_ingest import Ingest, SqliteSink, ColumnarSink, open_serial, read_columnar
+import vendor_drivers
+
+CHECKS = []
+
+# Projects whose ulora/core.py must resolve to the shared driver
+SHIM_PROJECTS = (
+    "Embedded_Systems/uLora",
+    "MicroPython/Pymakr/uLora",
+    "MicroPython/Pymakr/uLora_send",
+    "MicroPython/Pymakr/uLora_receive",
+)
+
+
+def check(func):
+    CHECKS.append(func)
+    return func
+
+
+def setup(parameters=None, profiles=None, **fake_options):
+    Pin.reset_all()
+    radio = FakeSX127x(spi_id=1, ss=10, dio0=5, **fake_options)
+    return radio, ULoRa(*radio.backend(), parameters=parameters, profiles=profiles)
+
+
+def expect(actual, expected, what):
+    if actual != expected:
+        raise AssertionError("{}: expected {!r}, got {!r}".format(what, expected, actual))
+
+
+# ---------------------------
+# Configuration
+# ---------------------------
+@check
+def init_leaves_lora_standby():
+    radio, lora = setup()
+    expect(radio.regs[0x01], 0x81, "RegOpMode")
+    expect(radio.regs[0x0E], 0x00, "FifoTxBaseAddr")
+    expect(radio.regs[0x0F], 0x00, "FifoRxBaseAddr")
+
+
+@check
+def frequency_registers():
+    radio, lora = setup()
+    expect(bytes(radio.regs[0x06:0x09]), b"\x6c\x40\x00", "433 MHz Frf")
+    lora.set_frequency(868000000)
+    expect(bytes(radio.regs[0x06:0x09]), b"\xd9\x00\x00", "868 MHz Frf")
+
+
+@check
+def modem_config_bits():
+    radio, lora = setup({"spreading_factor": 7, "coding_rate": 6, "signal_bandwidth": 250e3})
+    expect(radio.regs[0x1E] >> 4, 7, "SpreadingFactor")
+    expect(radio.regs[0x1E] & 0x04, 0x04, "RxPayloadCrcOn")
+    expect(radio.regs[0x1D] >> 4, 8, "Bw")
+    expect((radio.regs[0x1D] >> 1) & 0x07, 2, "CodingRate")
+    expect(radio.regs[0x1D] & 0x01, 0, "ImplicitHeaderModeOn")
+    lora.enable_crc(False)
+    expect(radio.regs[0x1E] & 0x04, 0, "RxPayloadCrcOn after disable")
+
+
+@check
+def preamble_and_sync_word():
+    radio, lora = setup({"preamble_length": 300, "sync_word": 0x34})
+    expect(bytes(radio.regs[0x20:0x22]), b"\x01\x2c", "Preamble")
+    expect(radio.regs[0x39], 0x34, "SyncWord")
+
+
+@check
+def write_registers_bursts_consecutive_addresses():
+    radio, lora = setup()
+    before = radio.spi_transactions
+    lora.write_registers(((0x06, 0x11), (0x07, 0x22), (0x08, 0x33), (0x20, 0x00), (0x21, 0x0A)))
+    expect(radio.spi_transactions - before, 2, "SPI transactions")
+    expect(bytes(radio.regs[0x06:0x09]), b"\x11\x22\x33", "Frf")
+    expect(radio.regs[0x21], 0x0A, "PreambleLsb")
+
+
+@check
+def register_access_does_not_allocate():
+    radio, lora = setup()
+    with AllocationCounter(lora_module) as counter:
+        for _ in range(100):
+            lora.write_register(0x12, 0xFF)
+            lora.read_register(0x12)
+    expect(counter.count, 0, "buffer allocations")
+
+
+@check
+def shadow_matches_chip_after_init():
+    radio, lora = setup({"spreading_factor": 12, "invert_IQ": True, "implicitHeader": True})
+    expect(lora.check_shadow(), [], "shadow mismatches")
+    expect(lora.implicit_header_mode, True, "implicit header mode")
+
+
+@check
+def config_setters_do_not_read():
+    radio, lora = setup()
+    for setter, value, transactions in ((lora.set_coding_rate, 8, 1),
+                                        (lora.set_signal_bandwidth, 250e3, 1),
+                                        (lora.enable_crc, False, 1),
+                                        (lora.set_spreading_factor, 10, 3)):
+        before = radio.spi_transactions
+        setter(value)
+        expect(radio.spi_transactions - before, transactions, setter.__name__ + " SPI transactions")
+    expect(lora.check_shadow(), [], "shadow mismatches")
+    expect(radio.regs[0x1D], 0x88, "ModemConfig1")
+
+
+@check
+def implicit_poll_is_one_read():
+    radio, lora = setup()
+    lora.receive(4)
+    before = radio.spi_transactions
+    for _ in range(10):
+        lora.received_packet(4)
+    expect(radio.spi_transactions - before, 10, "SPI transactions for 10 polls")
+
+
+@check
+def resync_and_verify_mode():
+    radio, lora = setup()
+    radio.regs[0x39] = 0x34  # written behind the driver's back
+    lora.verify_shadow = True
+    try:
+        lora.read_shadow(0x39)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("verify mode missed a stale shadow")
+    expect(lora.check_shadow(), [(0x39, 0x12, 0x34)], "mismatches")
+    lora.resync()
+    expect(lora.read_shadow(0x39), 0x34, "sync word after resync")
+
+
+@check
+def profile_image_matches_setters():
+    radio, lora = setup()
+    lora.set_spreading_factor(9)
+    lora.set_signal_bandwidth(62500)
+    lora.set_coding_rate(7)
+    lora.set_preamble_length(16)
+    lora.set_frequency(868100000)
+    lora.invert_iq(True)
+    expected = bytes(radio.regs)
+    radio, lora = setup()
+    lora.apply_profile(ModemProfile({"spreading_factor": 9, "signal_bandwidth": 62500, "coding_rate": 7,
+                                     "preamble_length": 16, "frequency": 868100000, "invert_IQ": True}))
+    expect(bytes(radio.regs), expected, "register file")
+    expect(lora.check_shadow(), [], "shadow mismatches")
+
+
+@check
+def profile_switch_writes_only_differences():
+    radio, lora = setup(profiles={"long_range": {"spreading_factor": 12, "coding_rate": 8},
+                                  "fast": {"spreading_factor": 7, "signal_bandwidth": 500e3}})
+    expect(lora.apply_profile("default"), 0, "bursts for the current profile")
+    before = radio.spi_transactions
+    expect(lora.apply_profile("long_range"), 2, "bursts to long_range")
+    expect(radio.spi_transactions - before, 2, "SPI transactions")
+    expect(radio.regs[0x26] & 0x08, 0x08, "LowDataRateOptimize at SF12/125k")
+    expect(lora.apply_profile("fast"), 2, "bursts to fast")
+    expect(radio.regs[0x1D] >> 4, 9, "500 kHz Bw")
+    expect(lora.parameters["spreading_factor"], 7, "parameters follow the profile")
+    expect(lora.check_shadow(), [], "shadow mismatches")
+
+
+@check
+def profile_keeps_pa_output_and_waits_for_cad():
+    radio, lora = setup(parameters={"pa_output_pin": PA_OUTPUT_RFO_PIN, "tx_power_level": 12},
+                        profiles={"low": {"tx_power_level": 5}})
+    expect(radio.regs[0x09], 0x70 | 12, "RFO at 12 dBm")
+    lora.apply_profile("low")
+    expect(radio.regs[0x09], 0x70 | 5, "RFO kept by the profile")
+    lora.set_tx_power(8)
+    expect(radio.regs[0x09], 0x70 | 8, "RFO kept by set_tx_power")
+    radio._start_cad = lambda: None
+    lora.cad_nowait(lambda detected: None)
+    try:
+        lora.apply_profile("default")
+        raise AssertionError("profile applied during CAD")
+    except RuntimeError:
+        pass
+    expect(radio.regs[0x09], 0x70 | 8, "unchanged during CAD")
+
+
+@check
+def profile_switch_resumes_irq_receive():
+    radio, lora = setup(profiles={"fast": {"spreading_factor": 7}})
+    ring = lora.receive_irq()
+    lora.apply_profile("fast")
+    expect(radio.mode(), 0x05, "mode after switch")
+    radio.inject(b"fast")
+    expect(ring.get()[0], b"fast", "payload")
+
+
+@check
+def pin_objects_accepted():
+    Pin.reset_all()
+    radio = FakeSX127x(spi_id=1, ss=10, dio0=5)
+    spi, pins = radio.backend()
+    lora = ULoRa(spi, {"ss": Pin(10, Pin.OUT), "dio0": Pin(5, Pin.IN)})
+    lora.println("pins")
+    expect(radio.sent, [b"pins"], "sent")
+
+
+# ---------------------------
+# Transmit
+# ---------------------------
+@check
+def println_sends_exact_payload():
+    radio, lora = setup()
+    lora.println("Ping 1")
+    lora.println(b"\x00\x01\xff")
+    expect(radio.sent, [b"Ping 1", b"\x00\x01\xff"], "sent")
+    expect(radio.regs[0x12], 0, "IRQ flags cleared")
+
+
+@check
+def write_truncates_at_fifo_size():
+    radio, lora = setup()
+    lora.begin_packet()
+    expect(lora.write(bytes(300)), 255, "bytes written")
+    lora.end_packet()
+    expect(len(radio.sent[0]), 255, "sent length")
+
+
+@check
+def blocking_send_times_out():
+    radio, lora = setup(auto_tx_done=False)
+    try:
+        lora.println("stuck", timeout=20)
+    except RuntimeError:
+        expect(radio.mode(), 0x01, "mode after timeout")
+        return
+    raise AssertionError("no RuntimeError on TX timeout")
+
+
+@check
+def send_nowait_reports_completion():
+    radio, lora = setup(auto_tx_done=False)
+    results = []
+    lora.send_nowait("async", callback=results.append)
+    expect(lora.tx_pending(), True, "pending while on air")
+    expect(radio.regs[0x40] >> 6, 1, "DIO0 mapped to TxDone")
+    radio.complete_tx()
+    expect(results, [True], "callback")
+    expect(lora.tx_pending(), False, "pending after TxDone")
+
+
+@check
+def send_nowait_times_out():
+    radio, lora = setup(auto_tx_done=False)
+    results = []
+    lora.send_nowait("stuck", callback=results.append, timeout=1)
+    while lora.tx_pending():
+        pass
+    expect(results, [False], "callback")
+
+
+# ---------------------------
+# Receive
+# ---------------------------
+@check
+def polling_receive():
+    radio, lora = setup()
+    lora.receive()
+    radio.inject(b"polled", rssi=-90, snr=5.5)
+    expect(lora.listen(timeout=50), b"polled", "payload")
+    expect(lora.packet_rssi(), -90, "RSSI")
+    expect(lora.packet_snr(), 5.5, "SNR")
+
+
+@check
+def polling_rejects_crc_error():
+    radio, lora = setup()
+    lora.receive()
+    radio.inject(b"bad", crc_error=True)
+    expect(lora.received_packet(), False, "received_packet")
+
+
+@check
+def implicit_header_receive():
+    radio, lora = setup()
+    lora.receive(4)
+    expect(radio.regs[0x1D] & 0x01, 1, "ImplicitHeaderModeOn")
+    radio.inject(b"abcdefgh")
+    expect(lora.received_packet(4), True, "received_packet")
+    expect(lora.read_payload(), b"abcd", "payload")
+
+
+@check
+def irq_receive_in_order():
+    radio, lora = setup()
+    ring = lora.receive_irq()
+    expect(radio.regs[0x40] >> 6, 0, "DIO0 mapped to RxDone")
+    for i in range(3):
+        radio.inject(bytes([i]) * (i + 1), rssi=-100 + i)
+    radio.inject(b"bad", crc_error=True)
+    expect(ring.snr[:3], [32, 32, 32], "SNR stored as int quarter dB")
+    expect([ring.get() for _ in range(3)],
+           [(b"\x00", -100, 8.0), (b"\x01\x01", -99, 8.0), (b"\x02\x02\x02", -98, 8.0)], "packets")
+    expect(ring.get(), None, "empty ring")
+    expect(lora.crc_errors, 1, "CRC errors")
+
+
+@check
+def irq_receive_ring_overflow():
+    radio, lora = setup()
+    ring = lora.receive_irq(ring=PacketRing(2))
+    for i in range(4):
+        radio.inject(bytes([i]))
+    expect(len(ring), 2, "buffered")
+    expect(ring.dropped, 2, "dropped")
+    expect(ring.get()[0], b"\x00", "oldest kept")
+
+
+@check
+def irq_receive_ring_overflow_skips_callback():
+    radio, lora = setup()
+    got = []
+    ring = lora.receive_irq(callback=got.append, ring=PacketRing(2))
+    packets = lora.gc_policy.packets
+    for i in range(4):
+        radio.inject(bytes([i]))
+    expect((len(ring), ring.dropped), (2, 2), "buffered, dropped")
+    expect(got, [b"\x00", b"\x01"], "no callback for dropped packets")
+    expect(lora.gc_policy.packets, packets, "no GC accounting in the handler")
+    ring.get()
+    radio.inject(b"next")
+    expect(got[-1], b"next", "delivering again once there is room")
+
+
+@check
+def irq_receive_resumes_after_tx():
+    radio, lora = setup()
+    ring = lora.receive_irq()
+    lora.println("tx")
+    expect(radio.mode(), 0x05, "mode after TX")
+    radio.inject(b"rx")
+    expect(ring.get()[0], b"rx", "payload")
+
+
+# ---------------------------
+# Airtime and duty cycle
+# ---------------------------
+@check
+def driver_time_on_air_matches_datasheet():
+    cases = (
+        {"spreading_factor": 7},
+        {"spreading_factor": 12, "coding_rate": 8},   # LowDataRateOptimize on
+        {"spreading_factor": 6, "implicitHeader": True},
+        {"spreading_factor": 9, "signal_bandwidth": 41.7e3, "preamble_length": 12, "enable_CRC": False},
+        {"spreading_factor": 11, "signal_bandwidth": 500e3, "coding_rate": 6},
+    )
+    for parameters in cases:
+        radio, lora = setup(parameters)
+        m = radio.modem_config()
+        for length in (0, 1, 20, 51, 255):
+            expected = time_on_air_us(m.sf, m.bandwidth, m.coding_rate, m.preamble, length,
+                                      m.implicit_header, m.crc, m.ldro)
+            actual = lora.time_on_air_us(length)
+            # The datasheet formula in floating point can land 1 us either side
+            if abs(actual - expected) > 1:
+                expect(actual, expected, "{} {} bytes".format(parameters, length))
+    radio, lora = setup({"spreading_factor": 7})
+    expect(lora.time_on_air_us(20), 56576, "SF7 20 bytes")
+    lora.set_implicit_header(True)
+    expect(lora.time_on_air_us(20), 51456, "SF7 20 bytes implicit header")
+
+
+@check
+def duty_cycle_limiter_refills_at_duty_rate():
+    clock = VirtualClock()
+    utime.set_clock(clock)
+    try:
+        limiter = DutyCycleLimiter(0.01, burst_ms=100)
+        expect(limiter.remaining_us(), 100000, "full bucket")
+        expect(limiter.consume(60000), True, "first packet")
+        expect(limiter.consume(60000), False, "second packet over budget")
+        expect(limiter.wait_ms(60000), 2000, "wait for 20 ms of airtime at 1%")
+        clock.run_until(1999000)
+        expect(limiter.consume(60000), False, "1 ms early")
+        clock.run_until(2000000)
+        expect(limiter.consume(60000), True, "after refill")
+        expect(limiter.wait_ms(200000), -1, "longer than the bucket")
+        clock.run_until(3600000000)
+        expect(limiter.remaining_us(), 100000, "refill capped at the bucket")
+        expect(limiter.stats(), {"remaining_us": 100000, "used_us": 120000, "rejected": 2}, "stats")
+    finally:
+        utime.set_clock(None)
+
+
+@check
+def duty_cycle_rejects_or_waits():
+    clock = VirtualClock()
+    utime.set_clock(clock)
+    try:
+        radio, lora = setup({"spreading_factor": 7})
+        airtime = lora.time_on_air_us(4)
+        lora.duty_cycle = DutyCycleLimiter(0.01, burst_ms=airtime / 1000)
+        lora.receive_irq()
+        lora.println(b"one")
+        try:
+            lora.println(b"two")
+            raise AssertionError("no DutyCycleError over budget")
+        except DutyCycleError as e:
+            expect(e.wait_ms, -(-airtime * 100 // 1000), "wait_ms")
+        expect(radio.sent, [b"one"], "sent")
+        expect(radio.mode(), 0x05, "back in continuous RX after the refusal")
+        lora.duty_cycle.wait = True
+        start = utime.ticks_ms()
+        lora.println(b"two!")
+        expect(radio.sent, [b"one", b"two!"], "sent after waiting")
+        expect(utime.ticks_diff(utime.ticks_ms(), start) >= airtime * 100 // 1000, True,
+               "slept for the budget")
+        expect(lora.airtime_us, 2 * airtime, "airtime accounted")
+    finally:
+        utime.set_clock(None)
+
+
+# ---------------------------
+# Channel activity detection
+# ---------------------------
+@check
+def cad_reports_channel_activity():
+    radio, lora = setup()
+    expect(lora.cad(), False, "clear channel")
+    expect(radio.mode(), 0x01, "standby after CAD")
+    radio.cad_busy = True
+    expect(lora.cad(), True, "busy channel")
+    expect(radio.regs[0x12] & 0x05, 0, "CAD flags cleared")
+    ring = lora.receive_irq()
+    results = []
+    lora.cad_nowait(results.append)
+    expect(results, [True], "cad_nowait callback")
+    expect(radio.regs[0x40] >> 6, 0, "DIO0 back on RxDone")
+    expect(radio.mode(), 0x05, "continuous RX after CAD")
+    radio.inject(b"after cad")
+    expect(ring.get()[0], b"after cad", "packet received after CAD")
+    expect((lora.cad_runs, lora.cad_detections), (3, 2), "CAD counters")
+
+
+@check
+def cad_detects_packets_on_air():
+    with Simulation(seed=1) as sim:
+        a = sim.add_ulora("a", (0, 0))
+        b = sim.add_ulora("b", (1000, 0))
+        far = sim.add_ulora("far", (10 ** 6, 0))
+        results = []
+        sim.at(0, a.driver.send_nowait, b"x" * 20)
+        sim.at(10, lambda: results.append(("b", b.driver.cad())))
+        sim.at(10, lambda: results.append(("far", far.driver.cad())))
+        sim.run(a.driver.tx_timeout_ms())
+        sim.at(sim.now_ms, lambda: results.append(("idle", b.driver.cad())))
+        sim.run(100)
+        expect(dict(results), {"b": True, "far": False, "idle": False}, "CAD results")
+
+
+@check
+def csma_backs_off_while_channel_busy():
+    with Simulation(seed=1) as sim:
+        a = sim.add_ulora("a", (0, 0))
+        node = sim.add_transceiver("b", (500, 0))
+        csma = CsmaTransmitter(node.driver, rng=random.Random(1))
+        results = []
+        airtime_ms = a.driver.time_on_air_us(100) / 1000
+        sim.at(0, a.driver.send_nowait, b"x" * 100)
+        sim.at(5, csma.send_nowait, b"after", results.append)
+        sim.every(1, csma.pending)
+        sim.run(airtime_ms * 10)
+        expect(results, [True], "sent")
+        expect(csma.busy >= 1, True, "found the channel busy")
+        expect(node.radio.sent, [b"after"], "sent once")
+        expect(sim.channel.stats["collisions"], 0, "collisions")
+        expect(csma.stats()["sent"], 1, "stats")
+
+
+@check
+def csma_drops_after_max_attempts():
+    Pin.reset_all()
+    radio = FakeSX127x(spi_id=1, ss=10, dio0=5)
+    with quiet():
+        csma = CsmaTransmitter(LoRaTransceiver(*radio.backend()), slot_ms=1, max_attempts=3)
+    radio.cad_busy = True
+    expect(csma.send(b"blocking"), False, "blocking send dropped")
+    results = []
+    csma.send_nowait(b"nowait", results.append)
+    while csma.pending():
+        pass
+    expect(results, [False], "non-blocking send dropped")
+    expect((csma.dropped, csma.cads, csma.busy), (2, 6, 6), "counters")
+    radio.cad_busy = False
+    with quiet():
+        expect(csma.send(b"clear"), True, "sent on a clear channel")
+    expect(radio.sent, [b"clear"], "sent")
+
+
+@check
+def csma_returns_to_idle_after_a_failed_send():
+    Pin.reset_all()
+    radio = FakeSX127x(spi_id=1, ss=10, dio0=5)
+    with quiet():
+        transceiver = LoRaTransceiver(*radio.backend(), verbose=False)
+    csma = CsmaTransmitter(transceiver, slot_ms=1)
+    try:
+        csma.send_nowait(b"x" * 300)
+        raise AssertionError("oversize message accepted")
+    except ValueError:
+        pass
+    expect(csma.pending(), False, "idle after an oversize message")
+    # The radio fails when the transmission starts, outside the handler
+    results = []
+
+    def broken(*args, **kwargs):
+        raise OSError("SPI error")
+    transceiver.send = broken
+    csma.send_nowait(b"lost", results.append)
+    while csma.pending():
+        pass
+    expect((results, csma.failed), ([False], 1), "reported as failed")
+    del transceiver.send
+    csma.send_nowait(b"next", results.append)
+    while csma.pending():
+        pass
+    expect((results[1:], radio.sent), ([True], [b"next"]), "next message sent")
+
+
+@check
+def csma_transmits_outside_irq_and_counts_cad_timeouts():
+    Pin.reset_all()
+    radio = FakeSX127x(spi_id=1, ss=10, dio0=5)
+    with quiet():
+        csma = CsmaTransmitter(LoRaTransceiver(*radio.backend()), slot_ms=1, max_attempts=2)
+    results = []
+    csma.send_nowait(b"clear", results.append)
+    expect(radio.sent, [], "nothing sent from the CadDone handler")
+    with quiet():
+        while csma.pending():
+            pass
+    expect((radio.sent, results), ([b"clear"], [True]), "sent from pending()")
+    # CadDone never comes: both attempts time out, and neither is busy
+    radio._start_cad = lambda: None
+    csma.send_nowait(b"stuck", results.append)
+    while csma.pending():
+        pass
+    expect(results[1:], [False], "dropped")
+    expect((csma.busy, csma.cad_timeouts, csma.lora.cad_timeouts, csma.lora.cad_detections),
+           (0, 2, 2, 0), "timeouts counted apart from detections")
+
+
+# ---------------------------
+# TDMA
+# ---------------------------
+def skewed_clock(sim, ppm, offset_us=0):
+    """
+    A ticks_us for a board whose crystal is ppm fast, wrapping like utime's.
+    """
+    return lambda: (int(sim.clock.now_us * (1 + ppm / 1e6)) + offset_us) % utime.TICKS_PERIOD
+
+
+@check
+def clock_sync_tracks_offset_and_drift():
+    sync = ClockSync()
+    # Local clock 40 ppm fast and 12345 us ahead, one pair every 10 s
+    for n in range(8):
+        reference = n * 10000000
+        sync.update(reference + 12345 + reference * 40 // 1000000, reference)
+    expect_near([sync.drift_ppb], [40000], 10, "drift")
+    reference = 8 * 10000000 + 5000000
+    expect_near([sync.to_local(reference)], [reference + 12345 + reference * 40 // 1000000], 2, "to_local")
+    expect_near([sync.to_reference(sync.to_local(reference))], [reference], 2, "round trip")
+    expect(sync.max_error_us <= 400, True, "error shrinks after the first interval")
+    expect(sync.error_us, 0, "last prediction")
+
+
+def tdma_network(sim, clocks, frame_ms=1000, **beacon_options):
+    """
+    A gateway beaconing at (0, 0) and an egg per clock around it, eggs
+    sending one packet each frame. Returns the gateway's TdmaBeacon and the
+    eggs' TdmaSchedulers.
+    """
+    parameters = {"frequency": 868100000, "spreading_factor": 7}
+    gateway = sim.add_transceiver("gateway", (0, 0), parameters)
+    beacon = TdmaBeacon(gateway.driver, frame_ms=frame_ms, guard_ms=3, **beacon_options)
+    gateway.driver.start_listening(callback=beacon.on_packet, slots=0)
+    sim.every(1, beacon.pending)
+    eggs = []
+    for i, clock in enumerate(clocks):
+        radio = sim.add_transceiver("egg{}".format(i), (100 + 50 * i, 0), parameters).driver
+        tdma = TdmaScheduler(radio, i + 1, clock=clock)
+        radio.start_listening(callback=tdma.on_packet)
+
+        def drain(radio=radio, tdma=tdma):
+            packet = radio.poll(raw=True)
+            while packet:
+                tdma.handle(packet[0])
+                packet = radio.poll(raw=True)
+            if not tdma.pending():
+                tdma.send_nowait(b"egg %d" % tdma.node_id)
+        sim.every(1, drain)
+        eggs.append(tdma)
+    return beacon, eggs
+
+
+@check
+def tdma_eggs_send_in_their_slots():
+    with Simulation(seed=1) as sim:
+        beacon, eggs = tdma_network(sim, [skewed_clock(sim, ppm, offset)
+                                          for ppm, offset in ((0, 0), (50, 777777), (-80, 3141592))])
+        sim.run(20000)
+        expect([egg.slot for egg in eggs], [1, 2, 3], "slots from node ids")
+        expect([round(egg.sync.drift_ppb / 1000) for egg in eggs], [0, 50, -80], "drift ppm")
+        expect(max(egg.sync.max_error_us for egg in eggs) <= 20, True, "sync error")
+        expect(sim.channel.stats["collisions"], 0, "collisions")
+        stats = beacon.stats()
+        expect((stats["received"] >= 3 * 18, stats["in_slot"]), (True, 1.0), "every packet in a slot")
+        # The frames before the eggs first synced carried nothing
+        expect_near([stats["utilisation"]], [3 / stats["slots"]], 0.02, "utilisation")
+
+
+@check
+def tdma_refuses_ids_without_a_slot():
+    with Simulation(seed=1) as sim:
+        beacon, eggs = tdma_network(sim, [skewed_clock(sim, 0, 0), skewed_clock(sim, 50, 777777)])
+        sim.run(3000)
+        slots = beacon.stats()["slots"]
+        sent = eggs[1].sent
+        # Wrapped, this id would land in the first egg's slot
+        eggs[1].node_id = slots + eggs[0].node_id
+        sim.run(5000)
+        expect([egg.slot for egg in eggs], [1, -1], "id at or above the slot count gets no slot")
+        expect((eggs[1].sent, eggs[1].stats()["refused"] > 0), (sent, True), "egg without a slot stays silent")
+        expect(sim.channel.stats["collisions"], 0, "collisions")
+
+
+@check
+def tdma_keeps_sync_across_tick_wrap():
+    # Every clock wraps a few seconds in, the gateway's first
+    wrap = utime.TICKS_PERIOD
+    with Simulation(seed=1) as sim:
+        beacon, eggs = tdma_network(sim, [skewed_clock(sim, 50, wrap - 5000000),
+                                          skewed_clock(sim, -80, wrap - 7000000)],
+                                    clock=skewed_clock(sim, 0, wrap - 3000000))
+        sim.run(15000)
+        expect([egg.synced for egg in eggs], [True, True], "synced")
+        expect(max(egg.sync.max_error_us for egg in eggs) <= 20, True, "sync error")
+        expect((beacon.received >= 2 * 10, beacon.in_slot), (True, beacon.received), "every packet in a slot")
+
+
+@check
+def tdma_keeps_slot_through_missed_beacons():
+    with Simulation(seed=1) as sim:
+        beacon, eggs = tdma_network(sim, [skewed_clock(sim, 100)])
+        egg = eggs[0]
+        sim.run(5000)
+        # Deaf to beacons: the drift estimate holds the slot for max_missed frames
+        egg.handle = lambda payload: True
+        sent = egg.sent
+        sim.run((egg.max_missed + 1) * 1000)
+        expect((egg.synced, egg.sent > sent), (False, True), "sent until out of sync")
+        expect(beacon.in_slot, beacon.received, "all in slot")
+        sent = egg.sent
+        sim.run(2000)
+        expect(egg.sent, sent, "stopped")
+        del egg.handle
+        sim.run(2000)
+        expect((egg.synced, egg.sent > sent, egg.missed >= egg.max_missed), (True, True, True), "resynced")
+
+
+# ---------------------------
+# Adaptive data rate
+# ---------------------------
+def adr_link(sim, distance, interval_ms=1000, **options):
+    """
+    A gateway managing its link to an egg distance metres away, which sends
+    a packet every interval_ms. Returns both controllers and the list of
+    packets the gateway received.
+    """
+    parameters = {"frequency": 868100000, "spreading_factor": 9, "tx_power_level": 14}
+    got = []
+    ends = []
+    for node_id, position in ((0, (0, 0)), (1, (distance, 0))):
+        radio = sim.add_transceiver("node{}".format(node_id), position, parameters).driver
+        adr = AdrController(radio, node_id, window=8, confirm_ms=3000, retry_ms=2000, ack_limit=4,
+                            ack_delay=4, **options)
+        radio.start_listening()
+
+        def pump(radio=radio, adr=adr):
+            packet = radio.poll(raw=True)
+            while packet:
+                if not adr.handle(*packet):
+                    adr.observe(1 - adr.node_id, packet[1], packet[2])
+                    got.append(packet[0])
+                packet = radio.poll(raw=True)
+            if not radio.tx_busy():
+                frame = adr.poll()
+                if frame is not None:
+                    radio.send(frame, wait=False)
+        sim.every(5, pump)
+        ends.append(adr)
+    gateway, egg = ends
+    gateway.manage(1)
+
+    def send():
+        if egg.before_send(0):
+            egg.radio.send(b"data", wait=False)
+    sim.every(interval_ms, send)
+    return gateway, egg, got
+
+
+@check
+def adr_margin_from_snr_and_rssi():
+    with Simulation(seed=1) as sim:
+        radio = sim.add_transceiver("gateway", (0, 0)).driver
+        adr = AdrController(radio, 0, window=4, margin_db=5)
+        expect((adr.base, adr.margin(1)), ((9, 10), None), "base settings, nothing heard")
+        for snr in (-4, -2, -2, 0, 9):
+            adr.observe(1, -110, snr)
+        # The oldest sample has left the window
+        expect_near([adr.margin(1)], [1.25 + 12.5 - 5], 1e-9, "SNR margin")
+        for _ in range(4):
+            adr.observe(1, -80, 12)
+        expect_near([adr.margin(1)], [-80 - noise_floor_dbm(125000) + 12.5 - 5], 1e-9,
+                    "RSSI margin above the SNR ceiling")
+
+
+@check
+def adr_steps_down_a_strong_link():
+    with Simulation(seed=1) as sim:
+        gateway, egg, got = adr_link(sim, 300)
+        sim.run(60000)
+        settings = gateway.settings(1)
+        expect((settings, egg.settings(0)), ((7, 2), (7, 2)), "both ends at SF7, lowest power")
+        expect((gateway.changes >= 1, egg.changes >= 1, gateway.fallbacks, egg.fallbacks),
+               (True, True, 0, 0), "confirmed without fallbacks")
+        expect(gateway.margin(1) >= 0, True, "margin left")
+        received = len(got)
+        sim.run(10000)
+        expect(len(got) - received >= 9, True, "delivery at the new settings")
+
+
+@check
+def adr_reverts_unconfirmed_change():
+    with Simulation(seed=1) as sim:
+        gateway, egg, got = adr_link(sim, 300)
+        handle = gateway.handle
+        # The gateway misses every ANS: the egg switches alone and comes back
+        gateway.handle = lambda payload, *args: True if payload[0] == 0x90 | KIND_ANS else \
+            handle(payload, *args)
+        sim.run(20000)
+        expect((egg.reverts >= 1, gateway.settings(1), egg.settings(0)), (True, (9, 14), (9, 14)),
+               "egg went back")
+        received = len(got)
+        sim.run(3000)
+        expect(len(got) > received, True, "still delivering")
+        del gateway.handle
+        sim.run(60000)
+        expect((gateway.settings(1), egg.settings(0)), ((7, 2), (7, 2)), "changed once ANS got through")
+
+
+@check
+def adr_falls_back_when_link_fails():
+    with Simulation(seed=1) as sim:
+        gateway, egg, got = adr_link(sim, 300, timeout_ms=10000)
+        sim.run(60000)
+        expect(gateway.settings(1), (7, 2), "stepped down")
+        # SF7 at 2 dBm no longer reaches, SF9 at 14 dBm does
+        sim.nodes[1].radio.position = (4000, 0)
+        sim.run(15000)
+        expect((gateway.fallbacks, egg.fallbacks, egg.pings >= 1), (1, 1, True), "both fell back")
+        received = len(got)
+        sim.run(5000)
+        expect(len(got) - received >= 4, True, "delivering at base again")
+        expect(gateway.settings(1)[0] >= 9 or gateway.settings(1)[1] > 2, True, "not back at SF7 2 dBm")
+
+
+# ---------------------------
+# Reliable transport
+# ---------------------------
+def run_link(a, b, duration_ms, delay_ms=20, drop=None, start_ms=0):
+    """
+    Move frames between two transports in 1 ms steps, each arriving
+    delay_ms after it was sent unless drop(sender, frame) says otherwise.
+    """
+    on_air = []
+    peak = 0
+    for now in range(start_ms, start_ms + duration_ms):
+        for sender, receiver in ((a, b), (b, a)):
+            frame = sender.poll(now)
+            if frame is not None and not (drop and drop(sender, frame)):
+                on_air.append((now + delay_ms, receiver, frame))
+        for item in [item for item in on_air if item[0] <= now]:
+            on_air.remove(item)
+            item[1].handle(item[2], now)
+        peak = max(peak, max((len(p.inflight) for p in getattr(a, "peers", {}).values()), default=0))
+    return peak
+
+
+def transport_pair(**options):
+    got = []
+    a = ReliableTransport(1, rng=random.Random(1), **options)
+    b = ReliableTransport(2, rng=random.Random(2), on_receive=lambda src, data: got.append((src, data)),
+                          **options)
+    return a, b, got
+
+
+@check
+def reliable_in_order_with_window():
+    a, b, got = transport_pair(window=4)
+    messages = [b"msg %d" % i for i in range(10)]
+    for m in messages:
+        expect(a.send(2, m), True, "queued")
+    peak = run_link(a, b, 2000)
+    expect(got, [(1, m) for m in messages], "delivered")
+    expect(peak, 4, "frames in flight")
+    stats = a.stats()
+    expect((stats["acked"], stats["retransmits"], a.pending()), (10, 0, 0), "acked")
+    expect(b.stats()["acks"] < 10, True, "one ACK per burst")
+    expect(b.stats()["duplicates"], 0, "duplicates")
+
+
+@check
+def reliable_recovers_lost_frames():
+    a, b, got = transport_pair(window=4, min_rto_ms=100, queue_limit=32)
+    messages = [b"m%d" % i for i in range(30)]
+    for m in messages:
+        a.send(2, m)
+    count = [0]
+
+    def drop(sender, frame):
+        count[0] += 1
+        return count[0] % 3 == 0
+    run_link(a, b, 60000, drop=drop)
+    expect(got, [(1, m) for m in messages], "delivered once, in order")
+    expect(a.stats()["failed"], 0, "failed")
+    expect(a.stats()["retransmits"] > 0, True, "retransmitted")
+    expect(b.stats()["nacks"] > 0, True, "NACKs for gaps")
+    expect(b.stats()["duplicates"] > 0, True, "duplicates suppressed")
+
+
+@check
+def reliable_rto_follows_rtt():
+    a, b, got = transport_pair(window=1, rto_ms=3000, min_rto_ms=50, queue_limit=32)
+    for i in range(20):
+        a.send(2, b"x")
+    run_link(a, b, 10000, delay_ms=100)
+    expect(len(got), 20, "delivered")
+    peer = a.peers[2]
+    expect(abs(peer.srtt - 200) <= 2, True, "smoothed RTT {} ms".format(peer.srtt))
+    expect(peer.rto < 3000, True, "RTO adapted from 3000 ms")
+    expect(a.stats()["latency_ms"] >= 200, True, "latency")
+
+
+@check
+def reliable_restarts_session_after_failure():
+    a, b, got = transport_pair(window=2, rto_ms=100, min_rto_ms=100, max_retries=2)
+    a.send(2, b"lost 1")
+    a.send(2, b"lost 2")
+    run_link(a, b, 5000, drop=lambda sender, frame: sender is a)
+    expect((a.stats()["failed"], got), (2, []), "given up")
+    a.send(2, b"after")
+    run_link(a, b, 1000, start_ms=5000)
+    expect(got, [(1, b"after")], "delivered in the new session")
+    expect(a.handle(bytes((1, 2, 3, 4, 5))), False, "not a transport frame")
+
+
+# ---------------------------
+# Fragmentation
+# ---------------------------
+def fragment_index(frame):
+    """Index of a DATA frame, None for other frames."""
+    return frame[4] | frame[5] << 8 if frame[0] & 0x0C == 0 else None
+
+
+@check
+def fragment_round_trip_from_generator():
+    got = []
+    sent = []
+    pulled = [0]
+    a = Fragmenter(1, fragment_size=100, block=4, on_sent=lambda *args: sent.append(args))
+    b = Fragmenter(2, on_receive=lambda src, data: got.append((src, data)))
+    message = bytes(random.Random(1).getrandbits(8) for _ in range(3000))
+
+    def chunks():
+        # Odd sizes, so fragments straddle chunks
+        for i in range(0, len(message), 77):
+            pulled[0] += 1
+            yield message[i:i + 77]
+    message_id = a.send(2, chunks())
+    b.handle(a.poll(0), 0)
+    expect(pulled[0] * 77 <= 4 * 100 + 77, True, "read one block ahead, not the whole message")
+    run_link(a, b, 5000)
+    expect(got, [(1, message)], "reassembled")
+    expect(sent, [(2, message_id, True)], "sender told")
+    expect((a.stats()["fragments_sent"], a.stats()["retransmits"]), (30, 0), "fragments")
+    # An empty message is one empty fragment; too long a packet is refused
+    a.send(2, b"")
+    run_link(a, b, 1000, start_ms=5000)
+    expect(got[-1], (1, b""), "empty message")
+    with quiet():
+        radio = FakeSX127x(spi_id=1, ss=10, dio0=5)
+        transceiver = LoRaTransceiver(*radio.backend())
+    try:
+        transceiver.send(bytes(256))
+        expect(True, False, "256 byte packet refused")
+    except ValueError:
+        pass
+
+
+@check
+def fragment_resends_only_missing():
+    got = []
+    a = Fragmenter(1, fragment_size=50, block=8, reply_timeout_ms=300)
+    b = Fragmenter(2, on_receive=lambda src, data: got.append(data))
+    message = bytes(range(256)) * 4
+    a.send(2, message)
+    lost = {3, 5, 20}
+    polls = [0]
+
+    def drop(sender, frame):
+        index = fragment_index(frame) if sender is a else None
+        if index in lost:
+            lost.discard(index)
+            return True
+        # Lose the first STATUS too: the sender has to QUERY for it
+        if sender is b and polls[0] == 0:
+            polls[0] += 1
+            return True
+        return False
+    run_link(a, b, 10000, drop=drop)
+    expect(got, [message], "reassembled")
+    stats = a.stats()
+    # Fragment 20 ends the message and carries its POLL: losing it costs a
+    # second QUERY
+    expect((stats["fragments_sent"], stats["retransmits"], stats["queries"]), (21, 3, 2),
+           "only the lost fragments sent again")
+    expect(b.stats()["duplicates"], 0, "no duplicates")
+
+
+@check
+def fragment_receiver_memory_is_bounded():
+    chunks = []
+    a = Fragmenter(1, fragment_size=200, block=4)
+    streaming = Fragmenter(2, max_message=100,
+                           on_chunk=lambda src, mid, data, last: chunks.append((len(data), last)))
+    a.send(2, (bytes(200) for _ in range(12)))
+    run_link(a, streaming, 5000)
+    expect((len(chunks), chunks[-1]), (12, (200, True)), "streamed in order past max_message")
+    expect(streaming._sessions, {}, "nothing held after the message")
+
+    sent = []
+    a = Fragmenter(1, fragment_size=200, block=4, on_sent=lambda dst, mid, ok: sent.append(ok))
+    bounded = Fragmenter(2, max_message=1000, on_receive=lambda src, data: sent.append(data))
+    a.send(2, bytes(1500))
+    run_link(a, bounded, 5000)
+    expect((sent, bounded.aborts), ([False], 1), "too long a message aborted")
+
+    # A sender that goes quiet: the receiver drops the half-built message
+    a = Fragmenter(1, fragment_size=10, block=4)
+    b = Fragmenter(2, timeout_ms=1000)
+    a.send(2, bytes(100))
+    run_link(a, b, 100, drop=lambda sender, frame: sender is a and fragment_index(frame) not in (0, 1))
+    expect(len(b._sessions), 1, "reassembling")
+    b.poll(2000)
+    expect((len(b._sessions), b.timeouts), (0, 1), "timed out")
+    # A late fragment from the middle cannot restart it
+    b.handle(bytes((0xB0 | FLAG_POLL, 1, 2, a._current.id, 20, 0)) + bytes(10), 2000)
+    expect((len(b._sessions), b.aborts), (0, 1), "refused")
+
+
+# ---------------------------
+# Simulated channel
+# ---------------------------
+@check
+def time_on_air_matches_datasheet():
+    expect(time_on_air_us(7, 125000, 1, 8, 20, False, True, False), 56576, "SF7 20 bytes")
+    expect(time_on_air_us(12, 125000, 4, 8, 51, False, True, True), 3547136, "SF12 CR4/8 51 bytes")
+
+
+@check
+def channel_delivers_after_airtime():
+    with Simulation(seed=1) as sim:
+        a = sim.add_ulora("a", (0, 0))
+        b = sim.add_ulora("b", (1000, 0))
+        ring = b.driver.receive_irq()
+        sim.at(0, a.driver.send_nowait, b"over the air")
+        sim.run(1)
+        expect(len(ring), 0, "buffered while on air")
+        sim.run(a.driver.tx_timeout_ms())
+        payload, rssi, snr = ring.get()
+        expect(payload, b"over the air", "payload")
+        expect(rssi, round(10 - sim.channel.path_loss_db(a.radio, b.radio)), "RSSI")
+        expect(a.driver.tx_pending(), False, "sender done")
+
+
+@check
+def channel_collision_and_capture():
+    with Simulation(seed=1) as sim:
+        near = sim.add_ulora("near", (10, 0))
+        far = sim.add_ulora("far", (3000, 0))
+        rx = sim.add_ulora("rx", (0, 0))
+        ring = rx.driver.receive_irq()
+        sim.at(0, far.driver.send_nowait, b"far")
+        sim.at(20, near.driver.send_nowait, b"near")
+        sim.run(1000)
+        expect(len(ring), 0, "packets delivered")
+        expect(rx.driver.crc_errors, 1, "CRC errors from the collision")
+        # The near node is far above capture_db: its packet survives the far one
+        sim.at(sim.now_ms, near.driver.send_nowait, b"near")
+        sim.at(sim.now_ms + 20, far.driver.send_nowait, b"far")
+        sim.run(1000)
+        expect(ring.get()[0], b"near", "captured packet")
+        expect(rx.driver.crc_errors, 1, "no new CRC error")
+        expect(sim.channel.stats["collisions"], 1, "collisions")
+
+
+@check
+def channel_interop_between_drivers():
+    with Simulation(seed=1) as sim:
+        settings = {"frequency": 915000000, "spreading_factor": 9, "coding_rate": 8}
+        ulora = sim.add_ulora("ulora", (0, 0), settings)
+        sx127x = sim.add_sx127x("sx127x", (100, 0), dict(settings, enable_CRC=True))
+        meshtastic = sim.add_meshtastic("mesh", (0, 100), frequency=915.0, bandwidth=125000,
+                                        spreading_factor=9, coding_rate=8, crc=True)
+        got = []
+        sx127x.driver.onReceive(lambda sx, payload: got.append(("sx127x", bytes(payload))))
+        sx127x.driver.receive()
+        meshtastic.driver.on_recv(lambda payload: got.append(("mesh", bytes(payload))))
+        meshtastic.driver.recv()
+        sim.at(0, ulora.driver.send_nowait, b"hi")
+        sim.run(1000)
+        expect(sorted(got), [("mesh", b"hi"), ("sx127x", b"hi")], "received")
+
+
+# ---------------------------
+# Mesh flooding
+# ---------------------------
+MESH_RADIO = {"frequency": 915.0, "bandwidth": 125000, "spreading_factor": 7, "crc": True,
+              "tx_power": 2}
+
+
+def mesh_network(sim, positions, router_class=None, **options):
+    """
+    MeshRouter (or router_class) nodes at positions, polled every 5 ms.
+    Returns the routers and the list (node, source, payload) deliveries are
+    appended to.
+    """
+    router_class = router_class or meshtastic_module("mesh").MeshRouter
+    got = []
+    routers = []
+    for i, position in enumerate(positions):
+        node = sim.add_meshtastic("node{}".format(i), position, **MESH_RADIO)
+        router = router_class(node.driver, i, rng=random.Random(i),
+                                 on_receive=lambda src, data, rssi, snr, i=i: got.append((i, src, bytes(data))),
+                                 **options)
+        sim.every(5, router.poll)
+        routers.append(router)
+    return routers, got
+
+
+@check
+def mesh_duplicate_cache_forgets_oldest():
+    cache = meshtastic_module("mesh").DuplicateCache(3)
+    expect([cache.add(key) for key in (1, 2, 1, 3, 4)], [True, True, False, True, True], "added")
+    expect((1 in cache, 2 in cache, 4 in cache, len(cache)), (False, True, True, 3), "oldest forgotten")
+
+
+@check
+def mesh_floods_across_hops():
+    # 1200 m apart at 2 dBm: each node hears only its neighbours
+    chain = [(1200 * i, 0) for i in range(4)]
+    with Simulation(seed=1) as sim:
+        routers, got = mesh_network(sim, chain)
+        sim.at(0, routers[0].send, b"end to end")
+        sim.run(5000)
+        expect(sorted(got), [(i, 0, b"end to end") for i in (1, 2, 3)], "delivered once each")
+        expect([r.relayed for r in routers], [0, 1, 1, 1], "relays")
+        expect([r.duplicates for r in routers], [1, 1, 1, 0], "copies heard again")
+        del got[:]
+        sim.at(sim.now_ms, routers[0].send, b"one hop", 0xFF, 1)
+        sim.run(5000)
+        expect(sorted(got), [(1, 0, b"one hop"), (2, 0, b"one hop")], "hop limit")
+        # Unicast: relayed towards node 3 but delivered there only
+        del got[:]
+        sim.at(sim.now_ms, routers[0].send, b"for 3", 3)
+        sim.run(5000)
+        expect(got, [(3, 0, b"for 3")], "unicast")
+
+
+@check
+def mesh_managed_flood_drops_redundant_relays():
+    # Five nodes in earshot of each other: one relay is enough
+    cluster = [(0, 0), (100, 0), (0, 100), (-100, 0), (0, -100)]
+    relays = {}
+    for managed in (False, True):
+        with Simulation(seed=1) as sim:
+            routers, got = mesh_network(sim, cluster, managed=managed, redundancy=1)
+            sim.at(0, routers[0].send, b"hi")
+            sim.run(5000)
+            expect(len(got), 4, "delivered")
+            relays[managed] = (sum(r.relayed for r in routers), sum(r.cancelled for r in routers))
+    expect(relays[False], (4, 0), "plain flood relays everywhere")
+    expect(relays[True], (1, 3), "managed flood relays once")
+
+
+@check
+def mesh_router_recovers_from_stuck_transmission():
+    with Simulation(seed=1) as sim:
+        routers, got = mesh_network(sim, [(0, 0), (100, 0)])
+        lora = routers[0].lora
+        expect(lora.time_on_air_ms(20), time_on_air_us(7, 125000, 1, 4, 20, False, True, False) // 1000 + 1,
+               "time on air")
+        # The first packet never goes out: the radio stays in TX until the
+        # deadline, then the next one is sent
+        radio = sim.nodes[0].radio
+        radio._transmit = lambda: radio.__dict__.pop("_transmit")
+        sim.at(0, routers[0].send, b"stuck")
+        sim.at(10, routers[0].send, b"after")
+        sim.run(1000)
+        expect((lora.tx_timeouts, routers[0].tx_failed), (1, 1), "timed out once")
+        expect(got, [(1, 0, b"after")], "next packet delivered")
+
+
+# ---------------------------
+# Mesh routing
+# ---------------------------
+@check
+def routing_table_is_bounded():
+    routing = meshtastic_module("routing")
+    table = routing.RoutingTable(3)
+    for destination, metric in ((1, 10), (2, 30), (3, 20)):
+        row = table.add(destination, metric)
+        table.metric[row] = metric
+    expect(table.add(4, 40), -1, "no room for a longer route")
+    row = table.add(4, 15)
+    expect((row, table.find(2), table.find(4)), (1, -1, 1), "longest route evicted")
+    table.metric[row] = 15
+    table.state[table.find(3)] = routing.BROKEN
+    expect((table.add(5, 50), table.find(3)), (2, -1), "broken route evicted first")
+    table.remove(table.find(1))
+    expect((len(table), table.find(5), table.destination[0]), (2, 0, 5), "last row moved into the hole")
+    expect(table.next_hop_for(1), None, "removed")
+
+
+def routed_chain(sim, count, **options):
+    # 1200 m apart at 2 dBm: each node hears only its neighbours
+    routing = meshtastic_module("routing")
+    return mesh_network(sim, [(1200 * i, 0) for i in range(count)], routing.DistanceVectorRouter,
+                        advert_interval_ms=2000, **options)
+
+
+@check
+def routing_converges_on_a_chain():
+    with Simulation(seed=1) as sim:
+        routers, got = routed_chain(sim, 4)
+        sim.run(12000)
+        routes = {destination: (next_hop, metric) for destination, next_hop, metric, usable
+                  in routers[0].table.routes() if usable}
+        expect(sorted(routes), [1, 2, 3], "destinations")
+        expect([routes[d][0] for d in (1, 2, 3)], [1, 1, 1], "next hops")
+        expect(routes[1][1] < routes[2][1] < routes[3][1], True, "metrics grow with hops")
+        expect(routers[3].table.next_hop_for(0), 2, "route back")
+
+
+@check
+def routing_unicast_follows_route():
+    with Simulation(seed=1) as sim:
+        routers, got = routed_chain(sim, 4)
+        sim.run(12000)
+        before = sim.channel.stats["transmissions"]
+        relayed = [r.relayed for r in routers]
+        sim.at(sim.now_ms, routers[0].send, b"for 3", 3)
+        sim.run(1000)
+        expect(got, [(3, 0, b"for 3")], "delivered")
+        # Adverts are sent as CONTROL frames and not counted as relays
+        expect([r.relayed - n for r, n in zip(routers, relayed)], [0, 1, 1, 0], "forwarded by 1 and 2 only")
+        expect(sim.channel.stats["transmissions"] - before <= 3 + 4, True, "three hops, no flood")
+        expect(routers[0].fallbacks, 0, "no fallback")
+
+
+@check
+def routing_breaks_lost_routes_and_falls_back_to_flooding():
+    with Simulation(seed=1) as sim:
+        routers, got = routed_chain(sim, 3)
+        sim.run(12000)
+        expect(routers[0].table.next_hop_for(2), 1, "route")
+        # Node 2 goes silent: its route expires after three advert intervals
+        routers[2]._advertise = lambda full: None
+        sim.run(10000)
+        expect(routers[0].table.next_hop_for(2), None, "route broken")
+        expect(routers[0].table.next_hop_for(1), 1, "neighbour kept")
+        expect(routers[0].broken >= 1, True, "counted")
+        # No route: flooded instead, and node 1 relays it as a flood
+        del routers[2]._advertise
+        sim.at(sim.now_ms, routers[0].send, b"for 2", 2)
+        sim.run(1000)
+        expect((routers[0].fallbacks, routers[0].routed), (1, 0), "flooded")
+        expect(got, [(2, 0, b"for 2")], "delivered")
+
+
+# ---------------------------
+# BU03 UWB frames
+# ---------------------------
+def uwb_frame(*ranges_mm):
+    return b"\xaa%\x01" + struct.pack("<8I", *(ranges_mm + (0,) * (8 - len(ranges_mm))))
+
+
+def parse_all(parser):
+    frames = []
+    while parser.next_frame() is not None:
+        frames.append(list(parser.ranges))
+    return frames
+
+
+@check
+def bu03_parser_emits_every_frame():
+    parser = FrameParser()
+    parser.feed(uwb_frame(1500, 2300) + uwb_frame(1510) + uwb_frame(1520, 0, 900))
+    frames = parse_all(parser)
+    expect([f[:3] for f in frames], [[1500, 2300, 0], [1510, 0, 0], [1520, 0, 900]], "ranges")
+    expect(parser.pending(), 0, "bytes left")
+
+
+@check
+def bu03_parser_resynchronises():
+    parser = FrameParser()
+    stream = uwb_frame(1111)[20:] + b"\x00\xaa\x17" + uwb_frame(1500) + uwb_frame(1600)
+    got = []
+    # Byte at a time, as a slow UART would deliver it
+    for i in range(len(stream)):
+        parser.feed(stream[i:i + 1])
+        got.extend(f[0] for f in parse_all(parser))
+    expect(got, [1500, 1600], "ranges")
+    expect(parser.skipped, 15 + 3, "skipped bytes")
+
+
+@check
+def bu03_parser_decodes_frames_across_ring_wrap():
+    parser = FrameParser(size=64)
+    expected = []
+    for i in range(20):
+        frame = uwb_frame(1000 + i, 2000 + i, 0, 0, 0, 0, 0, 7000 + i)
+        expected.append([1000 + i, 2000 + i, 7000 + i])
+        expect(parser.feed(frame), len(frame), "bytes accepted")
+        got = parse_all(parser)
+        expect([[f[0], f[1], f[7]] for f in got], expected[-1:], "frame {}".format(i))
+
+
+@check
+def bu03_poll_drains_uart():
+    Pin.reset_all()
+    uwb = BU03()
+    # Partial frame: nothing yet
+    stream = uwb_frame(1500) * 9 + uwb_frame(2500)
+    UART.feed(1, stream[:30])
+    expect(uwb.poll(), 0, "frames from partial data")
+    UART.feed(1, stream[30:])
+    seen = []
+    expect(uwb.poll(lambda ranges: seen.append(ranges[0])), 10, "frames")
+    expect(seen, [1500] * 9 + [2500], "ranges")
+    UART.feed(1, uwb_frame(0, 1234))
+    expect(uwb.poll_distance(), [None, 1.234, None, None, None, None, None, None], "distances")
+    expect(uwb.decode_uwb_distances(b"\x01" + uwb_frame(42)), [0.042] + [None] * 7, "one-shot decode")
+
+
+def bu03_with_module(uart_id=2, **module_config):
+    """
+    BU03 driver with a fake module answering AT commands on uart_id: 2 is
+    the config UART reconfigure() uses, 1 the data UART configure() uses.
+    """
+    Pin.reset_all()
+    for i in (1, 2):
+        UART.attach(i, None)
+    module = FakeBU03(**module_config)
+    UART.attach(uart_id, module)
+    UART.feed(uart_id, b"stale\r\nOK\r\n")  # leftovers from before boot must not satisfy a command
+    uwb = BU03()
+    return uwb, module
+
+
+@check
+def bu03_configure_skips_matching_config():
+    uwb, module = bu03_with_module(id=3, role=1, channel=2, rate=1)
+    try:
+        start = time.monotonic()
+        with quiet():
+            changed = uwb.reconfigure(3, 1, 2, 1)
+        expect(changed, False, "reconfigured")
+        expect(module.commands, ["AT+GETCFG"], "commands sent")
+        expect(module.saves, 0, "flash writes")
+        if time.monotonic() - start > 0.2:
+            raise AssertionError("matching config took {:.2f} s".format(time.monotonic() - start))
+        expect(uwb.uart is uwb.config_uart, False, "back on the data UART")
+    finally:
+        UART.attach(2, None)
+
+
+@check
+def bu03_configure_writes_and_verifies():
+    uwb, module = bu03_with_module(1, id=0, role=0, getcfg_ok=False)
+    try:
+        with quiet():
+            changed = uwb.configure(5, 1, 1, 1)
+        expect(changed, True, "reconfigured")
+        expect(module.commands, ["AT+GETCFG", "AT+SETCFG=5,1,1,1", "AT+SAVE", "AT+GETCFG"], "commands sent")
+        expect(module.saved, [5, 1, 1, 1], "saved config")
+        expect((uwb.config.id, uwb.config.role), (5, 1), "parsed config")
+        with quiet():
+            expect(uwb.verify_config(5, 1), True, "verify_config")
+    finally:
+        UART.attach(1, None)
+
+
+@check
+def bu03_at_errors_and_timeouts():
+    uwb, module = bu03_with_module(1)
+    try:
+        with quiet():
+            expect(uwb.send_at("AT+BOGUS").status, "ERROR", "unknown command")
+        UART.attach(1, None)
+        with quiet():
+            expect(uwb.send_at("AT", timeout_ms=20).status, "TIMEOUT", "no module")
+            try:
+                uwb.configure(1, 1)
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError("configure without a module should raise")
+    finally:
+        UART.attach(1, None)
+    cfg = BU03Config.parse("+GETCFG:2,1,5,0")
+    expect((cfg.id, cfg.role, cfg.channel, cfg.rate), (2, 1, 5, 0), "bare GETCFG numbers")
+    expect(BU03Config.parse("OK"), None, "not a config line")
+
+
+@check
+def bu03_frames_keep_arrival_times():
+    parser = FrameParser(size=256, chunks=4)
+    frame = uwb_frame(1500)
+    parser.feed(frame[:20], now_us=1000)
+    parser.feed(frame[20:] + uwb_frame(1600) + uwb_frame(1700), now_us=2000)
+    parser.feed(uwb_frame(1800), now_us=3000)
+    got = []
+    while parser.next_frame() is not None:
+        got.append((parser.ranges[0], parser.timestamp_us))
+    expect(got, [(1500, 2000), (1600, 2000), (1700, 2000), (1800, 3000)], "frames and stamps")
+    # More writes than stamps: the extra bytes share the newest stamp
+    for i, b in enumerate(uwb_frame(1900)):
+        parser.feed(bytes([b]), now_us=4000 + i)
+    expect(parser.next_frame()[0], 1900, "frame from byte writes")
+    expect(parser.timestamp_us, 4000 + FRAME_LENGTH - 1, "stamp of last byte")
+
+
+@check
+def bu03_irq_ring_survives_busy_main_loop():
+    Pin.reset_all()
+    UART.attach(1, None)
+    clock = VirtualClock()
+    utime.set_clock(clock)
+    uwb = BU03()
+    try:
+        uwb.poll()
+        expect(uwb.start_irq(), True, "UART IRQ available")
+        for i in range(60):
+            clock.schedule(10000 + i * 20000, UART.feed, 1, uwb_frame(1000 + i))
+        # The main loop is stuck for 1.5 s (e.g. a blocking LoRa receive)
+        clock.run_until(1500000)
+        got = []
+        uwb.poll(lambda ranges: got.append((ranges[0], uwb.parser.timestamp_us)))
+        expect(got, [(1000 + i, 10000 + i * 20000) for i in range(60)], "frames and arrival times")
+        expect(uwb.parser.overflows, 0, "ring overflows")
+    finally:
+        uwb.stop_irq()
+        utime.set_clock(None)
+
+
+# ---------------------------
+# UWB position
+# ---------------------------
+ANCHORS = [[0.0, 0.0], [6.0, 0.0], [0.0, 4.0], [6.0, 4.0], None, None, None, None]
+
+
+def expect_near(actual, expected, tolerance, what):
+    if any(abs(a - e) > tolerance for a, e in zip(actual, expected)):
+        raise AssertionError("{}: expected {!r}, got {!r}".format(what, expected, list(actual)))
+
+
+@check
+def multilateration_exact_ranges():
+    solver = Multilateration(ANCHORS)
+    for tag in ((2.3, 1.7), (0.5, 3.5), (5.9, 0.2)):
+        ranges = [int(math.dist(tag, a) * 1000) if a else 0 for a in ANCHORS]
+        expect(solver.solve(ranges, scale=0.001), True, "fix")
+        expect_near(solver.position, tag, 0.002, "position")
+        expect(solver.used, 4, "anchors used")
+    anchors3 = [[0, 0, 0], [6, 0, 2.5], [0, 4, 2.5], [6, 4, 0], [3, 0, 2.5]]
+    solver = Multilateration(anchors3)
+    tag = (2.0, 1.0, 1.2)
+    expect(solver.solve([math.dist(tag, a) for a in anchors3]), True, "3D fix")
+    expect_near(solver.position, tag, 0.002, "3D position")
+
+
+@check
+def multilateration_missing_and_degenerate_anchors():
+    solver = Multilateration(ANCHORS)
+    tag = (2.3, 1.7)
+    ranges = [math.dist(tag, a) if a else None for a in ANCHORS]
+    # Two anchors only: no linear start until there has been a fix
+    expect(solver.solve([ranges[0], ranges[1]]), False, "two anchors, no previous fix")
+    expect(solver.solve(ranges), True, "four anchors")
+    expect(solver.solve([ranges[0], ranges[1]]), True, "two anchors after a fix")
+    expect_near(solver.position, tag, 0.002, "position from two anchors")
+    collinear = Multilateration([[0, 0], [1, 0], [2, 0]])
+    expect(collinear.solve([1.0, 1.0, 1.5]), False, "collinear anchors")
+    gated = Multilateration(ANCHORS, max_residual=0.05)
+    expect(gated.solve([ranges[0], ranges[1], ranges[2], ranges[3] + 1.0]), False, "outlier range rejected")
+    expect(load_anchors({}), None, "no anchors configured")
+
+
+@check
+def range_filter_gates_spikes_and_dropouts():
+    rf = RangeFilter(gate_m=0.5, max_misses=3, timeout_ms=500)
+    for t in range(0, 1000, 50):
+        rf.update([2000, 3000], t, scale=0.001)
+    expect_near(rf.ranges[:2], (2.0, 3.0), 0.001, "steady ranges")
+    expect(rf.update([3500, 3010], 1000, scale=0.001), 2, "visible")
+    expect_near(rf.ranges[:2], (2.0, 3.005), 0.01, "spike rejected, small change kept")
+    expect(rf.rejected, 1, "rejections")
+    # Dropout: coast on the last range, then drop it after the timeout
+    rf.update([None, 3000], 1200, scale=0.001)
+    expect_near(rf.ranges[:1], (2.0,), 0.001, "coasting")
+    expect(rf.update([None, 3000], 1600, scale=0.001), 1, "visible after timeout")
+    # A sustained jump restarts the track
+    for t in (1650, 1700, 1750):
+        rf.update([0, 5000], t, scale=0.001)
+    expect_near(rf.ranges[1:2], (5.0,), 0.001, "restarted range")
+
+
+@check
+def position_tracker_smooths_and_gates():
+    tracker = PositionTracker(dims=2, fix_noise=0.05)
+    rng = random.Random(1)
+    # Walk along x at 0.5 m/s with 5 cm fix noise
+    raw_err = track_err = 0.0
+    for i in range(200):
+        t = i * 50
+        truth = (1.0 + 0.5 * t / 1000, 2.0)
+        fix = (truth[0] + rng.gauss(0, 0.05), truth[1] + rng.gauss(0, 0.05))
+        expect(tracker.update(fix, t), True, "fix {} accepted".format(i))
+        if i >= 50:
+            raw_err += math.dist(fix, truth) ** 2
+            track_err += math.dist(tracker.position, truth) ** 2
+    if track_err > raw_err / 2:
+        raise AssertionError("tracker did not smooth: {:.4f} vs raw {:.4f}".format(track_err, raw_err))
+    expect_near(tracker.velocity, (0.5, 0.0), 0.1, "velocity")
+    expect(tracker.update((9.0, 9.0), 10000), False, "outlier fix rejected")
+    tracker.mark_reported(10000)
+    expect(tracker.report_due(10050, min_move_m=0.1, max_interval_ms=5000), False, "no news")
+    expect(tracker.report_due(15000, min_move_m=0.1, max_interval_ms=5000), True, "heartbeat")
+    tracker.predict(10500)
+    expect(tracker.report_due(10500, min_move_m=0.1, max_interval_ms=5000), True, "moved")
+    expect((tracker.gate, PositionTracker(dims=3).gate, PositionTracker(gate=5.0).gate),
+           (9.21, 11.34, 5.0), "gate by dims")
+
+
+# ---------------------------
+# Telemetry frames
+# ---------------------------
+@check
+def telemetry_round_trip():
+    encoder = telemetry.TelemetryEncoder(3)
+    frame = bytes(encoder.encode(telemetry.TYPE_TELEMETRY, ranges=[1.5, 2.3, 0, None, 70.0],
+                                 range_scale=1000, position=(2.304, -1.7, 0.5),
+                                 rssi=-72, snr=-7.25, battery_mv=3912))
+    expect(len(frame), 5 + 1 + 6 + 6 + 2 + 2, "frame size")
+    got = telemetry.decode(frame)
+    expect((got.type, got.node, got.seq), (telemetry.TYPE_TELEMETRY, 3, 0), "header")
+    expect(got.ranges, [1500, 2300, None, None, 0xFFFF, None, None, None], "ranges, far one saturated")
+    expect(got.position, (2.3, -1.7, 0.5), "position in cm")
+    expect((got.rssi, got.snr, got.battery_mv), (-72, -7.25, 3912), "link and battery")
+    ping = telemetry.decode(bytes(encoder.encode(telemetry.TYPE_PING)))
+    expect((ping.seq, ping.ranges, ping.describe()), (1, None, "P3#1"), "ping")
+    text = telemetry.decode(bytes(encoder.encode(telemetry.TYPE_TEXT, text="hi")))
+    expect(text.text, "hi", "text frame")
+
+
+@check
+def telemetry_rejects_legacy_and_truncated_payloads():
+    for payload in (b"Ping 42", b"Hello From Eggbert: 3!", b"Pong 0", b"\x12"):
+        expect(telemetry.decode(payload), None, repr(payload))
+    frame = bytes(telemetry.TelemetryEncoder(1).encode(ranges=[1000, 2000], position=(1, 2)))
+    for cut in range(len(frame)):
+        expect(telemetry.decode(frame[:cut]), None, "frame cut to {} bytes".format(cut))
+    with AllocationCounter(telemetry) as counter:
+        encoder = telemetry.TelemetryEncoder(1)
+        base = counter.count
+        for _ in range(10):
+            encoder.encode(ranges=[1000, 2000], position=(1, 2), rssi=-80, snr=5)
+        expect(counter.count - base, 0, "buffers allocated by encode")
+
+
+# ---------------------------
+# Serial frames and gateway ingest
+# ---------------------------
+class ByteSink:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+
+def serial_stream(packets):
+    sink = ByteSink()
+    writer = FrameWriter(sink)
+    for i, payload in enumerate(packets):
+        writer.write(payload, -60 - i, 7.25 - i, 1000 + i)
+    return sink.data
+
+
+@check
+def serial_frame_crc_is_ccitt_false():
+    expect(serial_frame.crc16(b"123456789"), 0x29B1, "check value")
+    expect(serial_frame._crc16(b"123456789"), 0x29B1, "table fallback")
+    data = bytes(range(256))
+    expect(serial_frame._crc16(data), serial_frame.crc16(data), "fallback matches")
+
+
+@check
+def serial_frames_round_trip_through_noise():
+    packets = [b"", b"\xa5\x5a", bytes(range(255)), b"hello"]
+    good = serial_stream(packets)
+    bad = bytearray(serial_stream([b"corrupt"]))
+    bad[-3] ^= 0x01
+    # Console text (with a stray sync word), a corrupted frame, a frame
+    # claiming an impossible length, then the good ones
+    stream = b"boot \xa5\x5a\r\n" + bytes(bad) + b"\xa5\x5a\xff\xff" + bytes(good)
+    for chunk in (1, 3, 7, len(stream)):
+        decoder = FrameDecoder()
+        frames = []
+        for i in range(0, len(stream), chunk):
+            frames += decoder.feed(stream[i:i + chunk])
+        expect([frame[3] for frame in frames], packets, "payloads, {} byte chunks".format(chunk))
+        expect(frames[2][:3], (1002, -62, 5.25), "timestamp, RSSI, SNR")
+        expect((decoder.crc_errors, len(decoder.buf)), (1, 0), "one CRC error, nothing left over")
+    try:
+        FrameWriter(ByteSink()).encode(bytes(256), 0, 0)
+        expect(True, False, "256 byte payload rejected")
+    except ValueError:
+        pass
+
+
+@check
+def transceiver_keeps_stdout_clear_for_frames():
+    Pin.reset_all()
+    radio = FakeSX127x(spi_id=1, ss=10, dio0=5)
+    with quiet():
+        transceiver = LoRaTransceiver(*radio.backend(), verbose=False)
+    transceiver.start_listening()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        transceiver.send(b"blocking")
+        transceiver.send(b"nowait", wait=False)
+        radio.inject(b"heard")
+        expect(transceiver.poll(raw=True)[0], b"heard", "received")
+    expect(output.getvalue(), "", "nothing printed per packet")
+
+
+@check
+def gateway_ingest_over_pty():
+    encoder = telemetry.TelemetryEncoder(7)
+    packets = [bytes(encoder.encode(ranges=[1000 + i], battery_mv=3700)) for i in range(300)] + [b"Ping 1"]
+    with tempfile.TemporaryDirectory() as directory:
+        master, slave = os.openpty()
+        fd = open_serial(os.ttyname(slave))
+        db_path = os.path.join(directory, "packets.db")
+        columnar_path = os.path.join(directory, "packets.col")
+        ingest = Ingest(fd, [SqliteSink(db_path), ColumnarSink(columnar_path)], workers=0, batch=64,
+                        flush_ms=20)
+        data = b"print() output\r\n" + bytes(serial_stream(packets))
+
+        def board():
+            os.write(master, data[:1000])
+            time.sleep(0.05)
+            os.write(master, data[1000:])
+            for _ in range(200):
+                if ingest.stored >= len(packets):
+                    break
+                time.sleep(0.01)
+            ingest.stop()
+        threading.Thread(target=board, daemon=True).start()
+        ingest.run()
+        for end in (fd, slave, master):
+            os.close(end)
+        stats = ingest.stats()
+        expect((stats["stored"], stats["crc_errors"], stats["batches"] >= 5), (301, 0, True), "stored in batches")
+        db = sqlite3.connect(db_path)
+        expect(db.execute("PRAGMA journal_mode").fetchone()[0], "wal", "WAL mode")
+        rows = db.execute("SELECT board_ms, rssi, node, seq, payload FROM packets ORDER BY id").fetchall()
+        db.close()
+        expect(rows[5], (1005, -65, 7, 5, packets[5]), "decoded row")
+        expect(rows[-1][2:], (None, None, b"Ping 1"), "undecoded row")
+        blocks = list(read_columnar(columnar_path))
+        expect(sum(len(block["payload"]) for block in blocks), 301, "columnar rows")
+        expect((list(blocks[0]["seq"][:3]), blocks[-1]["node"][-1], blocks[-1]["payload"][-1]),
+               ([0, 1, 2], -1, b"Ping 1"), "columnar values")
+
+
+# ---------------------------
+# Shared driver
+# ---------------------------
+@check
+def ulora_core_shims_use_shared_driver():
+    repo = os.path.dirname(hostenv.FIRMWARE_DIR)
+    for project in SHIM_PROJECTS:
+        sys.path.insert(0, os.path.join(repo, project))
+        try:
+            for name in ("ulora", "ulora.core"):
+                sys.modules.pop(name, None)
+            core = importlib.import_module("ulora.core")
+            expect(core.ULoRa is ULoRa, True, project + " ulora.core.ULoRa is shared")
+        finally:
+            sys.path.pop(0)
+
+
+@check
+def pymakr_projects_import_without_drivers():
+    repo = os.path.dirname(hostenv.FIRMWARE_DIR)
+    shared = sys.modules["Drivers.lora.lora"]
+    for project in vendor_drivers.PROJECTS:
+        with tempfile.TemporaryDirectory() as directory:
+            # The project as uploaded: its ulora package plus the vendored driver
+            shutil.copytree(os.path.join(repo, project, "ulora"), os.path.join(directory, "ulora"),
+                            ignore=shutil.ignore_patterns("__pycache__", "lora.py"))
+            vendor_drivers.vendor(directory)
+            sys.path.insert(0, directory)
+            # As on a board with only this project uploaded: no /Drivers
+            sys.modules["Drivers.lora.lora"] = None
+            try:
+                for name in ("ulora", "ulora.core", "ulora.lora"):
+                    sys.modules.pop(name, None)
+                core = importlib.import_module("ulora.core")
+                expect(core.ULoRa is sys.modules["ulora.lora"].ULoRa, True, project + " uses the copy")
+            finally:
+                sys.modules["Drivers.lora.lora"] = shared
+                for name in ("ulora", "ulora.core", "ulora.lora"):
+                    sys.modules.pop(name, None)
+                sys.path.pop(0)
+
+
+def main():
+    failures = 0
+    for func in CHECKS:
+        try:
+            func()
+            print("PASS  {}".format(func.__name__))
+        except Exception:
+            failures += 1
+            print("FAIL  {}".format(func.__name__))
+            traceback.print_exc()
+    print("\n{} checks, {} failed".format(len(CHECKS), failures))
+    return failures
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main() else 0)
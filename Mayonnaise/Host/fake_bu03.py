@@ -0,0 +1,61 @@
+"""
+AT command side of a BU03 UWB module, for host runs. Attach it to the UART
+the firmware configures the module on:
+
+    bu03 = FakeBU03(id=0, role=1)
+    UART.attach(2, bu03)
+
+It answers AT, AT+GETCFG, AT+SETCFG=id,role,channel,rate, AT+SAVE and
+AT+RESTORE the way the module does, replies instantly, and counts the
+commands it was sent and the flash writes they caused.
+"""
+
+
+class FakeBU03:
+    def __init__(self, id=0, role=0, channel=1, rate=1, getcfg_ok=True):
+        """
+        :param getcfg_ok: End the GETCFG reply with OK; some firmware
+                          versions send only the configuration line.
+        """
+        self.saved = [id, role, channel, rate]
+        self.config = list(self.saved)
+        self.getcfg_ok = getcfg_ok
+        self.commands = []
+        self.saves = 0
+        self._pending = bytearray()
+
+    def uart_write(self, data):
+        self._pending.extend(data)
+        reply = b""
+        while b"\n" in self._pending:
+            end = self._pending.index(b"\n")
+            line = bytes(self._pending[:end]).strip().decode()
+            del self._pending[:end + 1]
+            if line:
+                reply += self.command(line)
+        return reply
+
+    def command(self, line):
+        self.commands.append(line)
+        if line == "AT":
+            return b"OK\r\n"
+        if line == "AT+GETCFG":
+            reply = "getcfg ID:{}, Role:{}, CH:{}, Rate:{}\r\n".format(*self.config).encode()
+            return reply + (b"OK\r\n" if self.getcfg_ok else b"")
+        if line.startswith("AT+SETCFG="):
+            try:
+                values = [int(v) for v in line[len("AT+SETCFG="):].split(",")]
+            except ValueError:
+                return b"ERROR\r\n"
+            if len(values) != 4:
+                return b"ERROR\r\n"
+            self.config = values
+            return b"OK\r\n"
+        if line == "AT+SAVE":
+            self.saved = list(self.config)
+            self.saves += 1
+            return b"OK\r\n"
+        if line == "AT+RESTORE":
+            self.config = [0, 0, 1, 1]
+            return b"OK\r\n"
+        return b"ERROR\r\n"
@@ -0,0 +1,445 @@
+"""
+Host-side fake SX127x LoRa module.
+
+Models the register file and FIFO behind the SPI bus closely enough for the
+SX127x drivers in this repo (ULoRa, PICO_Loarutil's SX127x / LoraUtil and
+Pico_Meshtastic's LoRa) to run unchanged under CPython. The fake attaches
+itself to a simulated SPI bus and drives the DIO0 pin from its IRQ flags, so
+the interrupt-driven paths can be exercised by injecting packets.
+
+    radio = FakeSX127x(spi_id=1, ss=10, dio0=5)
+    lora = ULoRa(*radio.backend())
+    lora.receive_irq()
+    radio.inject(b"hello", rssi=-70, snr=7.5)   # fires the DIO0 handler
+
+Given a rf_channel.Channel, transmissions stay on air for their real time
+on air and are received by the other radios on the channel. Busy-polling
+the IRQ flags then advances the virtual clock: to the end of the packet in
+TX or of the detection in CAD, or by idle_poll_us while waiting in RX.
+Channel activity detection reports a co-channel packet the radio could
+demodulate on air at the start or end of the detection; without a channel
+it reports the cad_busy attribute.
+"""
+from collections import namedtuple
+
+from machine import Pin, SPI, current_board
+
+# ============================================================================
+# Registers
+# ============================================================================
+REG_FIFO                = 0x00
+REG_OP_MODE             = 0x01
+REG_FRF_MSB             = 0x06
+REG_PA_CONFIG           = 0x09
+REG_FIFO_ADDR_PTR       = 0x0D
+REG_FIFO_TX_BASE_ADDR   = 0x0E
+REG_FIFO_RX_BASE_ADDR   = 0x0F
+REG_FIFO_RX_CURRENT_ADDR= 0x10
+REG_IRQ_FLAGS_MASK      = 0x11
+REG_IRQ_FLAGS           = 0x12
+REG_RX_NB_BYTES         = 0x13
+REG_MODEM_STAT          = 0x18
+REG_PKT_SNR_VALUE       = 0x19
+REG_PKT_RSSI_VALUE      = 0x1A
+REG_RSSI_VALUE          = 0x1B
+REG_MODEM_CONFIG_1      = 0x1D
+REG_MODEM_CONFIG_2      = 0x1E
+REG_PREAMBLE_MSB        = 0x20
+REG_PREAMBLE_LSB        = 0x21
+REG_PAYLOAD_LENGTH      = 0x22
+REG_FIFO_RX_BYTE_ADDR   = 0x25
+REG_MODEM_CONFIG_3      = 0x26
+REG_INVERTIQ            = 0x33
+REG_SYNC_WORD           = 0x39
+REG_DIO_MAPPING_1       = 0x40
+REG_VERSION             = 0x42
+REG_PA_DAC              = 0x4D
+
+MODE_MASK               = 0x07
+MODE_SLEEP              = 0x00
+MODE_STDBY              = 0x01
+MODE_TX                 = 0x03
+MODE_RX_CONTINUOUS      = 0x05
+MODE_RX_SINGLE          = 0x06
+MODE_CAD                = 0x07
+
+IRQ_CAD_DETECTED_MASK   = 0x01
+IRQ_CAD_DONE_MASK       = 0x04
+IRQ_TX_DONE_MASK        = 0x08
+IRQ_VALID_HEADER_MASK   = 0x10
+IRQ_PAYLOAD_CRC_ERROR_MASK = 0x20
+IRQ_RX_DONE_MASK        = 0x40
+
+# RegModemStat: signal detected, synchronized, RX on-going, header valid
+MODEM_STAT_RECEIVING    = 0x0F
+MODEM_STAT_CLEAR        = 0x10
+
+# DIO0 source selected by REG_DIO_MAPPING_1 bits 7-6
+DIO0_SOURCES = (IRQ_RX_DONE_MASK, IRQ_TX_DONE_MASK, 0x04, 0x00)
+
+# Power-on register values that the drivers depend on
+RESET_VALUES = {
+    REG_OP_MODE: 0x09,
+    0x06: 0x6C, 0x07: 0x80, 0x08: 0x00,  # 434 MHz
+    0x09: 0x4F,                          # PA config
+    0x0C: 0x20,                          # LNA
+    REG_FIFO_TX_BASE_ADDR: 0x80,
+    0x1D: 0x72,                          # modem config 1
+    0x1E: 0x70,                          # modem config 2
+    0x20: 0x00, 0x21: 0x08,              # preamble
+    REG_PAYLOAD_LENGTH: 0x01,
+    0x23: 0xFF,                          # max payload length
+    0x26: 0x04,                          # modem config 3
+    0x31: 0xC3, 0x33: 0x27, 0x37: 0x0A,
+    0x39: 0x12,                          # sync word
+    0x3B: 0x1D,
+    REG_VERSION: 0x12,
+    REG_PA_DAC: 0x84,
+}
+
+BANDWIDTHS = (7800, 10400, 15600, 20800, 31250, 41700, 62500, 125000, 250000, 500000)
+
+FXOSC = 32000000
+
+# Registers that modem_config() decodes
+MODEM_REGISTERS = frozenset((0x06, 0x07, 0x08, REG_MODEM_CONFIG_1, REG_MODEM_CONFIG_2,
+                             REG_PREAMBLE_MSB, REG_PREAMBLE_LSB, REG_MODEM_CONFIG_3,
+                             REG_INVERTIQ, REG_SYNC_WORD))
+
+# Modem settings decoded from the registers, as used by the channel
+ModemConfig = namedtuple("ModemConfig", (
+    "frequency", "bandwidth", "sf", "coding_rate", "implicit_header", "crc",
+    "preamble", "ldro", "sync_word", "invert_iq_tx", "invert_iq_rx"))
+
+
+class FakeSX127x:
+    """
+    Register-level fake of one SX127x on a simulated SPI bus, bound to the
+    machine.Board that is current when it is created.
+    Without a channel, transmissions are recorded in self.sent and complete
+    instantly unless auto_tx_done is False, in which case they stay on air
+    until complete_tx() is called (or forever, to simulate a wedged radio).
+    """
+    def __init__(self, spi_id=1, ss=10, dio0=5, auto_tx_done=True, reset=None,
+                 channel=None, position=(0.0, 0.0), idle_poll_us=100, name=None):
+        """
+        :param reset: (Optional) Reset pin id; driving it low resets the registers.
+        :param channel: (Optional) rf_channel.Channel to transmit and receive on.
+        :param position: (x, y) in metres, for the channel's path loss.
+        :param idle_poll_us: Virtual time each empty IRQ flag poll in RX takes.
+        """
+        self.spi_id = spi_id
+        self.ss = ss
+        self.dio0 = dio0
+        self.auto_tx_done = auto_tx_done
+        self.board = current_board()
+        self.name = name
+        self.regs = bytearray(128)
+        self.fifo = bytearray(256)
+        self._reset_registers()
+        self.sent = []
+        self.received = 0
+        self.spi_transactions = 0
+        self._addr = None
+        self._write_mode = False
+        self._selected = False
+        self.channel = channel
+        self.position = position
+        self.idle_poll_us = idle_poll_us
+        self.reception = None   # packet being received, managed by the channel
+        self._tx = None         # Transmission on air
+        self._cad = None        # clock event ending a channel activity detection
+        self._cad_detected = False
+        self.cad_busy = False   # CAD result without a channel
+        SPI.attach(spi_id, self, self.board)
+        Pin.watch(ss, self._on_chip_select, self.board)
+        if reset is not None:
+            Pin.watch(reset, self._on_reset, self.board)
+        Pin.drive(dio0, 0, self.board)
+        if channel is not None:
+            channel.attach(self)
+
+    def __repr__(self):
+        return "FakeSX127x({!r})".format(self.name or self.board.name)
+
+    # ---------------------------
+    # Simulation Hooks
+    # ---------------------------
+    def backend(self):
+        """
+        :return: (spi, pins) arguments for constructing a driver on this fake.
+        """
+        return SPI(self.spi_id), {"ss": self.ss, "dio0": self.dio0}
+
+    def mode(self):
+        return self.regs[REG_OP_MODE] & MODE_MASK
+
+    def in_rx(self):
+        return self.mode() in (MODE_RX_CONTINUOUS, MODE_RX_SINGLE)
+
+    def complete_tx(self):
+        """
+        Finish an in-progress transmission, raising TxDone.
+        """
+        if self.mode() == MODE_TX:
+            self._set_mode(MODE_STDBY)
+            self._raise_irq(IRQ_TX_DONE_MASK)
+
+    def inject(self, payload, rssi=-60, snr=8.0, crc_error=False):
+        """
+        Deliver a packet over the air. Ignored unless the module is in RX.
+
+        :return: True if the packet was received.
+        """
+        if not self.in_rx():
+            return False
+        self.receive_packet(payload, rssi, snr, crc_error)
+        return True
+
+    # ---------------------------
+    # Channel Interface
+    # ---------------------------
+    def modem_config(self):
+        """
+        :return: ModemConfig decoded from the current register values.
+        """
+        if self._modem is None:
+            self._modem = self._decode_modem()
+        return self._modem
+
+    def _decode_modem(self):
+        regs = self.regs
+        frf = (regs[REG_FRF_MSB] << 16) | (regs[REG_FRF_MSB + 1] << 8) | regs[REG_FRF_MSB + 2]
+        config_1 = regs[REG_MODEM_CONFIG_1]
+        config_2 = regs[REG_MODEM_CONFIG_2]
+        return ModemConfig(
+            frequency=frf * FXOSC / (1 << 19),
+            bandwidth=BANDWIDTHS[min(config_1 >> 4, 9)],
+            sf=max(6, min(config_2 >> 4, 12)),
+            coding_rate=max(1, (config_1 >> 1) & 0x07),
+            implicit_header=bool(config_1 & 0x01),
+            crc=bool(config_2 & 0x04),
+            preamble=(regs[REG_PREAMBLE_MSB] << 8) | regs[REG_PREAMBLE_LSB],
+            ldro=bool(regs[REG_MODEM_CONFIG_3] & 0x08),
+            sync_word=regs[REG_SYNC_WORD],
+            invert_iq_tx=not regs[REG_INVERTIQ] & 0x01,
+            invert_iq_rx=bool(regs[REG_INVERTIQ] & 0x40),
+        )
+
+    def tx_power_dbm(self):
+        """
+        :return: Output power set by RegPaConfig (and RegPaDac high power mode).
+        """
+        pa = self.regs[REG_PA_CONFIG]
+        if pa & 0x80:
+            power = 2 + (pa & 0x0F)
+            if self.regs[REG_PA_DAC] & 0x07 == 0x07:
+                power += 3
+            return power
+        max_power = 10.8 + 0.6 * ((pa >> 4) & 0x07)
+        return max_power - (15 - (pa & 0x0F))
+
+    def implicit_length(self):
+        return self.regs[REG_PAYLOAD_LENGTH]
+
+    def rssi_offset(self):
+        """
+        :return: RSSI register offset: 157 on the HF port, 164 below 779 MHz.
+        """
+        return 157 if self.modem_config().frequency >= 779000000 else 164
+
+    def receive_packet(self, payload, rssi, snr, crc_error=False):
+        """
+        Write a received packet into the FIFO and raise RxDone, as the modem
+        does at the end of a packet. Consecutive packets in continuous RX
+        follow each other in the FIFO.
+        """
+        start = self._rx_write
+        for i, byte in enumerate(payload):
+            self.fifo[(start + i) & 0xFF] = byte
+        self._rx_write = (start + len(payload)) & 0xFF
+        self.regs[REG_FIFO_RX_CURRENT_ADDR] = start
+        self.regs[REG_FIFO_RX_BYTE_ADDR] = self._rx_write
+        self.regs[REG_RX_NB_BYTES] = len(payload)
+        self.regs[REG_PKT_RSSI_VALUE] = max(0, min(255, int(round(rssi)) + self.rssi_offset()))
+        self.regs[REG_PKT_SNR_VALUE] = max(-128, min(127, int(round(snr * 4)))) & 0xFF
+        self.received += 1
+        if self.mode() == MODE_RX_SINGLE:
+            self._set_mode(MODE_STDBY)
+        flags = IRQ_RX_DONE_MASK | IRQ_VALID_HEADER_MASK
+        if crc_error:
+            flags |= IRQ_PAYLOAD_CRC_ERROR_MASK
+        self._raise_irq(flags)
+
+    def tx_finished(self):
+        """
+        Called by the channel when this radio's packet has been fully sent.
+        """
+        self._tx = None
+        self.complete_tx()
+
+    # ---------------------------
+    # SPI Device Interface
+    # ---------------------------
+    def write(self, buf):
+        for byte in buf:
+            self._transfer_byte(byte)
+
+    def readinto(self, buf, write=0x00):
+        for i in range(len(buf)):
+            buf[i] = self._transfer_byte(write)
+
+    def write_readinto(self, write_buf, read_buf):
+        for i in range(len(write_buf)):
+            read_buf[i] = self._transfer_byte(write_buf[i])
+
+    def _on_reset(self, level):
+        if level == 0:
+            self._set_mode(MODE_SLEEP)
+            self._reset_registers()
+
+    def _reset_registers(self):
+        if getattr(self, "_cad", None) is not None:
+            self.channel.clock.cancel(self._cad)
+            self._cad = None
+        if getattr(self, "_tx", None) is not None:
+            self.channel.abort(self._tx)
+            self._tx = None
+        if getattr(self, "reception", None) is not None:
+            self.channel.drop_reception(self)
+        self.regs[:] = bytes(128)
+        for address, value in RESET_VALUES.items():
+            self.regs[address] = value
+        self._rx_write = 0
+        self._modem = None
+
+    def _on_chip_select(self, level):
+        if level == 0 and not self._selected:
+            self._selected = True
+            self._addr = None
+            self.spi_transactions += 1
+        elif level == 1 and self._selected:
+            self._selected = False
+            # DIO0 changes are only applied between transactions
+            self._update_dio0()
+
+    def _transfer_byte(self, out):
+        if self._addr is None:
+            # First byte of a transaction: wnr bit + register address
+            self._addr = out & 0x7F
+            self._write_mode = bool(out & 0x80)
+            return 0
+        address = self._addr
+        if address == REG_FIFO:
+            ptr = self.regs[REG_FIFO_ADDR_PTR]
+            value = self.fifo[ptr]
+            if self._write_mode:
+                self.fifo[ptr] = out
+            self.regs[REG_FIFO_ADDR_PTR] = (ptr + 1) & 0xFF
+            return value
+        # Burst access to other registers auto-increments the address
+        self._addr = (address + 1) & 0x7F
+        if self.channel is not None and not self._write_mode:
+            if address == REG_IRQ_FLAGS:
+                self._idle_poll()
+            elif address == REG_RSSI_VALUE and self.in_rx():
+                rssi = self.channel.current_rssi(self) + self.rssi_offset()
+                self.regs[REG_RSSI_VALUE] = max(0, min(255, int(rssi)))
+            elif address == REG_MODEM_STAT:
+                self.regs[REG_MODEM_STAT] = (MODEM_STAT_RECEIVING if self.reception is not None
+                                             else MODEM_STAT_CLEAR)
+        value = self.regs[address]
+        if self._write_mode:
+            self._write_register(address, out)
+        return value
+
+    # ---------------------------
+    # Register Side Effects
+    # ---------------------------
+    def _idle_poll(self):
+        """
+        The driver is reading the IRQ flags. If nothing can change them
+        before the next channel event, let virtual time pass.
+        """
+        flags = self.regs[REG_IRQ_FLAGS]
+        clock = self.channel.clock
+        if self._tx is not None and not flags & IRQ_TX_DONE_MASK:
+            clock.run_until(self._tx.end_us)
+        elif self._cad is not None and not flags & IRQ_CAD_DONE_MASK:
+            clock.run_until(self._cad.at)
+        elif flags == 0 and self.in_rx():
+            clock.run_until(clock.now_us + self.idle_poll_us)
+
+    def _write_register(self, address, value):
+        if address == REG_VERSION:
+            return
+        if address == REG_IRQ_FLAGS:
+            # Flags are cleared by writing 1
+            self.regs[REG_IRQ_FLAGS] &= ~value & 0xFF
+        elif address == REG_OP_MODE:
+            self._set_mode(value & MODE_MASK, value)
+        else:
+            self.regs[address] = value
+            if address in MODEM_REGISTERS:
+                self._modem = None
+
+    def _set_mode(self, mode, op_mode=None):
+        old = self.mode()
+        if op_mode is None:
+            op_mode = (self.regs[REG_OP_MODE] & ~MODE_MASK) | mode
+        self.regs[REG_OP_MODE] = op_mode
+        if mode == old:
+            return
+        if mode in (MODE_RX_CONTINUOUS, MODE_RX_SINGLE):
+            if old not in (MODE_RX_CONTINUOUS, MODE_RX_SINGLE):
+                self._rx_write = self.regs[REG_FIFO_RX_BASE_ADDR]
+        elif self.reception is not None:
+            self.channel.drop_reception(self)
+        if old == MODE_TX and self._tx is not None:
+            # Leaving TX early cuts the packet off
+            self.channel.abort(self._tx)
+            self._tx = None
+        if old == MODE_CAD and self._cad is not None:
+            self.channel.clock.cancel(self._cad)
+            self._cad = None
+        if mode == MODE_TX:
+            self._transmit()
+        elif mode == MODE_CAD:
+            self._start_cad()
+
+    def _transmit(self):
+        base = self.regs[REG_FIFO_TX_BASE_ADDR]
+        length = self.regs[REG_PAYLOAD_LENGTH]
+        payload = bytes(self.fifo[(base + i) & 0xFF] for i in range(length))
+        self.sent.append(payload)
+        if self.channel is not None:
+            self._tx = self.channel.transmit(self, payload)
+        elif self.auto_tx_done:
+            self.complete_tx()
+
+    def _start_cad(self):
+        if self.channel is None:
+            self._end_cad(self.cad_busy)
+            return
+        # CAD listens for about one symbol, then needs 32 chips to decide
+        modem = self.modem_config()
+        duration = ((1 << modem.sf) + 32) * 1000000 // modem.bandwidth
+        self._cad_detected = self.channel.activity(self)
+        self._cad = self.channel.clock.call_later(duration, self._cad_elapsed)
+
+    def _cad_elapsed(self):
+        self._cad = None
+        self._end_cad(self._cad_detected or self.channel.activity(self))
+
+    def _end_cad(self, detected):
+        self._set_mode(MODE_STDBY)
+        self._raise_irq(IRQ_CAD_DONE_MASK | (IRQ_CAD_DETECTED_MASK if detected else 0))
+
+    def _raise_irq(self, flags):
+        self.regs[REG_IRQ_FLAGS] |= flags & ~self.regs[REG_IRQ_FLAGS_MASK]
+        if not self._selected:
+            self._update_dio0()
+
+    def _update_dio0(self):
+        source = DIO0_SOURCES[self.regs[REG_DIO_MAPPING_1] >> 6]
+        Pin.drive(self.dio0, self.regs[REG_IRQ_FLAGS] & source, self.board)
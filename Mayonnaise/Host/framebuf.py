@@ -0,0 +1,57 @@
+"""
+Host-side stand-in for the MicroPython framebuf module.
+Only fill() and pixel() touch the buffer; text and shapes are accepted and
+ignored, which is enough for drivers that subclass FrameBuffer.
+"""
+
+MONO_VLSB = 0
+MONO_HLSB = 3
+MONO_HMSB = 4
+
+
+class FrameBuffer:
+    def __init__(self, buffer, width, height, format, stride=None):
+        self.buf = buffer
+        self.fb_width = width
+        self.fb_height = height
+
+    def fill(self, c):
+        value = 0xFF if c else 0x00
+        for i in range(len(self.buf)):
+            self.buf[i] = value
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self.fb_width and 0 <= y < self.fb_height):
+            return None
+        index = (y >> 3) * self.fb_width + x
+        bit = 1 << (y & 7)
+        if c is None:
+            return 1 if self.buf[index] & bit else 0
+        if c:
+            self.buf[index] |= bit
+        else:
+            self.buf[index] &= ~bit & 0xFF
+
+    def text(self, s, x, y, c=1):
+        pass
+
+    def hline(self, x, y, w, c):
+        pass
+
+    def vline(self, x, y, h, c):
+        pass
+
+    def line(self, x1, y1, x2, y2, c):
+        pass
+
+    def rect(self, x, y, w, h, c, f=False):
+        pass
+
+    def fill_rect(self, x, y, w, h, c):
+        pass
+
+    def scroll(self, xstep, ystep):
+        pass
+
+    def blit(self, fbuf, x, y, key=-1, palette=None):
+        pass
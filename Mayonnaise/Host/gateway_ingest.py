@@ -0,0 +1,330 @@
+"""
+Gateway ingest daemon: stores every packet a receiver board forwards over
+serial.
+
+Reads the binary frames of Drivers/lora/serial_frame.py (a node running
+main.py with "serial_frames" in config.json) from a serial port, and
+anything else on the line, such as print() output, is skipped. A reader
+thread cuts the frames into batches of --batch frames, or whatever arrived
+within --flush-ms. A pool of --workers processes decodes the telemetry in
+each batch, and the main thread writes every batch to SQLite as one
+transaction. The database runs in WAL mode, so it can be queried while the
+daemon writes. With --columnar each batch is also appended to a columnar
+file (see read_columnar()).
+
+    packets(id, host_time, board_ms, rssi, snr, length, payload,
+            type, node, seq, decoded)
+
+type, node and seq are NULL for packets that are not telemetry frames, and
+decoded holds the frame as JSON.
+
+    python3 Host/gateway_ingest.py /dev/ttyACM0 --db eggs.db [--columnar eggs.col]
+                                   [--baud 115200] [--workers 2] [--batch 512]
+                                   [--flush-ms 200] [--stats 10]
+"""
+import argparse
+import json
+import os
+import queue
+import select
+import signal
+import sqlite3
+import struct
+import sys
+import termios
+import threading
+import time
+import tty
+from array import array
+from multiprocessing import Pool
+
+import hostenv
+
+from Drivers.lora.serial_frame import FrameDecoder
+from Drivers.lora.telemetry import decode
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packets (
+    id INTEGER PRIMARY KEY,
+    host_time REAL NOT NULL,
+    board_ms INTEGER NOT NULL,
+    rssi INTEGER NOT NULL,
+    snr REAL NOT NULL,
+    length INTEGER NOT NULL,
+    payload BLOB NOT NULL,
+    type INTEGER,
+    node INTEGER,
+    seq INTEGER,
+    decoded TEXT
+)
+"""
+INSERT = "INSERT INTO packets (host_time, board_ms, rssi, snr, length, payload, type, node, seq, " \
+         "decoded) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+# Columnar file: MAGIC, then one block per batch: <II rows, body length,
+# then each column's little-endian array in COLUMNS order, then the payload
+# offsets (rows + 1 x I) and the payload bytes. -1 marks missing fields.
+MAGIC = b"EGGCOL1\n"
+BLOCK = struct.Struct("<II")
+COLUMNS = (("host_time", "d"), ("board_ms", "I"), ("rssi", "h"), ("snr", "f"),
+           ("type", "h"), ("node", "h"), ("seq", "i"))
+READ_SIZE = 65536
+
+
+def open_serial(path, baud=115200):
+    """
+    Open a serial port (or the slave end of a pseudo-terminal) raw, at baud.
+
+    :return: File descriptor.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+    tty.setraw(fd)
+    attributes = termios.tcgetattr(fd)
+    speed = getattr(termios, "B{}".format(baud))
+    attributes[4] = attributes[5] = speed
+    termios.tcsetattr(fd, termios.TCSANOW, attributes)
+    return fd
+
+
+def _ignore_interrupts():
+    # Workers leave Ctrl-C to the main process, which drains and stops
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def decode_batch(frames):
+    """
+    Turn (host time, board ms, rssi, snr, payload) frames into packets rows.
+    Runs in the worker processes.
+    """
+    rows = []
+    for host_time, board_ms, rssi, snr, payload in frames:
+        frame = decode(payload)
+        if frame is None:
+            rows.append((host_time, board_ms, rssi, snr, len(payload), payload, None, None, None, None))
+        else:
+            rows.append((host_time, board_ms, rssi, snr, len(payload), payload, frame.type, frame.node,
+                         frame.seq, json.dumps(frame.as_dict())))
+    return rows
+
+
+class SqliteSink:
+    """
+    Appends batches of rows to the packets table, one transaction each.
+    """
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # A crash may lose the last transactions but never corrupts the file
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(SCHEMA)
+        self.db.commit()
+
+    def write(self, rows):
+        with self.db:
+            self.db.executemany(INSERT, rows)
+
+    def close(self):
+        self.db.close()
+
+
+class ColumnarSink:
+    """
+    Appends batches of rows to a columnar file, one block each.
+    """
+    def __init__(self, path):
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+    def write(self, rows):
+        columns = [array(code) for name, code in COLUMNS]
+        offsets = array("I", [0])
+        payloads = bytearray()
+        for host_time, board_ms, rssi, snr, length, payload, type, node, seq, decoded in rows:
+            for column, value in zip(columns, (host_time, board_ms, rssi, snr, type, node, seq)):
+                column.append(-1 if value is None else value)
+            payloads += payload
+            offsets.append(len(payloads))
+        parts = columns + [offsets]
+        if sys.byteorder == "big":
+            for part in parts:
+                part.byteswap()
+        body = b"".join(part.tobytes() for part in parts) + payloads
+        self.file.write(BLOCK.pack(len(rows), len(body)) + body)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_columnar(path):
+    """
+    Yield each block of a columnar file as a dict of column name -> array,
+    plus "payload": a list of bytes.
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a columnar packet file".format(path))
+        while True:
+            head = file.read(BLOCK.size)
+            if len(head) < BLOCK.size:
+                return
+            rows, length = BLOCK.unpack(head)
+            body = file.read(length)
+            block = {}
+            pos = 0
+            for name, code in COLUMNS + (("offsets", "I"),):
+                column = array(code)
+                size = column.itemsize * (rows + 1 if name == "offsets" else rows)
+                column.frombytes(body[pos:pos + size])
+                if sys.byteorder == "big":
+                    column.byteswap()
+                block[name] = column
+                pos += size
+            offsets = block.pop("offsets")
+            block["payload"] = [body[pos + offsets[i]:pos + offsets[i + 1]] for i in range(rows)]
+            yield block
+
+
+class Ingest:
+    """
+    Serial reader thread, decode pool and storage, wired together.
+    """
+    def __init__(self, fd, sinks, workers=2, batch=512, flush_ms=200):
+        """
+        :param fd: File descriptor to read frames from.
+        :param sinks: Objects with write(rows) and close().
+        :param workers: Decode processes; 0 decodes on the main thread.
+        :param batch: Frames per batch at most.
+        :param flush_ms: Longest a frame waits for its batch to fill.
+        """
+        self.fd = fd
+        self.sinks = sinks
+        self.workers = workers
+        self.batch = batch
+        self.flush_ms = flush_ms
+        self.decoder = FrameDecoder()
+        self.batches = queue.Queue(maxsize=64)
+        self.stopping = threading.Event()
+        self.stored = 0
+        self.batches_written = 0
+        self.write_s = 0.0
+        self.latency_max_s = 0.0
+
+    def stop(self):
+        self.stopping.set()
+
+    def _read(self):
+        # Reader thread: frames into batches, None once stopped
+        pending = []
+        first = 0
+        fd = self.fd
+        try:
+            while not self.stopping.is_set():
+                timeout = self.flush_ms / 1000
+                if pending:
+                    timeout = max(first + self.flush_ms / 1000 - time.time(), 0)
+                ready = select.select([fd], [], [], timeout)[0]
+                if ready:
+                    data = os.read(fd, READ_SIZE)
+                    if not data:
+                        break
+                    now = time.time()
+                    for frame in self.decoder.feed(data):
+                        if not pending:
+                            first = now
+                        pending.append((now,) + frame)
+                        if len(pending) >= self.batch:
+                            self.batches.put(pending)
+                            pending = []
+                if pending and time.time() - first >= self.flush_ms / 1000:
+                    self.batches.put(pending)
+                    pending = []
+        except OSError:
+            # The port went away (board reset or unplugged)
+            pass
+        finally:
+            if pending:
+                self.batches.put(pending)
+            self.batches.put(None)
+
+    def run(self):
+        """
+        Ingest until stop() is called or the port closes. Frames already
+        read when that happens are still stored.
+        """
+        reader = threading.Thread(target=self._read, daemon=True)
+        reader.start()
+        batches = iter(self.batches.get, None)
+        pool = Pool(self.workers, _ignore_interrupts) if self.workers else None
+        try:
+            for rows in (pool.imap(decode_batch, batches) if pool else map(decode_batch, batches)):
+                start = time.time()
+                for sink in self.sinks:
+                    sink.write(rows)
+                done = time.time()
+                self.write_s += done - start
+                self.latency_max_s = max(self.latency_max_s, done - rows[0][0])
+                self.stored += len(rows)
+                self.batches_written += 1
+        finally:
+            self.stop()
+            # Unblock the reader if a sink failed with the queue full
+            while reader.is_alive():
+                try:
+                    self.batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            if pool:
+                pool.close()
+                pool.join()
+            for sink in self.sinks:
+                sink.close()
+
+    def stats(self):
+        """
+        :return: Dict of frames decoded and stored, CRC errors, bytes
+                 skipped, batches written, time spent writing and the
+                 longest a frame took from arrival to storage.
+        """
+        stats = self.decoder.stats()
+        stats.update({"stored": self.stored, "batches": self.batches_written,
+                      "write_s": self.write_s, "latency_max_s": self.latency_max_s})
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("port", help="serial device, e.g. /dev/ttyACM0")
+    parser.add_argument("--db", default="packets.db", help="SQLite database")
+    parser.add_argument("--columnar", help="also append to this columnar file")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--workers", type=int, default=2, help="decode processes, 0 for none")
+    parser.add_argument("--batch", type=int, default=512, help="frames per transaction at most")
+    parser.add_argument("--flush-ms", type=int, default=200, help="longest a frame waits for its batch")
+    parser.add_argument("--stats", type=float, default=10, help="seconds between stats lines, 0 for none")
+    args = parser.parse_args()
+
+    sinks = [SqliteSink(args.db)]
+    if args.columnar:
+        sinks.append(ColumnarSink(args.columnar))
+    ingest = Ingest(open_serial(args.port, args.baud), sinks, args.workers, args.batch, args.flush_ms)
+
+    def report():
+        last = 0
+        while not ingest.stopping.wait(args.stats):
+            stats = ingest.stats()
+            print("{} stored ({:.0f}/s), {} CRC errors, {} bytes skipped".format(
+                stats["stored"], (stats["stored"] - last) / args.stats, stats["crc_errors"],
+                stats["skipped"]), file=sys.stderr)
+            last = stats["stored"]
+    if args.stats:
+        threading.Thread(target=report, daemon=True).start()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: ingest.stop())
+    ingest.run()
+    print(json.dumps(ingest.stats()), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""
+Prepare CPython to run the Mayonnaise firmware. Import this first from any
+host script: it puts the Host stand-ins and the firmware root on sys.path and
+adds MicroPython's tick and sleep helpers to the time module, which the
+drivers use directly, and gc.mem_free()/gc.mem_alloc().
+"""
+import gc
+import os
+import sys
+import time
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+FIRMWARE_DIR = os.path.dirname(HOST_DIR)
+
+for path in (FIRMWARE_DIR, HOST_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import utime
+
+for name in ("sleep_ms", "sleep_us", "ticks_ms", "ticks_us", "ticks_add", "ticks_diff"):
+    if not hasattr(time, name):
+        setattr(time, name, getattr(utime, name))
+
+# CPython has no fixed heap; report a large free heap so low-memory GC
+# policies never trigger unless a script overrides these
+if not hasattr(gc, "mem_free"):
+    gc.mem_free = lambda: 1 << 30
+if not hasattr(gc, "mem_alloc"):
+    gc.mem_alloc = lambda: 0
@@ -0,0 +1,285 @@
+"""
+Host-side stand-in for the MicroPython machine module.
+
+Put this folder first on sys.path to import the Mayonnaise drivers under
+CPython. Pins with the same id share their state, so a simulated device can
+drive an input (e.g. the LoRa DIO0 line) and fire the IRQ handler the driver
+attached to it. SPI buses forward every transfer to the device attached to
+that bus id with SPI.attach(). UARTs with the same id share a receive buffer
+that a simulated device fills with UART.feed(). I2C writes are counted only.
+
+Pin, SPI and UART ids are scoped to a Board. Everything runs on one default
+board unless a simulation creates a Board per node and constructs each
+node's devices and drivers inside "with board:", so hundreds of simulated
+nodes can all use pin 10 for chip select without sharing it.
+"""
+
+
+class Board:
+    """
+    The pins, SPI devices and UARTs of one simulated microcontroller.
+    Objects created while a board is current stay bound to it.
+    """
+    _stack = []
+
+    def __init__(self, name=None):
+        self.name = name
+        self.pins = {}          # pin id -> _PinState
+        self.spi_devices = {}   # bus id -> simulated device
+        self.uarts = {}         # uart id -> _UARTState
+
+    def __enter__(self):
+        Board._stack.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        Board._stack.pop()
+
+    def __repr__(self):
+        return "Board({!r})".format(self.name)
+
+
+_default_board = Board("default")
+
+
+def current_board():
+    return Board._stack[-1] if Board._stack else _default_board
+
+
+def _pin_state(board, id):
+    state = board.pins.get(id)
+    if state is None:
+        state = board.pins[id] = _PinState()
+    return state
+
+
+class _PinState:
+    def __init__(self):
+        self.level = 0
+        self.handler = None
+        self.trigger = 0
+        self.irq_pin = None
+        self.watchers = []
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self._board = current_board()
+        self._state = _pin_state(self._board, id)
+        if value is not None:
+            self.value(value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if value is not None:
+            self.value(value)
+
+    def value(self, level=None):
+        if level is None:
+            return self._state.level
+        Pin.drive(self.id, level, self._board)
+
+    __call__ = value
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def toggle(self):
+        self.value(1 - self._state.level)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        self._state.handler = handler
+        self._state.trigger = trigger if handler else 0
+        self._state.irq_pin = self
+
+    @classmethod
+    def drive(cls, id, level, board=None):
+        """
+        Set the level of a pin, notifying watchers and firing the attached
+        IRQ handler on a matching edge.
+        """
+        state = _pin_state(board or current_board(), id)
+        level = 1 if level else 0
+        old = state.level
+        state.level = level
+        for watcher in state.watchers:
+            watcher(level)
+        if state.handler and old != level:
+            edge = cls.IRQ_RISING if level else cls.IRQ_FALLING
+            if state.trigger & edge:
+                state.handler(state.irq_pin)
+
+    @classmethod
+    def watch(cls, id, callback, board=None):
+        """
+        Call callback(level) every time pin id is written or driven.
+        """
+        _pin_state(board or current_board(), id).watchers.append(callback)
+
+    @classmethod
+    def reset_all(cls):
+        """
+        Forget every pin, handler and watcher on the current board.
+        """
+        current_board().pins.clear()
+
+
+class SPI:
+    MSB = 0
+    LSB = 1
+
+    def __init__(self, id, *args, **kwargs):
+        self.id = id
+        self._board = current_board()
+
+    @classmethod
+    def attach(cls, id, device, board=None):
+        """
+        Connect a simulated device to bus id. The device must implement
+        write(buf), readinto(buf, write) and write_readinto(out, into).
+        """
+        (board or current_board()).spi_devices[id] = device
+
+    def _device(self):
+        device = self._board.spi_devices.get(self.id)
+        if device is None:
+            raise OSError("no device attached to SPI({})".format(self.id))
+        return device
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def deinit(self):
+        pass
+
+    def write(self, buf):
+        self._device().write(buf)
+
+    def read(self, nbytes, write=0x00):
+        buf = bytearray(nbytes)
+        self._device().readinto(buf, write)
+        return bytes(buf)
+
+    def readinto(self, buf, write=0x00):
+        self._device().readinto(buf, write)
+
+    def write_readinto(self, write_buf, read_buf):
+        self._device().write_readinto(write_buf, read_buf)
+
+
+class _UARTState:
+    def __init__(self):
+        self.rx = bytearray()
+        self.tx = bytearray()
+        self.device = None
+        self.irq = None     # (handler, uart) from UART.irq()
+
+
+class UART:
+    IRQ_RX = 0x01
+    IRQ_RXIDLE = 0x02
+
+    def __init__(self, id, baudrate=115200, *args, **kwargs):
+        self.id = id
+        self._state = current_board().uarts.setdefault(id, _UARTState())
+
+    @classmethod
+    def feed(cls, id, data, board=None):
+        """
+        Append bytes to the receive buffer of UART id, as if sent by the
+        device on the other end, then run its irq() handler if it has one.
+        """
+        state = (board or current_board()).uarts.setdefault(id, _UARTState())
+        state.rx.extend(data)
+        if state.irq is not None:
+            handler, uart = state.irq
+            handler(uart)
+
+    @classmethod
+    def sent(cls, id, board=None):
+        """
+        Return and clear everything the firmware wrote to UART id.
+        """
+        state = (board or current_board()).uarts.setdefault(id, _UARTState())
+        data = bytes(state.tx)
+        state.tx[:] = b""
+        return data
+
+    @classmethod
+    def attach(cls, id, device, board=None):
+        """
+        Connect a simulated device to UART id. Every write is passed to
+        device.uart_write(data); any bytes it returns arrive on the receive
+        buffer. attach(id, None) disconnects it.
+        """
+        (board or current_board()).uarts.setdefault(id, _UARTState()).device = device
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def irq(self, handler=None, trigger=0, hard=False):
+        """
+        Call handler(uart) after each feed(), as a receive-idle interrupt
+        would after each burst. handler=None disables it.
+        """
+        self._state.irq = (handler, self) if handler is not None else None
+
+    def any(self):
+        return len(self._state.rx)
+
+    def read(self, nbytes=None):
+        rx = self._state.rx
+        if not rx:
+            return None
+        if nbytes is None or nbytes > len(rx):
+            nbytes = len(rx)
+        data = bytes(rx[:nbytes])
+        del rx[:nbytes]
+        return data
+
+    def readinto(self, buf, nbytes=None):
+        data = self.read(len(buf) if nbytes is None else nbytes)
+        if data is None:
+            return None
+        buf[:len(data)] = data
+        return len(data)
+
+    def write(self, buf):
+        if isinstance(buf, str):
+            buf = buf.encode()
+        state = self._state
+        if state.device is not None:
+            reply = state.device.uart_write(bytes(buf))
+            if reply:
+                state.rx.extend(reply)
+        else:
+            state.tx.extend(buf)
+        return len(buf)
+
+
+class I2C:
+    def __init__(self, id, *args, **kwargs):
+        self.id = id
+        self.writes = 0
+
+    def scan(self):
+        return []
+
+    def writeto(self, addr, buf, stop=True):
+        self.writes += 1
+        return 1
+
+    def writevto(self, addr, vector, stop=True):
+        self.writes += 1
+        return 1
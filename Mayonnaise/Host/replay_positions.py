@@ -0,0 +1,214 @@
+"""
+Offline multilateration of logged BU03 frames with NumPy.
+
+Solves every frame of a recorded BU03 data-UART capture (the raw byte
+stream, as dumped from the UART) at once with the same two steps as
+Drivers/uwb/position.py: a linearised least-squares start, then
+Gauss-Newton on the range residuals, vectorised over frames. Anchors come
+from config.json. Writes one CSV line per frame: frame, x, y[, z], rms,
+anchors.
+
+With --synthetic, generates a noisy random walk instead, solves it with both
+this batch solver and the firmware's Multilateration, and compares accuracy
+and speed.
+
+    python3 Host/replay_positions.py capture.bin [--config config.json] > track.csv
+    python3 Host/replay_positions.py --synthetic 2000 [--noise 0.03]
+"""
+import argparse
+import json
+import math
+import sys
+import time
+
+import numpy as np
+
+import hostenv
+
+from Drivers.uwb.bu03 import FrameParser
+from Drivers.uwb.position import MAX_ANCHORS, Multilateration, load_anchors
+
+
+def anchor_array(anchors):
+    """
+    (MAX_ANCHORS, d) float array, NaN rows for missing base stations.
+    """
+    dims = len(next(a for a in anchors if a is not None))
+    out = np.full((MAX_ANCHORS, dims), np.nan)
+    for i, anchor in enumerate(anchors[:MAX_ANCHORS]):
+        if anchor is not None:
+            out[i] = anchor
+    return out
+
+
+def _solve_normal(m, v, ok):
+    """
+    Solve the stacked systems m x = v for the rows in ok that are well
+    conditioned. Returns x (NaN elsewhere) and the updated ok mask.
+    """
+    x = np.full(v.shape, np.nan)
+    idx = np.flatnonzero(ok)
+    if idx.size:
+        good = np.linalg.cond(m[idx]) < 1e8
+        idx = idx[good]
+        x[idx] = np.linalg.solve(m[idx], v[idx][..., None])[..., 0]
+    solved = np.zeros(ok.shape, bool)
+    solved[idx] = True
+    return x, solved
+
+
+def solve_batch(anchors, ranges, iterations=5):
+    """
+    Multilaterate every frame.
+
+    :param anchors: (MAX_ANCHORS, d) array from anchor_array().
+    :param ranges: (N, MAX_ANCHORS) ranges in metres; 0 or NaN if not visible.
+    :return: positions (N, d), RMS residuals (N,) and anchors used (N,);
+             NaN positions where a frame could not be solved.
+    """
+    ranges = np.asarray(ranges, float)
+    dims = anchors.shape[1]
+    w = (np.nan_to_num(ranges) > 0) & ~np.isnan(anchors[:, 0])[None, :]
+    used = w.sum(axis=1)
+    r = np.where(w, ranges, 0.0)
+    a = np.nan_to_num(anchors)
+    wf = w.astype(float)
+
+    # Linearised start: [-2 (a - c), 1] . [p - c, |p - c|^2] = r^2 - |a - c|^2
+    centre = (wf @ a) / np.maximum(used, 1)[:, None]
+    rel = a[None, :, :] - centre[:, None, :]
+    rows = np.concatenate([-2 * rel, np.ones(rel.shape[:2] + (1,))], axis=2)
+    y = r * r - (rel * rel).sum(axis=2)
+    m = np.einsum("nk,nki,nkj->nij", wf, rows, rows)
+    v = np.einsum("nk,nki,nk->ni", wf, rows, y)
+    x, linear = _solve_normal(m, v, used > dims)
+    p = _refine(x[:, :dims] + centre, linear, a, r, wf, iterations)
+
+    # Frames with too few anchors for the linear step start from the last fix
+    # of one that had enough, as the firmware solver starts from its last fix
+    solved = ~np.isnan(p[:, 0])
+    last = np.maximum.accumulate(np.where(solved, np.arange(len(p)), -1))
+    start = ~linear & (used >= dims) & (last >= 0)
+    if start.any():
+        p[start] = p[last[start]]
+        p[start] = _refine(p, start, a, r, wf, iterations)[start]
+
+    ok = ~np.isnan(p[:, 0])
+    dist = np.linalg.norm(p[:, None, :] - a[None, :, :], axis=2)
+    rms = np.sqrt((wf * (dist - r) ** 2).sum(axis=1) / np.maximum(used, 1))
+    rms[~ok] = np.nan
+    return p, rms, used
+
+
+def _refine(p, ok, a, r, wf, iterations):
+    """
+    Gauss-Newton on the range residuals for the frames in ok; NaN elsewhere.
+    """
+    p = np.where(ok[:, None], p, np.nan)
+    for _ in range(iterations):
+        diff = p[:, None, :] - a[None, :, :]
+        dist = np.linalg.norm(diff, axis=2)
+        jac = np.nan_to_num(diff / np.where(dist > 1e-6, dist, np.inf)[..., None])
+        f = np.nan_to_num(dist - r)
+        m = np.einsum("nk,nki,nkj->nij", wf, jac, jac)
+        g = -np.einsum("nk,nki,nk->ni", wf, jac, f)
+        step, ok = _solve_normal(m, g, ok)
+        p = np.where(ok[:, None], p + np.nan_to_num(step), np.nan)
+    return p
+
+
+def read_capture(path):
+    """
+    Ranges in metres, one row per frame, from a raw BU03 UART capture.
+    """
+    parser = FrameParser()
+    rows = []
+    with open(path, "rb") as f:
+        data = f.read()
+    while data:
+        n = parser.feed(data)
+        data = data[n:]
+        while parser.next_frame() is not None:
+            rows.append(list(parser.ranges))
+    return np.array(rows, float).reshape(-1, MAX_ANCHORS) / 1000.0
+
+
+def synthetic(anchors, frames, noise, dropout, seed):
+    """
+    A random walk inside the anchors' bounding box with Gaussian range
+    noise and random base-station dropouts.
+    """
+    rng = np.random.default_rng(seed)
+    installed = ~np.isnan(anchors[:, 0])
+    low = np.nanmin(anchors, axis=0)
+    high = np.nanmax(anchors, axis=0)
+    steps = rng.normal(0, 0.02, (frames, anchors.shape[1]))
+    truth = np.clip((low + high) / 2 + np.cumsum(steps, axis=0), low, high)
+    ranges = np.linalg.norm(truth[:, None, :] - np.nan_to_num(anchors)[None], axis=2)
+    ranges += rng.normal(0, noise, ranges.shape)
+    visible = installed[None, :] & (rng.random(ranges.shape) >= dropout)
+    return truth, np.where(visible, ranges, 0.0)
+
+
+def compare(anchors_list, frames, noise, dropout, seed):
+    anchors = anchor_array(anchors_list)
+    truth, ranges = synthetic(anchors, frames, noise, dropout, seed)
+
+    start = time.perf_counter()
+    batch, _, _ = solve_batch(anchors, ranges)
+    batch_s = time.perf_counter() - start
+
+    solver = Multilateration(anchors_list)
+    device = np.full(batch.shape, np.nan)
+    start = time.perf_counter()
+    for i, row in enumerate(ranges):
+        if solver.solve(row.tolist()):
+            device[i] = solver.position
+    device_s = time.perf_counter() - start
+
+    def error(est):
+        solved = ~np.isnan(est[:, 0])
+        err = np.linalg.norm(est[solved] - truth[solved], axis=1)
+        return solved.sum(), np.sqrt((err ** 2).mean()) if err.size else math.nan
+
+    print("{} frames, {} anchors, range noise {} m, dropout {:.0%}".format(
+        frames, int((~np.isnan(anchors[:, 0])).sum()), noise, dropout))
+    print("{:>10} {:>8} {:>10} {:>12}".format("solver", "fixes", "RMS err m", "frames/s"))
+    for name, est, seconds in (("batch", batch, batch_s), ("firmware", device, device_s)):
+        fixes, rms = error(est)
+        print("{:>10} {:>8} {:>10.3f} {:>12.0f}".format(name, fixes, rms, frames / seconds))
+    both = ~np.isnan(batch[:, 0]) & ~np.isnan(device[:, 0])
+    if both.any():
+        print("max batch/firmware difference: {:.4f} m".format(
+            np.abs(batch[both] - device[both]).max()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("capture", nargs="?", help="raw BU03 data-UART capture")
+    parser.add_argument("--config", default=hostenv.FIRMWARE_DIR + "/config.json")
+    parser.add_argument("--synthetic", type=int, metavar="FRAMES")
+    parser.add_argument("--noise", type=float, default=0.03, help="range noise in metres")
+    parser.add_argument("--dropout", type=float, default=0.1, help="per-range dropout probability")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        anchors = load_anchors(json.load(f))
+    if anchors is None:
+        parser.error("no anchors in " + args.config)
+
+    if args.synthetic:
+        compare(anchors, args.synthetic, args.noise, args.dropout, args.seed)
+        return
+    if not args.capture:
+        parser.error("give a capture file or --synthetic")
+
+    positions, rms, used = solve_batch(anchor_array(anchors), read_capture(args.capture))
+    out = sys.stdout
+    for i, (p, e, n) in enumerate(zip(positions, rms, used)):
+        out.write("{},{},{:.4f},{}\n".format(i, ",".join("{:.4f}".format(c) for c in p), e, n))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""
+Simulated LoRa radio channel shared by FakeSX127x radios, on a virtual clock.
+
+Every transmission occupies the channel for its exact time on air, computed
+from the transmitter's modem registers. At each receiver it arrives with an
+RSSI from a log-distance path loss model, with optional per-link
+shadowing and per-packet fading, and an SNR against the thermal
+noise floor for the receiver's bandwidth. A receiver in RX mode with a
+matching frequency, spreading factor, bandwidth, sync word and IQ setting
+locks onto the first packet it can demodulate; the packet is delivered
+when it ends if the receiver stayed in RX, no overlapping packet on the
+same channel came within capture_db of it, and the random loss draw
+passes. A collision delivers a corrupted payload (RxDone plus
+PayloadCrcError when the packet carries a CRC). A receiver that starts
+transmitting drops the packet it was receiving.
+
+    clock = VirtualClock()
+    channel = Channel(clock, seed=1)
+    a = FakeSX127x(channel=channel, position=(0, 0))
+    b = FakeSX127x(channel=channel, position=(500, 0))
+"""
+import heapq
+import math
+import random
+
+# Lowest SNR each spreading factor can demodulate (SX1276 datasheet)
+DEMOD_FLOOR_DB = {6: -5.0, 7: -7.5, 8: -10.0, 9: -12.5, 10: -15.0, 11: -17.5, 12: -20.0}
+
+STATS = ("transmissions", "delivered", "collisions", "below_sensitivity",
+         "half_duplex", "lost", "aborted")
+
+
+def time_on_air_us(sf, bandwidth, coding_rate, preamble, length, implicit_header, crc, ldro):
+    """
+    LoRa packet duration from the SX127x datasheet formula.
+
+    :param coding_rate: Denominator offset 1..4 (4/5 .. 4/8).
+    :return: Time on air in microseconds.
+    """
+    symbol_us = (1 << sf) * 1000000 / bandwidth
+    bits = 8 * length - 4 * sf + 28 + (16 if crc else 0) - (20 if implicit_header else 0)
+    payload_symbols = 8 + max(math.ceil(bits / (4 * (sf - (2 if ldro else 0)))) * (coding_rate + 4), 0)
+    return int((preamble + 4.25 + payload_symbols) * symbol_us)
+
+
+class _Event:
+    __slots__ = ("at", "seq", "callback", "args", "cancelled")
+
+    def __init__(self, at, seq, callback, args):
+        self.at = at
+        self.seq = seq
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.at, self.seq) < (other.at, other.seq)
+
+
+class VirtualClock:
+    """
+    Discrete-event clock. Firmware code takes no virtual time between yield
+    points; time moves when it sleeps (see utime.set_clock) or when a radio
+    sees it busy-polling the IRQ flags, and scheduled events run in order as
+    it does. run_until() may be re-entered from inside an event, e.g. by a
+    node that blocks waiting for its own TxDone.
+    """
+    def __init__(self):
+        self.now_us = 0
+        self._events = []
+        self._seq = 0
+
+    def schedule(self, at_us, callback, *args):
+        """
+        Run callback(*args) at virtual time at_us.
+
+        :return: Event handle for cancel().
+        """
+        self._seq += 1
+        event = _Event(max(at_us, self.now_us), self._seq, callback, args)
+        heapq.heappush(self._events, event)
+        return event
+
+    def call_later(self, delay_us, callback, *args):
+        return self.schedule(self.now_us + delay_us, callback, *args)
+
+    def cancel(self, event):
+        event.cancelled = True
+
+    def pending(self):
+        return sum(1 for event in self._events if not event.cancelled)
+
+    def run_until(self, at_us):
+        """
+        Run every event due up to at_us, then leave the clock at at_us.
+        """
+        events = self._events
+        while events and events[0].at <= at_us:
+            event = heapq.heappop(events)
+            if event.cancelled:
+                continue
+            if event.at > self.now_us:
+                self.now_us = event.at
+            event.callback(*event.args)
+        if at_us > self.now_us:
+            self.now_us = at_us
+
+    def sleep_us(self, us):
+        self.run_until(self.now_us + us)
+
+
+class Transmission:
+    __slots__ = ("radio", "payload", "modem", "power_dbm", "start_us", "end_us", "end_event")
+
+    def __init__(self, radio, payload, modem, power_dbm, start_us, end_us):
+        self.radio = radio
+        self.payload = payload
+        self.modem = modem
+        self.power_dbm = power_dbm
+        self.start_us = start_us
+        self.end_us = end_us
+        self.end_event = None
+
+
+class Reception:
+    """
+    A packet a receiver has locked onto, with the strongest overlapping
+    co-channel signal seen while it was on air.
+    """
+    __slots__ = ("tx", "rssi", "snr", "interference_dbm")
+
+    def __init__(self, tx, rssi, snr, interference_dbm):
+        self.tx = tx
+        self.rssi = rssi
+        self.snr = snr
+        self.interference_dbm = interference_dbm
+
+
+class Channel:
+    """
+    Shared medium for FakeSX127x radios. Positions are in metres.
+    """
+    def __init__(self, clock=None, path_loss_exponent=2.7, reference_loss_db=40.0,
+                 shadowing_db=0.0, fading_db=0.0, noise_figure_db=6.0, capture_db=6.0,
+                 loss_rate=0.0, seed=None):
+        """
+        :param clock: VirtualClock, created if not given.
+        :param path_loss_exponent: n in PL(d) = PL(1 m) + 10 n log10(d).
+        :param reference_loss_db: Path loss at 1 m.
+        :param shadowing_db: Standard deviation of per-link log-normal shadowing.
+        :param fading_db: Standard deviation of the signal level of each
+                          packet at each receiver around its link's mean.
+        :param noise_figure_db: Receiver noise figure.
+        :param capture_db: Margin by which a packet must beat every overlapping
+                           co-channel packet to survive the collision.
+        :param loss_rate: Probability that an otherwise good packet is lost.
+        :param seed: Seed for shadowing, fading, loss and corruption draws.
+        """
+        self.clock = clock or VirtualClock()
+        self.path_loss_exponent = path_loss_exponent
+        self.reference_loss_db = reference_loss_db
+        self.shadowing_db = shadowing_db
+        self.fading_db = fading_db
+        self.noise_figure_db = noise_figure_db
+        self.capture_db = capture_db
+        self.loss_rate = loss_rate
+        self.random = random.Random(seed)
+        self.radios = []
+        self.on_air = []
+        self.stats = dict.fromkeys(STATS, 0)
+        self._shadowing = {}
+
+    def attach(self, radio):
+        self.radios.append(radio)
+
+    # ---------------------------
+    # Propagation
+    # ---------------------------
+    def path_loss_db(self, a, b):
+        (ax, ay), (bx, by) = a.position, b.position
+        distance = max(math.hypot(ax - bx, ay - by), 1.0)
+        loss = self.reference_loss_db + 10 * self.path_loss_exponent * math.log10(distance)
+        if self.shadowing_db:
+            key = (id(a), id(b)) if id(a) < id(b) else (id(b), id(a))
+            if key not in self._shadowing:
+                self._shadowing[key] = self.random.gauss(0, self.shadowing_db)
+            loss += self._shadowing[key]
+        return loss
+
+    def noise_floor_dbm(self, bandwidth):
+        return -174 + 10 * math.log10(bandwidth) + self.noise_figure_db
+
+    def current_rssi(self, radio):
+        """
+        Strongest co-channel signal at radio right now, or the noise floor.
+        """
+        modem = radio.modem_config()
+        rssi = self.noise_floor_dbm(modem.bandwidth)
+        for tx in self.on_air:
+            if tx.radio is not radio and _same_channel(tx.modem, modem):
+                rssi = max(rssi, tx.power_dbm - self.path_loss_db(tx.radio, radio))
+        return rssi
+
+    def activity(self, radio):
+        """
+        What channel activity detection sees: True if a co-channel packet
+        strong enough for radio to demodulate is on air right now.
+        """
+        modem = radio.modem_config()
+        floor = self.noise_floor_dbm(modem.bandwidth) + DEMOD_FLOOR_DB[modem.sf]
+        for tx in self.on_air:
+            if (tx.radio is not radio and _same_channel(tx.modem, modem)
+                    and tx.power_dbm - self.path_loss_db(tx.radio, radio) >= floor):
+                return True
+        return False
+
+    # ---------------------------
+    # Transmission
+    # ---------------------------
+    def transmit(self, radio, payload):
+        """
+        Put a packet on air from radio, using its current modem registers.
+
+        :return: The Transmission; radio.tx_finished() is called at its end.
+        """
+        modem = radio.modem_config()
+        now = self.clock.now_us
+        airtime = time_on_air_us(modem.sf, modem.bandwidth, modem.coding_rate, modem.preamble,
+                                 len(payload), modem.implicit_header, modem.crc, modem.ldro)
+        tx = Transmission(radio, payload, modem, radio.tx_power_dbm(), now, now + airtime)
+        self.stats["transmissions"] += 1
+        # Transmitting kills whatever this radio was receiving
+        self.drop_reception(radio)
+        for other in self.radios:
+            if other is not radio:
+                self._arrive(other, tx)
+        self.on_air.append(tx)
+        tx.end_event = self.clock.schedule(tx.end_us, self._end, tx)
+        return tx
+
+    def abort(self, tx):
+        """
+        The transmitter left TX mode early: the packet is cut off everywhere.
+        """
+        if tx in self.on_air:
+            self.on_air.remove(tx)
+            self.clock.cancel(tx.end_event)
+            self.stats["aborted"] += 1
+            for other in self.radios:
+                if other.reception is not None and other.reception.tx is tx:
+                    other.reception = None
+
+    def drop_reception(self, radio):
+        """
+        The receiver left RX mode while locked onto a packet.
+        """
+        if radio.reception is not None:
+            radio.reception = None
+            self.stats["half_duplex"] += 1
+
+    def _arrive(self, rx, tx):
+        rssi = tx.power_dbm - self.path_loss_db(tx.radio, rx)
+        if self.fading_db:
+            rssi += self.random.gauss(0, self.fading_db)
+        modem = rx.modem_config()
+        reception = rx.reception
+        if reception is not None:
+            if _same_channel(tx.modem, modem):
+                reception.interference_dbm = max(reception.interference_dbm, rssi)
+            return
+        if not rx.in_rx() or not _compatible(tx.modem, modem):
+            return
+        snr = rssi - self.noise_floor_dbm(modem.bandwidth)
+        if snr < DEMOD_FLOOR_DB[modem.sf]:
+            self.stats["below_sensitivity"] += 1
+            return
+        # Packets already on air when this one starts also interfere
+        interference = -999.0
+        for other in self.on_air:
+            if other.radio is not rx and _same_channel(other.modem, modem):
+                interference = max(interference, other.power_dbm - self.path_loss_db(other.radio, rx))
+        rx.reception = Reception(tx, rssi, snr, interference)
+
+    def _end(self, tx):
+        self.on_air.remove(tx)
+        for rx in self.radios:
+            reception = rx.reception
+            if reception is None or reception.tx is not tx:
+                continue
+            rx.reception = None
+            self._deliver(rx, reception)
+        tx.radio.tx_finished()
+
+    def _deliver(self, rx, reception):
+        tx = reception.tx
+        modem = rx.modem_config()
+        payload = tx.payload
+        if modem.implicit_header:
+            # The receiver takes its own length and CRC setting on trust
+            length = rx.implicit_length()
+            payload = (payload + bytes(length))[:length]
+            crc = modem.crc
+        else:
+            crc = tx.modem.crc
+        if reception.rssi - reception.interference_dbm < self.capture_db:
+            self.stats["collisions"] += 1
+            payload = bytearray(payload)
+            for i in range(len(payload)):
+                if self.random.random() < 0.5:
+                    payload[i] ^= self.random.randrange(1, 256)
+            rx.receive_packet(bytes(payload), reception.rssi, reception.snr, crc_error=crc)
+            return
+        if self.loss_rate and self.random.random() < self.loss_rate:
+            self.stats["lost"] += 1
+            return
+        self.stats["delivered"] += 1
+        rx.receive_packet(payload, reception.rssi, reception.snr)
+
+
+def _same_channel(a, b):
+    """
+    True if a packet with modem a interferes with one with modem b: same
+    spreading factor and overlapping frequency. Different spreading factors
+    are treated as orthogonal.
+    """
+    return a.sf == b.sf and abs(a.frequency - b.frequency) < max(a.bandwidth, b.bandwidth) / 2
+
+
+def _compatible(tx, rx):
+    """
+    True if a receiver configured with rx can demodulate a packet sent with tx.
+    """
+    return (tx.sf == rx.sf and tx.bandwidth == rx.bandwidth
+            and abs(tx.frequency - rx.frequency) <= rx.bandwidth / 4
+            and tx.sync_word == rx.sync_word
+            and tx.invert_iq_tx == rx.invert_iq_rx
+            and (rx.implicit_header or not tx.implicit_header))
@@ -0,0 +1,210 @@
+"""
+Multi-node LoRa simulation on a Linux host.
+
+Each simulated egg gets its own machine.Board with a FakeSX127x on a shared
+rf_channel.Channel, and runs one of the repo's unmodified SX127x drivers:
+Mayonnaise ULoRa, PICO_Loarutil SX127x / LoraUtil or Pico_Meshtastic LoRa.
+Time is virtual (utime.set_clock), so hundreds of nodes and minutes of
+traffic run in seconds. Application behaviour is scheduled as clock events
+with at() / every(); packets arrive through each driver's DIO0 handler.
+
+    with Simulation(seed=1) as sim:
+        a = sim.add_ulora("a", (0, 0))
+        b = sim.add_ulora("b", (800, 0))
+        b.driver.receive_irq(callback=print)
+        sim.at(10, a.driver.send_nowait, b"hello")
+        sim.run(1000)
+"""
+import contextlib
+import os
+import sys
+
+import hostenv
+import utime
+
+from machine import Board, Pin, SPI
+from fake_sx127x import FakeSX127x
+from rf_channel import Channel, VirtualClock
+from Drivers.lora.lora import ULoRa
+from Drivers.lora.transceiver import LoRaTransceiver
+
+REPO_DIR = os.path.dirname(hostenv.FIRMWARE_DIR)
+PICO_LORAUTIL_LIB = os.path.join(REPO_DIR, "Embedded_Systems", "PICO_Loarutil", "lib")
+PICO_MESHTASTIC_LIB = os.path.join(REPO_DIR, "Embedded_Systems", "Pico_Meshtastic", "lib")
+
+# Wiring each firmware uses: (spi id, ss, dio0, reset)
+ULORA_PINS = (1, 10, 5, 4)        # Mayonnaise LoRaTransceiver
+LORAUTIL_PINS = (1, 13, 9, 14)    # PICO_Loarutil spicontrol.py
+MESHTASTIC_PINS = (1, 13, 9, 14)  # Pico_Meshtastic lora_lib_test.py
+
+
+class _NullWriter:
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def quiet():
+    """
+    Context that discards the drivers' console output.
+    """
+    return contextlib.redirect_stdout(_NullWriter())
+
+
+def _import_from(path, name):
+    if path not in sys.path:
+        sys.path.append(path)
+    return __import__(name)
+
+
+def meshtastic_module(name):
+    """
+    Import a module from Pico_Meshtastic's lib, e.g. "mesh".
+    """
+    return _import_from(PICO_MESHTASTIC_LIB, name)
+
+
+class SimNode:
+    """
+    One simulated egg: its board, radio and driver object.
+    """
+    def __init__(self, name, board, radio, driver):
+        self.name = name
+        self.board = board
+        self.radio = radio
+        self.driver = driver
+
+    def __repr__(self):
+        return "SimNode({!r})".format(self.name)
+
+
+class Simulation:
+    """
+    A virtual clock, a channel and the nodes on it. Installs the clock as
+    utime's time source until close().
+    """
+    def __init__(self, seed=None, **channel_options):
+        """
+        :param seed: Seed for the channel's random draws.
+        :param channel_options: Passed to rf_channel.Channel.
+        """
+        self.clock = VirtualClock()
+        self.channel = Channel(self.clock, seed=seed, **channel_options)
+        self.nodes = []
+        utime.set_clock(self.clock)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        utime.set_clock(None)
+
+    @property
+    def now_ms(self):
+        return self.clock.now_us / 1000
+
+    # ---------------------------
+    # Nodes
+    # ---------------------------
+    def _add(self, name, position, wiring, build):
+        spi_id, ss, dio0, reset = wiring
+        board = Board(name)
+        with board, quiet():
+            radio = FakeSX127x(spi_id=spi_id, ss=ss, dio0=dio0, reset=reset,
+                               channel=self.channel, position=position, name=name)
+            driver = build()
+        node = SimNode(name, board, radio, driver)
+        self.nodes.append(node)
+        return node
+
+    def add_ulora(self, name, position, parameters=None, **kwargs):
+        """
+        Node running Mayonnaise's ULoRa. kwargs go to the ULoRa constructor.
+        """
+        spi_id, ss, dio0, reset = ULORA_PINS
+        return self._add(name, position, ULORA_PINS, lambda: ULoRa(
+            SPI(spi_id), {"ss": ss, "reset": reset, "dio0": dio0}, parameters, **kwargs))
+
+    def add_transceiver(self, name, position, parameters=None, **kwargs):
+        """
+        Node running Mayonnaise's LoRaTransceiver. kwargs go to its constructor.
+        """
+        spi_id, ss, dio0, reset = ULORA_PINS
+        return self._add(name, position, ULORA_PINS, lambda: LoRaTransceiver(
+            SPI(spi_id), {"ss": ss, "reset": reset, "dio0": dio0}, parameters, **kwargs))
+
+    def add_sx127x(self, name, position, parameters=None):
+        """
+        Node running PICO_Loarutil's SX127x driver, initialised and in standby.
+        """
+        spicontrol = self._loarutil_module("spicontrol")
+        sx127x = _import_from(PICO_LORAUTIL_LIB, "sx127x")
+
+        def build():
+            spi = spicontrol.SpiControl()
+            lora = sx127x.SX127x(spiControl=spi, parameters=parameters or {})
+            spi.initLoraPins()
+            lora.init()
+            return lora
+        return self._add(name, position, LORAUTIL_PINS, build)
+
+    def add_lorautil(self, name, position):
+        """
+        Node running PICO_Loarutil's LoraUtil, listening on its fixed settings.
+        """
+        lorautil = self._loarutil_module("lorautil")
+        return self._add(name, position, LORAUTIL_PINS, lorautil.LoraUtil)
+
+    def add_meshtastic(self, name, position, **kwargs):
+        """
+        Node running Pico_Meshtastic's LoRa driver. kwargs go to LoRa().
+        """
+        meshtastic = meshtastic_module("lora")
+        spi_id, ss, dio0, reset = MESHTASTIC_PINS
+
+        def build():
+            return meshtastic.LoRa(SPI(spi_id), cs=Pin(ss, Pin.OUT), rx=Pin(dio0, Pin.IN), **kwargs)
+        return self._add(name, position, MESHTASTIC_PINS, build)
+
+    def _loarutil_module(self, name):
+        spicontrol = _import_from(PICO_LORAUTIL_LIB, "spicontrol")
+        # spicontrol's reset pulse uses time.sleep(); run it on the virtual clock
+        spicontrol.sleep = utime.sleep
+        return _import_from(PICO_LORAUTIL_LIB, name)
+
+    # ---------------------------
+    # Scheduling
+    # ---------------------------
+    def at(self, ms, callback, *args):
+        """
+        Run callback(*args) at virtual time ms.
+        """
+        return self.clock.schedule(int(ms * 1000), callback, *args)
+
+    def every(self, period_ms, callback, *args, start_ms=None):
+        """
+        Run callback(*args) every period_ms, first at start_ms (default: one period).
+        """
+        def tick():
+            callback(*args)
+            self.clock.call_later(int(period_ms * 1000), tick)
+        start = self.now_ms + period_ms if start_ms is None else start_ms
+        return self.at(start, tick)
+
+    def run(self, duration_ms, silent=True):
+        """
+        Advance virtual time by duration_ms, running everything due.
+
+        :param silent: Discard driver console output while running.
+        """
+        end = self.clock.now_us + int(duration_ms * 1000)
+        if silent:
+            with quiet():
+                self.clock.run_until(end)
+        else:
+            self.clock.run_until(end)
@@ -0,0 +1,113 @@
+"""
+Run the Mayonnaise main.py task scheduler on a Linux host with stubbed
+drivers and report per-task loop throughput.
+
+A simulated BU03 streams distance frames into UART 1 for a tag walking a
+circle between the anchors in config.json (with range noise and the odd
+spike), the fake SX127x keeps each packet on air for a fixed airtime, and a
+simulated peer (node 99) answers every packet with a ping frame.
+
+    python3 Host/run_node.py [seconds]
+"""
+import asyncio
+import math
+import random
+import struct
+import sys
+
+import hostenv
+
+from machine import UART
+from fake_sx127x import FakeSX127x
+from fake_bu03 import FakeBU03
+from Drivers.lora.telemetry import TelemetryEncoder, TYPE_PING
+import main as firmware
+
+UWB_FRAME_MS = 20   # BU03 native frame period
+AIRTIME_MS = 200    # ~40 byte packet at SF9 / 125 kHz
+
+
+def uwb_frame(distances_mm):
+    return b"\xaa%\x01" + struct.pack("<8I", *distances_mm)
+
+
+def tag_ranges(anchors, t, rng):
+    """
+    Ranges in mm from the anchors to a tag circling the middle of the site
+    at 0.5 m/s, with 2 cm noise and an occasional 1 m spike.
+    """
+    xs = [a[0] for a in anchors if a]
+    ys = [a[1] for a in anchors if a]
+    cx, cy = (min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2
+    radius = min(max(xs) - min(xs), max(ys) - min(ys)) / 4
+    angle = 0.5 * t / radius
+    tag = (cx + radius * math.cos(angle), cy + radius * math.sin(angle))
+    ranges = []
+    for anchor in anchors:
+        if not anchor:
+            ranges.append(0)
+            continue
+        r = math.dist(tag, anchor[:2]) + rng.gauss(0, 0.02)
+        if rng.random() < 0.01:
+            r += 1.0
+        ranges.append(int(r * 1000))
+    return ranges
+
+
+async def bu03_stream(count, anchors):
+    rng = random.Random(1)
+    while True:
+        if anchors:
+            ranges = tag_ranges(anchors, count[0] * UWB_FRAME_MS / 1000, rng)
+        else:
+            ranges = [1500 + count[0] % 100, 2300, 0, 0, 0, 0, 0, 0]
+        UART.feed(1, uwb_frame(ranges))
+        count[0] += 1
+        await asyncio.sleep(UWB_FRAME_MS / 1000)
+
+
+async def peer(radio):
+    answers = TelemetryEncoder(99)
+    while True:
+        if radio.mode() == 0x03:  # TX
+            await asyncio.sleep(AIRTIME_MS / 1000)
+            radio.complete_tx()
+            await asyncio.sleep(0.05)
+            radio.inject(bytes(answers.encode(TYPE_PING, rssi=-70, snr=8.0)), rssi=-72, snr=7.25)
+        await asyncio.sleep(0.005)
+
+
+async def run(seconds):
+    radio = FakeSX127x(spi_id=1, ss=10, dio0=5, auto_tx_done=False)
+    config = firmware.load_config(hostenv.FIRMWARE_DIR + "/config.json")
+    # The module already holds the configured settings, as on a normal boot
+    UART.attach(2, FakeBU03(config.get("id", 0), config.get("role", 0),
+                            config.get("channel", 1), config.get("rate", 1)))
+    node = firmware.Node(config)
+    node.init_hardware()
+    frames_sent = [0]
+    sims = [asyncio.create_task(bu03_stream(frames_sent, config.get("anchors"))), asyncio.create_task(peer(radio))]
+    try:
+        await asyncio.wait_for(node.run(), seconds)
+    except asyncio.TimeoutError:
+        pass
+    for sim in sims:
+        sim.cancel()
+
+    print("\n--- {} s on host ---".format(seconds))
+    print("periods: {}".format(node.periods))
+    for name, value in sorted(node.stats.items()):
+        print("{:>12}: {:6d}  ({:.1f}/s)".format(name, value, value / seconds))
+    print("UWB frames streamed: {}".format(frames_sent[0]))
+    if node.tracker:
+        print("track: {} fixes rejected, {} range spikes rejected, last {}".format(
+            node.tracker.rejected, node.range_filter.rejected, node.uwb_line))
+    print("last RX: {} RSSI {} SNR {}".format(node.last_received, node.last_rssi, node.last_snr))
+    print("LoRa GC: {}".format(node.radio.lora.gc_policy.stats()))
+    print("LoRa MAC: {}".format(node.mac.stats()))
+    if node.radio.lora.duty_cycle is not None:
+        print("LoRa duty cycle: {}".format(node.radio.lora.duty_cycle.stats()))
+
+
+if __name__ == "__main__":
+    asyncio.run(run(float(sys.argv[1]) if len(sys.argv) > 1 else 5))
@@ -0,0 +1,71 @@
+"""
+Decode egg telemetry frames on the host.
+
+Reads lines from files (or stdin) and prints one JSON object per frame.
+A line may hold a frame as hex ("120300001b13dc05..."), or be firmware
+console output such as "Received: b'\\x11c\\x02...' | RSSI: -72 dBm | ..."
+(or "Sending:"/"Sent:" for the node's own frames); for received packets the
+RSSI and SNR the receiver measured are added as rx_rssi and rx_snr. Lines that are neither, and legacy text packets, are skipped
+(or, with --text, printed as {"text": ...}).
+
+    python3 Host/telemetry_decode.py node.log
+    mpremote run main.py | python3 Host/telemetry_decode.py
+"""
+import argparse
+import ast
+import json
+import re
+import sys
+
+import hostenv
+
+from Drivers.lora.telemetry import decode
+
+CONSOLE = re.compile(r"(?:Received|Sending|Sent): (b'.*'|b\".*\")(?: \| RSSI: (-?[\d.]+) dBm \| SNR: (-?[\d.]+) dB)?")
+HEX = re.compile(r"^\s*([0-9a-fA-F]{10,})\s*$")
+
+
+def payloads(lines):
+    """
+    Yield (payload, rx_rssi, rx_snr) for every line that carries a packet.
+    """
+    for line in lines:
+        match = CONSOLE.search(line)
+        if match:
+            try:
+                payload = ast.literal_eval(match.group(1))
+            except (SyntaxError, ValueError):
+                continue
+            rssi = float(match.group(2)) if match.group(2) else None
+            snr = float(match.group(3)) if match.group(3) else None
+            yield payload, rssi, snr
+            continue
+        match = HEX.match(line)
+        if match and len(match.group(1)) % 2 == 0:
+            yield bytes.fromhex(match.group(1)), None, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="*", help="input files (default: stdin)")
+    parser.add_argument("--text", action="store_true", help="also print legacy text packets")
+    args = parser.parse_args()
+
+    streams = [open(name) for name in args.files] if args.files else [sys.stdin]
+    for stream in streams:
+        for payload, rssi, snr in payloads(stream):
+            frame = decode(payload)
+            if frame is not None:
+                record = frame.as_dict()
+            elif args.text:
+                record = {"text": payload.decode("utf-8", "replace")}
+            else:
+                continue
+            if rssi is not None:
+                record["rx_rssi"] = rssi
+                record["rx_snr"] = snr
+            print(json.dumps(record))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Host-side stand-in for the MicroPython utime module.
+Tick counters wrap at TICKS_PERIOD (2**30) like MicroPython's, so code that
+subtracts ticks instead of using ticks_diff() fails here as it would on a
+board, e.g. after about 18 minutes of ticks_us.
+
+By default ticks follow the host's monotonic clock and sleeps really sleep.
+A simulation can install a virtual clock with set_clock(): ticks then read
+the clock's now_us and sleeping advances it, running any events that fall
+due in the meantime.
+"""
+import time as _time
+
+time = _time.time
+
+TICKS_PERIOD = 1 << 30
+_TICKS_MAX = TICKS_PERIOD - 1
+_TICKS_HALF = TICKS_PERIOD // 2
+
+# Object with now_us and sleep_us(us), or None for real time
+_clock = None
+
+
+def set_clock(clock):
+    global _clock
+    _clock = clock
+
+
+def get_clock():
+    return _clock
+
+
+def ticks_ms():
+    if _clock is not None:
+        return _clock.now_us // 1000 & _TICKS_MAX
+    return int(_time.monotonic() * 1000) & _TICKS_MAX
+
+
+def ticks_us():
+    if _clock is not None:
+        return _clock.now_us & _TICKS_MAX
+    return int(_time.monotonic() * 1000000) & _TICKS_MAX
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & _TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + _TICKS_HALF) & _TICKS_MAX) - _TICKS_HALF
+
+
+def sleep_us(us):
+    if _clock is not None:
+        _clock.sleep_us(int(us))
+    else:
+        _time.sleep(us / 1000000)
+
+
+def sleep_ms(ms):
+    sleep_us(ms * 1000)
+
+
+def sleep(seconds):
+    sleep_us(seconds * 1000000)
@@ -0,0 +1,54 @@
+"""
+Copy the shared LoRa driver into Pymakr projects, as a step before upload.
+
+Pymakr uploads one project folder at a time, so a board flashed from
+MicroPython/Pymakr/<project> has no /Drivers to import the driver from. Each
+project's ulora/core.py imports Drivers/lora/lora.py when it is there, and
+falls back to ulora/lora.py, the copy this script writes. The copies are
+generated (and ignored by git): run this before every Pymakr upload, so the
+board gets the driver as it is now.
+
+    python3 Host/vendor_drivers.py [project ...]
+"""
+import argparse
+import os
+
+import hostenv
+
+REPO_DIR = os.path.dirname(hostenv.FIRMWARE_DIR)
+SOURCE = os.path.join(hostenv.FIRMWARE_DIR, "Drivers", "lora", "lora.py")
+PROJECTS = (
+    "MicroPython/Pymakr/uLora",
+    "MicroPython/Pymakr/uLora_send",
+    "MicroPython/Pymakr/uLora_receive",
+)
+HEADER = ("# Copy of Mayonnaise/Drivers/lora/lora.py for standalone Pymakr uploads.\n"
+          "# Generated by Mayonnaise/Host/vendor_drivers.py: edit the original instead.\n")
+
+
+def vendor(project_dir):
+    """
+    Write the driver to project_dir/ulora/lora.py.
+
+    :return: The path written.
+    """
+    path = os.path.join(project_dir, "ulora", "lora.py")
+    with open(SOURCE) as file:
+        text = HEADER + file.read()
+    with open(path, "w") as file:
+        file.write(text)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("projects", nargs="*", default=list(PROJECTS),
+                        help="project folders, relative to the repository root")
+    args = parser.parse_args()
+
+    for project in args.projects:
+        print("wrote " + vendor(os.path.join(REPO_DIR, project)))
+
+
+if __name__ == "__main__":
+    main()
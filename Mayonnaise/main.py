@@ -1,102 +1,311 @@
-import utime
+import json
+import sys
+import time
 from Drivers.oled.oled_class import OLED
+from Drivers.lora.lora import DutyCycleLimiter
+from Drivers.lora.csma import CsmaTransmitter
+from Drivers.lora.tdma import TdmaScheduler
+from Drivers.lora.serial_frame import FrameWriter
 from Drivers.lora.transceiver import LoRaTransceiver
+from Drivers.lora.telemetry import TelemetryEncoder, TYPE_PING, TYPE_TELEMETRY, decode
 from Drivers.uwb.bu03 import BU03
+from Drivers.uwb.position import Multilateration, load_anchors
+from Drivers.uwb.tracking import RangeFilter, PositionTracker
 
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
 
-def main():
-    # --- Init OLED ---
-    oled = None
-    try:
-        oled = OLED()
-        oled.display_text("Initialising...")
-        print("OLED initialised OK")
-    except Exception as e:
-        print("OLED init failed:", e)
+# Task periods in ms, overridden by the matching keys in config.json
+DEFAULT_PERIODS = {
+    "uwb_period_ms": 50,
+    "rx_period_ms": 20,
+    "tx_period_ms": 1000,
+    "display_period_ms": 250,
+}
 
-    # --- Init UWB ---
-    uwb = None
+
+def describe_payload(payload):
+    """
+    Short display form of a packet: a telemetry frame as e.g. 'T3#42',
+    legacy text packets as their text.
+    """
+    if isinstance(payload, str):
+        return payload
+    frame = decode(payload)
+    if frame is not None:
+        return frame.describe()
     try:
-        uwb = BU03()
-    except Exception as e:
-        print("UWB init failed:", e)
+        return payload.decode()
+    except Exception:
+        return str(payload)
 
-    # --- Init LoRa ---
-    radio = None
+
+def load_config(path="config.json"):
     try:
-        radio = LoRaTransceiver()
-        print("LoRa initialised OK")
-        if oled:
-            oled.display_text("LoRa OK\nReady")
+        with open(path) as f:
+            return json.load(f)
     except Exception as e:
-        print("LoRa init failed:", e)
-        if oled:
-            oled.display_text("LoRa FAIL\n{}".format(e))
+        print("Config load failed:", e)
+        return {}
 
-    counter = 0
-    last_sent = ""
-    last_received = ""
-    last_rssi = "-"
-    last_snr = "-"
 
-    try:
+class Node:
+    """
+    The egg firmware as independent cooperative tasks: UWB sampler, LoRa RX
+    listener, LoRa TX queue, ping producer and display refresher. Each task
+    runs at its own period so a slow one never stalls the others.
+    """
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.config = config
+        self.periods = {}
+        for key, default in DEFAULT_PERIODS.items():
+            self.periods[key] = config.get(key, default)
+
+        self.oled = None
+        self.uwb = None
+        self.radio = None
+        self.mac = None     # CsmaTransmitter, or TdmaScheduler with "tdma" in config.json
+        self.tdma = None
+        # With "serial_frames" in config.json every packet heard is forwarded
+        # to the host as a binary frame (Host/gateway_ingest.py)
+        self.forward = None
+        if config.get("serial_frames"):
+            self.forward = FrameWriter(getattr(sys.stdout, "buffer", sys.stdout))
+
+        # Tag position from the base-station ranges, if anchors are configured
+        anchors = load_anchors(config)
+        self.locator = Multilateration(anchors) if anchors else None
+        # Smoothed ranges feed the solver; the tracker smooths its fixes and
+        # decides when a position update is worth sending
+        self.range_filter = RangeFilter()
+        self.tracker = PositionTracker(self.locator.dims) if anchors else None
+        self._on_frame_cb = self._on_frame
+        self._frame_ms = 0
+        self._poll_ms = 0
+        self._poll_us = 0
+
+        # Binary frames for the LoRa link (Drivers/lora/telemetry.py)
+        self.telemetry = TelemetryEncoder(config.get("node_id", config.get("id", 0)))
+        self.link = None    # (rssi, snr) of the last packet heard
+        self.uwb_line = "UWB: Not connected"
+        self.status_line = "LoRa: Not connected"
+        self.last_sent = ""
+        self.last_received = ""
+        self.last_rssi = "-"
+        self.last_snr = "-"
+
+        self.tx_queue = []
+        self.tx_event = asyncio.Event()
+
+        # Loop iterations / events per task, for measuring throughput
+        self.stats = {"uwb": 0, "uwb_frames": 0, "rx": 0, "tx": 0, "tx_deferred": 0,
+                      "display": 0}
+
+    def init_hardware(self):
+        # --- Init OLED ---
+        try:
+            self.oled = OLED()
+            self.oled.display_text("Initialising...")
+            print("OLED initialised OK")
+        except Exception as e:
+            print("OLED init failed:", e)
+
+        # --- Init UWB ---
+        try:
+            self.uwb = BU03()
+        except Exception as e:
+            print("UWB init failed:", e)
+        if self.uwb is not None and not self.uwb.start_irq():
+            print("UWB: no UART IRQ, draining from a task")
+        if self.uwb is not None and "role" in self.config:
+            # Only writes (and resets the module) if its saved config differs
+            try:
+                config = self.config
+                self.uwb.reconfigure(config.get("id", 0), config["role"],
+                                     config.get("channel", 1), config.get("rate", 1))
+            except Exception as e:
+                print("UWB config failed:", e)
+
+        # --- Init LoRa ---
+        try:
+            # Airtime is limited to the band's duty cycle, e.g. 0.1 for 10%
+            duty = self.config.get("duty_cycle")
+            # Forwarded frames share stdout: keep per-packet prints off it
+            self.radio = LoRaTransceiver(duty_cycle=DutyCycleLimiter(duty) if duty else None,
+                                         verbose=self.forward is None)
+            # Listen before talk: CAD, then back off while other eggs
+            # transmit; or, under a TDMA gateway, send only in this egg's slot
+            if self.config.get("tdma"):
+                self.tdma = self.mac = TdmaScheduler(self.radio, self.config.get("id", 0))
+            else:
+                self.mac = CsmaTransmitter(self.radio)
+            # Packets are buffered from the DIO0 interrupt, so the RX task
+            # only drains the buffer and never blocks on the radio
+            self.radio.start_listening(callback=self.tdma.on_packet if self.tdma else None)
+            print("LoRa initialised OK")
+            if self.oled:
+                self.oled.display_text("LoRa OK\nReady")
+        except Exception as e:
+            print("LoRa init failed:", e)
+            if self.oled:
+                self.oled.display_text("LoRa FAIL\n{}".format(e))
+
+    def queue_tx(self, message):
+        self.tx_queue.append(message)
+        self.tx_event.set()
+
+    # --- UWB ---
+    async def uwb_task(self):
+        period = self.periods["uwb_period_ms"] / 1000
         while True:
-            # --- UWB ---
-            uwb_line = "UWB: Not connected"
-            if uwb is not None:
-                try:
-                    distances = uwb.read_distance()
-                    if distances:
-                        uwb.print_distances(distances)
-                        bs0 = distances[0]
-                        uwb_line = "UWB BS0:{:.2f}m".format(bs0) if bs0 else "UWB: No signal"
-                    else:
-                        uwb_line = "UWB: No data"
-                except Exception as e:
-                    uwb_line = "UWB ERR"
-                    print("UWB read error:", e)
+            self.stats["uwb"] += 1
+            try:
+                self._poll_ms = time.ticks_ms()
+                self._poll_us = time.ticks_us()
+                frames = self.uwb.poll(self._on_frame_cb)
+                if frames:
+                    self.stats["uwb_frames"] += frames
+                    self.update_position()
+            except Exception as e:
+                self.uwb_line = "UWB ERR"
+                print("UWB read error:", e)
+            await asyncio.sleep(period)
+
+    def _on_frame(self, ranges):
+        # Frames can be older than this poll; place each on the ticks_ms
+        # clock by how long ago it arrived
+        age_ms = time.ticks_diff(self._poll_us, self.uwb.parser.timestamp_us) // 1000
+        self._frame_ms = time.ticks_add(self._poll_ms, -age_ms)
+        self.range_filter.update(ranges, self._frame_ms, scale=0.001)
 
-            # --- LoRa TX/RX ---
-            status_line = "LoRa: Not connected"
-            if radio is not None:
+    def update_position(self):
+        ranges = self.range_filter.ranges
+        if self.locator and self.locator.solve(ranges):
+            self.tracker.update(self.locator.position, self._frame_ms)
+        if self.tracker and self.tracker.has_track:
+            position = self.tracker.position
+            self.uwb_line = "UWB {:.2f},{:.2f}m".format(position[0], position[1])
+        elif ranges[0]:
+            self.uwb_line = "UWB BS0:{:.2f}m".format(ranges[0])
+        else:
+            self.uwb_line = "UWB: No signal"
+
+    # --- LoRa RX ---
+    async def rx_task(self):
+        period = self.periods["rx_period_ms"] / 1000
+        while True:
+            self.stats["rx"] += 1
+            packet = self.radio.poll(raw=True)
+            while packet:
+                # TDMA beacons are for the scheduler, not the display
+                if self.tdma is None or not self.tdma.handle(packet[0]):
+                    payload, self.last_rssi, self.last_snr = packet
+                    if self.forward is not None:
+                        self.forward.write(payload, self.last_rssi, self.last_snr)
+                    self.link = (self.last_rssi, self.last_snr)
+                    self.last_received = describe_payload(payload)
+                    self.status_line = "RX OK"
+                packet = self.radio.poll(raw=True)
+            await asyncio.sleep(period)
+
+    # --- LoRa TX ---
+    async def tx_task(self):
+        while True:
+            await self.tx_event.wait()
+            self.tx_event.clear()
+            while self.tx_queue:
+                msg = self.tx_queue.pop(0)
                 try:
-                    msg = "Ping {}".format(counter)
-                    print("Sending:", msg)
-                    radio.send(msg)
-                    last_sent = msg
-
-                    reply = radio.receive(timeout=1000)
-                    if reply:
-                        last_rssi = radio.lora.packet_rssi()
-                        last_snr  = radio.lora.packet_snr()
-                        last_received = reply
-                        status_line = "RX OK"
-                        print("Received: {} | RSSI: {} dBm | SNR: {} dB".format(reply, last_rssi, last_snr))
+                    if await self.mac.send_async(msg):
+                        self.last_sent = describe_payload(msg)
+                        self.stats["tx"] += 1
                     else:
-                        status_line = "No reply TX#{}".format(counter)
-                        print("No reply received.")
+                        self.status_line = "TX busy/timeout"
                 except Exception as e:
-                    status_line = "LoRa ERR"
+                    self.status_line = "LoRa ERR"
                     print("LoRa error:", e)
 
-            # --- OLED ---
-            if oled:
-                try:
-                    screen = "{}\n{}\nRSSI:{}dBm\nSNR:{}dB\nTX:{}\nRX:{}".format(
-                        uwb_line, status_line, last_rssi, last_snr, last_sent, last_received
-                    )
-                    oled.display_text(screen)
-                except Exception as e:
-                    print("OLED display error:", e)
+    async def ping_task(self):
+        period = self.periods["tx_period_ms"] / 1000
+        while True:
+            tracker = self.tracker
+            if tracker and tracker.has_track:
+                # Only send a position when it has moved or the heartbeat is due
+                now = time.ticks_ms()
+                tracker.predict(now)
+                if tracker.report_due(now):
+                    # Left due if deferred, so it goes out once there is budget
+                    if self.queue_if_budget(self.telemetry_frame(TYPE_TELEMETRY, tracker.position)):
+                        tracker.mark_reported(now)
+            else:
+                self.queue_if_budget(self.telemetry_frame(TYPE_PING))
+            await asyncio.sleep(period)
+
+    def queue_if_budget(self, frame):
+        """
+        Queue a periodic frame only if it can go out now: when the duty
+        cycle is used up, a newer frame next period beats a stale backlog.
+        """
+        if self.tx_queue or self.radio.send_delay_ms(frame):
+            self.stats["tx_deferred"] += 1
+            return False
+        self.queue_tx(frame)
+        return True
+
+    def telemetry_frame(self, type, position=None):
+        """
+        Encode a frame with the latest smoothed ranges and link quality.
+        Returns a copy, since frames wait in the TX queue.
+        """
+        ranges = self.range_filter.ranges if self.uwb is not None else None
+        rssi, snr = self.link if self.link else (None, None)
+        return bytes(self.telemetry.encode(type, ranges=ranges, range_scale=1000,
+                                           position=position, rssi=rssi, snr=snr))
+
+    # --- OLED ---
+    async def display_task(self):
+        period = self.periods["display_period_ms"] / 1000
+        while True:
+            self.stats["display"] += 1
+            try:
+                screen = "{}\n{}\nRSSI:{}dBm\nSNR:{}dB\nTX:{}\nRX:{}".format(
+                    self.uwb_line, self.status_line, self.last_rssi, self.last_snr,
+                    self.last_sent, self.last_received
+                )
+                self.oled.display_text(screen)
+            except Exception as e:
+                print("OLED display error:", e)
+            await asyncio.sleep(period)
 
-            counter += 1
-            utime.sleep_ms(500)
+    async def run(self):
+        tasks = []
+        if self.uwb is not None:
+            tasks.append(asyncio.create_task(self.uwb_task()))
+            if not self.uwb.irq_active:
+                tasks.append(asyncio.create_task(self.uwb.drain_task()))
+        if self.radio is not None:
+            tasks.append(asyncio.create_task(self.rx_task()))
+            tasks.append(asyncio.create_task(self.tx_task()))
+            tasks.append(asyncio.create_task(self.ping_task()))
+        if self.oled:
+            tasks.append(asyncio.create_task(self.display_task()))
+        await asyncio.gather(*tasks)
 
+
+def main():
+    node = Node(load_config())
+    node.init_hardware()
+    try:
+        asyncio.run(node.run())
     except KeyboardInterrupt:
         print("Stopped.")
-
     except Exception as e:
         print("Unexpected error:", e)
 
 
-main()
+if __name__ == "__main__":
+    main()